@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.utils.html import format_html
-from .models import Appointment
+from core.admin_utils import FiltroAutocompletar, ListadoRapidoMixin
+from .models import Appointment, EntradaListaEspera, SerieCitas
 
 # Personalización visual del admin para MediCitas Pro
 admin.site.site_title = "MediCitas Pro - Administración"
@@ -8,11 +9,12 @@ admin.site.site_header = "🏥 MediCitas Pro - Panel de Administración"
 admin.site.index_title = "Sistema de Gestión Médica"
 # Registro personalizado para el modelo Appointment
 @admin.register(Appointment)
-class AppointmentAdmin(admin.ModelAdmin):
+class AppointmentAdmin(ListadoRapidoMixin, admin.ModelAdmin):
     list_display = ('get_patient_info', 'get_doctor_info', 'get_appointment_date', 'get_status_badge', 'get_priority_info', 'estado')
-    list_filter = ('doctor', 'fecha', 'estado', 'paciente__prioridad', 'clinica')
+    list_filter = (('doctor', FiltroAutocompletar), 'fecha', 'estado', 'paciente__prioridad', 'clinica')
     search_fields = ('paciente__dni', 'paciente__nombre', 'paciente__apellidos', 'doctor__nombre', 'doctor__apellidos', 'motivo')
     ordering = ('-fecha',)
+    list_select_related = ('paciente', 'doctor')
     list_per_page = 30
     date_hierarchy = 'fecha'
 
@@ -115,3 +117,21 @@ class AppointmentAdmin(admin.ModelAdmin):
             obj.motivo[:50] + '...' if len(obj.motivo) > 50 else obj.motivo
         )
     get_priority_info.short_description = '📝 Motivo'
+
+
+@admin.register(SerieCitas)
+class SerieCitasAdmin(ListadoRapidoMixin, admin.ModelAdmin):
+    list_display = ('paciente', 'doctor', 'frecuencia', 'intervalo', 'fecha_inicio', 'ocurrencias', 'creada_en')
+    list_filter = ('frecuencia', ('doctor', FiltroAutocompletar), 'clinica')
+    list_select_related = ('paciente', 'doctor')
+    search_fields = ('paciente__dni', 'paciente__nombre', 'paciente__apellidos', 'motivo')
+    raw_id_fields = ('paciente', 'doctor', 'creada_por')
+
+
+@admin.register(EntradaListaEspera)
+class EntradaListaEsperaAdmin(ListadoRapidoMixin, admin.ModelAdmin):
+    list_display = ('paciente', 'doctor', 'especialidad', 'desde', 'hasta', 'estado', 'creada_en', 'ofrecida_en')
+    list_filter = ('estado', 'especialidad', 'clinica', 'paciente__prioridad')
+    list_select_related = ('paciente', 'doctor')
+    search_fields = ('paciente__dni', 'paciente__nombre', 'paciente__apellidos', 'motivo')
+    raw_id_fields = ('paciente', 'doctor', 'cita')
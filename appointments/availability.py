@@ -0,0 +1,216 @@
+"""
+Motor de disponibilidad basado en mapas de bits.
+
+Cada doctor-día se representa como un entero de Python donde el bit i indica
+si la celda [inicio + i*RESOLUCION, inicio + (i+1)*RESOLUCION) está ocupada.
+Los huecos libres se obtienen con operaciones a nivel de bits y todas las
+citas del rango se leen con una única consulta.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .conflicts import ESTADOS_INACTIVOS, get_duracion_cita
+from .local_time import zona_por_nombre
+from .models import Appointment
+
+# Tamaño de celda del mapa de bits (minutos)
+RESOLUCION_MINUTOS = 5
+
+# Horario por defecto para doctores sin clínica (igual que AppointmentForm)
+HORARIO_INICIO_DEFAULT = time(8, 0)
+HORARIO_FIN_DEFAULT = time(18, 0)
+DIAS_LABORALES_DEFAULT = frozenset({1, 2, 3, 4, 5})
+
+
+def _as_time(valor):
+    """Los TimeField con default en cadena pueden llegar sin convertir"""
+    if isinstance(valor, str):
+        return datetime.strptime(valor[:5], '%H:%M').time()
+    return valor
+
+
+def parse_dias_laborales(valor):
+    """Convierte '1,2,3,4,5' (1=Lun, 7=Dom) en un conjunto de isoweekday"""
+    dias = set()
+    for parte in (valor or '').split(','):
+        parte = parte.strip()
+        if parte.isdigit() and 1 <= int(parte) <= 7:
+            dias.add(int(parte))
+    return frozenset(dias) or DIAS_LABORALES_DEFAULT
+
+
+class HorarioDoctor:
+    """
+    Jornada laboral de un doctor derivada de su clínica. Las horas y los días
+    laborales se interpretan en la zona horaria de la clínica.
+    """
+
+    def __init__(self, hora_inicio, hora_fin, dias_laborales, duracion, zona=None):
+        self.hora_inicio = hora_inicio
+        self.hora_fin = hora_fin
+        self.dias_laborales = dias_laborales
+        self.duracion = duracion
+        self.zona = zona or timezone.get_default_timezone()
+
+        self.minutos_jornada = max(
+            (hora_fin.hour * 60 + hora_fin.minute) - (hora_inicio.hour * 60 + hora_inicio.minute), 0
+        )
+        self.celdas = self.minutos_jornada // RESOLUCION_MINUTOS
+        self.mascara_jornada = (1 << self.celdas) - 1
+
+    @classmethod
+    def para_doctor(cls, doctor, clinica=None):
+        clinica = clinica if clinica is not None else (doctor.clinica if doctor.clinica_id else None)
+        if clinica is None:
+            return cls(HORARIO_INICIO_DEFAULT, HORARIO_FIN_DEFAULT, DIAS_LABORALES_DEFAULT,
+                       get_duracion_cita(doctor))
+        return cls(
+            _as_time(clinica.horario_inicio),
+            _as_time(clinica.horario_fin),
+            parse_dias_laborales(clinica.dias_laborales),
+            get_duracion_cita(doctor),
+            zona_por_nombre(clinica.zona_horaria),
+        )
+
+    def es_laboral(self, dia):
+        return dia.isoweekday() in self.dias_laborales
+
+    def inicio_jornada(self, dia):
+        return timezone.make_aware(datetime.combine(dia, self.hora_inicio), self.zona)
+
+    def error_jornada(self, inicio, duracion=None):
+        """
+        Mensaje de error si la cita que empieza en `inicio` cae en un día no
+        laboral o no termina dentro de la jornada; None si es válida
+        """
+        local = inicio.astimezone(self.zona)
+        if not self.es_laboral(local.date()):
+            return 'El día no es laboral'
+        fin = local + timedelta(minutes=duracion or self.duracion)
+        if local.time() < self.hora_inicio or fin.date() != local.date() or fin.time() > self.hora_fin:
+            return 'El horario está fuera de la jornada de la clínica'
+        return None
+
+    def celdas_para(self, minutos):
+        """Número de celdas necesarias para cubrir `minutos` (redondeo hacia arriba)"""
+        return max(-(-minutos // RESOLUCION_MINUTOS), 1)
+
+
+def mascara_ocupada(horario, dia, inicios, duracion=None):
+    """
+    Construye el mapa de bits de celdas ocupadas del día a partir de los
+    inicios de cita (datetimes aware). Las citas se recortan a la jornada.
+    """
+    base = horario.inicio_jornada(dia)
+    celdas_cita = horario.celdas_para(duracion or horario.duracion)
+    ocupado = 0
+    for inicio in inicios:
+        offset_min = (inicio - base).total_seconds() / 60
+        primera = int(offset_min // RESOLUCION_MINUTOS)
+        ultima = primera + celdas_cita  # exclusiva
+        # Una cita que empieza a mitad de celda ocupa también la siguiente
+        if offset_min % RESOLUCION_MINUTOS:
+            ultima += 1
+        primera = max(primera, 0)
+        ultima = min(ultima, horario.celdas)
+        if ultima > primera:
+            ocupado |= ((1 << (ultima - primera)) - 1) << primera
+    return ocupado
+
+
+def inicios_libres(libre, k):
+    """
+    Bit i activo si las k celdas i..i+k-1 están libres. Se calcula por
+    duplicación: log2(k) desplazamientos en lugar de k.
+    """
+    resultado = libre
+    cubiertas = 1
+    while cubiertas < k:
+        paso = min(cubiertas, k - cubiertas)
+        resultado &= resultado >> paso
+        cubiertas += paso
+    return resultado
+
+
+def mascara_paso(celdas, paso_celdas):
+    """Bits activos en 0, paso, 2*paso... dentro de la jornada"""
+    mascara = 0
+    for i in range(0, celdas, paso_celdas):
+        mascara |= 1 << i
+    return mascara
+
+
+def _bits(mascara):
+    """Posiciones de los bits activos, en orden creciente"""
+    posiciones = []
+    while mascara:
+        menor = mascara & -mascara
+        posiciones.append(menor.bit_length() - 1)
+        mascara ^= menor
+    return posiciones
+
+
+def slots_disponibles(doctor, fecha_inicio, fecha_fin=None, duracion=None, paso=None,
+                      desde=None, clinica=None):
+    """
+    Horarios libres del doctor para cada día de [fecha_inicio, fecha_fin].
+
+    Devuelve {date: [datetime, ...]} con todos los días del rango (lista vacía
+    en días no laborales). `duracion` es la de la cita a agendar y `paso` la
+    separación entre inicios sugeridos (por defecto, la duración). Los
+    horarios anteriores a `desde` (por defecto ahora) se descartan.
+    """
+    fecha_fin = fecha_fin or fecha_inicio
+    horario = HorarioDoctor.para_doctor(doctor, clinica)
+    duracion = duracion or horario.duracion
+    paso = paso or duracion
+    desde = desde or timezone.now()
+
+    dias = []
+    dia = fecha_inicio
+    while dia <= fecha_fin:
+        dias.append(dia)
+        dia += timedelta(days=1)
+
+    resultado = {dia: [] for dia in dias}
+    dias_laborales = [dia for dia in dias if horario.es_laboral(dia)]
+    if not dias_laborales or not horario.celdas:
+        return resultado
+
+    # Una sola consulta para todo el rango
+    rango_inicio = horario.inicio_jornada(dias_laborales[0]) - timedelta(minutes=horario.duracion)
+    rango_fin = horario.inicio_jornada(dias_laborales[-1]) + timedelta(
+        minutes=horario.celdas * RESOLUCION_MINUTOS)
+    inicios_por_dia = {}
+    for fecha in Appointment.objects.filter(
+        doctor=doctor,
+        fecha__gte=rango_inicio,
+        fecha__lt=rango_fin,
+    ).exclude(estado__in=ESTADOS_INACTIVOS).values_list('fecha', flat=True):
+        local = fecha.astimezone(horario.zona).date()
+        inicios_por_dia.setdefault(local, []).append(fecha)
+        # Las citas que cruzan la medianoche afectan también al día siguiente
+        fin_local = (fecha + timedelta(minutes=horario.duracion)).astimezone(horario.zona).date()
+        if fin_local != local:
+            inicios_por_dia.setdefault(fin_local, []).append(fecha)
+
+    k = horario.celdas_para(duracion)
+    candidatos = mascara_paso(horario.celdas, horario.celdas_para(paso))
+    delta_celda = timedelta(minutes=RESOLUCION_MINUTOS)
+
+    for dia in dias_laborales:
+        base = horario.inicio_jornada(dia)
+        ocupado = mascara_ocupada(horario, dia, inicios_por_dia.get(dia, ()))
+        libre = horario.mascara_jornada & ~ocupado
+        disponibles = inicios_libres(libre, k) & candidatos
+
+        # Descartar horarios pasados
+        if desde > base:
+            segundos = int((desde - base).total_seconds())
+            celdas_pasadas = -(-segundos // (RESOLUCION_MINUTOS * 60))
+            disponibles &= ~((1 << celdas_pasadas) - 1)
+
+        resultado[dia] = [base + delta_celda * i for i in _bits(disponibles)]
+
+    return resultado
@@ -0,0 +1,269 @@
+"""
+Reagendamiento de citas en lote.
+
+Todos los destinos se validan en memoria contra el motor de conflictos y los
+cambios se aplican en una única transacción con las filas bloqueadas
+(select_for_update). Si algún movimiento no es válido no se aplica ninguno.
+Los horarios destino se reservan en appointments.slots: si otra transacción
+ocupa alguno entretanto, se lanza HorarioOcupado y no se aplica nada.
+"""
+from datetime import datetime, timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from core import cache
+from doctors.models import Doctor
+
+from .availability import HorarioDoctor
+from .conflicts import construir_indices, dias_intervalo, get_duracion_cita, limites_dia
+from .counters import actualizar_contadores
+from .events import estado_cita, evento_cita, publicar_eventos
+from .local_time import asignar_fecha_local, zona_clinica
+from .models import Appointment
+from .slots import MENSAJE_HORA_NO_ALINEADA, alineada, ocupar
+from .waitlist import programar_relleno
+
+# Estados que ya no se pueden mover
+ESTADOS_NO_REAGENDABLES = ('completada', 'cancelada', 'no_asistio')
+
+MAX_MOVIMIENTOS_LOTE = 500
+
+
+class ReagendamientoError(Exception):
+    """Error en los datos de entrada del lote"""
+
+
+def parse_fecha_hora(fecha, hora, zona=None):
+    """Combina 'YYYY-MM-DD' y 'HH:MM' en un datetime aware en `zona` (por defecto la del servidor)"""
+    return timezone.make_aware(datetime.strptime(f"{fecha} {hora}", '%Y-%m-%d %H:%M'), zona)
+
+
+def movimientos_desde_lista(items):
+    """
+    Normaliza [{'cita_id', 'nueva_fecha', 'nueva_hora', 'doctor_id'?}, ...]
+    a una lista de (cita_id, doctor_id | None, nueva_datetime | None). La
+    fecha y la hora son las de la clínica del doctor destino (o del de la
+    cita si no cambia de doctor).
+    """
+    pendientes = []
+    for item in items:
+        try:
+            cita_id = int(item['cita_id'])
+        except (KeyError, TypeError, ValueError):
+            raise ReagendamientoError('Cada movimiento requiere cita_id')
+
+        nueva_fecha = item.get('nueva_fecha')
+        nueva_hora = item.get('nueva_hora')
+        doctor_id = item.get('doctor_id')
+        if not (nueva_fecha and nueva_hora) and not doctor_id:
+            raise ReagendamientoError(f'Movimiento sin destino para la cita {cita_id}')
+
+        try:
+            nueva_datetime = (
+                datetime.strptime(f"{nueva_fecha} {nueva_hora}", '%Y-%m-%d %H:%M')
+                if nueva_fecha and nueva_hora else None
+            )
+            doctor_id = int(doctor_id) if doctor_id else None
+        except ValueError:
+            raise ReagendamientoError(f'Destino inválido para la cita {cita_id}')
+        if nueva_datetime and not alineada(nueva_datetime):
+            raise ReagendamientoError(f'{MENSAJE_HORA_NO_ALINEADA} (cita {cita_id})')
+        pendientes.append((cita_id, doctor_id, nueva_datetime))
+
+    # Clínica de cada doctor destino: una consulta para las citas y otra para los doctores
+    con_hora = [(cita_id, doctor_id) for cita_id, doctor_id, nueva in pendientes if nueva]
+    clinicas_cita = dict(
+        Appointment.objects.filter(id__in=[cita_id for cita_id, doctor_id in con_hora if not doctor_id])
+        .values_list('id', 'doctor__clinica_id')
+    )
+    clinicas_doctor = dict(
+        Doctor.objects.filter(id__in={doctor_id for _, doctor_id in con_hora if doctor_id})
+        .values_list('id', 'clinica_id')
+    )
+    return [
+        (cita_id, doctor_id, timezone.make_aware(nueva_datetime, zona_clinica(
+            clinicas_doctor.get(doctor_id) if doctor_id else clinicas_cita.get(cita_id)
+        )) if nueva_datetime else None)
+        for cita_id, doctor_id, nueva_datetime in pendientes
+    ]
+
+
+def movimientos_desde_regla(regla):
+    """
+    Expande una regla del tipo "mover todas las citas del doctor D del día X
+    (opcionalmente entre hora_desde y hora_hasta) al doctor E y/o al día Y",
+    conservando la hora de cada cita.
+    """
+    try:
+        doctor_id = int(regla['doctor_id'])
+        dia = datetime.strptime(regla['fecha'], '%Y-%m-%d').date()
+        doctor_destino_id = int(regla['doctor_destino_id']) if regla.get('doctor_destino_id') else None
+        dia_destino = (
+            datetime.strptime(regla['fecha_destino'], '%Y-%m-%d').date()
+            if regla.get('fecha_destino') else None
+        )
+        hora_desde = datetime.strptime(regla['hora_desde'], '%H:%M').time() if regla.get('hora_desde') else None
+        hora_hasta = datetime.strptime(regla['hora_hasta'], '%H:%M').time() if regla.get('hora_hasta') else None
+    except (KeyError, TypeError, ValueError):
+        raise ReagendamientoError('Regla inválida: se requieren doctor_id y fecha válidos')
+
+    if doctor_destino_id is None and dia_destino is None:
+        raise ReagendamientoError('La regla debe indicar doctor_destino_id y/o fecha_destino')
+
+    # El día y las horas de la regla son los de la clínica del doctor
+    zona = zona_clinica(Doctor.objects.filter(id=doctor_id).values_list('clinica_id', flat=True).first())
+    inicio, fin = limites_dia(dia, zona)
+    citas = Appointment.objects.filter(
+        doctor_id=doctor_id,
+        fecha__gte=inicio,
+        fecha__lt=fin,
+    ).exclude(estado__in=ESTADOS_NO_REAGENDABLES).order_by('fecha').values_list('id', 'fecha')
+
+    desplazamiento = timedelta(days=(dia_destino - dia).days) if dia_destino else timedelta(0)
+    movimientos = []
+    for cita_id, fecha in citas:
+        local = fecha.astimezone(zona)
+        hora_local = local.time()
+        if hora_desde and hora_local < hora_desde:
+            continue
+        if hora_hasta and hora_local >= hora_hasta:
+            continue
+        nueva_datetime = (
+            timezone.make_aware(datetime.combine(local.date() + desplazamiento, hora_local), zona)
+            if dia_destino else None
+        )
+        movimientos.append((cita_id, doctor_destino_id, nueva_datetime))
+    return movimientos
+
+
+def reagendar_en_lote(movimientos, usuario):
+    """
+    Aplica una lista de (cita_id, doctor_id | None, nueva_datetime | None).
+
+    Devuelve (aplicado, resultados) donde `resultados` contiene un dict por
+    movimiento con `ok` y, si corresponde, `error`. Si algún movimiento falla
+    no se modifica ninguna cita.
+    """
+    if len(movimientos) > MAX_MOVIMIENTOS_LOTE:
+        raise ReagendamientoError(f'Máximo {MAX_MOVIMIENTOS_LOTE} movimientos por lote')
+    ids = [cita_id for cita_id, _, _ in movimientos]
+    if len(set(ids)) != len(ids):
+        raise ReagendamientoError('Una cita aparece más de una vez en el lote')
+
+    doctor_usuario = Doctor.objects.filter(usuario=usuario).first()
+
+    with transaction.atomic():
+        # Bloquear las filas afectadas durante toda la operación
+        citas = {cita.id: cita for cita in Appointment.objects.select_for_update().filter(id__in=ids)}
+
+        doctor_ids = {cita.doctor_id for cita in citas.values()}
+        doctor_ids.update(doctor_id for _, doctor_id, _ in movimientos if doctor_id)
+        doctores = Doctor.objects.select_related('clinica').in_bulk(doctor_ids)
+        horarios = {doctor_id: HorarioDoctor.para_doctor(doctor) for doctor_id, doctor in doctores.items()}
+
+        # Resolver destino y validaciones que no dependen de otras citas
+        resultados = []
+        destinos = []
+        for cita_id, doctor_id, nueva_datetime in movimientos:
+            resultado = {'cita_id': cita_id, 'ok': False}
+            resultados.append(resultado)
+            cita = citas.get(cita_id)
+            if cita is None:
+                resultado['error'] = 'Cita no encontrada'
+                continue
+            if not usuario.is_staff and (doctor_usuario is None or cita.doctor_id != doctor_usuario.id):
+                resultado['error'] = 'Sin permisos para reagendar esta cita'
+                continue
+            if cita.estado in ESTADOS_NO_REAGENDABLES:
+                resultado['error'] = f'No se puede reagendar una cita {cita.get_estado_display().lower()}'
+                continue
+
+            doctor_destino_id = doctor_id or cita.doctor_id
+            doctor_destino = doctores.get(doctor_destino_id)
+            if doctor_destino is None or not doctor_destino.activo:
+                resultado['error'] = 'Doctor destino no encontrado o inactivo'
+                continue
+            # Un doctor solo mueve citas a su agenda o a la de otro doctor de su clínica
+            if not usuario.is_staff and doctor_destino.id != doctor_usuario.id and (
+                    doctor_usuario.clinica_id is None or doctor_destino.clinica_id != doctor_usuario.clinica_id):
+                resultado['error'] = 'Sin permisos para mover citas a la agenda de este doctor'
+                continue
+            inicio = nueva_datetime or cita.fecha
+
+            error_jornada = horarios[doctor_destino_id].error_jornada(inicio)
+            if error_jornada:
+                resultado['error'] = error_jornada
+                continue
+            destinos.append((resultado, cita, doctor_destino, inicio))
+
+        # Validar conflictos en memoria con una sola consulta para todos los doctor-día
+        claves = set()
+        for _, _, doctor_destino, inicio in destinos:
+            duracion = get_duracion_cita(doctor_destino)
+            zona = zona_clinica(doctor_destino.clinica_id)
+            claves.update((doctor_destino.id, dia) for dia in dias_intervalo(inicio, duracion, zona))
+        indices = construir_indices(doctores, claves, exclude_ids=ids)
+
+        liberados = []
+        anteriores = {}
+        for resultado, cita, doctor_destino, inicio in destinos:
+            duracion = get_duracion_cita(doctor_destino)
+            dias = dias_intervalo(inicio, duracion, zona_clinica(doctor_destino.clinica_id))
+            if any(indices[(doctor_destino.id, dia)].overlaps(inicio, duracion) for dia in dias):
+                resultado['error'] = 'Conflicto con otra cita en el horario destino'
+                resultado['conflicto'] = True
+                continue
+            for dia in dias:
+                indices[(doctor_destino.id, dia)].add(cita.id, inicio, duracion)
+
+            # Cada fecha en la zona de su clínica, como la vista diaria
+            anterior = timezone.localtime(cita.fecha, zona_clinica(cita.clinica_id))
+            nueva = timezone.localtime(inicio, zona_clinica(doctor_destino.clinica_id))
+            resultado.update({
+                'ok': True,
+                'fecha_anterior': anterior.strftime('%Y-%m-%d %H:%M'),
+                'fecha_nueva': nueva.strftime('%Y-%m-%d %H:%M'),
+                'doctor_anterior_id': cita.doctor_id,
+                'doctor_id': doctor_destino.id,
+            })
+            liberados.append((cita.doctor_id, cita.fecha))
+            anteriores[cita.id] = estado_cita(cita)
+            cita.fecha = inicio
+            if cita.doctor_id != doctor_destino.id:
+                cita.doctor = doctor_destino
+                cita.clinica_id = doctor_destino.clinica_id or cita.clinica_id
+
+        if not all(resultado['ok'] for resultado in resultados):
+            transaction.set_rollback(True)
+            return False, resultados
+
+        # bulk_update no aplica auto_now; las filas están bloqueadas, la versión leída es la actual
+        ahora = timezone.now()
+        for cita in citas.values():
+            cita.actualizada_en = ahora
+            cita.version += 1
+            asignar_fecha_local(cita)
+        Appointment.objects.bulk_update(
+            list(citas.values()),
+            ['fecha', 'fecha_local', 'hora_local', 'doctor', 'clinica', 'actualizada_en', 'version'],
+        )
+        ocupar(citas.values(), doctores)
+        actualizar_contadores(anteriores.values(), [estado_cita(citas[cita_id]) for cita_id in anteriores])
+
+        # bulk_update no emite señales
+        afectados = {r['doctor_anterior_id'] for r in resultados} | {r['doctor_id'] for r in resultados}
+        cache.invalidar(
+            doctores=afectados,
+            clinicas={anterior['clinica_id'] for anterior in anteriores.values()}
+            | {cita.clinica_id for cita in citas.values()},
+        )
+        publicar_eventos([
+            evento_cita('reagendada', citas[cita_id], anterior) for cita_id, anterior in anteriores.items()
+        ])
+
+        # Los horarios de origen quedan libres para la lista de espera
+        for doctor_id, fecha in liberados:
+            programar_relleno(doctor_id, fecha)
+
+    return True, resultados
@@ -0,0 +1,323 @@
+"""
+Altas y modificaciones masivas de citas (integraciones que cargan la agenda
+de un día de una vez).
+
+Cada elemento se valida con las reglas de AppointmentForm
+(AppointmentLoteForm, sin consultas por fila) y la jornada con el
+HorarioDoctor de su doctor, en la zona horaria de la clínica. Pacientes,
+doctores y citas a modificar se leen con una consulta cada uno y los
+conflictos de horario de todos los doctor-día del lote con una sola
+consulta por rango (construir_indices), incluidos los solapamientos entre
+elementos del propio lote. Las filas se escriben con bulk_create / bulk_update y los horarios se
+reservan en appointments.slots dentro de la misma transacción.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from core import cache
+from core.bulk import agregar_error, errores_formulario, escribir_lote, resultados_vacios
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .availability import HorarioDoctor
+from .bulk_reschedule import ESTADOS_NO_REAGENDABLES
+from .conflicts import construir_indices, dias_intervalo, get_duracion_cita
+from .counters import actualizar_contadores
+from .events import estado_cita, evento_cita, publicar_eventos
+from .forms import AppointmentLoteForm
+from .local_time import asignar_fecha_local, zona_clinica
+from .models import Appointment
+from .slots import HorarioOcupado, ocupar
+from .waitlist import programar_relleno
+
+CAMPOS_MODIFICABLES = ('paciente', 'fecha', 'motivo', 'observaciones')
+
+MENSAJE_CONFLICTO = (
+    'Ya existe una cita programada cerca de esta hora. '
+    'Por favor seleccione otro horario.'
+)
+
+MENSAJE_CONCURRENTE = 'Otro proceso reservó uno de los horarios del lote; reintente la operación'
+
+
+def _formularios(items, resultados, parcial=False):
+    """Aplica AppointmentLoteForm a cada elemento; devuelve [(resultado, datos limpios)]"""
+    validos = []
+    for resultado, item in zip(resultados, items):
+        if not isinstance(item, dict):
+            agregar_error(resultado, '__all__', 'Se esperaba un objeto')
+            continue
+        form = AppointmentLoteForm(item, parcial=parcial)
+        if not form.is_valid():
+            resultado['errores'] = errores_formulario(form)
+            continue
+        validos.append((resultado, form.cleaned_data))
+    return validos
+
+
+def _comprobar_pacientes(validos):
+    """Una consulta para todos los pacientes referenciados"""
+    ids = {datos['paciente'] for _, datos in validos if datos.get('paciente')}
+    existentes = set(Patient.objects.filter(id__in=ids).values_list('id', flat=True))
+    for resultado, datos in validos:
+        if datos.get('paciente') and datos['paciente'] not in existentes:
+            agregar_error(resultado, 'paciente', 'Paciente no encontrado')
+
+
+def _fecha_en_clinica(resultado, datos, horario):
+    """
+    Interpreta una fecha enviada sin zona horaria en la de la clínica del
+    doctor (como el calendario) y comprueba la jornada. False si no es válida.
+    """
+    if datos.pop('fecha_sin_zona', False):
+        datos['fecha'] = timezone.make_aware(timezone.make_naive(datos['fecha']), horario.zona)
+    error = horario.error_jornada(datos['fecha'])
+    if error:
+        agregar_error(resultado, 'fecha', error)
+        return False
+    return True
+
+
+def _comprobar_conflictos(destinos, doctores, exclude_ids=()):
+    """
+    `destinos` es [(resultado, cita_id, doctor_id, inicio)]. Los elementos
+    aceptados se añaden al índice para detectar solapamientos dentro del lote.
+    """
+    claves = set()
+    for _, _, doctor_id, inicio in destinos:
+        duracion = get_duracion_cita(doctores[doctor_id])
+        claves.update(
+            (doctor_id, dia) for dia in dias_intervalo(inicio, duracion, zona_clinica(doctores[doctor_id].clinica_id))
+        )
+    indices = construir_indices(doctores, claves, exclude_ids=exclude_ids)
+
+    for resultado, cita_id, doctor_id, inicio in destinos:
+        duracion = get_duracion_cita(doctores[doctor_id])
+        dias = dias_intervalo(inicio, duracion, zona_clinica(doctores[doctor_id].clinica_id))
+        if any(indices[(doctor_id, dia)].overlaps(inicio, duracion) for dia in dias):
+            agregar_error(resultado, 'fecha', MENSAJE_CONFLICTO)
+            continue
+        for dia in dias:
+            indices[(doctor_id, dia)].add(cita_id, inicio, duracion)
+
+
+def _ocupar_horarios(citas, doctores, resultados):
+    """
+    Reserva los horarios de las citas escritas. Si otra transacción ocupó
+    alguno desde la validación se revierte el lote y los `resultados` pasan
+    a error; devuelve False.
+    """
+    try:
+        ocupar(citas, doctores)
+    except HorarioOcupado:
+        transaction.set_rollback(True)
+        for resultado in resultados:
+            resultado['ok'] = False
+            agregar_error(resultado, 'fecha', MENSAJE_CONCURRENTE)
+        return False
+    return True
+
+
+def _invalidar_al_confirmar(citas):
+    # bulk_create/bulk_update no emiten señales: los eventos SSE se publican aparte
+    doctor_ids = {cita.doctor_id for cita in citas}
+    cache.invalidar(doctores=doctor_ids, clinicas={cita.clinica_id for cita in citas})
+
+
+def crear_citas_lote(items, usuario, modo):
+    """
+    Crea las citas de `items` ({"paciente", "fecha", "motivo",
+    "observaciones"?, "doctor"?}). Un doctor crea citas en su propia agenda;
+    el personal staff debe indicar el doctor de cada una.
+    """
+    resultados = resultados_vacios(items)
+    validos = _formularios(items, resultados)
+    doctor_usuario = Doctor.objects.filter(usuario=usuario).first()
+
+    for resultado, datos in validos:
+        if datos.get('doctor') is None:
+            if doctor_usuario is None:
+                agregar_error(resultado, 'doctor', 'Doctor requerido')
+            else:
+                datos['doctor'] = doctor_usuario.id
+        elif not usuario.is_staff and (doctor_usuario is None or datos['doctor'] != doctor_usuario.id):
+            agregar_error(resultado, 'doctor', 'Sin permisos para agendar citas de otro doctor')
+
+    with transaction.atomic():
+        _comprobar_pacientes(validos)
+
+        # Bloquear a los doctores serializa las cargas concurrentes sobre las mismas agendas
+        doctores = Doctor.objects.select_for_update(of=('self',)).select_related('clinica').in_bulk(
+            {datos['doctor'] for resultado, datos in validos if 'errores' not in resultado}
+        )
+        destinos = []
+        for resultado, datos in validos:
+            if 'errores' in resultado:
+                continue
+            doctor = doctores.get(datos['doctor'])
+            if doctor is None or not doctor.activo:
+                agregar_error(resultado, 'doctor', 'Doctor no encontrado o inactivo')
+                continue
+            if not _fecha_en_clinica(resultado, datos, HorarioDoctor.para_doctor(doctor)):
+                continue
+            # Ids provisionales negativos para las citas nuevas del lote
+            destinos.append((resultado, -(resultado['indice'] + 1), doctor.id, datos['fecha']))
+        _comprobar_conflictos(destinos, doctores)
+
+        if not escribir_lote(resultados, modo):
+            return resultados
+
+        nuevas = [
+            (resultado, asignar_fecha_local(Appointment(
+                paciente_id=datos['paciente'],
+                doctor=doctores[datos['doctor']],
+                clinica_id=doctores[datos['doctor']].clinica_id,
+                fecha=datos['fecha'],
+                motivo=datos['motivo'],
+                observaciones=datos.get('observaciones') or None,
+            )))
+            for resultado, datos in validos if 'errores' not in resultado
+        ]
+        citas = Appointment.objects.bulk_create([cita for _, cita in nuevas])
+        if citas and citas[0].pk is None:
+            # MySQL no devuelve los ids de un INSERT múltiple: recuperarlos con una consulta
+            ids = {
+                (doctor_id, fecha, paciente_id): cita_id
+                for cita_id, doctor_id, fecha, paciente_id in Appointment.objects.filter(
+                    doctor_id__in={cita.doctor_id for cita in citas},
+                    fecha__in={cita.fecha for cita in citas},
+                    paciente_id__in={cita.paciente_id for cita in citas},
+                ).values_list('id', 'doctor_id', 'fecha', 'paciente_id')
+            }
+            for cita in citas:
+                cita.pk = ids.get((cita.doctor_id, cita.fecha, cita.paciente_id))
+
+        if not _ocupar_horarios(citas, doctores, [resultado for resultado, _ in nuevas]):
+            return resultados
+
+        for resultado, cita in nuevas:
+            resultado.update({'ok': True, 'id': cita.pk})
+        actualizar_contadores(actuales=[estado_cita(cita) for cita in citas])
+        _invalidar_al_confirmar(citas)
+        publicar_eventos([evento_cita('creada', cita) for cita in citas])
+
+    return resultados
+
+
+def actualizar_citas_lote(items, usuario, modo):
+    """
+    Modifica las citas de `items` ({"id", "paciente"?, "fecha"?, "motivo"?,
+    "observaciones"?}). Solo se validan y escriben los campos enviados.
+    """
+    resultados = resultados_vacios(items)
+    ids_lote = set()
+    for resultado, item in zip(resultados, items):
+        try:
+            cita_id = int(item['id'])
+        except (KeyError, TypeError, ValueError):
+            agregar_error(resultado, 'id', 'Se requiere el id de la cita')
+            continue
+        if cita_id in ids_lote:
+            agregar_error(resultado, 'id', 'La cita aparece más de una vez en el lote')
+            continue
+        ids_lote.add(cita_id)
+        resultado['id'] = cita_id
+        if not any(campo in item for campo in CAMPOS_MODIFICABLES):
+            agregar_error(resultado, '__all__', f'Sin cambios: campos modificables {", ".join(CAMPOS_MODIFICABLES)}')
+
+    validos = _formularios(
+        [item for resultado, item in zip(resultados, items) if 'errores' not in resultado],
+        [resultado for resultado in resultados if 'errores' not in resultado],
+        parcial=True,
+    )
+    doctor_usuario = Doctor.objects.filter(usuario=usuario).first()
+
+    with transaction.atomic():
+        citas = Appointment.objects.select_for_update().in_bulk(
+            [resultado['id'] for resultado, _ in validos]
+        )
+        _comprobar_pacientes(validos)
+        doctores = Doctor.objects.select_related('clinica').in_bulk({cita.doctor_id for cita in citas.values()})
+        horarios = {doctor_id: HorarioDoctor.para_doctor(doctor) for doctor_id, doctor in doctores.items()}
+
+        destinos = []
+        for resultado, datos in validos:
+            cita = citas.get(resultado['id'])
+            if cita is None:
+                agregar_error(resultado, 'id', 'Cita no encontrada')
+                continue
+            if not usuario.is_staff and (doctor_usuario is None or cita.doctor_id != doctor_usuario.id):
+                agregar_error(resultado, 'id', 'Sin permisos para modificar esta cita')
+                continue
+            if 'fecha' in datos and not _fecha_en_clinica(resultado, datos, horarios[cita.doctor_id]):
+                continue
+            if 'fecha' in datos and datos['fecha'] != cita.fecha:
+                if cita.estado in ESTADOS_NO_REAGENDABLES:
+                    agregar_error(
+                        resultado, 'fecha',
+                        f'No se puede reagendar una cita {cita.get_estado_display().lower()}'
+                    )
+                    continue
+                destinos.append((resultado, cita.id, cita.doctor_id, datos['fecha']))
+        _comprobar_conflictos(
+            destinos, doctores, exclude_ids=[cita_id for _, cita_id, _, _ in destinos]
+        )
+
+        if not escribir_lote(resultados, modo):
+            return resultados
+
+        campos = {'actualizada_en', 'version', 'fecha_local', 'hora_local'}
+        modificadas = []
+        reagendadas = []
+        eventos = []
+        anteriores = []
+        liberados = []
+        ahora = timezone.now()
+        for resultado, datos in validos:
+            if 'errores' in resultado:
+                continue
+            cita = citas[resultado['id']]
+            anterior = estado_cita(cita)
+            anteriores.append(anterior)
+            if datos.get('fecha') is not None and datos['fecha'] != cita.fecha:
+                liberados.append((cita.doctor_id, cita.fecha))
+            for campo in CAMPOS_MODIFICABLES:
+                if campo not in datos:
+                    continue
+                if campo == 'paciente':
+                    cita.paciente_id = datos[campo]
+                elif campo == 'observaciones':
+                    cita.observaciones = datos[campo] or None
+                else:
+                    setattr(cita, campo, datos[campo])
+                campos.add(campo)
+            # bulk_update no aplica auto_now; las filas están bloqueadas, la versión leída es la actual
+            cita.actualizada_en = ahora
+            cita.version += 1
+            modificadas.append((resultado, asignar_fecha_local(cita)))
+            if cita.fecha != anterior['fecha']:
+                reagendadas.append((resultado, cita))
+            eventos.append(evento_cita(
+                'reagendada' if cita.fecha != anterior['fecha'] else 'actualizada', cita, anterior
+            ))
+            resultado['ok'] = True
+
+        Appointment.objects.bulk_update([cita for _, cita in modificadas], sorted(campos))
+        if not _ocupar_horarios(
+            [cita for _, cita in reagendadas], doctores, [resultado for resultado, _ in reagendadas]
+        ):
+            # Todo el lote se revierte, también lo que no cambiaba de horario
+            for resultado, _ in modificadas:
+                if resultado['ok']:
+                    resultado['ok'] = False
+                    agregar_error(resultado, '__all__', 'No aplicado: el lote se revirtió')
+            return resultados
+        actualizar_contadores(anteriores, [estado_cita(cita) for _, cita in modificadas])
+        _invalidar_al_confirmar([cita for _, cita in modificadas])
+        publicar_eventos(eventos)
+
+        # Los horarios anteriores quedan libres para la lista de espera
+        for doctor_id, fecha in liberados:
+            programar_relleno(doctor_id, fecha)
+
+    return resultados
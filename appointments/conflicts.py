@@ -0,0 +1,205 @@
+"""
+Motor de detección de conflictos de citas basado en intervalos.
+
+Cada doctor-día se representa con arreglos ordenados de inicio/fin construidos
+a partir de una sola consulta por rango. Las consultas "¿se solapa [t, t+d)?"
+y "listar solapamientos" se resuelven con búsqueda binaria sobre esos arreglos.
+Los intervalos se leen siempre de la base de datos (no hay caché entre
+peticiones), así que las reservas de otros procesos se ven de inmediato.
+
+Se descartó mantener los intervalos en memoria para no repetir consultas:
+con varios workers no sería correcto. ConflictIndex hace una consulta por
+comprobación; quien compruebe muchos horarios (lotes, series, búsquedas de
+huecos) debe cargar todos los doctor-día de una vez con construir_indices.
+"""
+from bisect import bisect_left
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+
+from .local_time import zona_clinica
+from .models import Appointment
+
+# Estados que no ocupan el horario del doctor
+ESTADOS_INACTIVOS = ('cancelada',)
+
+DURACION_CITA_DEFAULT = 30
+
+
+def get_duracion_cita(doctor):
+    """
+    Duración en minutos de las citas de un doctor: primero la del doctor,
+    luego la de su clínica y por último el valor por defecto.
+    """
+    if doctor.duracion_cita_default:
+        return doctor.duracion_cita_default
+    if doctor.clinica_id and doctor.clinica.duracion_cita_default:
+        return doctor.clinica.duracion_cita_default
+    return DURACION_CITA_DEFAULT
+
+
+def limites_dia(dia, zona=None):
+    """Devuelve el inicio y fin (aware) del día local indicado en `zona` (por defecto la de settings)"""
+    zona = zona or timezone.get_default_timezone()
+    inicio = timezone.make_aware(datetime.combine(dia, time.min), zona)
+    return inicio, timezone.make_aware(datetime.combine(dia + timedelta(days=1), time.min), zona)
+
+
+def dias_intervalo(inicio, duracion, zona=None):
+    """Días locales (en `zona`, por defecto la de settings) que cubre el intervalo [inicio, inicio + duracion)"""
+    zona = zona or timezone.get_default_timezone()
+    primero = inicio.astimezone(zona).date()
+    ultimo = (inicio + timedelta(minutes=duracion) - timedelta(microseconds=1)).astimezone(zona).date()
+    dias = [primero]
+    while dias[-1] < ultimo:
+        dias.append(dias[-1] + timedelta(days=1))
+    return dias
+
+
+class DoctorDayIntervals:
+    """
+    Intervalos ocupados de un doctor en un día.
+
+    `starts` y `ends` están ordenados por inicio; `max_ends[i]` es el mayor fin
+    entre los intervalos 0..i, lo que permite descartar en O(log n) cualquier
+    solapamiento aunque existan citas superpuestas entre sí.
+    """
+
+    def __init__(self, doctor_id, dia, duracion, rows):
+        self.doctor_id = doctor_id
+        self.dia = dia
+        self.duracion = duracion
+
+        delta = timedelta(minutes=duracion)
+        self.ids = []
+        self.starts = []
+        self.ends = []
+        self.max_ends = []
+        max_end = None
+        for cita_id, fecha in rows:
+            fin = fecha + delta
+            max_end = fin if max_end is None or fin > max_end else max_end
+            self.ids.append(cita_id)
+            self.starts.append(fecha)
+            self.ends.append(fin)
+            self.max_ends.append(max_end)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _candidatos(self, inicio, fin, exclude_id=None):
+        """
+        Recorre hacia atrás los intervalos que empiezan antes de `fin` mientras
+        el máximo acumulado de fines siga superando `inicio`.
+        """
+        i = bisect_left(self.starts, fin) - 1
+        while i >= 0 and self.max_ends[i] > inicio:
+            if self.ends[i] > inicio and self.ids[i] != exclude_id:
+                yield i
+            i -= 1
+
+    def overlaps(self, inicio, duracion=None, exclude_id=None):
+        """¿Se solapa [inicio, inicio + duracion) con alguna cita?"""
+        fin = inicio + timedelta(minutes=duracion or self.duracion)
+        return next(self._candidatos(inicio, fin, exclude_id), None) is not None
+
+    def list_overlaps(self, inicio, duracion=None, exclude_id=None):
+        """Lista de (id, inicio, fin) de las citas que se solapan, ordenada por inicio"""
+        fin = inicio + timedelta(minutes=duracion or self.duracion)
+        indices = sorted(self._candidatos(inicio, fin, exclude_id))
+        return [(self.ids[i], self.starts[i], self.ends[i]) for i in indices]
+
+    def add(self, cita_id, inicio, duracion=None):
+        """Inserta un intervalo manteniendo el orden (simulación de cambios en lote)"""
+        fin = inicio + timedelta(minutes=duracion or self.duracion)
+        pos = bisect_left(self.starts, inicio)
+        self.ids.insert(pos, cita_id)
+        self.starts.insert(pos, inicio)
+        self.ends.insert(pos, fin)
+        self.max_ends.insert(pos, fin)
+        for i in range(pos, len(self.max_ends)):
+            if i > 0 and self.max_ends[i - 1] > self.ends[i]:
+                self.max_ends[i] = self.max_ends[i - 1]
+            else:
+                self.max_ends[i] = self.ends[i]
+
+
+def construir_indices(doctores, claves, exclude_ids=()):
+    """
+    Carga con una sola consulta los intervalos de varios doctor-día.
+
+    `doctores` es {doctor_id: Doctor} y `claves` un iterable de
+    (doctor_id, dia), con el día local de la clínica del doctor (ver
+    dias_intervalo). Las citas de `exclude_ids` se omiten (por ejemplo, las
+    que se van a mover). Devuelve {(doctor_id, dia): DoctorDayIntervals}.
+    """
+    claves = set(claves)
+    if not claves:
+        return {}
+
+    duraciones = {doctor_id: get_duracion_cita(doctor) for doctor_id, doctor in doctores.items()}
+    zonas = {doctor_id: zona_clinica(doctor.clinica_id) for doctor_id, doctor in doctores.items()}
+    inicio = min(limites_dia(dia, zonas[doctor_id])[0] for doctor_id, dia in claves)
+    fin = max(limites_dia(dia, zonas[doctor_id])[1] for doctor_id, dia in claves)
+
+    filas_por_clave = {clave: [] for clave in claves}
+    filas = Appointment.objects.filter(
+        doctor_id__in={doctor_id for doctor_id, _ in claves},
+        fecha__gte=inicio - timedelta(minutes=max(duraciones.values())),
+        fecha__lt=fin,
+    ).exclude(
+        estado__in=ESTADOS_INACTIVOS
+    ).exclude(
+        id__in=list(exclude_ids)
+    ).order_by('fecha').values_list('id', 'doctor_id', 'fecha')
+
+    for cita_id, doctor_id, fecha in filas:
+        dia_inicio = fecha.astimezone(zonas[doctor_id]).date()
+        dia_fin = (fecha + timedelta(minutes=duraciones[doctor_id])).astimezone(zonas[doctor_id]).date()
+        for dia in {dia_inicio, dia_fin}:
+            if (doctor_id, dia) in filas_por_clave:
+                filas_por_clave[(doctor_id, dia)].append((cita_id, fecha))
+
+    return {
+        (doctor_id, dia): DoctorDayIntervals(doctor_id, dia, duraciones[doctor_id], filas)
+        for (doctor_id, dia), filas in filas_por_clave.items()
+    }
+
+
+class ConflictIndex:
+    """
+    Comprobación de solapamientos de un doctor contra la base de datos.
+
+    No guarda intervalos entre llamadas: con varios procesos (workers) una
+    caché en memoria no vería las reservas hechas en los demás. Cada
+    comprobación carga con una sola consulta por rango, sobre el índice
+    (doctor, fecha), las citas que pueden solaparse con el intervalo.
+    """
+
+    def intervalos(self, doctor, inicio, duracion=None, exclude_id=None):
+        """DoctorDayIntervals con las citas activas que pueden solaparse con [inicio, inicio + duracion)"""
+        duracion_citas = get_duracion_cita(doctor)
+        fin = inicio + timedelta(minutes=duracion or duracion_citas)
+        # Una cita que empieza menos de `duracion_citas` minutos antes invade el intervalo
+        rows = Appointment.objects.filter(
+            doctor_id=doctor.id,
+            fecha__gt=inicio - timedelta(minutes=duracion_citas),
+            fecha__lt=fin,
+        ).exclude(
+            estado__in=ESTADOS_INACTIVOS
+        ).exclude(
+            id=exclude_id
+        ).order_by('fecha').values_list('id', 'fecha')
+        dia = inicio.astimezone(zona_clinica(doctor.clinica_id)).date()
+        return DoctorDayIntervals(doctor.id, dia, duracion_citas, list(rows))
+
+    def hay_conflicto(self, doctor, inicio, duracion=None, exclude_id=None):
+        """¿Se solapa [inicio, inicio + duracion) con alguna cita activa del doctor?"""
+        return self.intervalos(doctor, inicio, duracion, exclude_id).overlaps(inicio, duracion)
+
+    def conflictos(self, doctor, inicio, duracion=None, exclude_id=None):
+        """Lista de (id, inicio, fin) de las citas activas que se solapan"""
+        return self.intervalos(doctor, inicio, duracion, exclude_id).list_overlaps(inicio, duracion)
+
+
+conflict_index = ConflictIndex()
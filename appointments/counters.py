@@ -0,0 +1,145 @@
+"""
+Contadores diarios de citas por doctor (ContadorDiarioCitas).
+
+Cada fila cuenta las citas de un doctor en un día local con un estado y una
+prioridad de paciente. Las estadísticas de los dashboards suman estas filas
+con una sola agregación condicional, en lugar de contar sobre el historial
+completo de citas con una consulta por métrica.
+
+Appointment.save()/delete() y Patient.save() los mantienen mediante
+señales; las escrituras masivas (bulk_create, bulk_update, update) deben
+llamar a actualizar_contadores con los estados antes y después del cambio
+(dicts de events.estado_cita).
+"""
+from collections import Counter
+
+from django.db import transaction
+from django.db.models import Count, F, Max, Q, Subquery, Sum
+
+from patients.models import Patient
+
+from .models import Appointment, ContadorDiarioCitas
+
+TAMANO_LOTE = 1000
+
+
+def _clave(valores, prioridades):
+    prioridad = prioridades.get(valores['paciente_id'])
+    if prioridad is None:
+        return None
+    return valores['doctor_id'], valores['fecha_local'], valores['estado'], prioridad
+
+
+def actualizar_contadores(anteriores=(), actuales=()):
+    """
+    Resta las citas descritas en `anteriores` y suma las de `actuales`. Las
+    prioridades de los pacientes se leen en una sola consulta.
+    """
+    anteriores, actuales = list(anteriores), list(actuales)
+    if not anteriores and not actuales:
+        return
+    prioridades = dict(Patient.objects.filter(
+        id__in={valores['paciente_id'] for valores in anteriores + actuales}
+    ).values_list('id', 'prioridad'))
+    deltas = Counter()
+    for valores in anteriores:
+        deltas[_clave(valores, prioridades)] -= 1
+    for valores in actuales:
+        deltas[_clave(valores, prioridades)] += 1
+    # Paciente que ya no existe (borrado en cascada): no hay contador que tocar
+    deltas.pop(None, None)
+    aplicar_deltas(deltas)
+
+
+def aplicar_deltas(deltas):
+    """Aplica {(doctor_id, fecha, estado, prioridad): delta} con UPDATE total = total + delta"""
+    cambios = sorted((clave, delta) for clave, delta in deltas.items() if delta)
+    if not cambios:
+        return
+    with transaction.atomic():
+        # Solo las sumas pueden necesitar fila nueva; las restas nunca la crean
+        nuevas = [
+            ContadorDiarioCitas(doctor_id=doctor_id, fecha=fecha, estado=estado, prioridad=prioridad)
+            for (doctor_id, fecha, estado, prioridad), delta in cambios if delta > 0
+        ]
+        if nuevas:
+            ContadorDiarioCitas.objects.bulk_create(nuevas, ignore_conflicts=True)
+        # Mismo orden en todas las transacciones para no provocar interbloqueos
+        for (doctor_id, fecha, estado, prioridad), delta in cambios:
+            ContadorDiarioCitas.objects.filter(
+                doctor_id=doctor_id, fecha=fecha, estado=estado, prioridad=prioridad
+            ).update(total=F('total') + delta)
+
+
+def mover_prioridad(cambios):
+    """Recuenta las citas de los pacientes {paciente_id: (prioridad_anterior, prioridad_nueva)}"""
+    cambios = {paciente_id: par for paciente_id, par in cambios.items() if par[0] != par[1]}
+    if not cambios:
+        return
+    filas = Appointment.objects.filter(paciente_id__in=list(cambios)).values(
+        'paciente_id', 'doctor_id', 'fecha_local', 'estado'
+    ).annotate(total=Count('id')).order_by()
+    deltas = Counter()
+    for fila in filas:
+        anterior, nueva = cambios[fila['paciente_id']]
+        clave = (fila['doctor_id'], fila['fecha_local'], fila['estado'])
+        deltas[clave + (anterior,)] -= fila['total']
+        deltas[clave + (nueva,)] += fila['total']
+    aplicar_deltas(deltas)
+
+
+def resumir_contadores(doctor_id, **ventanas):
+    """
+    Estadísticas del doctor en una sola consulta. `ventanas` es {nombre: Q}
+    sobre fecha/estado/prioridad del contador; además devuelve 'total',
+    'pacientes' (pacientes distintos) y 'prioridades' ({prioridad: citas},
+    de mayor a menor y sin ceros).
+    """
+    agregados = {nombre: Sum('total', filter=condicion) for nombre, condicion in ventanas.items()}
+    # El alias no puede coincidir con el campo `total`
+    agregados['todas'] = Sum('total')
+    # Los contadores no distinguen pacientes: subconsulta sobre las citas del doctor
+    pacientes = Appointment.objects.filter(doctor_id=doctor_id).values('doctor_id').annotate(
+        distintos=Count('paciente_id', distinct=True)
+    ).values('distintos')
+    agregados['pacientes'] = Max(Subquery(pacientes))
+    for codigo, _ in Patient.PRIORITY_CHOICES:
+        agregados[f'prioridad_{codigo}'] = Sum('total', filter=Q(prioridad=codigo))
+    resumen = {
+        nombre: valor or 0
+        for nombre, valor in ContadorDiarioCitas.objects.filter(doctor_id=doctor_id).aggregate(**agregados).items()
+    }
+    resumen['total'] = resumen.pop('todas')
+    prioridades = [(codigo, resumen.pop(f'prioridad_{codigo}')) for codigo, _ in Patient.PRIORITY_CHOICES]
+    resumen['prioridades'] = dict(sorted(
+        ((codigo, total) for codigo, total in prioridades if total), key=lambda par: -par[1]
+    ))
+    return resumen
+
+
+def reconstruir_contadores(doctor_ids=None):
+    """
+    Recalcula desde cero los contadores de `doctor_ids` (ids o subconsulta;
+    None = todos). Devuelve el número de filas creadas.
+    """
+    contadores = ContadorDiarioCitas.objects.all()
+    citas = Appointment.objects.all()
+    if doctor_ids is not None:
+        contadores = contadores.filter(doctor_id__in=doctor_ids)
+        citas = citas.filter(doctor_id__in=doctor_ids)
+    filas = citas.values('doctor_id', 'fecha_local', 'estado', 'paciente__prioridad').annotate(
+        total=Count('id')
+    ).order_by()
+    with transaction.atomic():
+        contadores.delete()
+        nuevas = ContadorDiarioCitas.objects.bulk_create(
+            (
+                ContadorDiarioCitas(
+                    doctor_id=fila['doctor_id'], fecha=fila['fecha_local'], estado=fila['estado'],
+                    prioridad=fila['paciente__prioridad'], total=fila['total'],
+                )
+                for fila in filas.iterator()
+            ),
+            batch_size=TAMANO_LOTE,
+        )
+    return len(nuevas)
@@ -0,0 +1,105 @@
+"""
+Eventos de cambios de citas para el stream SSE del calendario y los
+dashboards (ver views_eventos.py).
+
+Cada cambio se publica al confirmar la transacción en los canales de su
+clínica y de su doctor (y en los anteriores si la cita cambió de doctor o de
+clínica). El evento lleva el estado actual y, salvo en las altas, el
+anterior, de modo que el cliente puede restar en (fecha_local, estado)
+anteriores y sumar en los nuevos sin volver a pedir el día.
+
+Tipos: creada, actualizada, reagendada, cancelada y eliminada. Se construyen
+con los valores ya cargados en la instancia, sin consultas.
+"""
+from django.db import transaction
+from django.utils import timezone
+
+from core.pubsub import broker
+
+from .local_time import valores_locales, zona_clinica
+
+TIPOS_EVENTO = ('creada', 'actualizada', 'reagendada', 'cancelada', 'eliminada')
+
+
+def canal_clinica(clinica_id):
+    return f'clinica:{clinica_id}'
+
+
+def canal_doctor(doctor_id):
+    return f'doctor:{doctor_id}'
+
+
+def estado_cita(cita):
+    """{doctor_id, paciente_id, clinica_id, fecha, fecha_local, estado} de una cita"""
+    return {
+        'doctor_id': cita.doctor_id,
+        'paciente_id': cita.paciente_id,
+        'clinica_id': cita.clinica_id,
+        'fecha': cita.fecha,
+        'fecha_local': cita.fecha_local,
+        'estado': cita.estado,
+    }
+
+
+def _serializar(estado):
+    # Fecha y hora en la zona de la clínica, igual que fecha_local
+    local = timezone.localtime(estado['fecha'], zona_clinica(estado['clinica_id']))
+    return {
+        'doctor_id': estado['doctor_id'],
+        'clinica_id': estado['clinica_id'],
+        'fecha': local.isoformat(),
+        'fecha_local': estado['fecha_local'].isoformat(),
+        'hora': local.strftime('%H:%M'),
+        'estado': estado['estado'],
+    }
+
+
+def evento_cita(tipo, cita, anterior=None):
+    """
+    Evento para `cita` con su estado actual. `anterior` es el estado_cita()
+    previo al cambio (None en las altas)
+    """
+    evento = {
+        'tipo': tipo,
+        'id': cita.pk,
+        'paciente_id': cita.paciente_id,
+        **_serializar(estado_cita(cita)),
+        'anterior': _serializar(anterior) if anterior else None,
+    }
+    canales = {canal_clinica(cita.clinica_id), canal_doctor(cita.doctor_id)}
+    if anterior:
+        canales.update({canal_clinica(anterior['clinica_id']), canal_doctor(anterior['doctor_id'])})
+    return canales, evento
+
+
+def tipo_cambio(anterior, actual):
+    if actual['estado'] == 'cancelada' and anterior['estado'] != 'cancelada':
+        return 'cancelada'
+    if anterior['fecha'] != actual['fecha'] or anterior['doctor_id'] != actual['doctor_id']:
+        return 'reagendada'
+    return 'actualizada'
+
+
+def anterior_desde_original(cita):
+    """
+    Estado previo a partir de los valores que guarda Appointment.from_db
+    (fecha, estado, doctor_id, paciente_id, clinica_id); los que no se cargaron se toman del actual
+    """
+    anterior = estado_cita(cita)
+    original = getattr(cita, '_original', None) or {}
+    anterior.update(original)
+    if 'fecha' in original or 'clinica_id' in original:
+        anterior['fecha_local'], _ = valores_locales(anterior['fecha'], anterior['clinica_id'])
+    return anterior
+
+
+def publicar_eventos(eventos):
+    """Publica [(canales, evento)] solo si la transacción se confirma"""
+    if not eventos:
+        return
+
+    def publicar():
+        for canales, evento in eventos:
+            broker.publicar(canales, evento)
+
+    transaction.on_commit(publicar)
@@ -2,10 +2,19 @@ from django import forms
 from django.utils import timezone
 from django.db import models
 from datetime import datetime, timedelta
+from django.utils.dateparse import parse_datetime
 from .models import Appointment
+from .availability import HorarioDoctor
+from .conflicts import conflict_index
+from .slots import MENSAJE_HORA_NO_ALINEADA, alineada
+from doctors.models import Doctor
 from patients.models import Patient
 
 class AppointmentForm(forms.ModelForm):
+    # Jornada comprobada con HorarioDoctor (la de la clínica del doctor o la
+    # jornada por defecto si no hay doctor)
+    validar_jornada = True
+
     class Meta:
         model = Appointment
         fields = ['paciente', 'fecha', 'motivo', 'observaciones']
@@ -68,6 +77,10 @@ class AppointmentForm(forms.ModelForm):
         fecha = self.cleaned_data.get('fecha')
         
         if fecha:
+            # Appointments start on the slot grid (see appointments.slots)
+            if not alineada(fecha):
+                raise forms.ValidationError(f"{MENSAJE_HORA_NO_ALINEADA}. Por favor seleccione otro horario.")
+
             # Check if the appointment is in the past
             if fecha < timezone.now():
                 raise forms.ValidationError(
@@ -81,34 +94,20 @@ class AppointmentForm(forms.ModelForm):
                     "No se pueden crear citas con más de un año de anticipación."
                 )
             
-            # Check business hours (8 AM to 6 PM)
-            if fecha.hour < 8 or fecha.hour >= 18:
-                raise forms.ValidationError(
-                    "Las citas solo pueden agendarse entre las 8:00 AM y las 6:00 PM."
-                )
-            
-            # Check if it's a weekend
-            if fecha.weekday() >= 5:  # Saturday = 5, Sunday = 6
-                raise forms.ValidationError(
-                    "Las citas solo pueden agendarse de lunes a viernes."
-                )
+            # Check business hours and working days of the doctor's clinic, in its time zone
+            if self.validar_jornada:
+                horario = HorarioDoctor.para_doctor(self.doctor or Doctor())
+                error = horario.error_jornada(fecha)
+                if error:
+                    raise forms.ValidationError(f"{error}. Por favor seleccione otro horario.")
             
             # Check for appointment conflicts if doctor is provided
             if self.doctor:
-                # Check for existing appointments within 30 minutes
-                start_time = fecha - timedelta(minutes=15)
-                end_time = fecha + timedelta(minutes=15)
-                
-                conflicting_appointments = Appointment.objects.filter(
-                    doctor=self.doctor,
-                    fecha__range=[start_time, end_time]
-                )
-                
-                # Exclude current appointment if editing
-                if self.instance and self.instance.pk:
-                    conflicting_appointments = conflicting_appointments.exclude(pk=self.instance.pk)
-                
-                if conflicting_appointments.exists():
+                # Check overlap against the doctor's booked intervals
+                # (excluding current appointment if editing)
+                exclude_id = self.instance.pk if self.instance else None
+
+                if conflict_index.hay_conflicto(self.doctor, fecha, exclude_id=exclude_id):
                     raise forms.ValidationError(
                         f"Ya existe una cita programada cerca de esta hora. "
                         f"Por favor seleccione otro horario."
@@ -147,3 +146,36 @@ class AppointmentForm(forms.ModelForm):
             return observaciones.strip()
         
         return observaciones
+
+
+class AppointmentLoteForm(AppointmentForm):
+    """
+    Mismas reglas que AppointmentForm para una cita de una carga masiva, sin
+    consultas por fila: paciente y doctor llegan como ids y se comprueban,
+    junto con los conflictos de horario, para todo el lote (ver
+    appointments.bulk_write).
+
+    El doctor de cada elemento se conoce después de validar el formulario:
+    la jornada se comprueba en bulk_write, y una fecha sin zona horaria
+    (`fecha_sin_zona`) se interpreta allí en la zona de su clínica.
+    """
+    paciente = forms.IntegerField(min_value=1)
+    doctor = forms.IntegerField(min_value=1, required=False)
+    validar_jornada = False
+
+    def __init__(self, *args, parcial=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if parcial:
+            # Modificación: solo se validan los campos enviados
+            for nombre in [nombre for nombre in self.fields if nombre not in self.data]:
+                del self.fields[nombre]
+
+    def clean_fecha(self):
+        fecha = super().clean_fecha()
+        enviada = parse_datetime(str(self.data.get('fecha', '')).strip())
+        self.cleaned_data['fecha_sin_zona'] = enviada is None or timezone.is_naive(enviada)
+        return fecha
+
+    def _post_clean(self):
+        # Sin construir la instancia ni validar unicidad contra la base de datos
+        pass
@@ -0,0 +1,215 @@
+"""
+Feeds iCalendar (RFC 5545) de citas por doctor y por clínica.
+
+Los eventos se generan en streaming sobre `iterator(chunk_size=...)`. El
+estado del feed (última modificación, número de citas y último borrado) se
+obtiene con una sola consulta agregada y sirve para ETag/Last-Modified. La
+variante con sync token devuelve solo los eventos modificados o borrados
+desde el token anterior.
+
+Los enlaces de suscripción llevan un token firmado con fecha que caduca a
+los TOKEN_DIAS_VALIDEZ días (enlaces_ics entrega uno nuevo). Los eventos
+solo incluyen las iniciales del paciente y el motivo de la cita: quien
+tenga el enlace no ve nombres ni observaciones clínicas.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+import hashlib
+
+from django.core import signing
+from django.db.models import Count, Max, Subquery
+from django.utils import timezone
+
+from .conflicts import get_duracion_cita, limites_dia
+from .models import Appointment, CitaEliminada
+
+ICS_CHUNK_SIZE = 500
+
+# Ventana del feed: citas desde hace ICS_DIAS_PASADOS días en adelante
+ICS_DIAS_PASADOS = 90
+
+# Margen aplicado al sync token para no perder escrituras de transacciones
+# que confirmaron justo después de generar el token anterior
+SYNC_MARGEN_SEGUNDOS = 5
+
+PRODID = '-//MediCitas Pro//Citas//ES'
+
+ESTADOS_ICS = {
+    'programada': 'TENTATIVE',
+    'confirmada': 'CONFIRMED',
+    'en_curso': 'CONFIRMED',
+    'completada': 'CONFIRMED',
+    'cancelada': 'CANCELLED',
+    'no_asistio': 'CANCELLED',
+}
+
+# Días que es válido un enlace de suscripción
+TOKEN_DIAS_VALIDEZ = 30
+
+_signer = signing.TimestampSigner(salt='appointments.ics')
+
+
+def token_feed(tipo, objeto_id):
+    """Token firmado y con fecha que da acceso de solo lectura al feed ('doctor' o 'clinica')"""
+    return _signer.sign(f'{tipo}:{objeto_id}')
+
+
+def verificar_token_feed(token, tipo, objeto_id):
+    """El token es del feed indicado y no ha caducado (SignatureExpired es una BadSignature)"""
+    try:
+        valor = _signer.unsign(token or '', max_age=timedelta(days=TOKEN_DIAS_VALIDEZ))
+    except signing.BadSignature:
+        return False
+    return valor == f'{tipo}:{objeto_id}'
+
+
+def inicio_ventana():
+    """Inicio de la ventana del feed; estable durante todo el día para no alterar el ETag"""
+    inicio, _ = limites_dia(timezone.localdate() - timedelta(days=ICS_DIAS_PASADOS))
+    return inicio
+
+
+def estado_feed(citas, eliminadas):
+    """
+    (etag, last_modified) del feed con una única consulta agregada.
+    Un borrado reduce el número de citas y cualquier alta o edición avanza
+    `actualizada_en`, por lo que el ETag cambia con cualquier modificación.
+    """
+    ultimo_borrado = eliminadas.order_by('-eliminada_en').values('eliminada_en')[:1]
+    estado = citas.aggregate(
+        ultima=Max('actualizada_en'),
+        total=Count('id'),
+        ultimo_borrado=Max(Subquery(ultimo_borrado)),
+    )
+    marcas = [marca for marca in (estado['ultima'], estado['ultimo_borrado']) if marca]
+    last_modified = max(marcas) if marcas else None
+    clave = f"{estado['ultima']}|{estado['total']}|{estado['ultimo_borrado']}"
+    return hashlib.md5(clave.encode()).hexdigest(), last_modified
+
+
+def crear_sync_token(momento):
+    return str(int(momento.timestamp() * 1_000_000))
+
+
+def leer_sync_token(token):
+    """Devuelve el datetime del token o None si no es válido"""
+    try:
+        micros = int(token)
+    except (TypeError, ValueError):
+        return None
+    return datetime.fromtimestamp(micros / 1_000_000, tz=dt_timezone.utc)
+
+
+def filtrar_desde_token(citas, eliminadas, desde):
+    """Citas modificadas y borrados posteriores al token (con margen)"""
+    limite = desde - timedelta(seconds=SYNC_MARGEN_SEGUNDOS)
+    return citas.filter(actualizada_en__gte=limite), eliminadas.filter(eliminada_en__gte=limite)
+
+
+def _escapar(texto):
+    return (
+        (texto or '')
+        .replace('\\', '\\\\')
+        .replace(';', '\\;')
+        .replace(',', '\\,')
+        .replace('\r\n', '\\n')
+        .replace('\n', '\\n')
+    )
+
+
+def _linea(nombre, valor):
+    """Línea de contenido plegada a 75 octetos y terminada en CRLF"""
+    datos = f'{nombre}:{valor}'.encode('utf-8')
+    partes = []
+    while len(datos) > 75:
+        corte = 75 if not partes else 74
+        # No cortar en medio de un carácter UTF-8
+        while corte and (datos[corte] & 0xC0) == 0x80:
+            corte -= 1
+        partes.append(datos[:corte])
+        datos = datos[corte:]
+    partes.append(datos)
+    return '\r\n '.join(parte.decode('utf-8') for parte in partes) + '\r\n'
+
+
+def _utc(momento):
+    return momento.astimezone(dt_timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+
+
+def _uid(cita_id):
+    return f'cita-{cita_id}@medicitas'
+
+
+def _iniciales(paciente):
+    return ''.join(f'{parte[0].upper()}.' for parte in f'{paciente.nombre} {paciente.apellidos}'.split())
+
+
+def _evento(cita):
+    fin = cita.fecha + timedelta(minutes=get_duracion_cita(cita.doctor))
+    return ''.join([
+        'BEGIN:VEVENT\r\n',
+        _linea('UID', _uid(cita.id)),
+        _linea('DTSTAMP', _utc(cita.actualizada_en)),
+        _linea('LAST-MODIFIED', _utc(cita.actualizada_en)),
+        _linea('DTSTART', _utc(cita.fecha)),
+        _linea('DTEND', _utc(fin)),
+        _linea('SUMMARY', _escapar(f'Cita: {_iniciales(cita.paciente)}')),
+        _linea('DESCRIPTION', _escapar(cita.motivo)),
+        _linea('STATUS', ESTADOS_ICS.get(cita.estado, 'TENTATIVE')),
+        'END:VEVENT\r\n',
+    ])
+
+
+def _evento_eliminado(eliminada):
+    return ''.join([
+        'BEGIN:VEVENT\r\n',
+        _linea('UID', _uid(eliminada.cita_id)),
+        _linea('DTSTAMP', _utc(eliminada.eliminada_en)),
+        _linea('DTSTART', _utc(eliminada.fecha)),
+        _linea('STATUS', 'CANCELLED'),
+        'END:VEVENT\r\n',
+    ])
+
+
+def generar_ics(citas, nombre, eliminadas=None, sync_token=None):
+    """
+    Generador con el contenido del calendario. `citas` es un queryset de
+    Appointment y `eliminadas` uno de CitaEliminada (solo para sync).
+    """
+    yield ''.join([
+        'BEGIN:VCALENDAR\r\n',
+        'VERSION:2.0\r\n',
+        _linea('PRODID', PRODID),
+        'CALSCALE:GREGORIAN\r\n',
+        _linea('X-WR-CALNAME', _escapar(nombre)),
+        _linea('X-WR-TIMEZONE', timezone.get_current_timezone_name()),
+    ])
+    if sync_token:
+        yield _linea('X-MEDICITAS-SYNC-TOKEN', sync_token)
+
+    citas = citas.select_related('paciente', 'doctor', 'doctor__clinica').only(
+        'id', 'fecha', 'motivo', 'estado', 'actualizada_en',
+        'paciente__nombre', 'paciente__apellidos',
+        'doctor__duracion_cita_default', 'doctor__clinica__duracion_cita_default',
+    ).order_by('fecha', 'id')
+    for cita in citas.iterator(chunk_size=ICS_CHUNK_SIZE):
+        yield _evento(cita)
+
+    if eliminadas is not None:
+        for eliminada in eliminadas.order_by('eliminada_en').iterator(chunk_size=ICS_CHUNK_SIZE):
+            yield _evento_eliminado(eliminada)
+
+    yield 'END:VCALENDAR\r\n'
+
+
+def citas_feed(doctor=None, clinica=None):
+    """Querysets (citas, eliminadas) de la ventana del feed"""
+    desde = inicio_ventana()
+    citas = Appointment.objects.filter(fecha__gte=desde)
+    eliminadas = CitaEliminada.objects.filter(fecha__gte=desde)
+    if doctor is not None:
+        citas = citas.filter(doctor=doctor)
+        eliminadas = eliminadas.filter(doctor_id=doctor.id)
+    if clinica is not None:
+        citas = citas.filter(clinica=clinica)
+        eliminadas = eliminadas.filter(clinica_id=clinica.id)
+    return citas, eliminadas
@@ -0,0 +1,133 @@
+"""
+Claves de idempotencia para los POST que reservan citas.
+
+El cliente envía una clave única por operación (cabecera Idempotency-Key o
+campo idempotency_key del formulario). La primera petición reserva la clave
+antes de ejecutar la vista y guarda su respuesta; los reintentos con la
+misma clave (doble clic, reenvío tras un timeout) reciben esa respuesta sin
+volver a crear nada. Mientras la original sigue en proceso, los duplicados
+reciben 409.
+
+Solo se guardan respuestas < 500: tras un error del servidor o una
+excepción la clave se libera y el reintento vuelve a ejecutarse.
+"""
+import hashlib
+from datetime import timedelta
+from functools import wraps
+
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.utils import timezone
+
+from .models import SolicitudIdempotente
+
+CABECERA = 'Idempotency-Key'
+CAMPO_FORMULARIO = 'idempotency_key'
+MAX_LONGITUD_CLAVE = 100
+
+# Tiempo durante el que una clave se respeta; después puede reutilizarse
+IDEMPOTENCIA_HORAS = 24
+
+
+def _huella(request):
+    contenido = request.method.encode() + b' ' + request.path.encode() + b'\n' + request.body
+    return hashlib.sha256(contenido).hexdigest()
+
+
+def _reservar(clave, usuario, ruta, huella):
+    """
+    Crea la fila de la clave. Devuelve (solicitud, reservada); si la clave
+    ya existía y no venció, `reservada` es False.
+    """
+    datos = {'usuario': usuario, 'ruta': ruta, 'huella': huella}
+    try:
+        with transaction.atomic():
+            return SolicitudIdempotente.objects.create(clave=clave, **datos), True
+    except IntegrityError:
+        pass
+
+    solicitud = SolicitudIdempotente.objects.filter(clave=clave).first()
+    if solicitud is None:
+        # Se liberó entre medias: nuevo intento
+        return _reservar(clave, usuario, ruta, huella)
+    if solicitud.creada_en >= timezone.now() - timedelta(hours=IDEMPOTENCIA_HORAS):
+        return solicitud, False
+
+    # Clave vencida: se reutiliza si nadie la reclamó antes
+    reclamada = SolicitudIdempotente.objects.filter(
+        pk=solicitud.pk, creada_en=solicitud.creada_en
+    ).update(
+        codigo_estado=None, tipo_contenido='', contenido=b'', ubicacion='',
+        creada_en=timezone.now(), usuario=usuario, ruta=ruta, huella=huella,
+    )
+    if not reclamada:
+        return SolicitudIdempotente.objects.get(pk=solicitud.pk), False
+    solicitud.refresh_from_db()
+    return solicitud, True
+
+
+def _repetir(solicitud):
+    response = HttpResponse(
+        bytes(solicitud.contenido),
+        status=solicitud.codigo_estado,
+        content_type=solicitud.tipo_contenido or None,
+    )
+    if solicitud.ubicacion:
+        response['Location'] = solicitud.ubicacion
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotente(vista):
+    """
+    Decorador para vistas de función (o dispatch vía method_decorator). Sin
+    clave, la vista se ejecuta normalmente.
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        if request.method != 'POST':
+            return vista(request, *args, **kwargs)
+        # El cuerpo se lee antes que request.POST para poder calcular la huella
+        huella = _huella(request)
+        clave = request.headers.get(CABECERA) or request.POST.get(CAMPO_FORMULARIO)
+        if not clave:
+            return vista(request, *args, **kwargs)
+        clave = clave.strip()
+        if not clave or len(clave) > MAX_LONGITUD_CLAVE:
+            return JsonResponse({'error': 'Clave de idempotencia inválida'}, status=400)
+
+        usuario = request.user if request.user.is_authenticated else None
+        solicitud, reservada = _reservar(clave, usuario, request.path[:255], huella)
+        if not reservada:
+            if solicitud.huella != huella or solicitud.usuario_id != getattr(usuario, 'pk', None):
+                return JsonResponse(
+                    {'error': 'La clave de idempotencia ya se usó con otra solicitud'}, status=422
+                )
+            if solicitud.codigo_estado is None:
+                response = JsonResponse(
+                    {'error': 'Hay una solicitud con esta clave en proceso'}, status=409
+                )
+                response['Retry-After'] = '1'
+                return response
+            return _repetir(solicitud)
+
+        try:
+            response = vista(request, *args, **kwargs)
+            if hasattr(response, 'render') and not getattr(response, 'is_rendered', True):
+                # Respuestas de DRF / TemplateResponse: se necesita el contenido
+                response = response.render()
+        except BaseException:
+            solicitud.delete()
+            raise
+
+        if response.status_code >= 500 or isinstance(response, StreamingHttpResponse):
+            solicitud.delete()
+            return response
+        solicitud.codigo_estado = response.status_code
+        solicitud.tipo_contenido = response.get('Content-Type', '')[:100]
+        solicitud.contenido = response.content
+        solicitud.ubicacion = response.get('Location', '')[:500]
+        solicitud.save(update_fields=['codigo_estado', 'tipo_contenido', 'contenido', 'ubicacion'])
+        return response
+
+    return envoltura
@@ -0,0 +1,116 @@
+"""
+Fecha y hora locales de las citas.
+
+`Appointment.fecha` se guarda en UTC. `fecha_local` y `hora_local` guardan el
+día y la hora de la cita en la zona horaria de su clínica, de modo que los
+filtros por día, semana o mes son comparaciones directas sobre columnas
+indexadas (en lugar de DATE(fecha), que no puede usar índices y agrupa en UTC).
+
+Appointment.save() mantiene ambas columnas; las escrituras masivas
+(bulk_create, bulk_update, update) deben usar estas funciones.
+"""
+import time
+from datetime import timedelta
+from functools import wraps
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.utils import timezone
+
+# Segundos que se reutiliza la zona leída de una clínica. Cada proceso tiene
+# su copia: el que guarda la clínica la invalida al momento y el resto ve la
+# zona nueva, como mucho, ZONA_TTL_SEGUNDOS después.
+ZONA_TTL_SEGUNDOS = 60
+
+# clinica_id -> (ZoneInfo, caduca_en)
+_zonas = {}
+
+
+def zona_por_nombre(nombre):
+    """ZoneInfo de `nombre`; la zona de settings si no es válido"""
+    try:
+        return ZoneInfo(nombre)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        return timezone.get_default_timezone()
+
+
+def zona_clinica(clinica_id):
+    """Zona horaria de la clínica (la de settings si no tiene clínica)"""
+    if clinica_id is None:
+        return timezone.get_default_timezone()
+    ahora = time.monotonic()
+    zona, caduca_en = _zonas.get(clinica_id, (None, 0))
+    if zona is None or ahora >= caduca_en:
+        from clinicas.models import Clinica
+        nombre = Clinica.objects.filter(id=clinica_id).values_list('zona_horaria', flat=True).first()
+        zona = zona_por_nombre(nombre)
+        _zonas[clinica_id] = (zona, ahora + ZONA_TTL_SEGUNDOS)
+    return zona
+
+
+def invalidar_zonas(clinica_id=None):
+    if clinica_id is None:
+        _zonas.clear()
+    else:
+        _zonas.pop(clinica_id, None)
+
+
+def valores_locales(fecha, clinica_id):
+    """(fecha_local, hora_local) de un instante en la zona de la clínica"""
+    local = fecha.astimezone(zona_clinica(clinica_id))
+    return local.date(), local.hour
+
+
+def asignar_fecha_local(cita):
+    """Fija fecha_local/hora_local a partir de `fecha` y la clínica. Devuelve la cita."""
+    cita.fecha_local, cita.hora_local = valores_locales(cita.fecha, cita.clinica_id)
+    return cita
+
+
+def recalcular_fechas_locales(citas, lote=1000):
+    """
+    Recalcula las columnas locales de un queryset de citas (tras un update()
+    sobre `fecha` o `clinica`, o un cambio de zona de la clínica). Devuelve
+    el número de citas corregidas.
+    """
+    from .models import Appointment
+
+    pendientes = []
+    total = 0
+    for cita in citas.only('id', 'fecha', 'clinica_id', 'fecha_local', 'hora_local').iterator(chunk_size=lote):
+        valores = valores_locales(cita.fecha, cita.clinica_id)
+        if valores != (cita.fecha_local, cita.hora_local):
+            cita.fecha_local, cita.hora_local = valores
+            pendientes.append(cita)
+        if len(pendientes) >= lote:
+            total += Appointment.objects.bulk_update(pendientes, ['fecha_local', 'hora_local'])
+            pendientes = []
+    if pendientes:
+        total += Appointment.objects.bulk_update(pendientes, ['fecha_local', 'hora_local'])
+    return total
+
+
+def hoy_local(clinica_id=None):
+    """Fecha actual en la zona de la clínica"""
+    return timezone.now().astimezone(zona_clinica(clinica_id)).date()
+
+
+def rango_mes(dia):
+    """(primer día, último día) del mes de `dia`, para filtrar con fecha_local__range"""
+    inicio = dia.replace(day=1)
+    fin = (inicio + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+    return inicio, fin
+
+
+def en_zona_del_doctor(vista):
+    """
+    Ejecuta la vista con la zona horaria de la clínica del doctor activa: los
+    formularios leen las fechas, y las plantillas y mensajes las muestran, en
+    esa zona (la de settings si el usuario no es doctor o no tiene clínica).
+    """
+    @wraps(vista)
+    def envoltura(request, *args, **kwargs):
+        doctor = getattr(request, 'doctor', None)
+        zona = zona_clinica(doctor.clinica_id) if doctor is not None and doctor.clinica_id else None
+        with timezone.override(zona):
+            return vista(request, *args, **kwargs)
+    return envoltura
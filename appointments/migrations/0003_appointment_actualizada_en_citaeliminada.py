@@ -0,0 +1,41 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:26
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def copiar_creada_en(apps, schema_editor):
+    # Las citas existentes toman como última modificación su fecha de creación
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Appointment.objects.update(actualizada_en=F('creada_en'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0002_appointment_clinica_appointment_estado'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CitaEliminada',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cita_id', models.PositiveIntegerField()),
+                ('doctor_id', models.PositiveIntegerField(db_index=True)),
+                ('clinica_id', models.PositiveIntegerField(blank=True, db_index=True, null=True)),
+                ('fecha', models.DateTimeField(verbose_name='Fecha y hora de la cita')),
+                ('eliminada_en', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Cita Eliminada',
+                'verbose_name_plural': 'Citas Eliminadas',
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='actualizada_en',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        migrations.RunPython(copiar_creada_en, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:28
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0003_appointment_actualizada_en_citaeliminada'),
+        ('clinicas', '0001_initial'),
+        ('doctors', '0002_doctor_activo_doctor_clinica_and_more'),
+        ('patients', '0002_patient_clinica'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerieCitas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('motivo', models.TextField(verbose_name='Motivo de la consulta')),
+                ('frecuencia', models.CharField(choices=[('semanal', 'Semanal'), ('mensual', 'Mensual')], max_length=10, verbose_name='Frecuencia')),
+                ('intervalo', models.PositiveSmallIntegerField(default=1, verbose_name='Cada cuántas semanas/meses')),
+                ('fecha_inicio', models.DateTimeField(verbose_name='Primera cita')),
+                ('ocurrencias', models.PositiveSmallIntegerField(verbose_name='Número de citas')),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+                ('clinica', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='clinicas.clinica', verbose_name='Clínica')),
+                ('creada_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL, verbose_name='Creada por')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='doctors.doctor', verbose_name='Doctor')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='patients.patient', verbose_name='Paciente')),
+            ],
+            options={
+                'verbose_name': 'Serie de Citas',
+                'verbose_name_plural': 'Series de Citas',
+                'ordering': ['-creada_en'],
+            },
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='serie',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='citas', to='appointments.seriecitas', verbose_name='Serie'),
+        ),
+    ]
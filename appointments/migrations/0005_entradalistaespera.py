@@ -0,0 +1,40 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:30
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0004_seriecitas'),
+        ('clinicas', '0001_initial'),
+        ('doctors', '0002_doctor_activo_doctor_clinica_and_more'),
+        ('patients', '0002_patient_clinica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntradaListaEspera',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('especialidad', models.CharField(blank=True, max_length=100, verbose_name='Especialidad')),
+                ('desde', models.DateField(verbose_name='Disponible desde')),
+                ('hasta', models.DateField(verbose_name='Disponible hasta')),
+                ('motivo', models.TextField(verbose_name='Motivo de la consulta')),
+                ('estado', models.CharField(choices=[('esperando', 'Esperando'), ('ofrecida', 'Cita Ofrecida'), ('cancelada', 'Cancelada')], default='esperando', max_length=10, verbose_name='Estado')),
+                ('creada_en', models.DateTimeField(auto_now_add=True)),
+                ('ofrecida_en', models.DateTimeField(blank=True, null=True)),
+                ('cita', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='entradas_lista_espera', to='appointments.appointment', verbose_name='Cita ofrecida')),
+                ('clinica', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='clinicas.clinica', verbose_name='Clínica')),
+                ('doctor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to='doctors.doctor', verbose_name='Doctor')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='patients.patient', verbose_name='Paciente')),
+            ],
+            options={
+                'verbose_name': 'Entrada de Lista de Espera',
+                'verbose_name_plural': 'Lista de Espera',
+                'ordering': ['creada_en'],
+                'indexes': [models.Index(fields=['estado', 'doctor', 'hasta'], name='appointment_estado_a4c25f_idx'), models.Index(fields=['estado', 'especialidad', 'hasta'], name='appointment_estado_ed4fa7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,79 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:10
+
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def calcular_fechas_locales(apps, schema_editor):
+    Appointment = apps.get_model('appointments', 'Appointment')
+    Clinica = apps.get_model('clinicas', 'Clinica')
+
+    def zona(nombre):
+        try:
+            return ZoneInfo(nombre)
+        except (ZoneInfoNotFoundError, ValueError, TypeError):
+            return ZoneInfo(settings.TIME_ZONE)
+
+    zonas = {clinica_id: zona(nombre) for clinica_id, nombre in Clinica.objects.values_list('id', 'zona_horaria')}
+    zona_default = zona(settings.TIME_ZONE)
+
+    pendientes = []
+    for cita in Appointment.objects.only('id', 'fecha', 'clinica_id').iterator(chunk_size=2000):
+        local = cita.fecha.astimezone(zonas.get(cita.clinica_id, zona_default))
+        cita.fecha_local, cita.hora_local = local.date(), local.hour
+        pendientes.append(cita)
+        if len(pendientes) >= 2000:
+            Appointment.objects.bulk_update(pendientes, ['fecha_local', 'hora_local'])
+            pendientes = []
+    if pendientes:
+        Appointment.objects.bulk_update(pendientes, ['fecha_local', 'hora_local'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0005_entradalistaespera'),
+        ('clinicas', '0002_clinica_zona_horaria'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='appointment',
+            name='fecha_local',
+            field=models.DateField(editable=False, null=True, verbose_name='Fecha local'),
+        ),
+        migrations.AddField(
+            model_name='appointment',
+            name='hora_local',
+            field=models.PositiveSmallIntegerField(editable=False, null=True, verbose_name='Hora local'),
+        ),
+        migrations.RunPython(calcular_fechas_locales, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='appointment',
+            name='fecha_local',
+            field=models.DateField(editable=False, verbose_name='Fecha local'),
+        ),
+        migrations.AlterField(
+            model_name='appointment',
+            name='hora_local',
+            field=models.PositiveSmallIntegerField(editable=False, verbose_name='Hora local'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'fecha'], name='cita_doctor_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['doctor', 'fecha_local'], name='cita_doctor_fecha_local_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['clinica', 'fecha_local'], name='cita_clinica_fecha_local_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['fecha_local', 'estado'], name='cita_fecha_local_estado_idx'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0006_appointment_fecha_local'),
+        ('clinicas', '0002_clinica_zona_horaria'),
+        ('doctors', '0002_doctor_activo_doctor_clinica_and_more'),
+        ('patients', '0002_patient_clinica'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['fecha', 'id'], name='cita_fecha_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['clinica', 'fecha'], name='cita_clinica_fecha_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),
+        ),
+    ]
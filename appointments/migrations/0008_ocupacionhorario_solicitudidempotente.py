@@ -0,0 +1,96 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:56
+
+from datetime import timedelta, timezone as dt_timezone
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+MINUTOS_TRAMO = 5
+
+
+def ocupar_citas_futuras(apps, schema_editor):
+    """
+    Tramos de las citas activas que aún no terminaron. Los solapamientos
+    heredados se conservan en appointments; solo la primera cita de cada
+    tramo queda registrada en la tabla.
+    """
+    Appointment = apps.get_model('appointments', 'Appointment')
+    OcupacionHorario = apps.get_model('appointments', 'OcupacionHorario')
+    Doctor = apps.get_model('doctors', 'Doctor')
+
+    duraciones = {
+        doctor_id: duracion or duracion_clinica or 30
+        for doctor_id, duracion, duracion_clinica in Doctor.objects.values_list(
+            'id', 'duracion_cita_default', 'clinica__duracion_cita_default'
+        )
+    }
+    paso = timedelta(minutes=MINUTOS_TRAMO)
+    ahora = timezone.now()
+    citas = Appointment.objects.filter(
+        fecha__gte=ahora - timedelta(days=1),
+    ).exclude(estado='cancelada').order_by('fecha', 'id').values_list('id', 'doctor_id', 'fecha')
+
+    filas = []
+    for cita_id, doctor_id, fecha in citas.iterator(chunk_size=2000):
+        fecha = fecha.astimezone(dt_timezone.utc)
+        fin = fecha + timedelta(minutes=duraciones.get(doctor_id, 30))
+        if fin <= ahora:
+            continue
+        tramo = fecha.replace(minute=fecha.minute - fecha.minute % MINUTOS_TRAMO, second=0, microsecond=0)
+        while tramo < fin:
+            filas.append(OcupacionHorario(doctor_id=doctor_id, inicio=tramo, cita_id=cita_id))
+            tramo += paso
+        if len(filas) >= 2000:
+            OcupacionHorario.objects.bulk_create(filas, ignore_conflicts=True)
+            filas = []
+    if filas:
+        OcupacionHorario.objects.bulk_create(filas, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0007_indices_paginacion'),
+        ('clinicas', '0002_clinica_zona_horaria'),
+        ('doctors', '0002_doctor_activo_doctor_clinica_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SolicitudIdempotente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('clave', models.CharField(max_length=100, unique=True)),
+                ('ruta', models.CharField(max_length=255)),
+                ('huella', models.CharField(max_length=64)),
+                ('codigo_estado', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('tipo_contenido', models.CharField(blank=True, max_length=100)),
+                ('contenido', models.BinaryField(blank=True)),
+                ('ubicacion', models.CharField(blank=True, max_length=500)),
+                ('creada_en', models.DateTimeField(auto_now_add=True, db_index=True)),
+                ('usuario', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Solicitud Idempotente',
+                'verbose_name_plural': 'Solicitudes Idempotentes',
+            },
+        ),
+        migrations.CreateModel(
+            name='OcupacionHorario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('inicio', models.DateTimeField(verbose_name='Inicio del tramo')),
+                ('cita', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupacion', to='appointments.appointment')),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='doctors.doctor')),
+            ],
+            options={
+                'verbose_name': 'Ocupación de Horario',
+                'verbose_name_plural': 'Ocupación de Horarios',
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'inicio'), name='ocupacion_doctor_inicio_unica')],
+            },
+        ),
+        migrations.RunPython(ocupar_citas_futuras, migrations.RunPython.noop),
+    ]
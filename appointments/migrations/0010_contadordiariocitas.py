@@ -0,0 +1,53 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def contar_citas(apps, schema_editor):
+    """Contadores iniciales a partir del historial completo de citas"""
+    Appointment = apps.get_model('appointments', 'Appointment')
+    ContadorDiarioCitas = apps.get_model('appointments', 'ContadorDiarioCitas')
+
+    filas = Appointment.objects.values('doctor_id', 'fecha_local', 'estado', 'paciente__prioridad').annotate(
+        total=Count('id')
+    ).order_by()
+    ContadorDiarioCitas.objects.bulk_create(
+        [
+            ContadorDiarioCitas(
+                doctor_id=fila['doctor_id'], fecha=fila['fecha_local'], estado=fila['estado'],
+                prioridad=fila['paciente__prioridad'], total=fila['total'],
+            )
+            for fila in filas
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('appointments', '0009_appointment_version'),
+        ('doctors', '0002_doctor_activo_doctor_clinica_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ContadorDiarioCitas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField(verbose_name='Fecha local')),
+                ('estado', models.CharField(choices=[('programada', 'Programada'), ('confirmada', 'Confirmada'), ('en_curso', 'En Curso'), ('completada', 'Completada'), ('cancelada', 'Cancelada'), ('no_asistio', 'No Asistió')], max_length=20, verbose_name='Estado de la Cita')),
+                ('prioridad', models.CharField(max_length=1, verbose_name='Prioridad del paciente')),
+                ('total', models.IntegerField(default=0)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='doctors.doctor')),
+            ],
+            options={
+                'verbose_name': 'Contador Diario de Citas',
+                'verbose_name_plural': 'Contadores Diarios de Citas',
+                'constraints': [models.UniqueConstraint(fields=('doctor', 'fecha', 'estado', 'prioridad'), name='contador_diario_unico')],
+            },
+        ),
+        migrations.RunPython(contar_citas, migrations.RunPython.noop),
+    ]
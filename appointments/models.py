@@ -1,6 +1,10 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import DEFERRED
 from django.apps import apps  # Usamos apps para obtener el modelo sin importar directamente
 
+# Valores leídos de la base de datos que se conservan en `_original` (ver from_db)
+CAMPOS_ORIGINALES = ('fecha', 'estado', 'doctor_id', 'paciente_id', 'clinica_id')
+
 class Appointment(models.Model):
     """
     Modelo para gestionar las citas médicas.
@@ -15,9 +19,16 @@ class Appointment(models.Model):
     doctor = models.ForeignKey('doctors.Doctor', on_delete=models.CASCADE)  # Referencia correcta al modelo Doctor
 
     fecha = models.DateTimeField(verbose_name="Fecha y hora de la cita")
+    # Día y hora de `fecha` en la zona horaria de la clínica (ver appointments.local_time)
+    fecha_local = models.DateField(editable=False, verbose_name="Fecha local")
+    hora_local = models.PositiveSmallIntegerField(editable=False, verbose_name="Hora local")
     motivo = models.TextField(verbose_name="Motivo de la consulta")
     observaciones = models.TextField(blank=True, null=True, verbose_name="Observaciones del doctor")
     creada_en = models.DateTimeField(auto_now_add=True)
+    # Se actualiza en cada save(); las escrituras masivas (update/bulk_update) deben fijarlo explícitamente
+    actualizada_en = models.DateTimeField(auto_now=True, db_index=True)
+    # Control de concurrencia optimista (ver appointments.versioning); igual que actualizada_en
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name="Versión")
     
     # Referencia a la clínica (para sistema multi-tenant)
     clinica = models.ForeignKey(
@@ -44,10 +55,299 @@ class Appointment(models.Model):
         verbose_name="Estado de la Cita"
     )
 
+    # Serie recurrente a la que pertenece (si fue generada desde una)
+    serie = models.ForeignKey(
+        'SerieCitas',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='citas',
+        verbose_name="Serie"
+    )
+
     class Meta:
         verbose_name = "Cita Médica"
         verbose_name_plural = "Citas Médicas"
         ordering = ['-fecha']
+        indexes = [
+            models.Index(fields=['fecha', 'id'], name='cita_fecha_id_idx'),
+            models.Index(fields=['doctor', 'fecha'], name='cita_doctor_fecha_idx'),
+            models.Index(fields=['clinica', 'fecha'], name='cita_clinica_fecha_idx'),
+            models.Index(fields=['estado', 'fecha'], name='cita_estado_fecha_idx'),
+            models.Index(fields=['doctor', 'fecha_local'], name='cita_doctor_fecha_local_idx'),
+            models.Index(fields=['clinica', 'fecha_local'], name='cita_clinica_fecha_local_idx'),
+            models.Index(fields=['fecha_local', 'estado'], name='cita_fecha_local_estado_idx'),
+        ]
 
     def __str__(self):
         return f"Cita de {self.paciente} con {self.doctor} el {self.fecha.strftime('%d/%m/%Y %H:%M')}"
+
+    def save(self, *args, version_esperada=None, **kwargs):
+        """
+        Con `version_esperada` el UPDATE solo se aplica si la fila sigue en esa
+        versión; si no, lanza versioning.CitaModificada
+        """
+        from .local_time import asignar_fecha_local
+        from .slots import ocupar
+        asignar_fecha_local(self)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'fecha', 'clinica', 'clinica_id'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'fecha_local', 'hora_local'}
+        cambia_horario = self._horario_modificado(update_fields)
+
+        version_anterior = self.__dict__.get('version')
+        incremento_relativo = False
+        if not self._state.adding:
+            if version_esperada is not None:
+                self.version = version_esperada + 1
+            else:
+                # Sin versión de referencia: incremento en la base de datos
+                self.version = models.F('version') + 1
+                incremento_relativo = True
+            if update_fields is not None:
+                kwargs['update_fields'] = set(kwargs['update_fields']) | {'version', 'actualizada_en'}
+            elif version_esperada is not None:
+                # Si el UPDATE no encuentra la fila no debe intentarse un INSERT
+                kwargs['force_update'] = True
+
+        self._version_esperada = version_esperada
+        try:
+            # La cita y la reserva de su horario (ver appointments.slots) se confirman juntas
+            with transaction.atomic(using=kwargs.get('using')):
+                super().save(*args, **kwargs)
+                if cambia_horario:
+                    ocupar([self])
+        except BaseException:
+            # La fila no cambió: la instancia conserva la versión que tenía
+            if not self._state.adding:
+                if version_anterior is None:
+                    self.__dict__.pop('version', None)
+                else:
+                    self.version = version_anterior
+            raise
+        finally:
+            self._version_esperada = None
+        if incremento_relativo:
+            # Se vuelve a leer de la base de datos cuando se necesite
+            del self.__dict__['version']
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields, forced_update):
+        version = getattr(self, '_version_esperada', None)
+        if version is None:
+            return super()._do_update(base_qs, using, pk_val, values, update_fields, forced_update)
+        if not super()._do_update(base_qs.filter(version=version), using, pk_val, values, update_fields, forced_update):
+            from .versioning import CitaModificada
+            raise CitaModificada(pk_val)
+        return True
+
+    def _horario_modificado(self, update_fields=None):
+        """Si el save() puede cambiar los tramos ocupados (fecha, estado o doctor)"""
+        campos = ('fecha', 'estado', 'doctor_id')
+        if update_fields is not None and not {'fecha', 'estado', 'doctor', 'doctor_id'} & set(update_fields):
+            return False
+        original = getattr(self, '_original', None)
+        if self._state.adding or not original or len(original) < len(campos):
+            return True
+        return any(self.__dict__.get(campo) != original[campo] for campo in campos)
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Valores leídos de la base de datos: permiten detectar en post_save
+        # si la cita liberó su horario (cancelación o reagendamiento) o cambió
+        # de contador diario
+        instance._original = {
+            campo: valor for campo, valor in zip(field_names, values)
+            if campo in CAMPOS_ORIGINALES and valor is not DEFERRED
+        }
+        return instance
+
+
+class OcupacionHorario(models.Model):
+    """
+    Tramo de la agenda de un doctor ocupado por una cita (ver
+    appointments.slots). La restricción única impide en la base de datos
+    reservar dos veces el mismo horario.
+    """
+    doctor = models.ForeignKey('doctors.Doctor', on_delete=models.CASCADE, related_name='+')
+    inicio = models.DateTimeField(verbose_name="Inicio del tramo")
+    cita = models.ForeignKey(Appointment, on_delete=models.CASCADE, related_name='ocupacion')
+
+    class Meta:
+        verbose_name = "Ocupación de Horario"
+        verbose_name_plural = "Ocupación de Horarios"
+        constraints = [
+            models.UniqueConstraint(fields=['doctor', 'inicio'], name='ocupacion_doctor_inicio_unica'),
+        ]
+
+    def __str__(self):
+        return f"Doctor {self.doctor_id} ocupado el {self.inicio.strftime('%d/%m/%Y %H:%M')}"
+
+
+class SolicitudIdempotente(models.Model):
+    """
+    Respuesta de un POST enviado con clave de idempotencia (ver
+    appointments.idempotency). Mientras `codigo_estado` es nulo la solicitud
+    original sigue en proceso.
+    """
+    clave = models.CharField(max_length=100, unique=True)
+    usuario = models.ForeignKey('auth.User', on_delete=models.CASCADE, null=True, blank=True)
+    ruta = models.CharField(max_length=255)
+    # sha256 del método, la ruta y el cuerpo: la clave no puede reutilizarse con otros datos
+    huella = models.CharField(max_length=64)
+    codigo_estado = models.PositiveSmallIntegerField(null=True, blank=True)
+    tipo_contenido = models.CharField(max_length=100, blank=True)
+    contenido = models.BinaryField(blank=True)
+    ubicacion = models.CharField(max_length=500, blank=True)
+    creada_en = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Solicitud Idempotente"
+        verbose_name_plural = "Solicitudes Idempotentes"
+
+    def __str__(self):
+        return f"{self.ruta} ({self.clave})"
+
+
+class ContadorDiarioCitas(models.Model):
+    """
+    Número de citas de un doctor en un día local, por estado y prioridad del
+    paciente. Lo mantienen las señales de Appointment y las escrituras
+    masivas (ver appointments.counters): las estadísticas de los dashboards
+    suman estas filas en lugar de recorrer el historial del doctor.
+    """
+    doctor = models.ForeignKey('doctors.Doctor', on_delete=models.CASCADE, related_name='+')
+    fecha = models.DateField(verbose_name="Fecha local")
+    estado = models.CharField(max_length=20, choices=Appointment.ESTADOS, verbose_name="Estado de la Cita")
+    prioridad = models.CharField(max_length=1, verbose_name="Prioridad del paciente")
+    total = models.IntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Contador Diario de Citas"
+        verbose_name_plural = "Contadores Diarios de Citas"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['doctor', 'fecha', 'estado', 'prioridad'], name='contador_diario_unico'
+            ),
+        ]
+
+    def __str__(self):
+        return f"Doctor {self.doctor_id} {self.fecha} {self.estado}/{self.prioridad}: {self.total}"
+
+
+class SerieCitas(models.Model):
+    """
+    Serie de citas recurrentes (seguimientos, terapias). Las ocurrencias se
+    generan como Appointment normales vinculadas a la serie.
+    """
+    FRECUENCIAS = [
+        ('semanal', 'Semanal'),
+        ('mensual', 'Mensual'),
+    ]
+
+    paciente = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, verbose_name="Paciente")
+    doctor = models.ForeignKey('doctors.Doctor', on_delete=models.CASCADE, verbose_name="Doctor")
+    clinica = models.ForeignKey(
+        'clinicas.Clinica',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Clínica"
+    )
+    motivo = models.TextField(verbose_name="Motivo de la consulta")
+    frecuencia = models.CharField(max_length=10, choices=FRECUENCIAS, verbose_name="Frecuencia")
+    intervalo = models.PositiveSmallIntegerField(default=1, verbose_name="Cada cuántas semanas/meses")
+    fecha_inicio = models.DateTimeField(verbose_name="Primera cita")
+    ocurrencias = models.PositiveSmallIntegerField(verbose_name="Número de citas")
+    creada_por = models.ForeignKey(
+        'auth.User',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        verbose_name="Creada por"
+    )
+    creada_en = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = "Serie de Citas"
+        verbose_name_plural = "Series de Citas"
+        ordering = ['-creada_en']
+
+    def __str__(self):
+        return f"Serie {self.get_frecuencia_display().lower()} de {self.paciente} con {self.doctor}"
+
+
+class EntradaListaEspera(models.Model):
+    """
+    Paciente en espera de un hueco con un doctor concreto o con cualquier
+    doctor de una especialidad. El orden de atención es prioridad del
+    paciente y, a igual prioridad, antigüedad de la entrada.
+    """
+    ESTADOS = [
+        ('esperando', 'Esperando'),
+        ('ofrecida', 'Cita Ofrecida'),
+        ('cancelada', 'Cancelada'),
+    ]
+
+    paciente = models.ForeignKey('patients.Patient', on_delete=models.CASCADE, verbose_name="Paciente")
+    doctor = models.ForeignKey(
+        'doctors.Doctor',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Doctor"
+    )
+    especialidad = models.CharField(max_length=100, blank=True, verbose_name="Especialidad")
+    clinica = models.ForeignKey(
+        'clinicas.Clinica',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        verbose_name="Clínica"
+    )
+    desde = models.DateField(verbose_name="Disponible desde")
+    hasta = models.DateField(verbose_name="Disponible hasta")
+    motivo = models.TextField(verbose_name="Motivo de la consulta")
+    estado = models.CharField(max_length=10, choices=ESTADOS, default='esperando', verbose_name="Estado")
+    cita = models.ForeignKey(
+        Appointment,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='entradas_lista_espera',
+        verbose_name="Cita ofrecida"
+    )
+    creada_en = models.DateTimeField(auto_now_add=True)
+    ofrecida_en = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Entrada de Lista de Espera"
+        verbose_name_plural = "Lista de Espera"
+        ordering = ['creada_en']
+        indexes = [
+            models.Index(fields=['estado', 'doctor', 'hasta']),
+            models.Index(fields=['estado', 'especialidad', 'hasta']),
+        ]
+
+    def __str__(self):
+        destino = self.doctor or self.especialidad
+        return f"{self.paciente} en espera para {destino}"
+
+
+class CitaEliminada(models.Model):
+    """
+    Registro de citas borradas para que los calendarios sincronizados
+    (feeds ICS con sync token) puedan retirarlas.
+    """
+    cita_id = models.PositiveIntegerField()
+    doctor_id = models.PositiveIntegerField(db_index=True)
+    clinica_id = models.PositiveIntegerField(null=True, blank=True, db_index=True)
+    fecha = models.DateTimeField(verbose_name="Fecha y hora de la cita")
+    eliminada_en = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = "Cita Eliminada"
+        verbose_name_plural = "Citas Eliminadas"
+
+    def __str__(self):
+        return f"Cita {self.cita_id} eliminada el {self.eliminada_en.strftime('%d/%m/%Y %H:%M')}"
@@ -0,0 +1,199 @@
+"""
+Motor de reportes de citas en una sola pasada.
+
+Las citas se leen una vez, como tuplas (values_list) en lotes por cursor
+(fecha_local, id): cada lote es una consulta con LIMIT sobre el índice
+(doctor|clinica, fecha_local), sin OFFSET y sin cargar el resultado entero
+en memoria (MySQL no transmite los resultados de iterator()). Con cada fila
+se actualizan a la vez todos los agregados: día, prioridad, estado, hora,
+franja de edad y términos frecuentes del motivo.
+
+La memoria es constante respecto al número de citas: los agregados tienen
+un tamaño acotado (días del periodo, 24 horas, unas pocas prioridades,
+estados y franjas) y los términos del motivo se cuentan con un contador
+top-k de capacidad fija (ContadorFrecuentes).
+"""
+import re
+import unicodedata
+from collections import Counter
+
+from django.db.models import Q
+
+from patients.models import Patient
+
+# Citas por consulta al recorrer el periodo
+LOTE = 2000
+
+# Franjas de edad del paciente en la fecha de la cita: (edad mínima, nombre)
+FRANJAS_EDAD = (
+    (0, '0-17'),
+    (18, '18-29'),
+    (30, '30-44'),
+    (45, '45-64'),
+    (65, '65+'),
+)
+SIN_EDAD = 'Desconocida'
+
+# Términos del motivo que se muestran y contadores que se mantienen para
+# obtenerlos (más contadores, menos error en los conteos aproximados)
+TERMINOS_REPORTE = 10
+CAPACIDAD_TERMINOS = 500
+
+# Palabras vacías (sin tildes: se comparan ya normalizadas)
+PALABRAS_VACIAS = frozenset('''
+    a al algo algun alguna algunas alguno algunos ante antes bajo bien cada
+    como con contra cual cuando de del desde donde dos durante e el ella ellas
+    ellos en entre era es esa esas ese eso esos esta estas este esto estos fue
+    ha hace hacia hasta hay la las le les lo los mas me mi mis muy ni no nos
+    o otra otro para pero poco por porque que se segun sin sobre su sus tambien
+    te tiene tras tu un una uno unos unas y ya
+'''.split())
+LONGITUD_MINIMA = 3
+_PALABRA = re.compile(r'[a-z0-9]+')
+
+NOMBRES_PRIORIDAD = dict(Patient.PRIORITY_CHOICES)
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes ni diacríticos (ñ -> n)"""
+    texto = unicodedata.normalize('NFKD', texto.lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+
+def terminos_motivo(motivo):
+    """
+    Términos de un motivo de consulta: palabras significativas y pares de
+    palabras consecutivas ("dolor cabeza"), cada uno una sola vez.
+    """
+    palabras = [
+        palabra for palabra in _PALABRA.findall(normalizar(motivo or ''))
+        if len(palabra) >= LONGITUD_MINIMA and palabra not in PALABRAS_VACIAS
+    ]
+    terminos = set(palabras)
+    terminos.update(f'{a} {b}' for a, b in zip(palabras, palabras[1:]))
+    return terminos
+
+
+class ContadorFrecuentes:
+    """
+    Elementos más frecuentes de un flujo con memoria acotada (algoritmo de
+    Misra-Gries): como mucho `capacidad` contadores. Cuando llega un
+    elemento nuevo y no hay sitio, se resta 1 a todos y se eliminan los que
+    llegan a 0; el coste amortizado por elemento es O(1).
+
+    Los conteos son aproximados por defecto: cada uno es como mucho
+    `error_maximo` menor que el real, y todo elemento con frecuencia mayor
+    que total / (capacidad + 1) conserva su contador.
+    """
+
+    def __init__(self, capacidad=CAPACIDAD_TERMINOS):
+        self.capacidad = capacidad
+        self.contadores = {}
+        self.total = 0
+        self.error_maximo = 0
+
+    def agregar(self, elemento):
+        self.total += 1
+        if elemento in self.contadores:
+            self.contadores[elemento] += 1
+        elif len(self.contadores) < self.capacidad:
+            self.contadores[elemento] = 1
+        else:
+            self.error_maximo += 1
+            for clave in list(self.contadores):
+                self.contadores[clave] -= 1
+                if not self.contadores[clave]:
+                    del self.contadores[clave]
+
+    def mas_comunes(self, n):
+        return Counter(self.contadores).most_common(n)
+
+
+def franja_edad(nacimiento, dia):
+    if nacimiento is None:
+        return SIN_EDAD
+    edad = dia.year - nacimiento.year - ((dia.month, dia.day) < (nacimiento.month, nacimiento.day))
+    nombre = FRANJAS_EDAD[0][1]
+    for minima, franja in FRANJAS_EDAD:
+        if edad >= minima:
+            nombre = franja
+    return nombre
+
+
+def recorrer(citas, campos, lote=LOTE):
+    """
+    Filas (values_list) de `citas` ordenadas por (fecha_local, id), en
+    lotes por cursor. Los dos primeros campos de cada fila son fecha_local
+    e id.
+    """
+    campos = ('fecha_local', 'id', *campos)
+    citas = citas.order_by('fecha_local', 'id').values_list(*campos)
+    ultima = None
+    while True:
+        pagina = citas
+        if ultima is not None:
+            pagina = citas.filter(
+                Q(fecha_local__gt=ultima[0]) | Q(fecha_local=ultima[0], id__gt=ultima[1])
+            )
+        filas = list(pagina[:lote])
+        yield from filas
+        if len(filas) < lote:
+            return
+        ultima = filas[-1]
+
+
+def _sin_redundantes(terminos):
+    """Quita las palabras que solo aparecen dentro de un par con el mismo conteo"""
+    cubiertas = {
+        (palabra, conteo) for termino, conteo in terminos if ' ' in termino for palabra in termino.split()
+    }
+    return [(termino, conteo) for termino, conteo in terminos if (termino, conteo) not in cubiertas]
+
+
+def generar_reporte(citas, desde, hasta):
+    """
+    Reporte de las citas de `citas` (queryset de Appointment) con
+    fecha_local en [desde, hasta], en una sola pasada.
+    """
+    por_dia = Counter()
+    por_prioridad = Counter()
+    por_estado = Counter()
+    por_hora = Counter()
+    por_edad = Counter()
+    terminos = ContadorFrecuentes()
+    total = 0
+
+    filas = recorrer(
+        citas.filter(fecha_local__range=(desde, hasta)),
+        ('hora_local', 'estado', 'motivo', 'paciente__prioridad', 'paciente__fecha_nacimiento'),
+    )
+    for dia, _, hora, estado, motivo, prioridad, nacimiento in filas:
+        total += 1
+        por_dia[dia] += 1
+        por_prioridad[prioridad] += 1
+        por_estado[estado] += 1
+        por_hora[hora] += 1
+        por_edad[franja_edad(nacimiento, dia)] += 1
+        for termino in terminos_motivo(motivo):
+            terminos.agregar(termino)
+
+    franjas = [nombre for _, nombre in FRANJAS_EDAD] + [SIN_EDAD]
+    return {
+        'period': f"{desde} to {hasta}",
+        'total_appointments': total,
+        'appointments_by_day': dict(sorted(por_dia.items())),
+        'appointments_by_priority': {
+            NOMBRES_PRIORIDAD.get(codigo, codigo): por_prioridad[codigo]
+            for codigo, _ in reversed(Patient.PRIORITY_CHOICES) if por_prioridad[codigo]
+        },
+        'appointments_by_status': dict(por_estado.most_common()),
+        'appointments_by_hour': dict(sorted(por_hora.items())),
+        'most_common_reasons': [
+            {'term': termino, 'count': conteo}
+            for termino, conteo in _sin_redundantes(terminos.mas_comunes(CAPACIDAD_TERMINOS))[:TERMINOS_REPORTE]
+        ],
+        'reasons_max_error': terminos.error_maximo,
+        'patient_demographics': {
+            'age_bands': {franja: por_edad[franja] for franja in franjas if por_edad[franja]},
+        },
+    }
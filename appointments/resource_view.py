@@ -0,0 +1,102 @@
+"""
+Vista de recursos (doctor × franja horaria) para las grillas de día/semana.
+
+La respuesta es columnar: en lugar de una lista de diccionarios por cita se
+devuelven arreglos paralelos (ids, día, minuto, duración, estado, doctor,
+paciente) y los valores repetidos se envían una sola vez en tablas internadas.
+Todas las citas del rango se leen con un único `values_list`. El día y el
+minuto de cada cita son los locales de la clínica de su doctor, igual que la
+jornada.
+"""
+from datetime import timedelta
+
+from .availability import HorarioDoctor
+from .conflicts import get_duracion_cita, limites_dia
+from .models import Appointment
+
+# Estados en el orden de Appointment.ESTADOS; las citas referencian su posición
+ESTADOS_CODIGOS = [clave for clave, _ in Appointment.ESTADOS]
+
+MAX_DIAS_RECURSOS = 14
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def construir_vista_recursos(doctores, fecha_inicio, fecha_fin, paso=None):
+    """
+    Matriz doctor × franja de [fecha_inicio, fecha_fin] en formato columnar.
+
+    `doctores` es una lista de Doctor (con clinica cargada) que define las
+    columnas de la grilla. `paso` es el tamaño de franja en minutos (por
+    defecto, la menor duración de cita entre los doctores).
+    """
+    duraciones = [get_duracion_cita(doctor) for doctor in doctores]
+    horarios = [HorarioDoctor.para_doctor(doctor) for doctor in doctores]
+    indice_doctor = {doctor.id: i for i, doctor in enumerate(doctores)}
+
+    dias = []
+    dia = fecha_inicio
+    while dia <= fecha_fin:
+        dias.append(dia)
+        dia += timedelta(days=1)
+    zonas = [horario.zona for horario in horarios]
+
+    columnas = {
+        'ids': [],
+        'dias': [],
+        'minutos': [],
+        'duraciones': [],
+        'estados': [],
+        'doctores': [],
+        'pacientes': [],
+    }
+    pacientes = {}
+    estado_indice = {clave: i for i, clave in enumerate(ESTADOS_CODIGOS)}
+
+    if doctores:
+        filas = Appointment.objects.filter(
+            doctor_id__in=indice_doctor.keys(),
+            fecha__gte=min(limites_dia(fecha_inicio, zona)[0] for zona in zonas),
+            fecha__lt=max(limites_dia(fecha_fin, zona)[1] for zona in zonas),
+        ).order_by('fecha', 'id').values_list(
+            'id', 'doctor_id', 'fecha', 'estado', 'paciente__nombre', 'paciente__apellidos'
+        )
+
+        for cita_id, doctor_id, fecha, estado, nombre, apellidos in filas:
+            d = indice_doctor[doctor_id]
+            local = fecha.astimezone(zonas[d])
+            n = (local.date() - fecha_inicio).days
+            # Con doctores en varias zonas el rango leído cubre horas fuera del de algunos
+            if not 0 <= n < len(dias):
+                continue
+            paciente = f"{nombre} {apellidos}"
+
+            columnas['ids'].append(cita_id)
+            columnas['dias'].append(n)
+            columnas['minutos'].append(_minutos(local))
+            columnas['duraciones'].append(duraciones[d])
+            columnas['estados'].append(estado_indice.get(estado, 0))
+            columnas['doctores'].append(d)
+            columnas['pacientes'].append(pacientes.setdefault(paciente, len(pacientes)))
+
+    return {
+        'fechas': [dia.strftime('%Y-%m-%d') for dia in dias],
+        'paso': paso or (min(duraciones) if duraciones else None),
+        'doctores': {
+            'ids': [doctor.id for doctor in doctores],
+            'nombres': [f"{doctor.nombre} {doctor.apellidos}" for doctor in doctores],
+            'especialidades': [doctor.especialidad for doctor in doctores],
+            'duraciones': duraciones,
+            'jornada_inicio': [_minutos(horario.hora_inicio) for horario in horarios],
+            'jornada_fin': [_minutos(horario.hora_fin) for horario in horarios],
+            'dias_laborales': [
+                [horario.es_laboral(dia) for dia in dias] for horario in horarios
+            ],
+        },
+        'estados': ESTADOS_CODIGOS,
+        'pacientes': list(pacientes),
+        'citas': columnas,
+        'total': len(columnas['ids']),
+    }
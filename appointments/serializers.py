@@ -1,7 +1,13 @@
 from rest_framework import serializers
 from .models import Appointment
+from .slots import MENSAJE_HORA_NO_ALINEADA, alineada
 
 class AppointmentSerializaer(serializers.ModelSerializer):
     class Meta:
         model = Appointment
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+    def validate_fecha(self, fecha):
+        if not alineada(fecha):
+            raise serializers.ValidationError(MENSAJE_HORA_NO_ALINEADA)
+        return fecha
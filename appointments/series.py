@@ -0,0 +1,265 @@
+"""
+Series de citas recurrentes.
+
+Todas las ocurrencias de una regla se validan juntas contra las citas
+existentes con una sola consulta por rango y se insertan con bulk_create.
+Las modificaciones de "esta y las siguientes" se aplican como un único
+UPDATE sobre el conjunto de citas afectadas. Los horarios se reservan en
+appointments.slots dentro de la misma transacción (HorarioOcupado si otra
+transacción ocupó alguno desde la validación).
+"""
+import calendar
+from datetime import date, datetime, timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core import cache
+from doctors.models import Doctor
+
+from .availability import HorarioDoctor
+from .bulk_reschedule import ESTADOS_NO_REAGENDABLES
+from .conflicts import construir_indices, dias_intervalo
+from .counters import actualizar_contadores
+from .events import estado_cita, evento_cita, publicar_eventos
+from .local_time import asignar_fecha_local, recalcular_fechas_locales, zona_clinica
+from .models import Appointment, SerieCitas
+from .slots import MENSAJE_HORA_NO_ALINEADA, alineada, liberar, ocupar
+from .waitlist import programar_relleno
+
+MAX_OCURRENCIAS = 104
+MAX_INTERVALO = 12
+
+ACCIONES_SERIE = ('cancelar', 'editar')
+
+
+class SerieError(Exception):
+    """Error en los datos de la serie"""
+
+
+def expandir_recurrencia(inicio, frecuencia, intervalo, ocurrencias, zona=None):
+    """
+    Fechas de las ocurrencias conservando la hora local de `inicio` en `zona`
+    (la de la clínica; por defecto la del servidor). En la frecuencia
+    mensual, los días inexistentes (p. ej. 31) pasan al último día del mes.
+    """
+    local = timezone.localtime(inicio, zona)
+    fechas = []
+    for n in range(ocurrencias):
+        if frecuencia == 'semanal':
+            dia = local.date() + timedelta(weeks=n * intervalo)
+        else:
+            meses = local.month - 1 + n * intervalo
+            año, mes = local.year + meses // 12, meses % 12 + 1
+            dia = date(año, mes, min(local.day, calendar.monthrange(año, mes)[1]))
+        fechas.append(timezone.make_aware(datetime.combine(dia, local.time()), zona))
+    return fechas
+
+
+def validar_ocurrencias(doctor, fechas, exclude_ids=()):
+    """
+    Devuelve {fecha: error} con las ocurrencias inválidas (pasado, fuera de
+    jornada o en conflicto). Las citas existentes de todos los días se leen
+    con una sola consulta.
+    """
+    horario = HorarioDoctor.para_doctor(doctor)
+    duracion = horario.duracion
+    ahora = timezone.now()
+
+    zona = horario.zona
+    claves = {(doctor.id, dia) for fecha in fechas for dia in dias_intervalo(fecha, duracion, zona)}
+    indices = construir_indices({doctor.id: doctor}, claves, exclude_ids=exclude_ids)
+
+    errores = {}
+    for fecha in fechas:
+        if fecha < ahora:
+            errores[fecha] = 'La fecha ya pasó'
+            continue
+        error = horario.error_jornada(fecha)
+        if error:
+            errores[fecha] = error
+            continue
+        if any(indices[(doctor.id, dia)].overlaps(fecha, duracion) for dia in dias_intervalo(fecha, duracion, zona)):
+            errores[fecha] = 'Conflicto con otra cita'
+    return errores
+
+
+def crear_serie(paciente, doctor, motivo, frecuencia, intervalo, fecha_inicio, ocurrencias,
+                usuario=None, omitir_conflictos=False):
+    """
+    Crea la serie y sus citas. Devuelve (serie, citas, errores); si hay
+    ocurrencias inválidas y no se pidió `omitir_conflictos`, no se crea nada
+    y `serie` es None.
+    """
+    if frecuencia not in dict(SerieCitas.FRECUENCIAS):
+        raise SerieError('Frecuencia inválida')
+    if not 1 <= ocurrencias <= MAX_OCURRENCIAS:
+        raise SerieError(f'El número de citas debe estar entre 1 y {MAX_OCURRENCIAS}')
+    if not 1 <= intervalo <= MAX_INTERVALO:
+        raise SerieError(f'El intervalo debe estar entre 1 y {MAX_INTERVALO}')
+
+    fechas = expandir_recurrencia(fecha_inicio, frecuencia, intervalo, ocurrencias, zona_clinica(doctor.clinica_id))
+
+    with transaction.atomic():
+        # Serializa las altas concurrentes del mismo doctor durante la validación
+        Doctor.objects.select_for_update().filter(id=doctor.id).exists()
+
+        errores = validar_ocurrencias(doctor, fechas)
+        validas = [fecha for fecha in fechas if fecha not in errores]
+        if (errores and not omitir_conflictos) or not validas:
+            return None, [], errores
+
+        serie = SerieCitas.objects.create(
+            paciente=paciente,
+            doctor=doctor,
+            clinica=doctor.clinica,
+            motivo=motivo,
+            frecuencia=frecuencia,
+            intervalo=intervalo,
+            fecha_inicio=validas[0],
+            ocurrencias=len(validas),
+            creada_por=usuario,
+        )
+        citas = Appointment.objects.bulk_create([
+            asignar_fecha_local(Appointment(
+                paciente=paciente,
+                doctor=doctor,
+                clinica=doctor.clinica,
+                fecha=fecha,
+                motivo=motivo,
+                serie=serie,
+            ))
+            for fecha in validas
+        ])
+
+        if citas and citas[0].pk is None:
+            # MySQL no devuelve los ids de un INSERT múltiple
+            citas = list(serie.citas.order_by('fecha'))
+        ocupar(citas, {doctor.id: doctor})
+        actualizar_contadores(actuales=[estado_cita(cita) for cita in citas])
+
+        # bulk_create no emite señales
+        cache.invalidar(doctores=[doctor.id], clinicas=[doctor.clinica_id])
+        publicar_eventos([evento_cita('creada', cita) for cita in citas])
+
+    return serie, citas, errores
+
+
+def modificar_desde(cita, accion, cambios=None):
+    """
+    Aplica `accion` a `cita` y a las siguientes citas de su serie que sigan
+    pendientes. `cambios` (para 'editar') admite motivo, observaciones,
+    nueva_hora ('HH:MM'), desplazar_dias y doctor_id.
+
+    Devuelve (aplicado, total, errores) donde `errores` es {fecha: error}
+    si algún horario resultante no es válido (en cuyo caso no se aplica nada).
+    """
+    if cita.serie_id is None:
+        raise SerieError('La cita no pertenece a una serie')
+    if accion not in ACCIONES_SERIE:
+        raise SerieError('Acción inválida')
+    cambios = cambios or {}
+    ahora = timezone.now()
+
+    with transaction.atomic():
+        citas = Appointment.objects.select_for_update().filter(
+            serie_id=cita.serie_id,
+            fecha__gte=cita.fecha,
+        ).exclude(estado__in=ESTADOS_NO_REAGENDABLES)
+        # Filas bloqueadas con su estado previo (para los eventos de cambio)
+        anteriores = {fila.id: estado_cita(fila) for fila in citas}
+        afectadas = [(cita_id, anterior['fecha'], anterior['doctor_id']) for cita_id, anterior in anteriores.items()]
+        if not afectadas:
+            return True, 0, {}
+        ids = [cita_id for cita_id, _, _ in afectadas]
+        doctores_afectados = {doctor_id for _, _, doctor_id in afectadas}
+
+        if accion == 'cancelar':
+            total = citas.update(estado='cancelada', actualizada_en=ahora, version=F('version') + 1)
+            liberar(ids)
+            for _, fecha, doctor_id in afectadas:
+                programar_relleno(doctor_id, fecha)
+        else:
+            campos, delta, doctor = _cambios_serie(cita, cambios)
+            if delta or doctor:
+                doctor = doctor or cita.doctor
+                nuevas = [fecha + delta for _, fecha, _ in afectadas]
+                errores = validar_ocurrencias(doctor, nuevas, exclude_ids=ids)
+                if errores:
+                    transaction.set_rollback(True)
+                    return False, 0, errores
+                if delta:
+                    campos['fecha'] = F('fecha') + delta
+                campos['doctor'] = doctor
+                campos['clinica'] = doctor.clinica
+                doctores_afectados.add(doctor.id)
+                for _, fecha, doctor_id in afectadas:
+                    programar_relleno(doctor_id, fecha)
+
+            total = citas.filter(id__in=ids).update(actualizada_en=ahora, version=F('version') + 1, **campos)
+            if 'fecha' in campos or 'clinica' in campos:
+                recalcular_fechas_locales(Appointment.objects.filter(id__in=ids))
+
+            # La definición de la serie sigue a sus citas futuras
+            datos_serie = {k: v for k, v in campos.items() if k in ('motivo', 'doctor', 'clinica')}
+            if datos_serie:
+                SerieCitas.objects.filter(id=cita.serie_id).update(**datos_serie)
+
+        actualizadas = list(Appointment.objects.filter(id__in=ids))
+        if accion == 'editar' and (delta or doctor):
+            ocupar(actualizadas, {doctor.id: doctor})
+
+        # update() no emite señales
+        actualizar_contadores(anteriores.values(), [estado_cita(actual) for actual in actualizadas])
+        cache.invalidar(
+            doctores=doctores_afectados,
+            clinicas={anterior['clinica_id'] for anterior in anteriores.values()}
+            | {actual.clinica_id for actual in actualizadas},
+        )
+        eventos = []
+        for actual in actualizadas:
+            anterior = anteriores[actual.id]
+            tipo = 'cancelada' if accion == 'cancelar' else (
+                'reagendada' if (actual.fecha, actual.doctor_id) != (anterior['fecha'], anterior['doctor_id'])
+                else 'actualizada'
+            )
+            eventos.append(evento_cita(tipo, actual, anterior))
+        publicar_eventos(eventos)
+
+    return True, total, {}
+
+
+def _cambios_serie(cita, cambios):
+    """Traduce los cambios pedidos a (campos, desplazamiento, doctor nuevo)"""
+    campos = {}
+    for campo in ('motivo', 'observaciones'):
+        if campo in cambios:
+            campos[campo] = (cambios[campo] or '').strip()
+    if 'motivo' in campos and len(campos['motivo']) < 10:
+        raise SerieError('El motivo debe tener al menos 10 caracteres')
+
+    delta = timedelta(0)
+    try:
+        if cambios.get('nueva_hora'):
+            nueva_hora = datetime.strptime(cambios['nueva_hora'], '%H:%M').time()
+            if not alineada(nueva_hora):
+                raise SerieError(MENSAJE_HORA_NO_ALINEADA)
+            zona = zona_clinica(cita.clinica_id)
+            local = timezone.localtime(cita.fecha, zona)
+            delta += timezone.make_aware(datetime.combine(local.date(), nueva_hora), zona) - cita.fecha
+        if cambios.get('desplazar_dias'):
+            delta += timedelta(days=int(cambios['desplazar_dias']))
+        doctor_id = int(cambios['doctor_id']) if cambios.get('doctor_id') else None
+    except (TypeError, ValueError):
+        raise SerieError('Cambios inválidos')
+
+    doctor = None
+    if doctor_id and doctor_id != cita.doctor_id:
+        doctor = Doctor.objects.select_related('clinica').filter(id=doctor_id, activo=True).first()
+        if doctor is None:
+            raise SerieError('Doctor no encontrado o inactivo')
+
+    if not campos and not delta and not doctor:
+        raise SerieError('No se indicó ningún cambio')
+    return campos, delta, doctor
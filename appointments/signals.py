@@ -0,0 +1,85 @@
+"""
+Señales de la app de citas
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from core import cache
+
+from .conflicts import ESTADOS_INACTIVOS
+from .counters import actualizar_contadores
+from .events import anterior_desde_original, estado_cita, evento_cita, publicar_eventos, tipo_cambio
+from .models import CAMPOS_ORIGINALES, Appointment, CitaEliminada
+from .waitlist import hueco_liberado, programar_relleno, valores_hueco
+
+
+@receiver(post_delete, sender=Appointment)
+def registrar_cita_eliminada(sender, instance, **kwargs):
+    """Deja constancia del borrado para los feeds ICS incrementales"""
+    CitaEliminada.objects.create(
+        cita_id=instance.id,
+        doctor_id=instance.doctor_id,
+        clinica_id=instance.clinica_id,
+        fecha=instance.fecha,
+    )
+
+
+@receiver(post_save, sender=Appointment)
+def publicar_cambio_cita(sender, instance, created, **kwargs):
+    """Publica el cambio para los clientes SSE (antes de que se actualice `_original`)"""
+    if created:
+        publicar_eventos([evento_cita('creada', instance)])
+        return
+    anterior = anterior_desde_original(instance)
+    publicar_eventos([evento_cita(tipo_cambio(anterior, estado_cita(instance)), instance, anterior)])
+
+
+@receiver(post_delete, sender=Appointment)
+def publicar_cita_eliminada(sender, instance, **kwargs):
+    publicar_eventos([evento_cita('eliminada', instance, estado_cita(instance))])
+
+
+@receiver(post_save, sender=Appointment)
+@receiver(post_delete, sender=Appointment)
+def invalidar_cache_cita(sender, instance, **kwargs):
+    """Dashboards del doctor y la clínica de la cita, antes y después del cambio"""
+    original = getattr(instance, '_original', None) or {}
+    cache.invalidar(
+        doctores={instance.doctor_id, original.get('doctor_id')},
+        clinicas={instance.clinica_id, original.get('clinica_id')},
+    )
+
+
+@receiver(post_save, sender=Appointment)
+def actualizar_contador_diario(sender, instance, created, **kwargs):
+    """Mueve la cita entre los contadores diarios (antes de que se actualice `_original`)"""
+    if created:
+        actualizar_contadores(actuales=[estado_cita(instance)])
+        return
+    anterior = anterior_desde_original(instance)
+    actual = estado_cita(instance)
+    if any(anterior[campo] != actual[campo] for campo in ('doctor_id', 'paciente_id', 'fecha_local', 'estado')):
+        actualizar_contadores([anterior], [actual])
+
+
+@receiver(post_delete, sender=Appointment)
+def descontar_cita_eliminada(sender, instance, **kwargs):
+    actualizar_contadores(anteriores=[anterior_desde_original(instance)])
+
+
+@receiver(post_save, sender=Appointment)
+def ofrecer_hueco_liberado(sender, instance, **kwargs):
+    """Ofrece a la lista de espera el horario que deja libre una cancelación o un cambio"""
+    hueco = hueco_liberado(instance)
+    if hueco:
+        programar_relleno(*hueco)
+    instance._original = {
+        campo: instance.__dict__[campo] for campo in CAMPOS_ORIGINALES if campo in instance.__dict__
+    }
+
+
+@receiver(post_delete, sender=Appointment)
+def ofrecer_hueco_eliminado(sender, instance, **kwargs):
+    valores = valores_hueco(instance)
+    if 'fecha' in valores and valores.get('estado') not in ESTADOS_INACTIVOS:
+        programar_relleno(instance.doctor_id, valores['fecha'])
@@ -0,0 +1,217 @@
+"""
+Búsqueda del primer horario disponible entre varios doctores.
+
+Todas las citas de los doctores candidatos se leen con una sola consulta y la
+disponibilidad de cada doctor × día se evalúa como una matriz de NumPy con
+celdas de RESOLUCION_MINUTOS minutos.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+from math import ceil
+
+from django.db import connection
+from django.utils import timezone
+
+from core.database_utils import EpochSeconds
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .availability import RESOLUCION_MINUTOS, HorarioDoctor, slots_disponibles
+from .conflicts import ESTADOS_INACTIVOS
+from .local_time import zona_clinica
+from .models import Appointment
+
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+except ImportError:
+    NUMPY_AVAILABLE = False
+
+CELDAS_DIA = 24 * 60 // RESOLUCION_MINUTOS
+
+# Prioridades que siempre reciben el horario más temprano, sin balanceo de carga
+PRIORIDADES_SIN_BALANCEO = (Patient.PRIORITY_URGENT, Patient.PRIORITY_HIGH)
+
+
+def doctores_candidatos(especialidad=None, clinica=None):
+    """Doctores activos filtrados por especialidad y clínica"""
+    doctores = Doctor.objects.filter(activo=True).select_related('clinica')
+    if especialidad:
+        doctores = doctores.filter(especialidad__iexact=especialidad)
+    if clinica:
+        doctores = doctores.filter(clinica=clinica)
+    return list(doctores.order_by('id'))
+
+
+def _minutos(hora):
+    return hora.hour * 60 + hora.minute
+
+
+def _resultado(doctor, inicio, carga):
+    local = inicio.astimezone(zona_clinica(doctor.clinica_id))
+    return {
+        'doctor_id': doctor.id,
+        'doctor': f"{doctor.nombre} {doctor.apellidos}",
+        'especialidad': doctor.especialidad,
+        'inicio': local.isoformat(),
+        'fecha': local.strftime('%Y-%m-%d'),
+        'hora': local.strftime('%H:%M'),
+        'carga_dia': int(carga),
+    }
+
+
+def buscar_primeros_horarios(especialidad=None, clinica=None, fecha_inicio=None, dias=14,
+                             duracion=None, prioridad=None, limite=10, balancear=False,
+                             desde=None):
+    """
+    Devuelve los `limite` horarios libres más tempranos entre todos los
+    doctores activos de la especialidad/clínica en [fecha_inicio, fecha_inicio + dias).
+
+    Con `balancear`, dentro de un mismo día se prefiere al doctor con menos
+    citas ese día. Los pacientes de prioridad Urgente/Alta siempre reciben el
+    horario más temprano.
+    """
+    desde = desde or timezone.now()
+    if prioridad in PRIORIDADES_SIN_BALANCEO:
+        balancear = False
+
+    doctores = doctores_candidatos(especialidad, clinica)
+    if not doctores or dias <= 0 or limite <= 0:
+        return []
+    # Por defecto, el día en curso de la clínica que va más atrasada
+    fecha_inicio = fecha_inicio or min(desde.astimezone(zona_clinica(doctor.clinica_id)).date() for doctor in doctores)
+
+    if not NUMPY_AVAILABLE:
+        return _buscar_sin_numpy(doctores, fecha_inicio, dias, duracion, limite, desde)
+
+    D, N, C = len(doctores), dias, CELDAS_DIA
+    T = N * C
+    horarios = [HorarioDoctor.para_doctor(doctor, doctor.clinica) for doctor in doctores]
+    indice_doctor = {doctor.id: i for i, doctor in enumerate(doctores)}
+
+    # Medianoches locales de cada doctor × día en la zona de su clínica (tolera cambios de horario)
+    medianoches_zona = {}
+    for h in horarios:
+        if h.zona not in medianoches_zona:
+            medianoches_zona[h.zona] = [
+                timezone.make_aware(datetime.combine(fecha_inicio + timedelta(days=n), time.min), h.zona).timestamp()
+                for n in range(N + 1)
+            ]
+    medianoches = np.array([medianoches_zona[h.zona] for h in horarios])
+
+    # Jornada laboral: doctor × día × celda
+    ini = np.array([_minutos(h.hora_inicio) // RESOLUCION_MINUTOS for h in horarios])
+    fin = np.array([_minutos(h.hora_fin) // RESOLUCION_MINUTOS for h in horarios])
+    dia_laboral = np.array([
+        [(fecha_inicio + timedelta(days=n)).isoweekday() in h.dias_laborales for n in range(N)]
+        for h in horarios
+    ])
+    celda = np.arange(C)
+    jornada = (
+        dia_laboral[:, :, None]
+        & (celda[None, None, :] >= ini[:, None, None])
+        & (celda[None, None, :] < fin[:, None, None])
+    ).reshape(D, T)
+
+    # Una sola consulta con las citas de todos los doctores
+    duracion_existente = np.array([
+        max(ceil(h.duracion / RESOLUCION_MINUTOS), 1) for h in horarios
+    ])
+    max_duracion = max(h.duracion for h in horarios)
+    citas = Appointment.objects.filter(
+        doctor_id__in=indice_doctor.keys(),
+        fecha__gte=datetime.fromtimestamp(medianoches[:, 0].min(), tz=dt_timezone.utc)
+        - timedelta(minutes=max_duracion),
+        fecha__lt=datetime.fromtimestamp(medianoches[:, -1].max(), tz=dt_timezone.utc),
+    ).exclude(estado__in=ESTADOS_INACTIVOS).annotate(
+        ts=EpochSeconds('fecha')
+    ).values_list('doctor_id', 'ts').order_by()
+    # Cursor directo: las filas son enteros y no necesitan los conversores del ORM
+    with connection.cursor() as cursor:
+        cursor.execute(*citas.query.sql_with_params())
+        filas = cursor.fetchall()
+
+    ocupado = np.zeros((D, T), dtype=bool)
+    carga = np.zeros((D, N), dtype=np.int32)
+    if filas:
+        ids, ts = zip(*filas)
+        di = np.array([indice_doctor[doctor_id] for doctor_id in ids])
+        ts = np.array(ts, dtype=np.float64)
+        # Equivale a searchsorted(side='right') sobre las medianoches del doctor de cada cita
+        dia = (medianoches[di] <= ts[:, None]).sum(axis=1) - 1
+        # Las citas del día previo al rango se miden desde la primera medianoche
+        segundos = ts - medianoches[di, np.clip(dia, 0, N)]
+        inicio_flat = (
+            np.maximum(dia, 0) * C + np.floor(segundos / (RESOLUCION_MINUTOS * 60)).astype(np.int64)
+        )
+        parcial = (segundos % (RESOLUCION_MINUTOS * 60)) > 0
+        fin_flat = inicio_flat + duracion_existente[di] + parcial
+
+        # Arreglo de diferencias: +1 al empezar, -1 al terminar
+        inicio_flat = np.clip(inicio_flat, 0, T)
+        fin_flat = np.clip(fin_flat, 0, T)
+        diferencias = np.zeros((D, T + 1), dtype=np.int32)
+        np.add.at(diferencias, (di, inicio_flat), 1)
+        np.add.at(diferencias, (di, fin_flat), -1)
+        ocupado = np.cumsum(diferencias[:, :T], axis=1) > 0
+
+        en_rango = (dia >= 0) & (dia < N)
+        np.add.at(carga, (di[en_rango], dia[en_rango]), 1)
+
+    libre = jornada & ~ocupado
+
+    # k celdas libres consecutivas desde cada posición (ventana deslizante)
+    k = np.array([
+        max(ceil((duracion or h.duracion) / RESOLUCION_MINUTOS), 1) for h in horarios
+    ])
+    acumulado = np.zeros((D, T + 1), dtype=np.int32)
+    acumulado[:, 1:] = np.cumsum(libre, axis=1)
+    posicion = np.arange(T)
+    extremo = np.minimum(posicion[None, :] + k[:, None], T)
+    ventana = np.take_along_axis(acumulado, extremo, axis=1) - acumulado[:, :T]
+    disponible = (ventana == k[:, None]) & (posicion[None, :] + k[:, None] <= T)
+
+    # Inicios alineados a la duración desde el comienzo de la jornada
+    celda_flat = posicion % C
+    disponible &= ((celda_flat[None, :] - ini[:, None]) % k[:, None]) == 0
+
+    # Descartar horarios pasados
+    ahora = desde.timestamp()
+    for i in range(D):
+        if ahora > medianoches[i, 0]:
+            dia_ahora = int(np.searchsorted(medianoches[i], ahora, side='right') - 1)
+            celda_ahora = ceil((ahora - medianoches[i, min(dia_ahora, N)]) / (RESOLUCION_MINUTOS * 60))
+            disponible[i, :min(dia_ahora * C + celda_ahora, T)] = False
+
+    d_idx, t_idx = np.nonzero(disponible)
+    if not len(d_idx):
+        return []
+    dia_idx = t_idx // C
+    if balancear:
+        orden = np.lexsort((d_idx, t_idx, carga[d_idx, dia_idx], dia_idx))
+    else:
+        orden = np.lexsort((d_idx, t_idx))
+
+    resultados = []
+    delta_celda = timedelta(minutes=RESOLUCION_MINUTOS)
+    for j in orden[:limite]:
+        n = int(dia_idx[j])
+        inicio = datetime.fromtimestamp(medianoches[d_idx[j], n], tz=dt_timezone.utc) + delta_celda * int(t_idx[j] % C)
+        resultados.append(_resultado(doctores[d_idx[j]], inicio, carga[d_idx[j], n]))
+    return resultados
+
+
+def _buscar_sin_numpy(doctores, fecha_inicio, dias, duracion, limite, desde):
+    """
+    Alternativa sin NumPy: motor de mapas de bits por doctor (una consulta
+    por doctor y sin balanceo de carga)
+    """
+    fecha_fin = fecha_inicio + timedelta(days=dias - 1)
+    candidatos = []
+    for doctor in doctores:
+        disponibilidad = slots_disponibles(doctor, fecha_inicio, fecha_fin, duracion=duracion,
+                                           desde=desde, clinica=doctor.clinica)
+        for slots in disponibilidad.values():
+            candidatos.extend((inicio, doctor.id, doctor) for inicio in slots)
+
+    candidatos.sort(key=lambda c: (c[0], c[1]))
+    return [_resultado(doctor, inicio, 0) for inicio, _, doctor in candidatos[:limite]]
@@ -0,0 +1,106 @@
+"""
+Ocupación de horarios garantizada por la base de datos.
+
+Cada cita activa que aún no terminó ocupa una fila de OcupacionHorario por
+cada tramo de MINUTOS_TRAMO minutos que toca su intervalo [fecha, fecha +
+duración). La restricción única (doctor, inicio) hace que, de dos
+transacciones que reservan a la vez el mismo horario, solo una pueda
+confirmar: la otra espera el bloqueo del índice y recibe IntegrityError,
+que aquí se traduce a HorarioOcupado.
+
+Las citas deben empezar en un múltiplo de MINUTOS_TRAMO minutos (ver
+alineada(); el formulario y las APIs rechazan el resto). Así el primer tramo
+de una cita es su propio inicio: dos citas seguidas ([09:30, 10:00) y
+[10:00, 10:30)) no comparten tramo y dos que se solapan comparten al menos
+el inicio de la posterior. Los inicios no alineados de datos anteriores se
+redondean hacia abajo, lo que puede rechazar una cita contigua pero nunca
+admitir un solapamiento.
+
+Las comprobaciones previas (AppointmentForm, motor de conflictos) siguen
+dando el mensaje de error habitual; esta tabla cierra la ventana entre la
+comprobación y el INSERT. Appointment.save() la mantiene; las escrituras
+masivas (bulk_create, bulk_update, update) deben llamar a ocupar/liberar.
+"""
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .conflicts import ESTADOS_INACTIVOS, get_duracion_cita
+from .models import OcupacionHorario
+
+MINUTOS_TRAMO = 5
+
+MENSAJE_HORARIO_OCUPADO = (
+    'Otro usuario acaba de reservar este horario. '
+    'Por favor seleccione otro.'
+)
+
+
+MENSAJE_HORA_NO_ALINEADA = f'La hora debe ser múltiplo de {MINUTOS_TRAMO} minutos'
+
+
+class HorarioOcupado(IntegrityError):
+    """El horario ya está reservado por otra cita"""
+
+
+def alineada(fecha):
+    """
+    ¿Empieza `fecha` en un múltiplo de MINUTOS_TRAMO minutos? Vale con la hora
+    local de cualquier zona: sus desfases son múltiplos de 15 minutos.
+    """
+    return fecha.minute % MINUTOS_TRAMO == 0 and not fecha.second and not fecha.microsecond
+
+
+def tramos(inicio, duracion):
+    """
+    Inicios (en UTC) de los tramos que toca [inicio, inicio + duracion): el
+    propio inicio si está alineado y los siguientes cada MINUTOS_TRAMO
+    """
+    paso = timedelta(minutes=MINUTOS_TRAMO)
+    inicio = inicio.astimezone(dt_timezone.utc)
+    fin = inicio + timedelta(minutes=duracion)
+    tramo = inicio.replace(minute=inicio.minute - inicio.minute % MINUTOS_TRAMO, second=0, microsecond=0)
+    while tramo < fin:
+        yield tramo
+        tramo += paso
+
+
+def _filas(citas, doctores, ahora):
+    filas = []
+    for cita in citas:
+        if cita.estado in ESTADOS_INACTIVOS:
+            continue
+        duracion = get_duracion_cita(doctores.get(cita.doctor_id) or cita.doctor)
+        if cita.fecha + timedelta(minutes=duracion) <= ahora:
+            continue
+        filas.extend(
+            OcupacionHorario(doctor_id=cita.doctor_id, inicio=inicio, cita_id=cita.pk)
+            for inicio in tramos(cita.fecha, duracion)
+        )
+    # Mismo orden de inserción en todas las transacciones para no provocar interbloqueos
+    filas.sort(key=lambda fila: (fila.doctor_id, fila.inicio))
+    return filas
+
+
+def ocupar(citas, doctores=None):
+    """
+    Sustituye los tramos ocupados por `citas` (ya guardadas) por los de su
+    horario actual. `doctores` ({id: Doctor} con su clínica) evita una
+    consulta por cita. Lanza HorarioOcupado si algún tramo pertenece a otra
+    cita; en ese caso no se modifica nada.
+    """
+    citas = [cita for cita in citas if cita.pk is not None]
+    if not citas:
+        return
+    try:
+        with transaction.atomic():
+            OcupacionHorario.objects.filter(cita_id__in=[cita.pk for cita in citas]).delete()
+            OcupacionHorario.objects.bulk_create(_filas(citas, doctores or {}, timezone.now()))
+    except IntegrityError as e:
+        raise HorarioOcupado(MENSAJE_HORARIO_OCUPADO) from e
+
+
+def liberar(cita_ids):
+    """Libera los tramos de citas canceladas con update()"""
+    OcupacionHorario.objects.filter(cita_id__in=list(cita_ids)).delete()
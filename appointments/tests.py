@@ -1,3 +1,1353 @@
-from django.test import TestCase
+import json
+import sys
+import threading
+import time
+from unittest import mock
+from datetime import datetime, time as dt_time, timedelta, timezone as dt_timezone
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import OperationalError, connection, transaction
+from django.test import Client, SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from clinicas.models import Clinica, UsuarioClinica
+from core.pubsub import Broker
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .availability import HorarioDoctor, inicios_libres, slots_disponibles
+from .conflicts import DoctorDayIntervals, conflict_index, construir_indices, dias_intervalo
+from .events import canal_clinica, canal_doctor, evento_cita
+from .forms import AppointmentForm
+from .ics import TOKEN_DIAS_VALIDEZ, token_feed
+from .local_time import ZONA_TTL_SEGUNDOS, asignar_fecha_local, invalidar_zonas, zona_clinica
+from .models import Appointment, EntradaListaEspera, SolicitudIdempotente
+from .reports import ContadorFrecuentes, franja_edad, generar_reporte, recorrer, terminos_motivo
+from .resource_view import construir_vista_recursos
+from .serializers import AppointmentSerializaer
+from .slot_search import _buscar_sin_numpy, buscar_primeros_horarios, doctores_candidatos
+from .series import crear_serie, expandir_recurrencia, modificar_desde
+from .slots import HorarioOcupado, liberar
+from .versioning import estado_actual
+from .views_eventos import _canales_solicitados, _varios_workers
+from .waitlist import _RellenoPendiente, programar_relleno
+
+# SQLite serializa las escrituras: los hilos que encuentran la base bloqueada reintentan
+REINTENTOS_BLOQUEO = 50
+
+
+def _crear_doctor(username):
+    usuario = User.objects.create_user(username, password='x')
+    return Doctor.objects.create(
+        usuario=usuario, nombre='Ana', apellidos='Pérez', especialidad='Medicina General',
+        duracion_cita_default=30,
+    )
+
+
+def _proxima_hora():
+    return (timezone.now() + timedelta(days=7)).replace(minute=0, second=0, microsecond=0)
+
+
+class ReservaConcurrenteTests(TransactionTestCase):
+    """Reservas simultáneas del mismo horario: la base de datos deja pasar solo una"""
+
+    HILOS = 8
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_concurrencia')
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='CONC-1')
+        self.fecha = _proxima_hora()
+
+    def _reservar_en_paralelo(self, fechas):
+        """Lanza una reserva por fecha a la vez; devuelve ([(resultado, cita_id)], segundos)"""
+        barrera = threading.Barrier(len(fechas))
+        resultados = []
+
+        def reservar(fecha):
+            try:
+                barrera.wait()
+                for intento in range(REINTENTOS_BLOQUEO):
+                    try:
+                        cita = Appointment.objects.create(
+                            paciente=self.paciente, doctor=self.doctor, fecha=fecha,
+                            motivo='Reserva concurrente de prueba',
+                        )
+                        resultados.append(('ok', cita.pk))
+                        return
+                    except HorarioOcupado:
+                        resultados.append(('ocupado', None))
+                        return
+                    except OperationalError:
+                        time.sleep(0.005 * (intento + 1))
+                resultados.append(('bloqueado', None))
+            finally:
+                connection.close()
+
+        hilos = [threading.Thread(target=reservar, args=(fecha,)) for fecha in fechas]
+        inicio = time.perf_counter()
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+        return resultados, time.perf_counter() - inicio
+
+    def test_un_solo_ganador_por_horario(self):
+        resultados, _ = self._reservar_en_paralelo([self.fecha] * self.HILOS)
+
+        self.assertEqual(sorted(r for r, _ in resultados), ['ocupado'] * (self.HILOS - 1) + ['ok'])
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor).count(), 1)
+
+    def test_solapamiento_parcial_es_conflicto(self):
+        resultados, _ = self._reservar_en_paralelo([
+            self.fecha + timedelta(minutes=10 * i) for i in range(3)
+        ])
+
+        self.assertEqual(sum(1 for r, _ in resultados if r == 'ok'), 1)
+        self.assertEqual(Appointment.objects.filter(doctor=self.doctor).count(), 1)
+
+    def test_cancelar_libera_el_horario(self):
+        cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self.fecha, motivo='Primera reserva de prueba',
+        )
+        with self.assertRaises(HorarioOcupado):
+            Appointment.objects.create(
+                paciente=self.paciente, doctor=self.doctor, fecha=self.fecha, motivo='Segunda reserva de prueba',
+            )
+        cita.estado = 'cancelada'
+        cita.save()
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self.fecha, motivo='Segunda reserva de prueba',
+        )
+
+    def test_rendimiento_horarios_distintos(self):
+        total = self.HILOS * 4
+        fechas = [self.fecha + timedelta(minutes=30 * i) for i in range(total)]
+        resultados, segundos = self._reservar_en_paralelo(fechas)
+
+        self.assertEqual([r for r, _ in resultados], ['ok'] * total)
+        sys.stderr.write(
+            f'\n{total} reservas concurrentes ({self.HILOS * 4} hilos, {connection.vendor}): '
+            f'{segundos * 1000:.0f} ms, {total / segundos:.0f} reservas/s\n'
+        )
+
+
+class IdempotenciaTests(TestCase):
+    URL = '/appointments/api/citas/'
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_idempotencia')
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='IDEM-1')
+        self.client.force_login(self.doctor.usuario)
+        self.datos = {
+            'paciente': self.paciente.pk,
+            'doctor': self.doctor.pk,
+            'fecha': _proxima_hora().isoformat(),
+            'motivo': 'Reserva idempotente de prueba',
+        }
+
+    def test_reintento_devuelve_la_misma_respuesta(self):
+        primera = self.client.post(self.URL, self.datos, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k-1')
+        segunda = self.client.post(self.URL, self.datos, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k-1')
+
+        self.assertEqual(primera.status_code, 201)
+        self.assertEqual(segunda.status_code, 201)
+        self.assertEqual(segunda.content, primera.content)
+        self.assertEqual(segunda['Idempotent-Replayed'], 'true')
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_clave_reutilizada_con_otros_datos(self):
+        self.client.post(self.URL, self.datos, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k-2')
+        otra = dict(self.datos, motivo='Otra reserva distinta de prueba')
+        response = self.client.post(self.URL, otra, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k-2')
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(Appointment.objects.count(), 1)
+
+    def test_horario_ocupado_responde_409(self):
+        self.client.post(self.URL, self.datos, content_type='application/json')
+        response = self.client.post(self.URL, self.datos, content_type='application/json', HTTP_IDEMPOTENCY_KEY='k-3')
+
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(SolicitudIdempotente.objects.get(clave='k-3').codigo_estado, 409)
+
+
+class ListadoCitasAdminTests(TestCase):
+    """El listado de citas hace las mismas consultas con 2 filas que con 10"""
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_admin')
+        self.client.force_login(User.objects.create_superuser('admin_listados', password='x'))
+
+    def _crear_citas(self, desde, hasta):
+        inicio = _proxima_hora().replace(hour=8)
+        for i in range(desde, hasta):
+            paciente = Patient.objects.create(nombre=f'Paciente{i}', apellidos='Admin', dni=f'ADM-{i}')
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, motivo='Control del listado',
+                fecha=inicio + timedelta(minutes=30 * i),
+            )
+
+    def test_listado_citas(self):
+        # sesión, usuario, filtro de clínicas, COUNT, página
+        # (paciente y doctor en el JOIN) y las dos de la jerarquía de fechas; el filtro por doctor
+        # no consulta la lista de doctores
+        for desde, hasta in ((0, 2), (2, 10)):
+            self._crear_citas(desde, hasta)
+            cache.clear()
+            with self.assertNumQueries(7):
+                self.assertEqual(self.client.get('/admin/appointments/appointment/').status_code, 200)
+
+    def test_filtro_por_doctor(self):
+        self._crear_citas(0, 3)
+        response = self.client.get(f'/admin/appointments/appointment/?doctor__id__exact={self.doctor.pk}')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['cl'].result_count, 3)
+        self.assertContains(response, 'filtro-autocompletar')
+
+
+class IndiceConflictosTests(TestCase):
+    """Solapamientos con intervalos semiabiertos [inicio, fin), también entre dos días"""
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_conflictos')
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='CONF-1')
+        # 23:45 - 00:15 (citas de 30 minutos)
+        self.noche = _proxima_hora().replace(hour=23, minute=45)
+        self.cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self.noche, motivo='Cita nocturna de prueba',
+        )
+
+    def test_intervalos_que_se_tocan_no_se_solapan(self):
+        self.assertFalse(conflict_index.hay_conflicto(self.doctor, self.noche - timedelta(minutes=30)))
+        self.assertFalse(conflict_index.hay_conflicto(self.doctor, self.noche + timedelta(minutes=30)))
+        self.assertTrue(conflict_index.hay_conflicto(self.doctor, self.noche - timedelta(minutes=29)))
+        self.assertTrue(conflict_index.hay_conflicto(self.doctor, self.noche + timedelta(minutes=29)))
+
+    def test_solapamiento_despues_de_medianoche(self):
+        medianoche = self.noche + timedelta(minutes=15)
+        self.assertTrue(conflict_index.hay_conflicto(self.doctor, medianoche))
+        self.assertEqual(
+            [cita_id for cita_id, _, _ in conflict_index.conflictos(self.doctor, medianoche)], [self.cita.pk]
+        )
+        self.assertFalse(conflict_index.hay_conflicto(self.doctor, medianoche, exclude_id=self.cita.pk))
+
+    def test_indices_por_dia_incluyen_la_cita_que_cruza_medianoche(self):
+        dia = self.noche.date()
+        siguiente = dia + timedelta(days=1)
+        indices = construir_indices({self.doctor.id: self.doctor}, [(self.doctor.id, dia), (self.doctor.id, siguiente)])
+        medianoche = self.noche + timedelta(minutes=15)
+        self.assertTrue(indices[(self.doctor.id, siguiente)].overlaps(medianoche, 30))
+        self.assertFalse(indices[(self.doctor.id, siguiente)].overlaps(medianoche + timedelta(minutes=15), 30))
+
+    def test_canceladas_no_ocupan(self):
+        self.cita.estado = 'cancelada'
+        self.cita.save()
+        self.assertFalse(conflict_index.hay_conflicto(self.doctor, self.noche))
+
+    def test_ve_citas_escritas_por_otro_proceso(self):
+        manana = self.noche - timedelta(hours=12)
+        self.assertFalse(conflict_index.hay_conflicto(self.doctor, manana))
+        # bulk_create no emite señales, como una reserva hecha en otro worker
+        Appointment.objects.bulk_create([asignar_fecha_local(Appointment(
+            paciente=self.paciente, doctor=self.doctor, fecha=manana, motivo='Reserva de otro proceso',
+        ))])
+        self.assertTrue(conflict_index.hay_conflicto(self.doctor, manana))
+
+    def test_citas_superpuestas_entre_si(self):
+        inicio = self.noche - timedelta(hours=5)
+        # Una cita larga (0-120) contiene a otra corta (10-20): el máximo acumulado de fines la encuentra
+        indice = DoctorDayIntervals(self.doctor.id, inicio.date(), 30, [(1, inicio), (2, inicio + timedelta(minutes=10))])
+        indice.ends[0] = indice.max_ends[0] = indice.max_ends[1] = inicio + timedelta(minutes=120)
+        self.assertEqual([i for i, _, _ in indice.list_overlaps(inicio + timedelta(minutes=60), 15)], [1])
+        indice.add(3, inicio + timedelta(minutes=90), 60)
+        self.assertEqual(
+            [i for i, _, _ in indice.list_overlaps(inicio + timedelta(minutes=100), 10)], [1, 3]
+        )
+        self.assertFalse(indice.overlaps(inicio + timedelta(minutes=150), 10))
+
+
+def _crear_clinica(codigo, **campos):
+    return Clinica.objects.create(
+        nombre=f'Clínica {codigo}', codigo=codigo, direccion='Calle 1', telefono='1',
+        email=f'{codigo.lower()}@example.com', dias_laborales='1,2,3,4,5,6,7', **campos,
+    )
+
+
+def _lunes_siguiente():
+    hoy = timezone.localdate()
+    return hoy + timedelta(days=7 - hoy.weekday())
+
+
+class PrimerHorarioDisponibleTests(TestCase):
+    """Primeros horarios libres entre los doctores de una clínica"""
+
+    URL = '/calendario/api/primer-horario/'
+
+    def setUp(self):
+        self.clinica = _crear_clinica('PRI')
+        self.otra = _crear_clinica('OTR')
+        self.doctores = [_crear_doctor(f'doctor_primer_{i}') for i in range(2)]
+        for doctor in self.doctores:
+            doctor.clinica = self.clinica
+            doctor.save()
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='PRI-1')
+        self.dia = _lunes_siguiente()
+        self.inicio = timezone.make_aware(datetime.combine(self.dia, dt_time(8, 0)))
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctores[0], fecha=self.inicio, motivo='Primera hora ocupada',
+        )
+
+    def _horarios(self, resultados):
+        return [(r['doctor_id'], r['hora']) for r in resultados]
+
+    def test_horarios_mas_tempranos_entre_doctores(self):
+        a, b = self.doctores
+        resultados = buscar_primeros_horarios(
+            clinica=self.clinica, fecha_inicio=self.dia, dias=1, limite=3, desde=self.inicio - timedelta(days=1),
+        )
+        self.assertEqual(self._horarios(resultados), [(b.id, '08:00'), (a.id, '08:30'), (b.id, '08:30')])
+
+    def test_sin_numpy_da_los_mismos_horarios(self):
+        parametros = dict(fecha_inicio=self.dia, dias=2, duracion=None, limite=5, desde=self.inicio - timedelta(days=1))
+        con_numpy = buscar_primeros_horarios(clinica=self.clinica, **parametros)
+        sin_numpy = _buscar_sin_numpy(doctores_candidatos(clinica=self.clinica), **parametros)
+        self.assertEqual(self._horarios(con_numpy), self._horarios(sin_numpy))
+
+    def test_balanceo_prefiere_al_doctor_con_menos_citas(self):
+        a, b = self.doctores
+        resultados = buscar_primeros_horarios(
+            clinica=self.clinica, fecha_inicio=self.dia, dias=1, limite=2, balancear=True,
+            desde=self.inicio - timedelta(days=1),
+        )
+        self.assertEqual([r['doctor_id'] for r in resultados], [b.id, b.id])
+
+    def test_otra_clinica_requiere_pertenecer_a_ella(self):
+        self.client.force_login(self.doctores[0].usuario)
+        self.assertEqual(self.client.get(self.URL, {'clinica_id': self.otra.id}).status_code, 403)
+        response = self.client.get(self.URL, {'clinica_id': self.clinica.id})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(all(r['doctor_id'] in {d.id for d in self.doctores} for r in response.json()['resultados']))
+
+    def test_usuario_sin_clinica(self):
+        self.client.force_login(User.objects.create_user('sin_clinica', password='x'))
+        self.assertEqual(self.client.get(self.URL).status_code, 403)
+
+
+class ReagendarLoteTests(TestCase):
+    """Reagendamiento en lote: todo o nada, y solo hacia agendas permitidas"""
+
+    URL = '/calendario/api/reagendar-lote/'
+
+    def setUp(self):
+        self.clinica = _crear_clinica('LOT')
+        self.otra = _crear_clinica('LOX')
+        self.doctor = _crear_doctor('doctor_lote')
+        self.colega = _crear_doctor('doctor_lote_colega')
+        self.ajeno = _crear_doctor('doctor_lote_ajeno')
+        for doctor, clinica in ((self.doctor, self.clinica), (self.colega, self.clinica), (self.ajeno, self.otra)):
+            doctor.clinica = clinica
+            doctor.save()
+        paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='LOT-1')
+        self.dia = _lunes_siguiente()
+        self.citas = [
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, motivo='Cita a reagendar',
+                fecha=timezone.make_aware(datetime.combine(self.dia, dt_time(9 + i, 0))),
+            )
+            for i in range(2)
+        ]
+        self.client.force_login(self.doctor.usuario)
+
+    def _mover(self, *movimientos):
+        return self.client.post(self.URL, {'movimientos': [
+            dict(cita_id=cita.id, nueva_fecha=str(self.dia), nueva_hora=hora, **extra)
+            for cita, hora, extra in movimientos
+        ]}, content_type='application/json')
+
+    def _horas(self):
+        return [
+            (timezone.localtime(cita.fecha).strftime('%H:%M'), cita.doctor_id)
+            for cita in Appointment.objects.filter(id__in=[c.id for c in self.citas]).order_by('id')
+        ]
+
+    def test_mueve_todas(self):
+        response = self._mover((self.citas[0], '14:00', {}), (self.citas[1], '15:00', {'doctor_id': self.colega.id}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._horas(), [('14:00', self.doctor.id), ('15:00', self.colega.id)])
+
+    def test_conflicto_no_aplica_ninguna(self):
+        response = self._mover((self.citas[0], '14:00', {}), (self.citas[1], '14:00', {}))
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self._horas(), [('09:00', self.doctor.id), ('10:00', self.doctor.id)])
+
+    def test_doctor_destino_de_otra_clinica(self):
+        response = self._mover((self.citas[0], '14:00', {'doctor_id': self.ajeno.id}))
+        self.assertEqual(response.status_code, 409)
+        self.assertIn('Sin permisos', response.json()['resultados'][0]['error'])
+        self.assertEqual(self._horas()[0], ('09:00', self.doctor.id))
+
+    def test_citas_contiguas_y_horas_no_alineadas(self):
+        # [14:00, 14:30) y [14:30, 15:00) no comparten tramo
+        response = self._mover((self.citas[0], '14:00', {}), (self.citas[1], '14:30', {}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self._horas(), [('14:00', self.doctor.id), ('14:30', self.doctor.id)])
+
+        # 09:33 y 10:03 compartirían el tramo de las 10:00: se rechazan antes de reservar
+        response = self._mover((self.citas[0], '09:33', {}), (self.citas[1], '10:03', {}))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('múltiplo de 5 minutos', response.json()['error'])
+        response = self.client.post('/calendario/api/reagendar/', {
+            'cita_id': self.citas[0].id, 'nueva_fecha': str(self.dia), 'nueva_hora': '09:33',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self._horas(), [('14:00', self.doctor.id), ('14:30', self.doctor.id)])
+        serializer = AppointmentSerializaer(data={'fecha': f'{self.dia}T09:33:00Z'})
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('fecha', serializer.errors)
+
+    def test_staff_puede_mover_a_otra_clinica(self):
+        self.client.force_login(User.objects.create_user('staff_lote', password='x', is_staff=True))
+        response = self._mover((self.citas[0], '14:00', {'doctor_id': self.ajeno.id}))
+        self.assertEqual(response.status_code, 200)
+        cita = Appointment.objects.get(id=self.citas[0].id)
+        self.assertEqual((cita.doctor_id, cita.clinica_id), (self.ajeno.id, self.otra.id))
+
+
+class FeedICSTests(TestCase):
+    """Feeds iCalendar: tokens con caducidad y eventos sin datos del paciente"""
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_ics')
+        paciente = Patient.objects.create(nombre='María José', apellidos='Gómez', dni='ICS-1')
+        Appointment.objects.create(
+            paciente=paciente, doctor=self.doctor, fecha=_proxima_hora(), motivo='Control de tensión',
+            observaciones='Nota clínica privada',
+        )
+        self.url = f'/calendario/ics/doctor/{self.doctor.id}.ics'
+
+    def test_eventos_con_iniciales_y_motivo(self):
+        contenido = b''.join(self.client.get(self.url, {'token': token_feed('doctor', self.doctor.id)})).decode()
+        self.assertIn('SUMMARY:Cita: M.J.G.', contenido)
+        self.assertIn('DESCRIPTION:Control de tensión', contenido)
+        self.assertNotIn('Gómez', contenido)
+        self.assertNotIn('Nota clínica', contenido)
+
+    def test_token_de_otro_feed(self):
+        response = self.client.get(self.url, {'token': token_feed('doctor', self.doctor.id + 1)})
+        self.assertEqual(response.status_code, 403)
+
+    def test_token_caducado(self):
+        emitido = time.time() - (TOKEN_DIAS_VALIDEZ + 1) * 86400
+        with mock.patch('django.core.signing.time.time', return_value=emitido):
+            token = token_feed('doctor', self.doctor.id)
+        self.assertEqual(self.client.get(self.url, {'token': token}).status_code, 403)
+
+    def test_enlaces_con_caducidad(self):
+        self.client.force_login(self.doctor.usuario)
+        enlaces = self.client.get('/calendario/api/ics/enlaces/').json()
+        self.assertIn('expira', enlaces)
+        self.client.logout()
+        token = enlaces['doctor'].split('token=')[1]
+        self.assertEqual(self.client.get(self.url, {'token': token}).status_code, 200)
+
+
+class ListaEsperaTests(TestCase):
+    """Relleno de huecos liberados y permisos sobre las entradas en espera"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('ESP')
+        self.doctor = _crear_doctor('doctor_espera')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.fecha = _proxima_hora()
+        paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='ESP-1')
+        self.cita = Appointment.objects.create(
+            paciente=paciente, doctor=self.doctor, fecha=self.fecha, motivo='Revisión anual',
+        )
+        self.urgente = self._entrada('ESP-2', Patient.PRIORITY_URGENT)
+        self.baja = self._entrada('ESP-3', Patient.PRIORITY_LOW)
+
+    def _entrada(self, dni, prioridad):
+        paciente = Patient.objects.create(nombre='Eva', apellidos='Ruiz', dni=dni, prioridad=prioridad)
+        return EntradaListaEspera.objects.create(
+            paciente=paciente, doctor=self.doctor, clinica=self.clinica,
+            desde=timezone.localdate(), hasta=timezone.localdate() + timedelta(days=30),
+            motivo='Adelantar la consulta',
+        )
+
+    def _cancelar_cita(self):
+        self.cita.estado = 'cancelada'
+        self.cita.save()
+
+    def test_hueco_para_la_entrada_mas_prioritaria(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self._cancelar_cita()
+        self.urgente.refresh_from_db()
+        self.baja.refresh_from_db()
+        self.assertEqual(self.urgente.estado, 'ofrecida')
+        self.assertEqual(self.urgente.cita.fecha, self.fecha)
+        self.assertEqual(self.baja.estado, 'esperando')
+
+    def test_transaccion_revertida_no_deja_huecos(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    self._cancelar_cita()
+                    raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertFalse(EntradaListaEspera.objects.exclude(estado='esperando').exists())
+
+    def test_huecos_de_una_transaccion_en_un_solo_callback(self):
+        paciente = Patient.objects.create(nombre='Ana', apellidos='Sanz', dni='ESP-4')
+        otra = Appointment.objects.create(
+            paciente=paciente, doctor=self.doctor, fecha=self.fecha + timedelta(hours=1), motivo='Revisión anual',
+        )
+        # update() no emite señales: los huecos se registran a mano, como en las operaciones en lote
+        Appointment.objects.filter(id__in=[self.cita.id, otra.id]).update(estado='cancelada')
+        liberar([self.cita.id, otra.id])
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            programar_relleno(self.doctor.id, self.cita.fecha)
+            programar_relleno(self.doctor.id, otra.fecha)
+        self.assertEqual(len([c for c in callbacks if isinstance(c, _RellenoPendiente)]), 1)
+        self.assertEqual(EntradaListaEspera.objects.filter(estado='ofrecida').count(), 2)
+
+    def test_cancelar_entrada_de_otra_clinica(self):
+        ajeno = _crear_doctor('doctor_espera_ajeno')
+        ajeno.clinica = _crear_clinica('AJE')
+        ajeno.save(update_fields=['clinica'])
+        self.client.force_login(ajeno.usuario)
+        response = self.client.post(f'/appointments/lista-espera/{self.urgente.id}/cancelar/')
+        self.assertEqual(response.status_code, 404)
+        self.urgente.refresh_from_db()
+        self.assertEqual(self.urgente.estado, 'esperando')
+
+    def test_cancelar_entrada_propia(self):
+        self.client.force_login(self.doctor.usuario)
+        response = self.client.post(f'/appointments/lista-espera/{self.urgente.id}/cancelar/')
+        self.assertEqual(response.status_code, 200)
+        self.urgente.refresh_from_db()
+        self.assertEqual(self.urgente.estado, 'cancelada')
+        response = self.client.post(f'/appointments/lista-espera/{self.urgente.id}/cancelar/')
+        self.assertEqual(response.status_code, 409)
+
+    def test_cancelar_entrada_requiere_csrf(self):
+        cliente = Client(enforce_csrf_checks=True)
+        cliente.force_login(self.doctor.usuario)
+        response = cliente.post(f'/appointments/lista-espera/{self.urgente.id}/cancelar/')
+        self.assertEqual(response.status_code, 403)
+
+
+class ZonaHorariaClinicaTests(TestCase):
+    """Jornada, búsqueda de horarios y vista diaria en la zona horaria de la clínica"""
+
+    # Lunes de invierno: Madrid está en UTC+1 y el servidor de pruebas en UTC
+    LUNES = datetime(2031, 1, 6).date()
+
+    def setUp(self):
+        invalidar_zonas()
+        self.clinica = _crear_clinica(
+            'MAD', zona_horaria='Europe/Madrid', horario_inicio=dt_time(8, 0), horario_fin=dt_time(18, 0),
+        )
+        self.doctor = _crear_doctor('doctor_madrid')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='ZONA-1')
+
+    def _utc(self, dia, hora, minuto=0):
+        return datetime.combine(dia, dt_time(hora, minuto), tzinfo=dt_timezone.utc)
+
+    def test_jornada_en_la_zona_de_la_clinica(self):
+        horario = HorarioDoctor.para_doctor(self.doctor)
+        self.assertEqual(horario.inicio_jornada(self.LUNES), self._utc(self.LUNES, 7))
+        # 07:30 UTC son las 08:30 en Madrid; 17:30 UTC, las 18:30
+        self.assertIsNone(horario.error_jornada(self._utc(self.LUNES, 7, 30)))
+        self.assertIsNotNone(horario.error_jornada(self._utc(self.LUNES, 17, 30)))
+
+    def test_primer_horario_en_la_zona_de_la_clinica(self):
+        resultados = buscar_primeros_horarios(
+            clinica=self.clinica, fecha_inicio=self.LUNES, dias=1, limite=1,
+            desde=self._utc(self.LUNES, 0) - timedelta(days=1),
+        )
+        self.assertEqual(resultados[0]['inicio'], '2031-01-06T08:00:00+01:00')
+        self.assertEqual(resultados[0]['hora'], '08:00')
+
+    def test_indices_por_dia_local_de_la_clinica(self):
+        # 23:30 UTC del lunes es la madrugada del martes en Madrid
+        inicio = self._utc(self.LUNES, 23, 30)
+        Appointment.objects.create(paciente=self.paciente, doctor=self.doctor, fecha=inicio, motivo='Guardia nocturna')
+        zona = zona_clinica(self.clinica.id)
+        martes = self.LUNES + timedelta(days=1)
+        self.assertEqual(dias_intervalo(inicio, 30, zona), [martes])
+        indices = construir_indices({self.doctor.id: self.doctor}, [(self.doctor.id, martes)])
+        self.assertTrue(indices[(self.doctor.id, martes)].overlaps(inicio, 30))
+
+    def test_citas_dia_con_fecha_y_hora_de_la_clinica(self):
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica, fecha=self._utc(self.LUNES, 23, 30),
+            motivo='Guardia nocturna',
+        )
+        self.client.force_login(self.doctor.usuario)
+        martes = (self.LUNES + timedelta(days=1)).isoformat()
+        citas = self.client.get('/calendario/api/citas-dia/', {'fecha': martes}).json()['citas']
+        self.assertEqual([(cita['fecha'], cita['hora']) for cita in citas], [(martes, '00:30')])
+
+    def test_reagendar_con_la_hora_de_la_clinica(self):
+        cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica, fecha=self._utc(self.LUNES, 8),
+            motivo='Cita a reagendar',
+        )
+        self.client.force_login(self.doctor.usuario)
+        respuesta = self.client.post('/calendario/api/reagendar/', {
+            'cita_id': cita.id, 'nueva_fecha': self.LUNES.isoformat(), 'nueva_hora': '10:00',
+        }, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['fecha_anterior'], '2031-01-06 09:00')
+        cita.refresh_from_db()
+        self.assertEqual(cita.fecha, self._utc(self.LUNES, 9))
+        citas = self.client.get('/calendario/api/citas-dia/', {'fecha': self.LUNES.isoformat()}).json()['citas']
+        self.assertEqual([c['hora'] for c in citas], ['10:00'])
+
+    def test_reagendar_lote_con_la_hora_de_la_clinica(self):
+        cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica, fecha=self._utc(self.LUNES, 8),
+            motivo='Cita a reagendar',
+        )
+        self.client.force_login(self.doctor.usuario)
+        # 17:30-18:00 en Madrid está dentro de la jornada (16:30 UTC)
+        respuesta = self.client.post('/calendario/api/reagendar-lote/', {'movimientos': [
+            {'cita_id': cita.id, 'nueva_fecha': self.LUNES.isoformat(), 'nueva_hora': '17:30'},
+        ]}, content_type='application/json')
+        self.assertEqual(respuesta.status_code, 200)
+        self.assertEqual(respuesta.json()['resultados'][0]['fecha_nueva'], '2031-01-06 17:30')
+        cita.refresh_from_db()
+        self.assertEqual(cita.fecha, self._utc(self.LUNES, 16, 30))
+
+    def test_formulario_con_la_jornada_de_la_clinica(self):
+        dia = _lunes_siguiente()
+        zona = zona_clinica(self.clinica.id)
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica,
+            fecha=datetime.combine(dia, dt_time(9, 0), tzinfo=zona), motivo='Primera consulta',
+        )
+        datos = {'paciente': self.paciente.id, 'motivo': 'Control de la tarde'}
+        with timezone.override(zona):
+            valido = AppointmentForm(dict(datos, fecha=f'{dia} 17:30'), doctor=self.doctor)
+            fuera = AppointmentForm(dict(datos, fecha=f'{dia} 18:00'), doctor=self.doctor)
+            self.assertTrue(valido.is_valid(), valido.errors)
+            self.assertFalse(fuera.is_valid())
+        self.assertEqual(valido.cleaned_data['fecha'], datetime.combine(dia, dt_time(17, 30), tzinfo=zona))
+        self.assertIn('fecha', fuera.errors)
+
+    def test_carga_masiva_con_la_hora_de_la_clinica(self):
+        dia = _lunes_siguiente()
+        zona = zona_clinica(self.clinica.id)
+        self.client.force_login(self.doctor.usuario)
+        items = [
+            {'paciente': self.paciente.id, 'fecha': f'{dia} 17:30', 'motivo': 'Carga de la agenda'},
+            # Con zona explícita: 17:30 UTC ya es fuera de la jornada en Madrid
+            {'paciente': self.paciente.id, 'fecha': f'{dia}T17:30:00+00:00', 'motivo': 'Carga de la agenda'},
+        ]
+        respuesta = self.client.post(
+            '/api/v1/appointments/api/citas/bulk/', json.dumps({'modo': 'parcial', 'items': items}),
+            content_type='application/json',
+        )
+        self.assertEqual(respuesta.status_code, 207)
+        self.assertIn('fecha', respuesta.json()['resultados'][1]['errores'])
+        self.assertEqual(Appointment.objects.get().fecha, datetime.combine(dia, dt_time(17, 30), tzinfo=zona))
+
+    def test_eventos_y_conflicto_de_version_en_la_zona_de_la_clinica(self):
+        cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica, fecha=self._utc(self.LUNES, 23, 30),
+            motivo='Guardia nocturna',
+        )
+        _, evento = evento_cita('creada', cita)
+        self.assertEqual((evento['fecha_local'], evento['hora']), ('2031-01-07', '00:30'))
+        self.assertEqual(evento['fecha'], '2031-01-07T00:30:00+01:00')
+        actual = estado_actual(cita.id)
+        self.assertEqual((actual['fecha'], actual['hora']), ('2031-01-07', '00:30'))
+
+    def test_vista_recursos_en_la_zona_de_la_clinica(self):
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica, fecha=self._utc(self.LUNES, 23, 30),
+            motivo='Guardia nocturna',
+        )
+        vista = construir_vista_recursos([self.doctor], self.LUNES, self.LUNES + timedelta(days=1))
+        self.assertEqual(vista['citas']['dias'], [1])
+        self.assertEqual(vista['citas']['minutos'], [30])
+
+    def test_serie_conserva_la_hora_de_la_clinica(self):
+        # 09:00 en Madrid es UTC+1 en invierno y UTC+2 tras el cambio de hora
+        inicio = datetime.combine(self.LUNES + timedelta(weeks=11), dt_time(9, 0), tzinfo=zona_clinica(self.clinica.id))
+        fechas = expandir_recurrencia(inicio, 'semanal', 1, 2, zona_clinica(self.clinica.id))
+        self.assertEqual([fecha.astimezone(dt_timezone.utc).hour for fecha in fechas], [8, 7])
+
+    def test_zona_cacheada_caduca(self):
+        self.assertEqual(zona_clinica(self.clinica.id).key, 'Europe/Madrid')
+        # update() no emite señales: otro proceso no se enteraría del cambio
+        Clinica.objects.filter(id=self.clinica.id).update(zona_horaria='America/Bogota')
+        self.assertEqual(zona_clinica(self.clinica.id).key, 'Europe/Madrid')
+        caducada = time.monotonic() + ZONA_TTL_SEGUNDOS + 1
+        with mock.patch('appointments.local_time.time.monotonic', return_value=caducada):
+            self.assertEqual(zona_clinica(self.clinica.id).key, 'America/Bogota')
+
+
+class CanalesEventosTests(TestCase):
+    """Canales del stream SSE que puede escuchar cada usuario"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('EVT')
+        self.doctor = _crear_doctor('doctor_eventos')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.colega = _crear_doctor('doctor_eventos_colega')
+        self.colega.clinica = self.clinica
+        self.colega.save(update_fields=['clinica'])
+        self.ajeno = _crear_doctor('doctor_eventos_ajeno')
+        self.ajeno.clinica = _crear_clinica('EVA')
+        self.ajeno.save(update_fields=['clinica'])
+
+    def _canales(self, params, usuario=None, doctor=None, roles=None):
+        usuario = usuario or self.doctor.usuario
+        return async_to_sync(_canales_solicitados)(params, usuario, doctor, roles or {})
+
+    def test_por_defecto_la_clinica_del_doctor(self):
+        canales, error = self._canales({}, doctor=self.doctor)
+        self.assertIsNone(error)
+        self.assertEqual(canales, {canal_clinica(self.clinica.id)})
+
+    def test_doctor_de_la_misma_clinica(self):
+        canales, error = self._canales({'doctor': str(self.colega.id)}, doctor=self.doctor)
+        self.assertIsNone(error)
+        self.assertEqual(canales, {canal_doctor(self.colega.id)})
+
+    def test_clinica_o_doctor_ajenos(self):
+        _, error = self._canales({'clinica': str(self.ajeno.clinica_id)}, doctor=self.doctor)
+        self.assertEqual(error.status_code, 403)
+        _, error = self._canales({'doctor': str(self.ajeno.id)}, doctor=self.doctor)
+        self.assertEqual(error.status_code, 403)
+
+    def test_usuario_sin_doctor(self):
+        usuario = User.objects.create_user('recepcion_eventos', password='x')
+        _, error = self._canales({}, usuario=usuario)
+        self.assertEqual(error.status_code, 400)
+        _, error = self._canales({'clinica': str(self.clinica.id)}, usuario=usuario)
+        self.assertEqual(error.status_code, 403)
+
+    def test_rol_en_la_clinica(self):
+        usuario = User.objects.create_user('recepcion_eventos_rol', password='x')
+        roles = {self.clinica.id: 'recepcionista'}
+        canales, error = self._canales({}, usuario=usuario, roles=roles)
+        self.assertEqual(canales, {canal_clinica(self.clinica.id)})
+        canales, error = self._canales({'doctor': str(self.colega.id)}, usuario=usuario, roles=roles)
+        self.assertEqual(canales, {canal_doctor(self.colega.id)})
+        _, error = self._canales({'clinica': str(self.ajeno.clinica_id)}, usuario=usuario, roles=roles)
+        self.assertEqual(error.status_code, 403)
+        _, error = self._canales({'doctor': str(self.ajeno.id)}, usuario=usuario, roles=roles)
+        self.assertEqual(error.status_code, 403)
+
+    def test_staff_cualquier_canal(self):
+        staff = User.objects.create_user('staff_eventos', password='x', is_staff=True)
+        canales, error = self._canales({'clinica': str(self.ajeno.clinica_id), 'doctor': str(self.ajeno.id)}, staff)
+        self.assertIsNone(error)
+        self.assertEqual(canales, {canal_clinica(self.ajeno.clinica_id), canal_doctor(self.ajeno.id)})
+
+    def test_parametros_invalidos(self):
+        _, error = self._canales({'clinica': 'x'}, doctor=self.doctor)
+        self.assertEqual(error.status_code, 400)
+
+
+class BrokerTests(SimpleTestCase):
+    """Reparto de mensajes del broker en memoria"""
+
+    def test_un_mensaje_por_suscripcion_y_desbordamiento(self):
+        async def escenario():
+            broker = Broker()
+            suscripcion = broker.suscribir({'clinica:1', 'doctor:2'}, max_buffer=2)
+            otra = broker.suscribir({'clinica:9'})
+            self.assertEqual(broker.publicar({'clinica:1', 'doctor:2'}, {'tipo': 'creada'}), 1)
+            mensajes = await suscripcion.esperar(1)
+            self.assertEqual([mensaje for _, mensaje in mensajes], [{'tipo': 'creada'}])
+            self.assertEqual(await otra.esperar(0.01), [])
+            for n in range(3):
+                broker.publicar({'doctor:2'}, {'n': n})
+            mensajes = await suscripcion.esperar(1)
+            self.assertTrue(suscripcion.desbordada)
+            self.assertEqual([mensaje for _, mensaje in mensajes], [{'n': 1}, {'n': 2}])
+            broker.cancelar(suscripcion)
+            broker.cancelar(otra)
+            self.assertEqual(broker.total_suscripciones(), 0)
+
+        async_to_sync(escenario)()
+
+    def test_stream_rechazado_con_varios_workers_en_memoria(self):
+        with mock.patch.dict('os.environ', {'WEB_CONCURRENCY': '4'}):
+            self.assertTrue(_varios_workers())
+        with mock.patch.dict('os.environ', {'WEB_CONCURRENCY': '1'}):
+            self.assertFalse(_varios_workers())
+
+
+class ConcurrenciaOptimistaTests(TestCase):
+    """Ediciones con una versión desactualizada no pisan los cambios de otro usuario"""
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_version')
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='VER-1')
+        self.fecha = timezone.make_aware(datetime.combine(_lunes_siguiente(), dt_time(10, 0)))
+        self.cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self.fecha, motivo='Revisión de tratamiento',
+        )
+        self.client.force_login(self.doctor.usuario)
+
+    def _modificar_en_otra_sesion(self):
+        """Otro usuario guarda la cita; devuelve la versión que tenía la primera sesión"""
+        version = self.cita.version
+        otra = Appointment.objects.get(id=self.cita.id)
+        otra.observaciones = 'Cambio de otra sesión'
+        otra.save(update_fields=['observaciones'], version_esperada=version)
+        return version
+
+    def _editar(self, version, motivo='Motivo editado en el formulario'):
+        return self.client.post(f'/appointments/editar/{self.cita.id}/', {
+            'paciente': self.paciente.id,
+            'fecha': timezone.localtime(self.fecha).strftime('%Y-%m-%d %H:%M'),
+            'motivo': motivo,
+            'observaciones': '',
+            'version': version,
+        })
+
+    def _reagendar(self, version):
+        return self.client.post('/calendario/api/reagendar/', {
+            'cita_id': self.cita.id,
+            'nueva_fecha': self.fecha.strftime('%Y-%m-%d'),
+            'nueva_hora': '12:00',
+            'version': version,
+        }, content_type='application/json')
+
+    def test_editar_con_version_desactualizada(self):
+        version = self._modificar_en_otra_sesion()
+        response = self._editar(version)
+        self.assertEqual(response.status_code, 409)
+        cita = Appointment.objects.get(id=self.cita.id)
+        self.assertEqual(cita.motivo, 'Revisión de tratamiento')
+        self.assertEqual(cita.observaciones, 'Cambio de otra sesión')
+        self.assertEqual(cita.version, version + 1)
+
+    def test_editar_incrementa_la_version(self):
+        version = self.cita.version
+        response = self._editar(version)
+        self.assertEqual(response.status_code, 302)
+        cita = Appointment.objects.get(id=self.cita.id)
+        self.assertEqual(cita.motivo, 'Motivo editado en el formulario')
+        self.assertEqual(cita.version, version + 1)
+
+    def test_reagendar_con_version_desactualizada(self):
+        version = self._modificar_en_otra_sesion()
+        response = self._reagendar(version)
+        self.assertEqual(response.status_code, 409)
+        self.assertTrue(response.json()['conflicto_version'])
+        cita = Appointment.objects.get(id=self.cita.id)
+        self.assertEqual(cita.fecha, self.fecha)
+        self.assertEqual(cita.version, version + 1)
+
+    def test_reagendar_incrementa_la_version(self):
+        version = self.cita.version
+        response = self._reagendar(version)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['version'], version + 1)
+        cita = Appointment.objects.get(id=self.cita.id)
+        self.assertEqual(timezone.localtime(cita.fecha).hour, 12)
+        self.assertEqual(cita.version, version + 1)
+
+
+class DisponibilidadMapaBitsTests(TestCase):
+    """Horarios libres calculados con el mapa de bits de cada doctor-día"""
+
+    def setUp(self):
+        self.doctor = _crear_doctor('doctor_disponibilidad')
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='DISP-1')
+        self.lunes = _lunes_siguiente()
+        self.desde = timezone.make_aware(datetime.combine(self.lunes - timedelta(days=7), dt_time.min))
+
+    def _hora(self, dia, hora, minuto=0):
+        return timezone.make_aware(datetime.combine(dia, dt_time(hora, minuto)))
+
+    def _horas_libres(self, dia):
+        slots = slots_disponibles(self.doctor, dia, desde=self.desde)[dia]
+        return [timezone.localtime(slot).strftime('%H:%M') for slot in slots]
+
+    def test_jornada_completa_sin_citas(self):
+        horas = self._horas_libres(self.lunes)
+        # 08:00-18:00 en bloques de 30 minutos
+        self.assertEqual(len(horas), 20)
+        self.assertEqual((horas[0], horas[-1]), ('08:00', '17:30'))
+
+    def test_cita_ocupa_sus_celdas(self):
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self._hora(self.lunes, 9), motivo='Consulta de control',
+        )
+        horas = self._horas_libres(self.lunes)
+        self.assertNotIn('09:00', horas)
+        self.assertIn('08:30', horas)
+        self.assertIn('09:30', horas)
+
+    def test_cita_a_mitad_de_celda_bloquea_ambos_horarios(self):
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self._hora(self.lunes, 9, 10), motivo='Consulta de control',
+        )
+        horas = self._horas_libres(self.lunes)
+        self.assertNotIn('09:00', horas)
+        self.assertNotIn('09:30', horas)
+        self.assertIn('10:00', horas)
+
+    def test_citas_canceladas_no_ocupan(self):
+        cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, fecha=self._hora(self.lunes, 9), motivo='Consulta de control',
+        )
+        cita.estado = 'cancelada'
+        cita.save()
+        self.assertIn('09:00', self._horas_libres(self.lunes))
+
+    def test_fin_de_semana_y_horarios_pasados(self):
+        sabado = self.lunes + timedelta(days=5)
+        self.assertEqual(slots_disponibles(self.doctor, sabado, desde=self.desde)[sabado], [])
+        slots = slots_disponibles(self.doctor, self.lunes, desde=self._hora(self.lunes, 12, 10))[self.lunes]
+        self.assertEqual(timezone.localtime(slots[0]).strftime('%H:%M'), '12:30')
+
+    def test_rango_con_una_sola_consulta(self):
+        with self.assertNumQueries(1):
+            disponibilidad = slots_disponibles(self.doctor, self.lunes, self.lunes + timedelta(days=6), desde=self.desde)
+        self.assertEqual(len(disponibilidad), 7)
+
+    def test_inicios_libres(self):
+        # Celdas libres 0-2 y 4-7: con k=3 pueden empezar en 0, 4 y 5
+        self.assertEqual(inicios_libres(0b11110111, 3), 0b00110001)
+
+
+class CalendarioResumenTests(TestCase):
+    """Vista mensual con conteos por día y detalle paginado del día"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('CAL')
+        self.doctor = _crear_doctor('doctor_calendario')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.lunes = _lunes_siguiente()
+        urgente = Patient.objects.create(
+            nombre='Eva', apellidos='Ruiz', dni='CAL-1', prioridad=Patient.PRIORITY_URGENT,
+        )
+        normal = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='CAL-2')
+        inicio = timezone.make_aware(datetime.combine(self.lunes, dt_time(9, 0)))
+        for n, (paciente, estado) in enumerate([(urgente, 'confirmada'), (normal, 'programada'), (normal, 'programada')]):
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, clinica=self.clinica, estado=estado,
+                fecha=inicio + timedelta(minutes=30 * n), motivo='Control de calendario',
+            )
+        self.client.force_login(self.doctor.usuario)
+
+    def test_resumen_mensual_por_estado_y_prioridad(self):
+        respuesta = self.client.get('/calendario/', {'mes': self.lunes.month, 'año': self.lunes.year})
+        resumen = respuesta.context['resumen_por_dia'][self.lunes.day]
+        self.assertEqual(resumen['total'], 3)
+        self.assertEqual(
+            [(fila['estado'], fila['total']) for fila in resumen['estados']],
+            [('programada', 2), ('confirmada', 1)],
+        )
+        self.assertEqual(
+            [(fila['prioridad'], fila['total']) for fila in resumen['prioridades']],
+            [(Patient.PRIORITY_URGENT, 1), (Patient.PRIORITY_LOW, 2)],
+        )
+
+    def test_citas_dia_paginadas(self):
+        params = {'fecha': self.lunes.isoformat(), 'por_pagina': 2}
+        primera = self.client.get('/calendario/api/citas-dia/', params).json()
+        self.assertEqual([cita['hora'] for cita in primera['citas']], ['09:00', '09:30'])
+        self.assertEqual((primera['pagina'], primera['total_paginas'], primera['total']), (1, 2, 3))
+        self.assertTrue(primera['tiene_siguiente'])
+
+        segunda = self.client.get('/calendario/api/citas-dia/', dict(params, pagina=2)).json()
+        self.assertEqual([cita['hora'] for cita in segunda['citas']], ['10:00'])
+        self.assertFalse(segunda['tiene_siguiente'])
+
+    def test_citas_dia_sin_fecha(self):
+        self.assertEqual(self.client.get('/calendario/api/citas-dia/').status_code, 400)
+
+
+class VistaRecursosTests(TestCase):
+    """Grilla doctor × franja en formato columnar"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('REC')
+        self.doctor = _crear_doctor('doctor_recursos')
+        self.colega = _crear_doctor('doctor_recursos_colega')
+        self.ajeno = _crear_doctor('doctor_recursos_ajeno')
+        Doctor.objects.filter(id__in=[self.doctor.id, self.colega.id]).update(clinica=self.clinica)
+        Doctor.objects.filter(id=self.colega.id).update(apellidos='Alonso', duracion_cita_default=20)
+        Doctor.objects.filter(id=self.ajeno.id).update(clinica=_crear_clinica('REA'))
+        self.lunes = _lunes_siguiente()
+        paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='REC-1')
+        inicio = timezone.make_aware(datetime.combine(self.lunes, dt_time(9, 0)))
+        for doctor, fecha in [(self.doctor, inicio), (self.colega, inicio + timedelta(days=1, minutes=90))]:
+            Appointment.objects.create(
+                paciente=paciente, doctor=doctor, clinica=self.clinica, fecha=fecha, motivo='Revisión de la grilla',
+            )
+        self.client.force_login(self.doctor.usuario)
+
+    def _recursos(self, **params):
+        params.setdefault('fecha_inicio', self.lunes.isoformat())
+        return self.client.get('/calendario/api/recursos/', params)
+
+    def test_columnas_de_la_clinica(self):
+        datos = self._recursos(fecha_fin=(self.lunes + timedelta(days=1)).isoformat()).json()
+        self.assertEqual(datos['doctores']['ids'], [self.colega.id, self.doctor.id])
+        self.assertEqual(datos['doctores']['duraciones'], [20, 30])
+        self.assertEqual(datos['paso'], 20)
+        citas = datos['citas']
+        self.assertEqual(citas['dias'], [0, 1])
+        self.assertEqual(citas['minutos'], [540, 630])
+        self.assertEqual(citas['doctores'], [1, 0])
+        # El paciente repetido se envía una sola vez
+        self.assertEqual(datos['pacientes'], ['Luis Gómez'])
+        self.assertEqual(citas['pacientes'], [0, 0])
+        self.assertEqual([datos['estados'][i] for i in citas['estados']], ['programada', 'programada'])
+
+    def test_filtro_por_doctor_y_paso(self):
+        datos = self._recursos(doctor_ids=str(self.doctor.id), paso='15').json()
+        self.assertEqual(datos['doctores']['ids'], [self.doctor.id])
+        self.assertEqual(datos['paso'], 15)
+        self.assertEqual(datos['citas']['ids'], list(
+            Appointment.objects.filter(doctor=self.doctor).values_list('id', flat=True)
+        ))
+
+    def test_sin_clinica_no_ve_otras_agendas(self):
+        self.client.force_login(User.objects.create_user('usuario_recursos', password='x'))
+        self.assertEqual(self._recursos().status_code, 403)
+        # Un doctor no puede pedir otra clínica
+        self.client.force_login(self.doctor.usuario)
+        otra_clinica = Doctor.objects.get(id=self.ajeno.id).clinica_id
+        self.assertEqual(self._recursos(clinica_id=otra_clinica).status_code, 403)
+
+    def test_rol_en_la_clinica_y_staff(self):
+        usuario = User.objects.create_user('recepcion_recursos', password='x')
+        UsuarioClinica.objects.create(usuario=usuario, clinica=self.clinica, rol='recepcionista')
+        self.client.force_login(usuario)
+        self.assertEqual(self._recursos().json()['doctores']['ids'], [self.colega.id, self.doctor.id])
+        self.client.force_login(User.objects.create_user('staff_recursos', password='x', is_staff=True))
+        datos = self._recursos().json()
+        self.assertEqual(set(datos['doctores']['ids']), {self.doctor.id, self.colega.id, self.ajeno.id})
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self._recursos(fecha_inicio='').status_code, 400)
+        self.assertEqual(self._recursos(fecha_fin=(self.lunes - timedelta(days=1)).isoformat()).status_code, 400)
+        self.assertEqual(self._recursos(paso='1').status_code, 400)
+
+
+class SeriesCitasTests(TestCase):
+    """Series recurrentes: expansión, alta conjunta y cambios desde una cita"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('SER')
+        self.doctor = _crear_doctor('doctor_series')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='SER-1')
+        self.inicio = timezone.make_aware(datetime.combine(_lunes_siguiente(), dt_time(9, 0)))
+
+    def _crear(self, **opciones):
+        return crear_serie(
+            self.paciente, self.doctor, 'Control semanal de tensión', frecuencia='semanal', intervalo=1,
+            fecha_inicio=self.inicio, ocurrencias=4, **opciones,
+        )
+
+    def test_mensual_pasa_al_ultimo_dia_del_mes(self):
+        inicio = timezone.make_aware(datetime(2031, 1, 31, 9, 0))
+        fechas = expandir_recurrencia(inicio, 'mensual', 1, 3)
+        self.assertEqual([fecha.date() for fecha in fechas], [
+            datetime(2031, 1, 31).date(), datetime(2031, 2, 28).date(), datetime(2031, 3, 31).date(),
+        ])
+
+    def test_conflicto_cancela_la_serie_salvo_que_se_omita(self):
+        ocupada = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica,
+            fecha=self.inicio + timedelta(weeks=2), motivo='Cita ya reservada',
+        )
+        serie, citas, errores = self._crear()
+        self.assertIsNone(serie)
+        self.assertEqual(list(errores), [ocupada.fecha])
+        self.assertEqual(Appointment.objects.count(), 1)
+
+        serie, citas, errores = self._crear(omitir_conflictos=True)
+        self.assertEqual(serie.ocurrencias, 3)
+        self.assertEqual(
+            sorted(cita.fecha for cita in citas),
+            [self.inicio, self.inicio + timedelta(weeks=1), self.inicio + timedelta(weeks=3)],
+        )
+        self.assertTrue(all(cita.fecha_local for cita in Appointment.objects.filter(serie=serie)))
+
+    def test_cancelar_desde_una_cita(self):
+        serie, citas, _ = self._crear()
+        citas = sorted(citas, key=lambda cita: cita.fecha)
+        aplicado, total, _ = modificar_desde(citas[1], 'cancelar')
+        self.assertTrue(aplicado)
+        self.assertEqual(total, 3)
+        self.assertEqual(
+            list(serie.citas.order_by('fecha').values_list('estado', flat=True)),
+            ['programada', 'cancelada', 'cancelada', 'cancelada'],
+        )
+
+    def test_editar_hora_desde_una_cita(self):
+        serie, citas, _ = self._crear()
+        citas = sorted(citas, key=lambda cita: cita.fecha)
+        aplicado, total, _ = modificar_desde(citas[2], 'editar', {'nueva_hora': '11:30'})
+        self.assertTrue(aplicado)
+        self.assertEqual(total, 2)
+        fechas = serie.citas.order_by('fecha').values_list('fecha', flat=True)
+        horas = [timezone.localtime(fecha).strftime('%H:%M') for fecha in fechas]
+        self.assertEqual(horas, ['09:00', '09:00', '11:30', '11:30'])
+
+    def test_editar_a_un_horario_ocupado_no_aplica_nada(self):
+        serie, citas, _ = self._crear()
+        citas = sorted(citas, key=lambda cita: cita.fecha)
+        Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica,
+            fecha=citas[3].fecha + timedelta(hours=1), motivo='Cita ya reservada',
+        )
+        aplicado, _, errores = modificar_desde(citas[0], 'editar', {'nueva_hora': '10:00'})
+        self.assertFalse(aplicado)
+        self.assertEqual(list(errores), [citas[3].fecha + timedelta(hours=1)])
+        self.assertEqual(
+            sorted(serie.citas.values_list('fecha', flat=True)), [cita.fecha for cita in citas],
+        )
+
+
+class PaginacionKeysetTests(TestCase):
+    """Listado REST de citas paginado por cursor sobre (fecha, id)"""
+
+    URL = '/api/v1/appointments/api/citas/'
+
+    def setUp(self):
+        self.clinica = _crear_clinica('KEY')
+        self.doctor = _crear_doctor('doctor_keyset')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='KEY-1')
+        inicio = timezone.make_aware(datetime.combine(_lunes_siguiente(), dt_time(9, 0)))
+        self.citas = [
+            Appointment.objects.create(
+                paciente=self.paciente, doctor=self.doctor, clinica=self.clinica,
+                fecha=inicio + timedelta(minutes=30 * n), motivo='Listado paginado',
+            )
+            for n in range(5)
+        ]
+        self.client.force_login(User.objects.create_user('staff_keyset', password='x', is_staff=True))
+
+    def test_recorre_todas_las_paginas_sin_offset(self):
+        vistos = []
+        url = self.URL + '?page_size=2'
+        paginas = 0
+        while url:
+            with CaptureQueriesContext(connection) as consultas:
+                datos = self.client.get(url).json()
+            self.assertFalse(any('OFFSET' in consulta['sql'] for consulta in consultas.captured_queries))
+            vistos += [cita['id'] for cita in datos['results']]
+            url = datos['next']
+            paginas += 1
+        self.assertEqual(paginas, 3)
+        self.assertEqual(vistos, [cita.id for cita in self.citas])
+
+    def test_filtros_indexados(self):
+        Appointment.objects.filter(id=self.citas[1].id).update(estado='confirmada')
+        datos = self.client.get(self.URL, {'estado': 'confirmada', 'doctor': self.doctor.id}).json()
+        self.assertEqual([cita['id'] for cita in datos['results']], [self.citas[1].id])
+        vacio = self.client.get(self.URL, {'desde': (_lunes_siguiente() + timedelta(days=1)).isoformat()}).json()
+        self.assertEqual(vacio['results'], [])
+
+    def test_parametros_invalidos(self):
+        self.assertEqual(self.client.get(self.URL, {'estado': 'inexistente'}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {'desde': '2031-13-01'}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {'cursor': 'no-es-un-cursor'}).status_code, 404)
+
+
+class ListadoValuesTests(TestCase):
+    """Listado REST leído con values(): misma salida que el serializer, fields y expand"""
+
+    URL = '/api/v1/appointments/api/citas/'
+
+    def setUp(self):
+        self.clinica = _crear_clinica('VAL')
+        self.doctor = _crear_doctor('doctor_values')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='VAL-1')
+        self.cita = Appointment.objects.create(
+            paciente=self.paciente, doctor=self.doctor, clinica=self.clinica,
+            fecha=_proxima_hora(), motivo='Listado con values',
+        )
+        self.client.force_login(User.objects.create_user('staff_values', password='x', is_staff=True))
+
+    def test_misma_salida_que_el_serializer(self):
+        fila = self.client.get(self.URL).json()['results'][0]
+        self.cita.refresh_from_db()
+        esperado = json.loads(JSONRenderer().render(AppointmentSerializaer(self.cita).data))
+        self.assertEqual(fila, esperado)
+
+    def test_fields_y_expand(self):
+        fila = self.client.get(self.URL, {'fields': 'id,estado', 'expand': 'paciente'}).json()['results'][0]
+        self.assertEqual(fila, {
+            'id': self.cita.id,
+            'estado': 'programada',
+            'paciente': {
+                'id': self.paciente.id, 'nombre': 'Luis', 'apellidos': 'Gómez', 'dni': 'VAL-1',
+                'prioridad': self.paciente.prioridad,
+            },
+        })
+
+    def test_campos_desconocidos(self):
+        self.assertEqual(self.client.get(self.URL, {'fields': 'id,inexistente'}).status_code, 400)
+        self.assertEqual(self.client.get(self.URL, {'expand': 'motivo'}).status_code, 400)
+
+
+class CargaMasivaCitasTests(TestCase):
+    """Altas y modificaciones de citas en lote, atómicas o parciales"""
+
+    URL = '/api/v1/appointments/api/citas/bulk/'
+
+    def setUp(self):
+        self.clinica = _crear_clinica('BLK')
+        self.doctor = _crear_doctor('doctor_lote')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='BLK-1')
+        self.inicio = timezone.make_aware(datetime.combine(_lunes_siguiente(), dt_time(9, 0)))
+        self.client.force_login(self.doctor.usuario)
+
+    def _item(self, minutos, **campos):
+        fecha = timezone.localtime(self.inicio + timedelta(minutes=minutos))
+        return dict({
+            'paciente': self.paciente.id, 'fecha': fecha.strftime('%Y-%m-%d %H:%M'),
+            'motivo': 'Carga de la agenda del día',
+        }, **campos)
+
+    def _enviar(self, items, modo=None, metodo='post'):
+        cuerpo = {'items': items}
+        if modo:
+            cuerpo['modo'] = modo
+        return getattr(self.client, metodo)(self.URL, json.dumps(cuerpo), content_type='application/json')
+
+    def test_atomico_no_escribe_si_el_lote_se_solapa(self):
+        respuesta = self._enviar([self._item(0), self._item(10), self._item(60)])
+        self.assertEqual(respuesta.status_code, 400)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual(['errores' in resultado for resultado in resultados], [False, True, False])
+        self.assertFalse(Appointment.objects.exists())
+
+    def test_parcial_escribe_los_validos(self):
+        respuesta = self._enviar([self._item(0), self._item(10), self._item(60, paciente=999999)], modo='parcial')
+        self.assertEqual(respuesta.status_code, 207)
+        datos = respuesta.json()
+        self.assertEqual((datos['aplicados'], datos['fallidos']), (1, 2))
+        self.assertIn('paciente', datos['resultados'][2]['errores'])
+        cita = Appointment.objects.get()
+        self.assertEqual(
+            (cita.id, cita.fecha, cita.clinica_id), (datos['resultados'][0]['id'], self.inicio, self.clinica.id),
+        )
+        self.assertEqual(cita.fecha_local, self.inicio.date())
+
+    def test_consultas_independientes_del_tamaño_del_lote(self):
+        def consultas(n, desde):
+            with CaptureQueriesContext(connection) as capturadas:
+                self.assertEqual(self._enviar([self._item(desde + 30 * i) for i in range(n)]).status_code, 201)
+            return len(capturadas)
+        self.assertEqual(consultas(2, 0), consultas(6, 120))
+
+    def test_modificacion_en_lote(self):
+        self._enviar([self._item(0), self._item(60)])
+        primera, segunda = Appointment.objects.order_by('fecha')
+        respuesta = self._enviar([
+            {'id': primera.id, 'fecha': self._item(180)['fecha']},
+            {'id': segunda.id, 'motivo': 'Motivo corregido en lote'},
+        ], metodo='patch')
+        self.assertEqual(respuesta.status_code, 200)
+        primera.refresh_from_db()
+        segunda.refresh_from_db()
+        self.assertEqual(primera.fecha, self.inicio + timedelta(minutes=180))
+        self.assertEqual(primera.version, 2)
+        self.assertEqual(segunda.motivo, 'Motivo corregido en lote')
+
+
+class ContadorFrecuentesTests(SimpleTestCase):
+    """Términos del motivo y contador top-k de memoria acotada"""
+
+    def test_terminos_normalizados_con_pares(self):
+        self.assertEqual(
+            terminos_motivo('Dolor de CABEZA y náuseas'),
+            {'dolor', 'cabeza', 'nauseas', 'dolor cabeza', 'cabeza nauseas'},
+        )
+
+    def test_frecuentes_con_capacidad_fija(self):
+        contador = ContadorFrecuentes(capacidad=2)
+        for elemento in 'aabacadaea':
+            contador.agregar(elemento)
+        self.assertLessEqual(len(contador.contadores), 2)
+        # 'a' supera total / (capacidad + 1) y conserva su contador
+        (elemento, conteo), = contador.mas_comunes(1)
+        self.assertEqual(elemento, 'a')
+        self.assertGreaterEqual(conteo, 6 - contador.error_maximo)
+
+    def test_franja_de_edad_en_la_fecha_de_la_cita(self):
+        nacimiento = datetime(2000, 6, 15).date()
+        self.assertEqual(franja_edad(nacimiento, datetime(2018, 6, 14).date()), '0-17')
+        self.assertEqual(franja_edad(nacimiento, datetime(2018, 6, 15).date()), '18-29')
+        self.assertEqual(franja_edad(None, datetime(2018, 6, 15).date()), 'Desconocida')
+
+
+class ReporteCitasTests(TestCase):
+    """Reporte de citas en una pasada con lotes por cursor"""
+
+    def setUp(self):
+        self.clinica = _crear_clinica('REP')
+        self.doctor = _crear_doctor('doctor_reportes')
+        self.doctor.clinica = self.clinica
+        self.doctor.save(update_fields=['clinica'])
+        self.lunes = _lunes_siguiente()
+        joven = Patient.objects.create(
+            nombre='Eva', apellidos='Ruiz', dni='REP-1', prioridad=Patient.PRIORITY_URGENT,
+            fecha_nacimiento=self.lunes - timedelta(days=365 * 20),
+        )
+        sin_fecha = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='REP-2')
+        inicio = timezone.make_aware(datetime.combine(self.lunes, dt_time(9, 0)))
+        for n, (paciente, motivo) in enumerate([
+            (joven, 'Dolor de cabeza persistente'),
+            (sin_fecha, 'Dolor de cabeza'),
+            (sin_fecha, 'Control de tensión'),
+        ]):
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, clinica=self.clinica, motivo=motivo,
+                fecha=inicio + timedelta(days=n // 2, minutes=30 * n),
+            )
+
+    def test_recorre_en_lotes_por_cursor(self):
+        citas = Appointment.objects.filter(doctor=self.doctor)
+        # Lotes de 2: una página llena y otra con la fila restante
+        with self.assertNumQueries(2):
+            filas = list(recorrer(citas, ('motivo',), lote=2))
+        ids = citas.order_by('fecha_local', 'id').values_list('id', flat=True)
+        self.assertEqual([fila[1] for fila in filas], list(ids))
+
+    def test_reporte_en_una_pasada(self):
+        reporte = generar_reporte(
+            Appointment.objects.filter(doctor=self.doctor), self.lunes, self.lunes + timedelta(days=6),
+        )
+        self.assertEqual(reporte['total_appointments'], 3)
+        self.assertEqual(reporte['appointments_by_day'], {self.lunes: 2, self.lunes + timedelta(days=1): 1})
+        self.assertEqual(reporte['appointments_by_priority'], {'Urgente': 1, 'Baja': 2})
+        self.assertEqual(reporte['patient_demographics']['age_bands'], {'18-29': 1, 'Desconocida': 2})
+        # 'dolor' y 'cabeza' solo aparecen dentro del par con el mismo conteo
+        self.assertEqual(reporte['most_common_reasons'][0], {'term': 'dolor cabeza', 'count': 2})
+        terminos = [fila['term'] for fila in reporte['most_common_reasons']]
+        self.assertNotIn('dolor', terminos)
+        self.assertEqual(reporte['reasons_max_error'], 0)
@@ -9,6 +9,8 @@ from .views import (
     eliminar_cita, 
     check_appointment_availability
 )
+from .views_series import crear_serie_citas, modificar_serie_desde
+from .views_lista_espera import lista_espera, cancelar_entrada_lista_espera
 
 # API Router
 router = DefaultRouter()
@@ -21,6 +23,10 @@ urlpatterns = [
     path('editar/<int:cita_id>/', editar_cita, name='editar_cita'),
     path('eliminar/<int:cita_id>/', eliminar_cita, name='eliminar_cita'),
     path('check-availability/', check_appointment_availability, name='check_appointment_availability'),
+    path('series/crear/', crear_serie_citas, name='crear_serie_citas'),
+    path('series/desde/<int:cita_id>/', modificar_serie_desde, name='modificar_serie_desde'),
+    path('lista-espera/', lista_espera, name='lista_espera'),
+    path('lista-espera/<int:entrada_id>/cancelar/', cancelar_entrada_lista_espera, name='cancelar_entrada_lista_espera'),
     
     # API endpoints
     path('api/', include(router.urls)),
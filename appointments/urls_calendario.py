@@ -1,5 +1,5 @@
 from django.urls import path
-from . import views_calendario
+from . import views_calendario, views_eventos
 
 app_name = 'calendario'
 
@@ -10,5 +10,14 @@ urlpatterns = [
     # APIs para el calendario
     path('api/citas-dia/', views_calendario.obtener_citas_dia, name='api_citas_dia'),
     path('api/reagendar/', views_calendario.reagendar_cita, name='api_reagendar'),
+    path('api/reagendar-lote/', views_calendario.reagendar_citas_lote, name='api_reagendar_lote'),
     path('api/horarios-disponibles/', views_calendario.horarios_disponibles, name='api_horarios_disponibles'),
+    path('api/primer-horario/', views_calendario.primer_horario_disponible, name='api_primer_horario'),
+    path('api/recursos/', views_calendario.vista_recursos, name='api_recursos'),
+    path('api/eventos/', views_eventos.eventos_citas, name='api_eventos'),
+    
+    # Feeds iCalendar
+    path('api/ics/enlaces/', views_calendario.enlaces_ics, name='api_ics_enlaces'),
+    path('ics/doctor/<int:doctor_id>.ics', views_calendario.feed_ics_doctor, name='ics_doctor'),
+    path('ics/clinica/<int:clinica_id>.ics', views_calendario.feed_ics_clinica, name='ics_clinica'),
 ]
@@ -0,0 +1,52 @@
+"""
+Control de concurrencia optimista de las citas.
+
+Appointment.version se incrementa en cada escritura (save(), bulk_update y
+update() deben sumarla). Las ediciones que parten de una versión que el
+cliente leyó antes (formulario de edición, reagendar desde el calendario)
+se guardan con save(version_esperada=v, update_fields=[...]): el UPDATE
+lleva `WHERE id = ? AND version = ?` y solo los campos modificados. Si otro
+usuario guardó antes no se actualiza ninguna fila y se lanza
+CitaModificada, sin haber bloqueado nada mientras el usuario editaba.
+"""
+from django.utils import timezone
+
+from .local_time import zona_clinica
+
+MENSAJE_CITA_MODIFICADA = (
+    'Otro usuario modificó esta cita mientras la editaba. '
+    'Revise los datos actuales y vuelva a intentarlo.'
+)
+
+
+class CitaModificada(Exception):
+    """La versión de la cita ya no es la que leyó el cliente (o la cita se eliminó)"""
+
+    def __init__(self, cita_id):
+        self.cita_id = cita_id
+        super().__init__(MENSAJE_CITA_MODIFICADA)
+
+
+def leer_version(valor):
+    """Versión enviada por el cliente, o None si falta o no es válida"""
+    try:
+        version = int(valor)
+    except (TypeError, ValueError):
+        return None
+    return version if version > 0 else None
+
+
+def estado_actual(cita_id):
+    """Estado guardado de la cita para la respuesta 409 (None si ya no existe)"""
+    from .models import Appointment
+
+    cita = Appointment.objects.filter(id=cita_id).values(
+        'id', 'version', 'fecha', 'estado', 'doctor_id', 'paciente_id', 'motivo', 'observaciones', 'clinica_id',
+    ).first()
+    if cita is None:
+        return None
+    # Fecha y hora que muestra el calendario: las de la clínica de la cita
+    local = timezone.localtime(cita.pop('fecha'), zona_clinica(cita.pop('clinica_id')))
+    cita.update({'fecha': local.strftime('%Y-%m-%d'), 'hora': local.strftime('%H:%M')})
+    cita['observaciones'] = cita['observaciones'] or ''
+    return cita
@@ -3,19 +3,38 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.http import JsonResponse
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from datetime import timedelta
+import uuid
 from .forms import AppointmentForm
+from .idempotency import idempotente
+from .local_time import en_zona_del_doctor
 from .models import Appointment
 from .serializers import AppointmentSerializaer
-from doctors.models import Doctor
-from doctors.utils import get_appointment_conflicts, suggest_optimal_appointment_time
-from rest_framework import viewsets
+from .bulk_write import actualizar_citas_lote, crear_citas_lote
+from .slots import MENSAJE_HORA_NO_ALINEADA, HorarioOcupado, alineada
+from .versioning import CitaModificada, leer_version
+from clinicas.middleware import doctor_requerido
+from doctors.utils import (
+    get_appointment_conflicts,
+    suggest_appointment_times_range,
+    suggest_optimal_appointment_time,
+)
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException
+from rest_framework.permissions import IsAuthenticated
+from core.bulk import leer_lote, respuesta_lote
+from core.filters import ListadoFiltradoMixin, entero, fecha, opcion
+from core.values_serializers import ValuesListMixin
+from patients.models import Patient
 
 @login_required
+@en_zona_del_doctor
+@idempotente
 def crear_cita(request):
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
 
@@ -31,9 +50,12 @@ def crear_cita(request):
                     request, 
                     f'¡Cita creada exitosamente! '
                     f'Paciente: {cita.paciente.nombre} {cita.paciente.apellidos} - '
-                    f'Fecha: {cita.fecha.strftime("%d/%m/%Y a las %H:%M")}'
+                    f'Fecha: {timezone.localtime(cita.fecha).strftime("%d/%m/%Y a las %H:%M")}'
                 )
                 return redirect('doctor_dashboard')
+            except HorarioOcupado as e:
+                form.add_error('fecha', str(e))
+                messages.error(request, 'Por favor corrija los errores en el formulario.')
             except Exception as e:
                 messages.error(request, f'Error al guardar la cita: {str(e)}')
         else:
@@ -42,28 +64,31 @@ def crear_cita(request):
         form = AppointmentForm(doctor=doctor)
     
     # Get suggested times for today and tomorrow
-    today = timezone.now().date()
+    today = timezone.localdate()
     tomorrow = today + timedelta(days=1)
     
-    suggested_times_today = suggest_optimal_appointment_time(doctor, today)
-    suggested_times_tomorrow = suggest_optimal_appointment_time(doctor, tomorrow)
+    # Una sola consulta de disponibilidad para ambos días
+    suggested_times = suggest_appointment_times_range(doctor, today, tomorrow, limit=3)
     
     context = {
         'form': form,
         'doctor': doctor,
-        'suggested_times_today': suggested_times_today[:3],  # First 3 suggestions
-        'suggested_times_tomorrow': suggested_times_tomorrow[:3],
+        'suggested_times_today': suggested_times[today],  # First 3 suggestions
+        'suggested_times_tomorrow': suggested_times[tomorrow],
         'today': today,
         'tomorrow': tomorrow,
+        # Nueva en cada render: un doble envío del mismo formulario crea una sola cita
+        'idempotency_key': uuid.uuid4().hex,
     }
     
     return render(request, 'crear_cita.html', context)
 
 @login_required
+@en_zona_del_doctor
 def check_appointment_availability(request):
     """AJAX endpoint to check appointment availability"""
     if request.method == 'GET':
-        doctor = get_object_or_404(Doctor, usuario=request.user)
+        doctor = doctor_requerido(request)
         fecha_str = request.GET.get('fecha')
         
         if not fecha_str:
@@ -72,17 +97,20 @@ def check_appointment_availability(request):
         try:
             fecha = timezone.datetime.fromisoformat(fecha_str.replace('Z', '+00:00'))
             
-            # Check for conflicts
-            start_time = fecha - timedelta(minutes=15)
-            end_time = fecha + timedelta(minutes=15)
+            if timezone.is_naive(fecha):
+                fecha = timezone.make_aware(fecha)
+            
+            if not alineada(fecha):
+                return JsonResponse({'available': False, 'message': MENSAJE_HORA_NO_ALINEADA})
             
-            conflicts = get_appointment_conflicts(doctor, start_time, end_time)
+            # Check for conflicts
+            conflicts = get_appointment_conflicts(doctor, fecha)
             
             if conflicts:
                 return JsonResponse({
                     'available': False,
                     'message': 'Ya existe una cita programada cerca de esta hora.',
-                    'suggestions': suggest_optimal_appointment_time(doctor, fecha.date())[:3]
+                    'suggestions': suggest_optimal_appointment_time(doctor, timezone.localtime(fecha).date(), limit=3)
                 })
             else:
                 return JsonResponse({
@@ -96,22 +124,44 @@ def check_appointment_availability(request):
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
 @login_required
+@en_zona_del_doctor
 def editar_cita(request, cita_id):
     """Edit an existing appointment"""
-    doctor = get_object_or_404(Doctor, usuario=request.user)
+    doctor = doctor_requerido(request)
     cita = get_object_or_404(Appointment, id=cita_id, doctor=doctor)
     
+    # Versión que el usuario tenía al abrir el formulario (concurrencia optimista)
+    version = cita.version
     if request.method == "POST":
+        version = leer_version(request.POST.get('version')) or cita.version
         form = AppointmentForm(request.POST, instance=cita, doctor=doctor)
         if form.is_valid():
             try:
-                cita_actualizada = form.save()
+                cita_actualizada = form.save(commit=False)
+                if form.has_changed():
+                    # UPDATE condicionado a la versión y solo con los campos modificados
+                    cita_actualizada.save(update_fields=form.changed_data, version_esperada=version)
                 messages.success(
                     request, 
                     f'¡Cita actualizada exitosamente! '
                     f'Paciente: {cita_actualizada.paciente.nombre} {cita_actualizada.paciente.apellidos}'
                 )
                 return redirect('doctor_dashboard')
+            except CitaModificada as e:
+                # Se muestra el estado actual para que el usuario vuelva a aplicar sus cambios
+                messages.warning(request, str(e))
+                cita = get_object_or_404(Appointment, id=cita_id, doctor=doctor)
+                context = {
+                    'form': AppointmentForm(instance=cita, doctor=doctor),
+                    'cita': cita,
+                    'doctor': doctor,
+                    'editing': True,
+                    'version': cita.version,
+                }
+                return render(request, 'crear_cita.html', context, status=409)
+            except HorarioOcupado as e:
+                form.add_error('fecha', str(e))
+                messages.error(request, 'Por favor corrija los errores en el formulario.')
             except Exception as e:
                 messages.error(request, f'Error al actualizar la cita: {str(e)}')
         else:
@@ -124,19 +174,21 @@ def editar_cita(request, cita_id):
         'cita': cita,
         'doctor': doctor,
         'editing': True,
+        'version': version,
     }
     
     return render(request, 'crear_cita.html', context)
 
 @login_required
+@en_zona_del_doctor
 def eliminar_cita(request, cita_id):
     """Delete an appointment"""
-    doctor = get_object_or_404(Doctor, usuario=request.user)
+    doctor = doctor_requerido(request)
     cita = get_object_or_404(Appointment, id=cita_id, doctor=doctor)
     
     if request.method == "POST":
         paciente_nombre = f"{cita.paciente.nombre} {cita.paciente.apellidos}"
-        fecha_cita = cita.fecha.strftime("%d/%m/%Y a las %H:%M")
+        fecha_cita = timezone.localtime(cita.fecha).strftime("%d/%m/%Y a las %H:%M")
         
         cita.delete()
         messages.success(
@@ -152,6 +204,51 @@ def eliminar_cita(request, cita_id):
     
     return render(request, 'confirmar_eliminar_cita.html', context)
 
-class AppointmentsViewSet(viewsets.ModelViewSet):
-    queryset = Appointment.objects.all().order_by('-id') # Define el conjunto de datos base
-    serializer_class = AppointmentSerializaer
\ No newline at end of file
+class HorarioNoDisponible(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'El horario ya está reservado por otra cita.'
+    default_code = 'horario_ocupado'
+
+
+@method_decorator(idempotente, name='dispatch')
+class AppointmentsViewSet(ListadoFiltradoMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Appointment.objects.all() # Define el conjunto de datos base
+    serializer_class = AppointmentSerializaer
+    # Cubierto por los índices (doctor, fecha), (clinica, fecha) y (estado, fecha)
+    keyset_ordering = ('fecha', 'id')
+    filtros = {
+        'doctor': ('doctor_id', entero),
+        'clinica': ('clinica_id', entero),
+        'estado': ('estado', opcion(Appointment.ESTADOS)),
+        'desde': ('fecha_local__gte', fecha),
+        'hasta': ('fecha_local__lte', fecha),
+        'prioridad': ('paciente__prioridad', opcion(Patient.PRIORITY_CHOICES)),
+    }
+    campos_expandibles = {
+        'paciente': ('nombre', 'apellidos', 'dni', 'prioridad'),
+        'doctor': ('nombre', 'apellidos', 'especialidad'),
+        'clinica': ('nombre', 'codigo'),
+    }
+
+    def perform_create(self, serializer):
+        try:
+            serializer.save()
+        except HorarioOcupado as e:
+            raise HorarioNoDisponible(str(e))
+
+    def perform_update(self, serializer):
+        try:
+            serializer.save()
+        except HorarioOcupado as e:
+            raise HorarioNoDisponible(str(e))
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk', permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """
+        Alta (POST) o modificación (PATCH) de varias citas en una petición:
+        {"items": [...], "modo": "atomico" | "parcial"}
+        """
+        items, modo = leer_lote(request.data)
+        if request.method == 'POST':
+            return respuesta_lote(crear_citas_lote(items, request.user, modo), modo, status.HTTP_201_CREATED)
+        return respuesta_lote(actualizar_citas_lote(items, request.user, modo), modo)
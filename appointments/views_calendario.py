@@ -1,48 +1,76 @@
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_GET
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
 from django.contrib.auth.decorators import login_required
+from django.core.paginator import Paginator
+from django.db.models import Count
 from django.utils import timezone
 from datetime import datetime, timedelta
 import json
 import calendar
 
 from .models import Appointment
+from .availability import slots_disponibles
+from .bulk_reschedule import (
+    ReagendamientoError,
+    movimientos_desde_lista,
+    movimientos_desde_regla,
+    reagendar_en_lote,
+)
+from .conflicts import conflict_index
+from .local_time import hoy_local, rango_mes, zona_clinica
+from .ics import (
+    TOKEN_DIAS_VALIDEZ,
+    citas_feed,
+    crear_sync_token,
+    estado_feed,
+    filtrar_desde_token,
+    generar_ics,
+    leer_sync_token,
+    token_feed,
+    verificar_token_feed,
+)
+from .resource_view import MAX_DIAS_RECURSOS, construir_vista_recursos
+from .slot_search import buscar_primeros_horarios
+from .slots import MENSAJE_HORA_NO_ALINEADA, HorarioOcupado, alineada
+from .versioning import CitaModificada, estado_actual, leer_version
+from clinicas.models import Clinica
 from doctors.models import Doctor
 from patients.models import Patient
 
+# Máximo de días que se pueden consultar en una sola llamada de disponibilidad
+MAX_DIAS_DISPONIBILIDAD = 62
+
+# Paginación del detalle de un día
+CITAS_POR_PAGINA = 50
+MAX_CITAS_POR_PAGINA = 200
+
 @login_required
 def vista_calendario(request):
     """
-    Vista principal del calendario interactivo
+    Vista principal del calendario interactivo.
+    Cada día muestra solo conteos por estado y prioridad; el detalle se carga
+    con `obtener_citas_dia` al abrir el día.
     """
-    # Obtener el mes y año actual o los especificados
-    hoy = timezone.now().date()
+    # Obtener el doctor actual (asumiendo que está logueado)
+    doctor = request.doctor
+    clinica = doctor.clinica if doctor else None
+    
+    # Obtener el mes y año actual (en la zona de la clínica) o los especificados
+    hoy = hoy_local(clinica.id if clinica else None)
     mes = int(request.GET.get('mes', hoy.month))
     año = int(request.GET.get('año', hoy.year))
     
-    # Obtener el doctor actual (asumiendo que está logueado)
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-        clinica = doctor.clinica
-    except Doctor.DoesNotExist:
-        doctor = None
-        clinica = None
-    
     # Generar datos del calendario
     cal = calendar.monthcalendar(año, mes)
     
-    # Obtener citas del mes
-    primer_dia = datetime(año, mes, 1).date()
-    if mes == 12:
-        ultimo_dia = datetime(año + 1, 1, 1).date() - timedelta(days=1)
-    else:
-        ultimo_dia = datetime(año, mes + 1, 1).date() - timedelta(days=1)
-    
-    citas_query = Appointment.objects.filter(
-        fecha__date__gte=primer_dia,
-        fecha__date__lte=ultimo_dia
-    )
+    # Rango del mes sobre la fecha local indexada: los días se agrupan en la
+    # zona horaria de la clínica y no en UTC
+    citas_query = Appointment.objects.filter(fecha_local__range=rango_mes(datetime(año, mes, 1).date()))
     
     # Filtrar por clínica si existe
     if clinica:
@@ -53,22 +81,30 @@ def vista_calendario(request):
     if doctor_id:
         citas_query = citas_query.filter(doctor_id=doctor_id)
     
-    citas = citas_query.select_related('paciente', 'doctor').order_by('fecha')
+    # Una sola consulta agrupada: día × estado × prioridad
+    conteos = citas_query.values(
+        'fecha_local', 'estado', 'paciente__prioridad'
+    ).annotate(total=Count('id')).order_by()
     
-    # Organizar citas por día
-    citas_por_dia = {}
-    for cita in citas:
-        dia = cita.fecha.date().day
-        if dia not in citas_por_dia:
-            citas_por_dia[dia] = []
-        citas_por_dia[dia].append({
-            'id': cita.id,
-            'paciente': str(cita.paciente),
-            'doctor': str(cita.doctor),
-            'hora': cita.fecha.strftime('%H:%M'),
-            'motivo': cita.motivo[:50] + '...' if len(cita.motivo) > 50 else cita.motivo,
-            'estado': cita.estado,
-        })
+    resumen_por_dia = {}
+    for fila in conteos:
+        resumen = resumen_por_dia.setdefault(fila['fecha_local'].day, {'total': 0, 'estados': {}, 'prioridades': {}})
+        resumen['total'] += fila['total']
+        estados = resumen['estados']
+        estados[fila['estado']] = estados.get(fila['estado'], 0) + fila['total']
+        prioridades = resumen['prioridades']
+        prioridades[fila['paciente__prioridad']] = prioridades.get(fila['paciente__prioridad'], 0) + fila['total']
+    
+    # Ordenar y etiquetar según las opciones de los modelos
+    for resumen in resumen_por_dia.values():
+        resumen['estados'] = [
+            {'estado': clave, 'nombre': nombre, 'total': resumen['estados'][clave]}
+            for clave, nombre in Appointment.ESTADOS if clave in resumen['estados']
+        ]
+        resumen['prioridades'] = [
+            {'prioridad': clave, 'nombre': nombre, 'total': resumen['prioridades'][clave]}
+            for clave, nombre in reversed(Patient.PRIORITY_CHOICES) if clave in resumen['prioridades']
+        ]
     
     # Obtener lista de doctores para el filtro
     doctores = Doctor.objects.filter(activo=True)
@@ -80,10 +116,13 @@ def vista_calendario(request):
         'mes': mes,
         'año': año,
         'mes_nombre': calendar.month_name[mes],
-        'citas_por_dia': citas_por_dia,
+        'resumen_por_dia': resumen_por_dia,
         'doctores': doctores,
         'doctor_seleccionado': doctor_id,
         'hoy': hoy,
+        # Para aplicar en el navegador los eventos del stream SSE
+        'clinica_id': clinica.id if clinica else None,
+        'estados_cita': dict(Appointment.ESTADOS),
     }
     
     return render(request, 'appointments/calendario.html', context)
@@ -91,7 +130,7 @@ def vista_calendario(request):
 @login_required
 def obtener_citas_dia(request):
     """
-    API para obtener citas de un día específico
+    API paginada con las citas de un día específico
     """
     fecha_str = request.GET.get('fecha')
     if not fecha_str:
@@ -99,39 +138,63 @@ def obtener_citas_dia(request):
     
     try:
         fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
+        pagina = int(request.GET.get('pagina', 1))
+        por_pagina = min(max(int(request.GET.get('por_pagina', CITAS_POR_PAGINA)), 1), MAX_CITAS_POR_PAGINA)
     except ValueError:
-        return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
     
     # Obtener doctor y clínica
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-        clinica = doctor.clinica
-    except Doctor.DoesNotExist:
-        doctor = None
-        clinica = None
+    doctor = request.doctor
+    clinica = doctor.clinica if doctor else None
     
-    # Obtener citas del día
-    citas_query = Appointment.objects.filter(fecha__date=fecha)
+    # Obtener citas del día (día local de la clínica, igual que la vista mensual)
+    citas_query = Appointment.objects.filter(fecha_local=fecha)
     
     if clinica:
         citas_query = citas_query.filter(clinica=clinica)
     
-    citas = citas_query.select_related('paciente', 'doctor').order_by('fecha')
+    doctor_id = request.GET.get('doctor_id')
+    if doctor_id:
+        citas_query = citas_query.filter(doctor_id=doctor_id)
+    
+    estado = request.GET.get('estado')
+    if estado:
+        citas_query = citas_query.filter(estado=estado)
+    
+    citas = citas_query.select_related('paciente', 'doctor').only(
+        'id', 'fecha', 'fecha_local', 'clinica_id', 'motivo', 'estado', 'observaciones', 'version',
+        'paciente__nombre', 'paciente__apellidos', 'paciente__dni', 'paciente__prioridad',
+        'doctor__nombre', 'doctor__apellidos', 'doctor__especialidad',
+    ).order_by('fecha', 'id')
+    
+    paginator = Paginator(citas, por_pagina)
+    page_obj = paginator.get_page(pagina)
     
     citas_data = []
-    for cita in citas:
+    for cita in page_obj:
+        # Misma zona que el filtro por fecha_local: la de la clínica de la cita
+        local = cita.fecha.astimezone(zona_clinica(cita.clinica_id))
         citas_data.append({
             'id': cita.id,
             'paciente': str(cita.paciente),
+            'prioridad': cita.paciente.prioridad,
+            'doctor_id': cita.doctor_id,
             'doctor': str(cita.doctor),
-            'fecha': cita.fecha.strftime('%Y-%m-%d'),
-            'hora': cita.fecha.strftime('%H:%M'),
+            'fecha': cita.fecha_local.isoformat(),
+            'hora': local.strftime('%H:%M'),
             'motivo': cita.motivo,
             'estado': cita.estado,
             'observaciones': cita.observaciones or '',
+            'version': cita.version,
         })
     
-    return JsonResponse({'citas': citas_data})
+    return JsonResponse({
+        'citas': citas_data,
+        'pagina': page_obj.number,
+        'total_paginas': paginator.num_pages,
+        'total': paginator.count,
+        'tiene_siguiente': page_obj.has_next(),
+    })
 
 @csrf_exempt
 @login_required
@@ -147,55 +210,103 @@ def reagendar_cita(request):
         cita_id = data.get('cita_id')
         nueva_fecha = data.get('nueva_fecha')
         nueva_hora = data.get('nueva_hora')
+        # Versión que mostraba el calendario; sin ella, la leída aquí
+        version = leer_version(data.get('version'))
         
         if not all([cita_id, nueva_fecha, nueva_hora]):
             return JsonResponse({'error': 'Datos incompletos'}, status=400)
         
         # Obtener la cita
-        cita = get_object_or_404(Appointment, id=cita_id)
+        cita = get_object_or_404(Appointment.objects.select_related('doctor'), id=cita_id)
         
         # Verificar permisos (solo el doctor de la cita o admin puede reagendar)
-        try:
-            doctor_usuario = Doctor.objects.get(usuario=request.user)
-            if cita.doctor != doctor_usuario and not request.user.is_staff:
+        doctor_usuario = request.doctor
+        if doctor_usuario is not None:
+            if cita.doctor_id != doctor_usuario.id and not request.user.is_staff:
                 return JsonResponse({'error': 'Sin permisos para reagendar esta cita'}, status=403)
-        except Doctor.DoesNotExist:
-            if not request.user.is_staff:
-                return JsonResponse({'error': 'Sin permisos'}, status=403)
+        elif not request.user.is_staff:
+            return JsonResponse({'error': 'Sin permisos'}, status=403)
         
-        # Crear nueva fecha y hora
+        # Crear nueva fecha y hora (las del calendario: zona de la clínica del doctor)
+        zona = zona_clinica(cita.doctor.clinica_id)
         nueva_datetime = datetime.strptime(f"{nueva_fecha} {nueva_hora}", '%Y-%m-%d %H:%M')
-        nueva_datetime = timezone.make_aware(nueva_datetime)
-        
-        # Verificar que no haya conflictos
-        conflictos = Appointment.objects.filter(
-            doctor=cita.doctor,
-            fecha=nueva_datetime
-        ).exclude(id=cita.id)
+        nueva_datetime = timezone.make_aware(nueva_datetime, zona)
+        if not alineada(nueva_datetime):
+            return JsonResponse({'error': MENSAJE_HORA_NO_ALINEADA}, status=400)
         
-        if conflictos.exists():
+        # Verificar que no haya conflictos (solapamiento según la duración de la cita)
+        if conflict_index.hay_conflicto(cita.doctor, nueva_datetime, exclude_id=cita.id):
             return JsonResponse({
                 'error': 'Ya existe una cita en ese horario',
                 'conflicto': True
             }, status=400)
         
-        # Actualizar la cita
+        # Actualizar solo la fecha, si nadie modificó la cita desde que se leyó
         fecha_anterior = cita.fecha
         cita.fecha = nueva_datetime
-        cita.save()
+        cita.save(update_fields=['fecha'], version_esperada=version or cita.version)
         
         return JsonResponse({
             'success': True,
             'mensaje': 'Cita reagendada exitosamente',
-            'fecha_anterior': fecha_anterior.strftime('%Y-%m-%d %H:%M'),
-            'fecha_nueva': nueva_datetime.strftime('%Y-%m-%d %H:%M')
+            'fecha_anterior': timezone.localtime(fecha_anterior, zona).strftime('%Y-%m-%d %H:%M'),
+            'fecha_nueva': nueva_datetime.strftime('%Y-%m-%d %H:%M'),
+            'version': cita.version,
         })
         
     except json.JSONDecodeError:
         return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except CitaModificada as e:
+        return JsonResponse({
+            'error': str(e),
+            'conflicto_version': True,
+            'cita': estado_actual(e.cita_id),
+        }, status=409)
+    except HorarioOcupado as e:
+        return JsonResponse({'error': str(e), 'conflicto': True}, status=409)
     except Exception as e:
         return JsonResponse({'error': str(e)}, status=500)
 
+@csrf_exempt
+@login_required
+def reagendar_citas_lote(request):
+    """
+    API para reagendar varias citas a la vez.
+    Acepta {"movimientos": [{"cita_id", "nueva_fecha", "nueva_hora", "doctor_id"?}, ...]}
+    o {"regla": {"doctor_id", "fecha", "doctor_destino_id"?, "fecha_destino"?, "hora_desde"?, "hora_hasta"?}}.
+    Se aplican todos los movimientos o ninguno.
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        if data.get('regla'):
+            movimientos = movimientos_desde_regla(data['regla'])
+        else:
+            movimientos = movimientos_desde_lista(data.get('movimientos') or [])
+        
+        if not movimientos:
+            return JsonResponse({'error': 'No hay citas para reagendar'}, status=400)
+        
+        aplicado, resultados = reagendar_en_lote(movimientos, request.user)
+        
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except ReagendamientoError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except HorarioOcupado as e:
+        return JsonResponse({'success': False, 'error': str(e), 'conflicto': True}, status=409)
+    
+    return JsonResponse({
+        'success': aplicado,
+        'mensaje': (
+            f'{len(resultados)} citas reagendadas exitosamente' if aplicado
+            else 'No se reagendó ninguna cita: corrija los errores indicados'
+        ),
+        'resultados': resultados,
+    }, status=200 if aplicado else 409)
+
 @login_required
 def horarios_disponibles(request):
     """
@@ -213,23 +324,220 @@ def horarios_disponibles(request):
     except ValueError:
         return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
     
-    # Obtener citas existentes del doctor en esa fecha
-    citas_existentes = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date=fecha
-    ).values_list('fecha__time', flat=True)
+    # Rango opcional: una sola consulta para todos los días
+    fecha_fin_str = request.GET.get('fecha_fin')
+    fecha_fin = fecha
+    if fecha_fin_str:
+        try:
+            fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date()
+        except ValueError:
+            return JsonResponse({'error': 'Formato de fecha inválido'}, status=400)
+        if fecha_fin < fecha or (fecha_fin - fecha).days > MAX_DIAS_DISPONIBILIDAD:
+            return JsonResponse({'error': 'Rango de fechas inválido'}, status=400)
+    
+    disponibilidad = slots_disponibles(doctor, fecha, fecha_fin)
+    zona = zona_clinica(doctor.clinica_id)
+    horarios_por_dia = {
+        dia.strftime('%Y-%m-%d'): [slot.astimezone(zona).strftime('%H:%M') for slot in slots]
+        for dia, slots in disponibilidad.items()
+    }
+    
+    if fecha_fin_str:
+        return JsonResponse({'dias': horarios_por_dia})
+    return JsonResponse({'horarios': horarios_por_dia[fecha.strftime('%Y-%m-%d')]})
+
+@login_required
+def primer_horario_disponible(request):
+    """
+    API para buscar los primeros horarios libres entre todos los doctores
+    de una especialidad y clínica
+    """
+    especialidad = request.GET.get('especialidad', '').strip()
+    clinica_id = request.GET.get('clinica_id')
+    
+    try:
+        fecha_str = request.GET.get('fecha_inicio')
+        fecha_inicio = datetime.strptime(fecha_str, '%Y-%m-%d').date() if fecha_str else None
+        dias = min(int(request.GET.get('dias', 14)), MAX_DIAS_DISPONIBILIDAD)
+        limite = min(int(request.GET.get('limite', 10)), 50)
+        duracion = int(request.GET['duracion']) if request.GET.get('duracion') else None
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+    
+    if dias < 1 or limite < 1 or (duracion is not None and not 5 <= duracion <= 480):
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+    
+    prioridad = request.GET.get('prioridad') or None
+    if prioridad and prioridad not in dict(Patient.PRIORITY_CHOICES):
+        return JsonResponse({'error': 'Prioridad inválida'}, status=400)
+    
+    # Por defecto se busca en la clínica del usuario; otra clínica solo si pertenece a ella
+    if clinica_id:
+        clinica = get_object_or_404(Clinica, id=clinica_id)
+        if not (request.user.is_staff or clinica.id in request.clinic_roles or
+                (request.doctor is not None and request.doctor.clinica_id == clinica.id)):
+            return JsonResponse({'error': 'No tiene permisos para ver esta clínica'}, status=403)
+    else:
+        clinica = request.clinica
+        if clinica is None and not request.user.is_staff:
+            return JsonResponse({'error': 'No tiene una clínica asignada'}, status=403)
+    
+    resultados = buscar_primeros_horarios(
+        especialidad=especialidad or None,
+        clinica=clinica,
+        fecha_inicio=fecha_inicio,
+        dias=dias,
+        duracion=duracion,
+        prioridad=prioridad,
+        limite=limite,
+        balancear=request.GET.get('balancear') in ('1', 'true'),
+    )
     
-    # Generar horarios disponibles (cada 30 minutos de 8:00 a 18:00)
-    horarios_disponibles = []
-    hora_inicio = datetime.strptime('08:00', '%H:%M').time()
-    hora_fin = datetime.strptime('18:00', '%H:%M').time()
+    return JsonResponse({'resultados': resultados, 'total': len(resultados)})
+
+@login_required
+def vista_recursos(request):
+    """
+    API de vista de recursos (una columna por doctor) para las grillas de
+    día/semana. Devuelve las citas del rango en formato columnar.
+    Parámetros: fecha_inicio, fecha_fin?, paso?, doctor_ids?, especialidad?
+    y clinica_id? (por defecto, la clínica del usuario).
+    """
+    try:
+        fecha_inicio = datetime.strptime(request.GET.get('fecha_inicio', ''), '%Y-%m-%d').date()
+        fecha_fin_str = request.GET.get('fecha_fin')
+        fecha_fin = datetime.strptime(fecha_fin_str, '%Y-%m-%d').date() if fecha_fin_str else fecha_inicio
+        paso = int(request.GET['paso']) if request.GET.get('paso') else None
+        doctor_ids = [int(i) for i in request.GET.get('doctor_ids', '').split(',') if i.strip()]
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
     
-    hora_actual = datetime.combine(fecha, hora_inicio)
-    hora_limite = datetime.combine(fecha, hora_fin)
+    if fecha_fin < fecha_inicio or (fecha_fin - fecha_inicio).days >= MAX_DIAS_RECURSOS:
+        return JsonResponse({'error': f'El rango debe ser de 1 a {MAX_DIAS_RECURSOS} días'}, status=400)
+    if paso is not None and not 5 <= paso <= 240:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
     
-    while hora_actual < hora_limite:
-        if hora_actual.time() not in citas_existentes:
-            horarios_disponibles.append(hora_actual.strftime('%H:%M'))
-        hora_actual += timedelta(minutes=30)
+    # Columnas: doctores activos de la clínica pedida (por defecto, la del usuario).
+    # El personal staff ve todas; el resto, solo las suyas
+    try:
+        clinica_id = int(request.GET['clinica_id']) if request.GET.get('clinica_id') else None
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+    if clinica_id is None and request.clinica is not None:
+        clinica_id = request.clinica.id
+    doctor = request.doctor
+    if not request.user.is_staff and (clinica_id is None or not (
+            clinica_id in request.clinic_roles or (doctor and doctor.clinica_id == clinica_id))):
+        return JsonResponse({'error': 'Sin permisos para ver esta clínica'}, status=403)
+    doctores = Doctor.objects.filter(activo=True).select_related('clinica')
+    if clinica_id is not None:
+        doctores = doctores.filter(clinica_id=clinica_id)
+    if doctor_ids:
+        doctores = doctores.filter(id__in=doctor_ids)
+    especialidad = request.GET.get('especialidad', '').strip()
+    if especialidad:
+        doctores = doctores.filter(especialidad__iexact=especialidad)
     
-    return JsonResponse({'horarios': horarios_disponibles})
+    datos = construir_vista_recursos(list(doctores.order_by('apellidos', 'nombre')), fecha_inicio, fecha_fin, paso)
+    return JsonResponse(datos)
+
+
+def _acceso_feed(request, tipo, objeto_id, clinica_id, usuario_id=None):
+    """Acceso por token firmado (clientes de calendario) o por sesión"""
+    if verificar_token_feed(request.GET.get('token'), tipo, objeto_id):
+        return True
+    user = request.user
+    if not user.is_authenticated:
+        return False
+    if user.is_staff or (usuario_id is not None and usuario_id == user.id):
+        return True
+    return clinica_id is not None and clinica_id in request.clinic_roles
+
+
+def _respuesta_feed(request, citas, eliminadas, nombre, archivo):
+    """
+    Feed completo con ETag/Last-Modified o, con `sync_token`, solo los cambios
+    desde el token anterior (un `sync_token` vacío devuelve el feed completo
+    junto con el primer token).
+    """
+    if 'sync_token' in request.GET:
+        token_anterior = request.GET.get('sync_token')
+        token = crear_sync_token(timezone.now())
+        if token_anterior:
+            desde = leer_sync_token(token_anterior)
+            if desde is None:
+                return JsonResponse({'error': 'sync_token inválido'}, status=400)
+            citas, eliminadas = filtrar_desde_token(citas, eliminadas, desde)
+        else:
+            eliminadas = None
+        response = StreamingHttpResponse(
+            generar_ics(citas, nombre, eliminadas, sync_token=token),
+            content_type='text/calendar; charset=utf-8',
+        )
+        response['X-Sync-Token'] = token
+    else:
+        etag, last_modified = estado_feed(citas, eliminadas)
+        etag = quote_etag(etag)
+        last_modified_ts = int(last_modified.timestamp()) if last_modified else None
+        no_modificado = get_conditional_response(request, etag=etag, last_modified=last_modified_ts)
+        if no_modificado is not None:
+            return no_modificado
+        response = StreamingHttpResponse(generar_ics(citas, nombre), content_type='text/calendar; charset=utf-8')
+        response['ETag'] = etag
+        if last_modified_ts:
+            response['Last-Modified'] = http_date(last_modified_ts)
+
+    response['Content-Disposition'] = f'inline; filename="{archivo}.ics"'
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+@require_GET
+def feed_ics_doctor(request, doctor_id):
+    """
+    Feed iCalendar con las citas de un doctor
+    """
+    doctor = get_object_or_404(Doctor, id=doctor_id)
+    if not _acceso_feed(request, 'doctor', doctor.id, doctor.clinica_id, doctor.usuario_id):
+        return JsonResponse({'error': 'Sin permisos para este calendario'}, status=403)
+    
+    citas, eliminadas = citas_feed(doctor=doctor)
+    return _respuesta_feed(
+        request, citas, eliminadas,
+        f"Citas - Dr(a). {doctor.nombre} {doctor.apellidos}", f"citas-doctor-{doctor.id}",
+    )
+
+
+@require_GET
+def feed_ics_clinica(request, clinica_id):
+    """
+    Feed iCalendar con las citas de una clínica
+    """
+    clinica = get_object_or_404(Clinica, id=clinica_id)
+    if not _acceso_feed(request, 'clinica', clinica.id, clinica.id):
+        return JsonResponse({'error': 'Sin permisos para este calendario'}, status=403)
+    
+    citas, eliminadas = citas_feed(clinica=clinica)
+    return _respuesta_feed(request, citas, eliminadas, f"Citas - {clinica.nombre}", f"citas-clinica-{clinica.id}")
+
+
+@login_required
+def enlaces_ics(request):
+    """
+    API con las URLs de suscripción (con token) a los feeds del usuario.
+    Los tokens caducan a los TOKEN_DIAS_VALIDEZ días (`expira`).
+    """
+    enlaces = {'expira': (timezone.now() + timedelta(days=TOKEN_DIAS_VALIDEZ)).isoformat()}
+    doctor = request.doctor
+    if doctor:
+        url = reverse('calendario:ics_doctor', args=[doctor.id])
+        enlaces['doctor'] = request.build_absolute_uri(f"{url}?token={token_feed('doctor', doctor.id)}")
+    
+    clinica_ids = sorted(request.clinic_roles)
+    enlaces['clinicas'] = {
+        clinica_id: request.build_absolute_uri(
+            f"{reverse('calendario:ics_clinica', args=[clinica_id])}?token={token_feed('clinica', clinica_id)}"
+        )
+        for clinica_id in clinica_ids
+    }
+    return JsonResponse(enlaces)
@@ -0,0 +1,142 @@
+"""
+Stream Server-Sent Events con los cambios de citas (ver events.py).
+
+Necesita servirse con ASGI (core/asgi.py): cada cliente conectado es una
+corrutina esperando en su suscripción, no un worker ocupado. Bajo WSGI la
+respuesta nunca terminaría, así que se rechaza. Con varios workers el
+broker en memoria no reparte los eventos entre procesos: en ese caso el
+stream exige PUBSUB_BACKEND = 'redis'.
+"""
+import json
+import os
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.handlers.asgi import ASGIRequest
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse, StreamingHttpResponse
+
+from core.pubsub import broker
+from doctors.models import Doctor
+
+from .events import canal_clinica, canal_doctor
+
+# Comentario periódico para que proxies y navegadores no cierren la conexión
+KEEPALIVE_SEGUNDOS = 15
+REINTENTO_MS = 5000
+
+
+def _varios_workers():
+    """WEB_CONCURRENCY es el número de workers de gunicorn/uvicorn"""
+    try:
+        return int(os.environ.get('WEB_CONCURRENCY', 1)) > 1
+    except ValueError:
+        return False
+
+
+def _mensaje_sse(evento, datos, secuencia=None):
+    lineas = []
+    if secuencia is not None:
+        lineas.append(f'id: {secuencia}')
+    lineas.append(f'event: {evento}')
+    lineas.append(f'data: {json.dumps(datos, cls=DjangoJSONEncoder)}')
+    return '\n'.join(lineas) + '\n\n'
+
+
+async def _canales_solicitados(params, usuario, doctor, roles):
+    """
+    Canales pedidos con ?clinica= y/o ?doctor=; por defecto la clínica del
+    doctor o la de su primer rol. Fuera del personal staff solo se pueden
+    escuchar la clínica del doctor, las clínicas en las que se tiene un rol
+    (`roles`, request.clinic_roles) y sus doctores. Devuelve (canales, None)
+    o (None, respuesta de error).
+    """
+    try:
+        clinica_id = int(params['clinica']) if params.get('clinica') else None
+        doctor_id = int(params['doctor']) if params.get('doctor') else None
+    except ValueError:
+        return None, JsonResponse({'error': 'Parámetros inválidos'}, status=400)
+
+    if clinica_id is None and doctor_id is None:
+        if doctor is not None and doctor.clinica_id:
+            clinica_id = doctor.clinica_id
+        elif doctor is not None:
+            doctor_id = doctor.id
+        elif roles:
+            clinica_id = next(iter(roles))
+        else:
+            return None, JsonResponse({'error': 'Indique clinica o doctor'}, status=400)
+
+    if not usuario.is_staff:
+        permitidas = set(roles)
+        if doctor is not None and doctor.clinica_id:
+            permitidas.add(doctor.clinica_id)
+        if clinica_id is not None and clinica_id not in permitidas:
+            return None, JsonResponse({'error': 'Sin permisos para esta clínica'}, status=403)
+        if doctor_id is not None and doctor_id != getattr(doctor, 'id', None) and not (
+            permitidas and await Doctor.objects.filter(id=doctor_id, clinica_id__in=permitidas).aexists()
+        ):
+            return None, JsonResponse({'error': 'Sin permisos para este doctor'}, status=403)
+
+    canales = set()
+    if clinica_id is not None:
+        canales.add(canal_clinica(clinica_id))
+    if doctor_id is not None:
+        canales.add(canal_doctor(doctor_id))
+    return canales, None
+
+
+async def _stream(canales, resincronizar):
+    suscripcion = broker.suscribir(canales)
+    try:
+        yield f'retry: {REINTENTO_MS}\n\n'
+        yield _mensaje_sse('conectado', {'canales': sorted(canales)})
+        if resincronizar:
+            # Reconexión: los cambios perdidos mientras tanto no se reenvían
+            yield _mensaje_sse('reset', {'motivo': 'reconexion'})
+        while True:
+            mensajes = await suscripcion.esperar(KEEPALIVE_SEGUNDOS)
+            if suscripcion.desbordada:
+                suscripcion.desbordada = False
+                yield _mensaje_sse('reset', {'motivo': 'desbordamiento'})
+                continue
+            if not mensajes:
+                yield ': ping\n\n'
+                continue
+            yield ''.join(
+                _mensaje_sse(evento['tipo'], evento, secuencia) for secuencia, evento in mensajes
+            )
+    finally:
+        broker.cancelar(suscripcion)
+
+
+@login_required
+async def eventos_citas(request):
+    """
+    API SSE con los cambios de citas de una clínica y/o un doctor.
+    Eventos: creada, actualizada, reagendada, cancelada, eliminada y reset
+    (el cliente debe recargar los datos que muestra).
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({'error': 'El stream de eventos requiere un servidor ASGI'}, status=501)
+    if settings.PUBSUB_BACKEND == 'memoria' and _varios_workers():
+        return JsonResponse({'error': 'Con varios workers el stream de eventos requiere el pub/sub de Redis'}, status=501)
+
+    usuario = await request.auser()
+    # El contexto de clínica (clinicas/middleware.py) se resuelve con consultas síncronas
+    doctor, roles = await sync_to_async(lambda: (request.doctor, request.clinic_roles))()
+    canales, error = await _canales_solicitados(request.GET, usuario, doctor, roles)
+    if error:
+        return error
+
+    response = StreamingHttpResponse(
+        _stream(canales, resincronizar=bool(request.headers.get('Last-Event-ID'))),
+        content_type='text/event-stream',
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Sin buffering en nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
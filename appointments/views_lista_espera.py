@@ -0,0 +1,127 @@
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth.decorators import login_required
+from django.db.models import Case, IntegerField, Q, Value, When
+from datetime import datetime
+import json
+
+from .models import EntradaListaEspera
+from .waitlist import ORDEN_PRIORIDAD
+from doctors.models import Doctor
+from patients.models import Patient
+
+MAX_ENTRADAS_LISTA = 200
+
+
+def _entrada_json(entrada):
+    return {
+        'id': entrada.id,
+        'paciente_id': entrada.paciente_id,
+        'paciente': f'{entrada.paciente.nombre} {entrada.paciente.apellidos}',
+        'prioridad': entrada.paciente.prioridad,
+        'doctor_id': entrada.doctor_id,
+        'especialidad': entrada.especialidad,
+        'desde': entrada.desde.isoformat(),
+        'hasta': entrada.hasta.isoformat(),
+        'motivo': entrada.motivo,
+        'estado': entrada.estado,
+        'cita_id': entrada.cita_id,
+    }
+
+
+@csrf_exempt
+@login_required
+def lista_espera(request):
+    """
+    GET: entradas en espera ordenadas por prioridad y antigüedad.
+    POST: alta en la lista. Body: {"paciente_id", "desde", "hasta", "motivo",
+    "doctor_id"? | "especialidad"?}
+    """
+    doctor_usuario = request.doctor
+
+    if request.method == 'GET':
+        entradas = EntradaListaEspera.objects.filter(
+            estado=request.GET.get('estado') or 'esperando'
+        ).select_related('paciente')
+        if doctor_usuario and not request.user.is_staff:
+            entradas = entradas.filter(doctor=doctor_usuario) | entradas.filter(
+                doctor__isnull=True, especialidad=doctor_usuario.especialidad
+            )
+        orden_prioridad = Case(
+            *[When(paciente__prioridad=codigo, then=Value(orden)) for codigo, orden in ORDEN_PRIORIDAD.items()],
+            default=Value(len(ORDEN_PRIORIDAD)),
+            output_field=IntegerField(),
+        )
+        entradas = entradas.order_by(orden_prioridad, 'creada_en', 'id')[:MAX_ENTRADAS_LISTA]
+        return JsonResponse({'entradas': [_entrada_json(entrada) for entrada in entradas]})
+
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        paciente = get_object_or_404(Patient, id=int(data.get('paciente_id')))
+        desde = datetime.strptime(data.get('desde'), '%Y-%m-%d').date()
+        hasta = datetime.strptime(data.get('hasta'), '%Y-%m-%d').date()
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Datos de la entrada inválidos'}, status=400)
+
+    if hasta < desde:
+        return JsonResponse({'error': 'El rango de fechas es inválido'}, status=400)
+    motivo = (data.get('motivo') or '').strip()
+    if len(motivo) < 10:
+        return JsonResponse({'error': 'El motivo debe tener al menos 10 caracteres'}, status=400)
+
+    doctor = None
+    especialidad = ''
+    if data.get('doctor_id'):
+        doctor = get_object_or_404(Doctor.objects.select_related('clinica'), id=data['doctor_id'], activo=True)
+    elif data.get('especialidad'):
+        especialidad = data['especialidad'].strip()
+    elif doctor_usuario:
+        doctor = doctor_usuario
+    else:
+        return JsonResponse({'error': 'Indique un doctor o una especialidad'}, status=400)
+
+    clinica = doctor.clinica if doctor else (doctor_usuario.clinica if doctor_usuario else None)
+    entrada = EntradaListaEspera.objects.create(
+        paciente=paciente,
+        doctor=doctor,
+        especialidad=especialidad,
+        clinica=clinica,
+        desde=desde,
+        hasta=hasta,
+        motivo=motivo,
+    )
+    return JsonResponse({'success': True, 'entrada': _entrada_json(entrada)}, status=201)
+
+
+def _entradas_permitidas(request):
+    """Entradas que puede gestionar el usuario: las de su agenda y las de sus clínicas"""
+    entradas = EntradaListaEspera.objects.all()
+    if request.user.is_staff:
+        return entradas
+    permitidas = Q(clinica_id__in=list(request.clinic_roles))
+    doctor = request.doctor
+    if doctor is not None:
+        permitidas |= Q(doctor=doctor)
+        if doctor.clinica_id:
+            permitidas |= Q(clinica_id=doctor.clinica_id)
+    return entradas.filter(permitidas)
+
+
+@login_required
+def cancelar_entrada_lista_espera(request, entrada_id):
+    """API para retirar a un paciente de la lista de espera"""
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+    entradas = _entradas_permitidas(request).filter(id=entrada_id)
+    actualizadas = entradas.filter(estado='esperando').update(estado='cancelada')
+    if not actualizadas:
+        get_object_or_404(entradas)
+        return JsonResponse({'error': 'La entrada ya no está en espera'}, status=409)
+    return JsonResponse({'success': True})
@@ -0,0 +1,135 @@
+from django.shortcuts import get_object_or_404
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.contrib.auth.decorators import login_required
+from django.utils import timezone
+import json
+
+from .bulk_reschedule import parse_fecha_hora
+from .idempotency import idempotente
+from .local_time import zona_clinica
+from .models import Appointment
+from .series import SerieError, crear_serie, modificar_desde
+from .slots import MENSAJE_HORA_NO_ALINEADA, HorarioOcupado, alineada
+from doctors.models import Doctor
+from patients.models import Patient
+
+
+def _errores_json(errores, zona):
+    return [
+        {'fecha': timezone.localtime(fecha, zona).strftime('%Y-%m-%d %H:%M'), 'error': error}
+        for fecha, error in sorted(errores.items())
+    ]
+
+
+@csrf_exempt
+@login_required
+@idempotente
+def crear_serie_citas(request):
+    """
+    API para crear una serie de citas recurrentes.
+    Body: {"paciente_id", "fecha", "hora", "frecuencia": "semanal"|"mensual",
+    "intervalo"?, "ocurrencias", "motivo", "doctor_id"?, "omitir_conflictos"?}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    try:
+        data = json.loads(request.body)
+        paciente = get_object_or_404(Patient, id=int(data.get('paciente_id')))
+        intervalo = int(data.get('intervalo') or 1)
+        ocurrencias = int(data.get('ocurrencias'))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Datos de la serie inválidos'}, status=400)
+
+    motivo = (data.get('motivo') or '').strip()
+    if len(motivo) < 10:
+        return JsonResponse({'error': 'El motivo debe tener al menos 10 caracteres'}, status=400)
+
+    # Un doctor crea series para sí mismo; el personal staff puede indicar el doctor
+    doctor = request.doctor
+    if data.get('doctor_id') and request.user.is_staff:
+        doctor = get_object_or_404(Doctor.objects.select_related('clinica'), id=data['doctor_id'])
+    if doctor is None:
+        return JsonResponse({'error': 'Doctor requerido'}, status=400)
+
+    # La fecha y la hora de la serie son las de la clínica del doctor
+    zona = zona_clinica(doctor.clinica_id)
+    try:
+        fecha_inicio = parse_fecha_hora(data.get('fecha'), data.get('hora'), zona)
+    except (TypeError, ValueError):
+        return JsonResponse({'error': 'Datos de la serie inválidos'}, status=400)
+    if not alineada(fecha_inicio):
+        return JsonResponse({'error': MENSAJE_HORA_NO_ALINEADA}, status=400)
+
+    try:
+        serie, citas, errores = crear_serie(
+            paciente, doctor, motivo,
+            frecuencia=data.get('frecuencia'),
+            intervalo=intervalo,
+            fecha_inicio=fecha_inicio,
+            ocurrencias=ocurrencias,
+            usuario=request.user,
+            omitir_conflictos=bool(data.get('omitir_conflictos')),
+        )
+    except SerieError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except HorarioOcupado as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+
+    if serie is None:
+        return JsonResponse({
+            'success': False,
+            'error': 'Hay citas de la serie que no se pueden agendar',
+            'omitidas': _errores_json(errores, zona),
+        }, status=409)
+
+    return JsonResponse({
+        'success': True,
+        'serie_id': serie.id,
+        'creadas': len(citas),
+        'citas': [
+            {'id': cita.id, 'fecha': timezone.localtime(cita.fecha, zona).strftime('%Y-%m-%d %H:%M')}
+            for cita in citas
+        ],
+        'omitidas': _errores_json(errores, zona),
+    }, status=201)
+
+
+@csrf_exempt
+@login_required
+def modificar_serie_desde(request, cita_id):
+    """
+    API para cancelar o editar una cita y las siguientes de su serie.
+    Body: {"accion": "cancelar"|"editar", "cambios": {"motivo"?, "observaciones"?,
+    "nueva_hora"?, "desplazar_dias"?, "doctor_id"?}}
+    """
+    if request.method != 'POST':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    
+    cita = get_object_or_404(Appointment.objects.select_related('doctor__clinica'), id=cita_id)
+
+    doctor_usuario = request.doctor
+    if not request.user.is_staff and (doctor_usuario is None or cita.doctor_id != doctor_usuario.id):
+        return JsonResponse({'error': 'Sin permisos para modificar esta serie'}, status=403)
+
+    try:
+        data = json.loads(request.body)
+        aplicado, total, errores = modificar_desde(cita, data.get('accion'), data.get('cambios'))
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'JSON inválido'}, status=400)
+    except SerieError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except HorarioOcupado as e:
+        return JsonResponse({'success': False, 'error': str(e)}, status=409)
+
+    if not aplicado:
+        return JsonResponse({
+            'success': False,
+            'error': 'Algunas citas no se pueden mover al nuevo horario',
+            'conflictos': _errores_json(errores, zona_clinica(cita.clinica_id)),
+        }, status=409)
+
+    return JsonResponse({'success': True, 'modificadas': total})
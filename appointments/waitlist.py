@@ -0,0 +1,258 @@
+"""
+Lista de espera con relleno automático de huecos liberados.
+
+Los huecos (doctor, inicio) liberados por cancelaciones o reagendamientos se
+procesan en lote: una consulta carga las entradas en espera candidatas, se
+reparten en montículos (heapq) por doctor y por especialidad ordenados por
+prioridad del paciente (U > A > M > B) y antigüedad, y las citas ofrecidas se
+crean con bulk_create en una única transacción.
+
+Los huecos liberados dentro de una misma transacción se acumulan en el
+callback de on_commit y se procesan juntos al confirmarla (p. ej. un doctor
+que cancela un día entero); los de una transacción revertida se descartan
+con ella.
+"""
+import heapq
+
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core import cache
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .conflicts import ESTADOS_INACTIVOS, construir_indices, dias_intervalo, get_duracion_cita
+from .counters import actualizar_contadores
+from .events import estado_cita, evento_cita, publicar_eventos
+from .local_time import asignar_fecha_local, zona_clinica
+from .models import Appointment, EntradaListaEspera
+from .slots import HorarioOcupado, ocupar
+
+ORDEN_PRIORIDAD = {
+    Patient.PRIORITY_URGENT: 0,
+    Patient.PRIORITY_HIGH: 1,
+    Patient.PRIORITY_MEDIUM: 2,
+    Patient.PRIORITY_LOW: 3,
+}
+
+CAMPOS_HUECO = ('fecha', 'estado', 'doctor_id')
+
+
+def hueco_liberado(cita):
+    """
+    (doctor_id, inicio) del horario que liberó `cita` en su último save(),
+    o None. Usa los valores originales que guarda Appointment.from_db.
+    """
+    original = getattr(cita, '_original', None)
+    actual = valores_hueco(cita)
+    if not original or any(campo not in original or campo not in actual for campo in CAMPOS_HUECO):
+        # Cita nueva o cargada con only()/defer(): no se puede comparar sin consultar
+        return None
+    if original['estado'] in ESTADOS_INACTIVOS:
+        return None
+    if actual['estado'] in ESTADOS_INACTIVOS:
+        return original['doctor_id'], original['fecha']
+    if original['fecha'] != actual['fecha'] or original['doctor_id'] != actual['doctor_id']:
+        return original['doctor_id'], original['fecha']
+    return None
+
+
+def valores_hueco(cita):
+    """Valores cargados de los campos que definen el horario (sin forzar consultas)"""
+    return {campo: cita.__dict__[campo] for campo in CAMPOS_HUECO if campo in cita.__dict__}
+
+
+class _RellenoPendiente:
+    """Callback de on_commit con los huecos liberados en un mismo savepoint"""
+
+    def __init__(self):
+        self.huecos = []
+
+    def __call__(self):
+        rellenar_huecos(self.huecos)
+
+
+def programar_relleno(doctor_id, inicio):
+    """
+    Registra un hueco liberado para rellenarlo al confirmar la transacción.
+    Los huecos registrados bajo los mismos savepoints se acumulan en un solo
+    callback de on_commit; si se revierte alguno de esos savepoints, Django
+    descarta el callback y los huecos con él. Fuera de una transacción se
+    rellena al momento.
+    """
+    if not connection.in_atomic_block:
+        rellenar_huecos([(doctor_id, inicio)])
+        return
+    activos = set(connection.savepoint_ids)
+    for sids, funcion, _ in connection.run_on_commit:
+        # Los savepoints de `sids` que ya no están activos se confirmaron en su padre
+        if isinstance(funcion, _RellenoPendiente) and activos <= sids:
+            funcion.huecos.append((doctor_id, inicio))
+            return
+    relleno = _RellenoPendiente()
+    relleno.huecos.append((doctor_id, inicio))
+    transaction.on_commit(relleno)
+
+
+def _clave(entrada):
+    return (ORDEN_PRIORIDAD.get(entrada.paciente.prioridad, len(ORDEN_PRIORIDAD)), entrada.creada_en, entrada.id)
+
+
+def _entradas_candidatas(doctores, dia_min, dia_max):
+    """Entradas en espera que podrían ocupar algún hueco (una sola consulta, filas bloqueadas)"""
+    especialidades = {doctor.especialidad for doctor in doctores.values()}
+    entradas = EntradaListaEspera.objects.filter(
+        Q(doctor_id__in=doctores.keys()) | Q(doctor__isnull=True, especialidad__in=especialidades),
+        estado='esperando',
+        desde__lte=dia_max,
+        hasta__gte=dia_min,
+    ).select_related('paciente')
+    if connection.features.has_select_for_update_skip_locked:
+        # Otro proceso rellenando huecos a la vez no debe esperar por las mismas filas
+        entradas = entradas.select_for_update(skip_locked=True)
+    return list(entradas)
+
+
+def rellenar_huecos(huecos):
+    """
+    Ofrece los huecos liberados a los pacientes en espera.
+
+    `huecos` es un iterable de (doctor_id, inicio). Devuelve la lista de
+    citas creadas. Cada hueco se asigna a la mejor entrada cuyo doctor (o
+    especialidad y clínica) y ventana de fechas encajen, siempre que el
+    horario siga libre.
+    """
+    huecos = sorted(set(huecos), key=lambda hueco: (hueco[1], hueco[0]))
+    ahora = timezone.now()
+    huecos = [(doctor_id, inicio) for doctor_id, inicio in huecos if inicio > ahora]
+    if not huecos:
+        return []
+
+    with transaction.atomic():
+        doctores = Doctor.objects.select_related('clinica').filter(activo=True).in_bulk(
+            {doctor_id for doctor_id, _ in huecos}
+        )
+        huecos = [(doctor_id, inicio) for doctor_id, inicio in huecos if doctor_id in doctores]
+        if not huecos:
+            return []
+
+        dias = [inicio.astimezone(zona_clinica(doctores[doctor_id].clinica_id)).date() for doctor_id, inicio in huecos]
+        entradas = _entradas_candidatas(doctores, min(dias), max(dias))
+        if not entradas:
+            return []
+
+        # Un montículo por doctor y otro por (especialidad, clínica)
+        por_doctor = {}
+        por_especialidad = {}
+        for entrada in entradas:
+            if entrada.doctor_id:
+                heap = por_doctor.setdefault(entrada.doctor_id, [])
+            else:
+                heap = por_especialidad.setdefault((entrada.especialidad, entrada.clinica_id), [])
+            heap.append((_clave(entrada), entrada))
+        for heap in list(por_doctor.values()) + list(por_especialidad.values()):
+            heapq.heapify(heap)
+
+        # El horario puede haberse vuelto a ocupar: validar con una sola consulta
+        claves = {
+            (doctor_id, dia)
+            for doctor_id, inicio in huecos
+            for dia in dias_intervalo(
+                inicio, get_duracion_cita(doctores[doctor_id]), zona_clinica(doctores[doctor_id].clinica_id)
+            )
+        }
+        indices = construir_indices(doctores, claves)
+
+        asignaciones = []
+        for doctor_id, inicio in huecos:
+            doctor = doctores[doctor_id]
+            duracion = get_duracion_cita(doctor)
+            zona = zona_clinica(doctor.clinica_id)
+            dias_hueco = dias_intervalo(inicio, duracion, zona)
+            if any(indices[(doctor_id, dia)].overlaps(inicio, duracion) for dia in dias_hueco):
+                continue
+
+            entrada = _mejor_entrada(
+                inicio.astimezone(zona).date(),
+                por_doctor.get(doctor_id),
+                por_especialidad.get((doctor.especialidad, doctor.clinica_id)),
+                por_especialidad.get((doctor.especialidad, None)),
+            )
+            if entrada is None:
+                continue
+            for dia in dias_hueco:
+                indices[(doctor_id, dia)].add(None, inicio, duracion)
+            asignaciones.append((entrada, doctor, inicio))
+
+        if not asignaciones:
+            return []
+
+        citas = Appointment.objects.bulk_create([
+            asignar_fecha_local(Appointment(
+                paciente_id=entrada.paciente_id,
+                doctor=doctor,
+                clinica=doctor.clinica,
+                fecha=inicio,
+                motivo=entrada.motivo,
+                observaciones='Cita asignada desde la lista de espera',
+            ))
+            for entrada, doctor, inicio in asignaciones
+        ])
+        if citas and citas[0].pk is None:
+            # MySQL no devuelve los ids de un INSERT múltiple: recuperarlos con una consulta
+            ids = {
+                (doctor_id, fecha, paciente_id): cita_id
+                for cita_id, doctor_id, fecha, paciente_id in Appointment.objects.filter(
+                    doctor_id__in={cita.doctor_id for cita in citas},
+                    fecha__in={cita.fecha for cita in citas},
+                    paciente_id__in={cita.paciente_id for cita in citas},
+                ).values_list('id', 'doctor_id', 'fecha', 'paciente_id')
+            }
+            for cita in citas:
+                cita.pk = ids.get((cita.doctor_id, cita.fecha, cita.paciente_id))
+        try:
+            ocupar(citas, doctores)
+        except HorarioOcupado:
+            # Otra reserva ganó alguno de los huecos: las entradas siguen en espera
+            transaction.set_rollback(True)
+            return []
+        actualizar_contadores(actuales=[estado_cita(cita) for cita in citas])
+        for (entrada, _, _), cita in zip(asignaciones, citas):
+            entrada.estado = 'ofrecida'
+            entrada.cita = cita
+            entrada.ofrecida_en = ahora
+        EntradaListaEspera.objects.bulk_update(
+            [entrada for entrada, _, _ in asignaciones], ['estado', 'cita', 'ofrecida_en']
+        )
+        cache.invalidar(doctores={cita.doctor_id for cita in citas}, clinicas={cita.clinica_id for cita in citas})
+        publicar_eventos([evento_cita('creada', cita) for cita in citas])
+
+    return citas
+
+
+def _mejor_entrada(dia, *heaps):
+    """
+    Extrae la entrada de mayor prioridad cuya ventana incluye `dia` entre
+    los montículos dados. Las entradas que no encajan se devuelven a su
+    montículo para huecos posteriores.
+    """
+    mejor = None
+    for heap in heaps:
+        if not heap:
+            continue
+        descartadas = []
+        while heap:
+            clave, entrada = heap[0]
+            if entrada.desde <= dia <= entrada.hasta:
+                if mejor is None or clave < mejor[0]:
+                    mejor = (clave, entrada, heap)
+                break
+            descartadas.append(heapq.heappop(heap))
+        for item in descartadas:
+            heapq.heappush(heap, item)
+
+    if mejor is None:
+        return None
+    heapq.heappop(mejor[2])
+    return mejor[1]
@@ -1,9 +1,14 @@
 from django.contrib import admin
+from django.db.models import OuterRef
 from django.utils.html import format_html
+from appointments.models import Appointment
+from core.admin_utils import ListadoRapidoMixin, contar
+from doctors.models import Doctor
+from patients.models import Patient
 from .models import Clinica
 
 @admin.register(Clinica)
-class ClinicaAdmin(admin.ModelAdmin):
+class ClinicaAdmin(ListadoRapidoMixin, admin.ModelAdmin):
     list_display = ('get_clinic_name', 'get_location_info', 'get_contact_info', 'get_stats')
     search_fields = ('nombre', 'direccion', 'telefono', 'email')
     ordering = ('nombre',)
@@ -22,8 +27,19 @@ class ClinicaAdmin(admin.ModelAdmin):
             'fields': ('telefono', 'email'),
             'description': 'Información de contacto'
         }),
+        ('🕒 Horario', {
+            'fields': ('zona_horaria',),
+            'description': 'Zona horaria en la que se agrupan las citas por día'
+        }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            num_doctores=contar(Doctor.objects.filter(clinica=OuterRef('pk')), 'clinica'),
+            num_pacientes=contar(Patient.objects.filter(clinica=OuterRef('pk')), 'clinica'),
+            num_citas=contar(Appointment.objects.filter(clinica=OuterRef('pk')), 'clinica'),
+        )
+    
     def get_clinic_name(self, obj):
         return format_html(
             '<strong style="color: #007bff;">🏥 {}</strong>',
@@ -57,9 +73,9 @@ class ClinicaAdmin(admin.ModelAdmin):
     get_contact_info.short_description = '📞 Contacto'
     
     def get_stats(self, obj):
-        doctor_count = obj.doctor_set.count()
-        patient_count = obj.patient_set.count()
-        appointment_count = obj.appointment_set.count()
+        doctor_count = obj.num_doctores
+        patient_count = obj.num_pacientes
+        appointment_count = obj.num_citas
         
         stats = []
         if doctor_count > 0:
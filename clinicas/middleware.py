@@ -0,0 +1,182 @@
+"""
+Contexto de clínica de cada petición.
+
+ContextoClinicaMiddleware expone, para el usuario autenticado:
+- request.doctor: su perfil de Doctor (o None), con `clinica` y `usuario`
+  ya asignados (acceder a ellos no hace consultas);
+- request.clinica: la clínica del doctor o, si no es doctor, la de su primera
+  asignación activa en UsuarioClinica (o None);
+- request.clinic_roles: {clinica_id: rol} de sus asignaciones activas.
+
+Los tres se resuelven juntos en el primer acceso a cualquiera de ellos: las
+peticiones que no los usan (estáticos, login, páginas públicas) no hacen
+ninguna consulta para obtenerlos.
+
+Con una caché compartida entre procesos (core/cache.py) los datos se
+guardan como datos planos por usuario (ámbito `usuario`), y además en la
+sesión junto con la versión de ese ámbito: mientras la versión no cambie,
+una petición normal no consulta la base de datos ni la entrada de la caché
+para obtenerlos. Las señales de Doctor, UsuarioClinica y Clinica invalidan
+el ámbito de los usuarios afectados, lo que descarta también la copia de
+la sesión. Son datos de autorización: con la caché 'locmem', privada de cada
+proceso, una invalidación no llegaría a los demás workers y se seguirían
+concediendo roles retirados, así que entonces se leen de la base de datos en
+cada petición que los usa.
+
+Las instancias de request.doctor y request.clinica se reconstruyen en cada
+petición, pero sus valores pueden venir de la caché: para guardarlas usar
+save(update_fields=[...]) con los campos modificados, o recargarlas con
+refresh_from_db() antes de escribir. Un save() completo reescribiría todas
+las columnas con los valores leídos de la caché.
+"""
+from datetime import date, time
+
+from django.db import router
+from django.http import Http404
+
+from core import cache
+from doctors.models import Doctor
+
+from .models import Clinica, UsuarioClinica
+
+CAMPOS_DOCTOR = {campo.attname: campo for campo in Doctor._meta.concrete_fields}
+CAMPOS_CLINICA = {campo.attname: campo for campo in Clinica._meta.concrete_fields}
+CLAVE_SESION = 'contexto_clinica'
+
+
+def calcular_contexto(usuario_id):
+    """Doctor, clínica y roles del usuario como datos planos (para la caché)"""
+    doctor = Doctor.objects.filter(usuario_id=usuario_id).values(*CAMPOS_DOCTOR).first()
+    roles = dict(
+        UsuarioClinica.objects.filter(usuario_id=usuario_id, activo=True)
+        .order_by('fecha_asignacion', 'id').values_list('clinica_id', 'rol')
+    )
+    clinica_id = doctor['clinica_id'] if doctor else next(iter(roles), None)
+    clinica = None
+    if clinica_id is not None:
+        clinica = Clinica.objects.filter(pk=clinica_id).values(*CAMPOS_CLINICA).first()
+    return {'doctor': doctor, 'clinica': clinica, 'roles': roles}
+
+
+def _a_sesion(valores):
+    """Valores de un modelo serializables en JSON (fechas y horas en ISO)"""
+    if valores is None:
+        return None
+    return {
+        campo: valor.isoformat() if isinstance(valor, (date, time)) else valor
+        for campo, valor in valores.items()
+    }
+
+
+def _desde_sesion(campos, valores):
+    if valores is None:
+        return None
+    return {campo: campos[campo].to_python(valor) for campo, valor in valores.items()}
+
+
+def _contexto_de_sesion(session, usuario_id, version):
+    guardado = session.get(CLAVE_SESION)
+    if not guardado or guardado['usuario'] != usuario_id or guardado['version'] != version:
+        return None
+    return {
+        'doctor': _desde_sesion(CAMPOS_DOCTOR, guardado['doctor']),
+        'clinica': _desde_sesion(CAMPOS_CLINICA, guardado['clinica']),
+        'roles': dict(guardado['roles']),
+    }
+
+
+def _guardar_en_sesion(session, usuario_id, version, contexto):
+    session[CLAVE_SESION] = {
+        'usuario': usuario_id,
+        'version': version,
+        'doctor': _a_sesion(contexto['doctor']),
+        'clinica': _a_sesion(contexto['clinica']),
+        # Las claves de un dict JSON son texto: los roles van como pares
+        'roles': list(contexto['roles'].items()),
+    }
+
+
+def contexto_usuario(usuario_id, session=None):
+    if not cache.compartida():
+        return calcular_contexto(usuario_id)
+    if session is None:
+        return cache.obtener('contexto_clinica', lambda: calcular_contexto(usuario_id), usuario=usuario_id)
+    version = cache.version(usuario=usuario_id)
+    contexto = _contexto_de_sesion(session, usuario_id, version)
+    if contexto is None:
+        contexto = cache.obtener('contexto_clinica', lambda: calcular_contexto(usuario_id), usuario=usuario_id)
+        _guardar_en_sesion(session, usuario_id, version, contexto)
+    return contexto
+
+
+def _instancia(modelo, valores):
+    if valores is None:
+        return None
+    return modelo.from_db(router.db_for_read(modelo), list(valores), list(valores.values()))
+
+
+def resolver_contexto(request):
+    """{'doctor', 'clinica', 'roles'} de la petición, con instancias de modelo"""
+    if not request.user.is_authenticated:
+        return {'doctor': None, 'clinica': None, 'roles': {}}
+    contexto = contexto_usuario(request.user.pk, getattr(request, 'session', None))
+    clinica = _instancia(Clinica, contexto['clinica'])
+    doctor = _instancia(Doctor, contexto['doctor'])
+    if doctor is not None:
+        doctor.usuario = request.user
+        if clinica is not None and doctor.clinica_id == clinica.pk:
+            doctor.clinica = clinica
+        elif doctor.clinica_id is None:
+            doctor.clinica = None
+    return {'doctor': doctor, 'clinica': clinica, 'roles': contexto['roles']}
+
+
+def _atributo_contexto(nombre):
+    def leer(request):
+        return request._contexto_clinica()[nombre]
+
+    def asignar(request, valor):
+        request._contexto_clinica()[nombre] = valor
+
+    return property(leer, asignar)
+
+
+class ContextoPerezoso:
+    """
+    Mezcla que el middleware añade a la clase de la petición. Son propiedades
+    y no SimpleLazyObject para que `request.doctor is None` siga funcionando.
+    """
+
+    def _contexto_clinica(self):
+        if '_contexto' not in self.__dict__:
+            self.__dict__['_contexto'] = resolver_contexto(self)
+        return self.__dict__['_contexto']
+
+    doctor = _atributo_contexto('doctor')
+    clinica = _atributo_contexto('clinica')
+    clinic_roles = _atributo_contexto('roles')
+
+
+_CLASES_PEREZOSAS = {}
+
+
+class ContextoClinicaMiddleware:
+    """Debe ir después de AuthenticationMiddleware y SessionMiddleware"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        clase = type(request)
+        if not issubclass(clase, ContextoPerezoso):
+            if clase not in _CLASES_PEREZOSAS:
+                _CLASES_PEREZOSAS[clase] = type(clase.__name__, (ContextoPerezoso, clase), {})
+            request.__class__ = _CLASES_PEREZOSAS[clase]
+        return self.get_response(request)
+
+
+def doctor_requerido(request):
+    """request.doctor o 404 si el usuario no tiene perfil de doctor"""
+    if request.doctor is None:
+        raise Http404('No se encontró el perfil de doctor asociado a su usuario.')
+    return request.doctor
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.1 on 2026-10-18 12:10
+
+import clinicas.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='clinica',
+            name='zona_horaria',
+            field=models.CharField(default=clinicas.models.zona_horaria_default, max_length=64, validators=[clinicas.models.validar_zona_horaria], verbose_name='Zona Horaria (IANA, p. ej. America/Guatemala)'),
+        ),
+    ]
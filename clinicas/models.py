@@ -1,5 +1,20 @@
 from django.db import models
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+
+def zona_horaria_default():
+    return settings.TIME_ZONE
+
+
+def validar_zona_horaria(valor):
+    try:
+        ZoneInfo(valor)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValidationError(f'Zona horaria desconocida: {valor}')
+
 
 class Clinica(models.Model):
     """
@@ -20,6 +35,13 @@ class Clinica(models.Model):
         verbose_name="Días Laborales (1=Lun, 7=Dom)"
     )
     
+    zona_horaria = models.CharField(
+        max_length=64,
+        default=zona_horaria_default,
+        validators=[validar_zona_horaria],
+        verbose_name="Zona Horaria (IANA, p. ej. America/Guatemala)"
+    )
+
     # Configuración de citas
     duracion_cita_default = models.IntegerField(default=30, verbose_name="Duración Default de Cita (min)")
     max_citas_por_dia = models.IntegerField(default=50, verbose_name="Máximo Citas por Día")
@@ -0,0 +1,47 @@
+"""
+Señales de la app de clínicas
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from appointments.counters import reconstruir_contadores
+from appointments.local_time import invalidar_zonas, recalcular_fechas_locales
+from appointments.models import Appointment
+from core import cache
+from doctors.models import Doctor
+
+from .models import Clinica, UsuarioClinica
+
+
+@receiver(pre_save, sender=Clinica)
+def recordar_zona_horaria(sender, instance, **kwargs):
+    instance._zona_anterior = None
+    if instance.pk:
+        instance._zona_anterior = Clinica.objects.filter(pk=instance.pk).values_list(
+            'zona_horaria', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Clinica)
+def recalcular_zona_horaria(sender, instance, created, **kwargs):
+    """Si cambia la zona horaria de la clínica, sus citas cambian de día/hora local"""
+    if created or instance._zona_anterior == instance.zona_horaria:
+        return
+    invalidar_zonas(instance.pk)
+    citas = Appointment.objects.filter(clinica_id=instance.pk)
+    recalcular_fechas_locales(citas)
+    reconstruir_contadores(citas.values('doctor_id').distinct())
+
+
+@receiver(post_save, sender=Clinica)
+@receiver(post_save, sender=UsuarioClinica)
+@receiver(post_delete, sender=UsuarioClinica)
+def invalidar_cache_clinica(sender, instance, **kwargs):
+    if sender is UsuarioClinica:
+        # Roles del usuario en su contexto de clínica (middleware.py)
+        cache.invalidar(clinicas=[instance.clinica_id], usuarios=[instance.usuario_id])
+        return
+    # Usuarios cuyo contexto de clínica incluye esta clínica
+    usuarios = set(Doctor.objects.filter(clinica=instance).values_list('usuario_id', flat=True))
+    usuarios.update(UsuarioClinica.objects.filter(clinica=instance).values_list('usuario_id', flat=True))
+    cache.invalidar(clinicas=[instance.pk], usuarios=usuarios)
@@ -0,0 +1,37 @@
+"""
+Estadísticas de clínica para los dashboards, cacheadas por clínica y día
+(ver core/cache.py).
+"""
+from django.db.models import Count, Q
+
+from appointments.local_time import hoy_local, rango_mes
+from appointments.models import Appointment
+from core import cache
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .models import UsuarioClinica
+
+
+def calcular_resumen(clinica_id, hoy):
+    """Conteos de la clínica: una consulta por tabla, las de citas en una sola agregación"""
+    mes = Q(fecha_local__range=rango_mes(hoy))
+    citas = Appointment.objects.filter(clinica_id=clinica_id).aggregate(
+        citas_hoy=Count('id', filter=Q(fecha_local=hoy)),
+        citas_mes=Count('id', filter=mes),
+        citas_completadas_mes=Count('id', filter=mes & Q(estado='completada')),
+    )
+    return {
+        'doctores': Doctor.objects.filter(clinica_id=clinica_id, activo=True).count(),
+        'pacientes': Patient.objects.filter(clinica_id=clinica_id).count(),
+        'usuarios': UsuarioClinica.objects.filter(clinica_id=clinica_id, activo=True).count(),
+        **citas,
+    }
+
+
+def resumen_clinica(clinica):
+    """Resumen cacheado de `clinica`; lo invalidan los cambios de sus citas, pacientes, doctores y usuarios"""
+    hoy = hoy_local(clinica.id)
+    return cache.obtener(
+        f'clinica_stats:{hoy.isoformat()}', lambda: calcular_resumen(clinica.id, hoy), clinica=clinica.id,
+    )
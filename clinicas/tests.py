@@ -1,3 +1,181 @@
-from django.test import TestCase
+from datetime import datetime, time, timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.cache import SessionStore
+from django.core.cache import cache
+from django.http import Http404
+from django.test import RequestFactory, TestCase
+from django.utils import timezone
+
+from appointments.models import Appointment
+from doctors.models import Doctor
+from patients.models import Patient
+
+from .middleware import ContextoClinicaMiddleware, doctor_requerido
+from .models import Clinica, UsuarioClinica
+
+
+class ListadoClinicasAdminTests(TestCase):
+    """El listado de clínicas hace las mismas consultas con 2 filas que con 10"""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin_listados', password='x'))
+
+    def _crear_clinicas(self, desde, hasta):
+        for i in range(desde, hasta):
+            clinica = Clinica.objects.create(
+                nombre=f'Clínica {i}', codigo=f'ADM{i}', direccion='Calle 1', telefono='1', email='c@example.com',
+            )
+            Doctor.objects.create(
+                usuario=User.objects.create_user(f'doctor_admin_{i}', password='x'),
+                nombre='Ana', apellidos='Pérez', especialidad='Medicina General', clinica=clinica,
+            )
+            Patient.objects.create(nombre='Luis', apellidos='Gómez', dni=f'ADM-{i}', clinica=clinica)
+
+    def test_listado_clinicas(self):
+        # sesión, usuario, COUNT y página (doctores, pacientes y citas anotados); el admin no
+        # usa el contexto de clínica, que no llega a consultarse
+        for desde, hasta in ((0, 2), (2, 10)):
+            self._crear_clinicas(desde, hasta)
+            cache.clear()
+            with self.assertNumQueries(4):
+                self.assertEqual(self.client.get('/admin/clinicas/clinica/').status_code, 200)
+
+
+class ContextoClinicaMiddlewareTests(TestCase):
+    """request.doctor, request.clinica y request.clinic_roles se resuelven una vez por petición"""
+
+    def setUp(self):
+        cache.clear()
+        self.clinica = Clinica.objects.create(
+            nombre='Central', codigo='CTX', direccion='Calle 1', telefono='1', email='c@example.com',
+        )
+        self.usuario = User.objects.create_user('doctor_contexto', password='x')
+        self.doctor = Doctor.objects.create(
+            usuario=self.usuario, nombre='Ana', apellidos='Pérez', especialidad='Medicina General',
+            clinica=self.clinica,
+        )
+        self.factory = RequestFactory()
+
+    def _contexto(self, session=None):
+        request = self.factory.get('/')
+        request.user = self.usuario
+        if session is not None:
+            request.session = session
+        ContextoClinicaMiddleware(lambda r: r)(request)
+        return request
+
+    def test_sin_acceso_no_consulta(self):
+        with self.assertNumQueries(0):
+            request = self._contexto()
+        with self.assertNumQueries(3):
+            self.assertEqual(request.doctor, self.doctor)
+            self.assertEqual(request.clinica, self.clinica)
+            self.assertEqual(request.clinic_roles, {})
+
+    @mock.patch('core.cache.compartida', return_value=True)
+    def test_contexto_en_la_sesion(self, _compartida):
+        UsuarioClinica.objects.create(usuario=self.usuario, clinica=self.clinica, rol='admin')
+        session = SessionStore()
+        self._contexto(session).doctor
+        with mock.patch('core.cache.obtener') as obtener, self.assertNumQueries(0):
+            request = self._contexto(session)
+            self.assertEqual(request.doctor, self.doctor)
+            self.assertEqual(request.clinica.horario_inicio, time(8, 0))
+            self.assertEqual(request.clinica.fecha_creacion, self.clinica.fecha_creacion)
+            self.assertEqual(request.clinic_roles, {self.clinica.id: 'admin'})
+        obtener.assert_not_called()
+
+        # Retirar el rol cambia la versión del usuario: la copia de la sesión se descarta
+        UsuarioClinica.objects.filter(usuario=self.usuario).delete()
+        self.assertEqual(self._contexto(session).clinic_roles, {})
+        self.assertEqual(session['contexto_clinica']['roles'], [])
+
+    @mock.patch('core.cache.compartida', return_value=True)
+    def test_contexto_cacheado_sin_consultas(self, _compartida):
+        self._contexto().doctor
+        with self.assertNumQueries(0):
+            request = self._contexto()
+            self.assertEqual(request.doctor, self.doctor)
+            self.assertEqual(request.doctor.clinica, self.clinica)
+            self.assertEqual(request.clinica, self.clinica)
+            self.assertEqual(request.clinic_roles, {})
+
+    def test_cambios_invalidan_el_contexto(self):
+        self._contexto()
+        UsuarioClinica.objects.create(usuario=self.usuario, clinica=self.clinica, rol='admin')
+        self.assertEqual(self._contexto().clinic_roles, {self.clinica.id: 'admin'})
+
+        self.doctor.especialidad = 'Cardiología'
+        self.doctor.save()
+        self.assertEqual(self._contexto().doctor.especialidad, 'Cardiología')
+
+        self.clinica.nombre = 'Central Norte'
+        self.clinica.save()
+        self.assertEqual(self._contexto().clinica.nombre, 'Central Norte')
+
+    def test_cache_local_no_sirve_roles_retirados(self):
+        # update() no emite señales: es lo que vería otro worker con una caché 'locmem'
+        asignacion = UsuarioClinica.objects.create(usuario=self.usuario, clinica=self.clinica, rol='admin')
+        self.assertEqual(self._contexto().clinic_roles, {self.clinica.id: 'admin'})
+        UsuarioClinica.objects.filter(id=asignacion.id).update(activo=False)
+        self.assertEqual(self._contexto().clinic_roles, {})
+
+    def test_usuario_sin_perfil(self):
+        request = self.factory.get('/')
+        request.user = User.objects.create_user('sin_perfil', password='x')
+        ContextoClinicaMiddleware(lambda r: r)(request)
+
+        self.assertIsNone(request.doctor)
+        self.assertIsNone(request.clinica)
+        with self.assertRaises(Http404):
+            doctor_requerido(request)
+
+
+class CargaTrabajoTests(TestCase):
+    """Mapa de calor doctores × días a partir de los contadores diarios"""
+
+    def setUp(self):
+        self.clinica = Clinica.objects.create(
+            nombre='Central', codigo='CAR', direccion='Calle 1', telefono='1', email='c@example.com',
+            max_citas_por_dia=10,
+        )
+        self.doctor = Doctor.objects.create(
+            usuario=User.objects.create_user('doctor_carga', password='x'),
+            nombre='Ana', apellidos='Pérez', especialidad='Medicina General', clinica=self.clinica,
+            duracion_cita_default=30,
+        )
+        hoy = timezone.localdate()
+        self.lunes = hoy + timedelta(days=7 - hoy.weekday())
+        paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='CAR-1')
+        inicio = timezone.make_aware(datetime.combine(self.lunes, time(9, 0)))
+        for n in range(6):
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, clinica=self.clinica,
+                fecha=inicio + timedelta(minutes=30 * n), motivo='Carga de trabajo',
+                estado='cancelada' if n == 5 else 'programada',
+            )
+        self.client.force_login(self.doctor.usuario)
+
+    def _carga(self, **params):
+        params.setdefault('desde', self.lunes.isoformat())
+        return self.client.get(f'/clinicas/{self.clinica.id}/api/carga/', params)
+
+    def test_ocupacion_frente_a_la_capacidad(self):
+        datos = self._carga(dias=7).json()
+        self.assertEqual(datos['laborables'], [True] * 5 + [False] * 2)
+        self.assertEqual(datos['minutos_jornada'], 600)
+        fila = datos['doctores'][0]
+        # Las canceladas no cuentan; 5 de 10 citas pesa más que 150 de 600 minutos
+        self.assertEqual(fila['capacidad_citas'], 10)
+        self.assertEqual((fila['citas'][0], fila['minutos'][0], fila['ocupacion'][0]), (5, 150, 50))
+        self.assertEqual(fila['niveles'][0], 'media')
+        self.assertEqual(fila['niveles'][1], 'baja')
+        self.assertEqual(fila['niveles'][6], 'no_laboral')
+        self.assertEqual(datos['citas_por_dia'], [5, 0, 0, 0, 0, 0, 0])
+
+    def test_permisos_y_parametros(self):
+        self.assertEqual(self._carga(dias=91).status_code, 400)
+        self.client.force_login(User.objects.create_user('ajeno_carga', password='x'))
+        self.assertEqual(self._carga().status_code, 403)
@@ -11,6 +11,7 @@ urlpatterns = [
     path('crear/', views.crear_clinica, name='crear'),
     path('<int:clinica_id>/editar/', views.editar_clinica, name='editar'),
     path('<int:clinica_id>/detalle/', views.detalle_clinica, name='detalle'),
+    path('<int:clinica_id>/api/carga/', views.carga_trabajo_api, name='carga_trabajo_api'),
     
     # Gestión de usuarios por clínica
     path('<int:clinica_id>/usuarios/', views.usuarios_clinica, name='usuarios'),
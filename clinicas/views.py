@@ -3,13 +3,20 @@ from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages
 from django.http import JsonResponse
 from django.db import transaction
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.utils import timezone
+from datetime import datetime
 
-from .models import Clinica, UsuarioClinica
+from .models import Clinica, UsuarioClinica, validar_zona_horaria, zona_horaria_default
+from .statistics import resumen_clinica
+from .workload import MAX_DIAS, carga_clinica
+from core import cache
 from doctors.models import Doctor
 from patients.models import Patient
 from appointments.models import Appointment
+from appointments.local_time import hoy_local, rango_mes, recalcular_fechas_locales
+from appointments.counters import actualizar_contadores
 
 def es_admin_global(user):
     """Verificar si el usuario es administrador global"""
@@ -26,16 +33,13 @@ def dashboard_clinicas(request):
     # Estadísticas por clínica
     estadisticas = []
     for clinica in clinicas:
+        resumen = resumen_clinica(clinica)
         stats = {
             'clinica': clinica,
-            'doctores': Doctor.objects.filter(clinica=clinica, activo=True).count(),
-            'pacientes': Patient.objects.filter(clinica=clinica).count(),
-            'citas_mes': Appointment.objects.filter(
-                clinica=clinica,
-                fecha__month=timezone.now().month,
-                fecha__year=timezone.now().year
-            ).count(),
-            'usuarios': UsuarioClinica.objects.filter(clinica=clinica, activo=True).count()
+            'doctores': resumen['doctores'],
+            'pacientes': resumen['pacientes'],
+            'citas_mes': resumen['citas_mes'],
+            'usuarios': resumen['usuarios'],
         }
         estadisticas.append(stats)
     
@@ -55,6 +59,8 @@ def crear_clinica(request):
     """
     if request.method == 'POST':
         try:
+            zona_horaria = request.POST.get('zona_horaria') or zona_horaria_default()
+            validar_zona_horaria(zona_horaria)
             with transaction.atomic():
                 clinica = Clinica.objects.create(
                     nombre=request.POST['nombre'],
@@ -66,6 +72,7 @@ def crear_clinica(request):
                     horario_fin=request.POST.get('horario_fin', '18:00'),
                     duracion_cita_default=int(request.POST.get('duracion_cita_default', 30)),
                     max_citas_por_dia=int(request.POST.get('max_citas_por_dia', 50)),
+                    zona_horaria=zona_horaria,
                 )
                 
                 # Asignar administrador si se especifica
@@ -116,6 +123,8 @@ def editar_clinica(request, clinica_id):
             clinica.duracion_cita_default = int(request.POST.get('duracion_cita_default', 30))
             clinica.max_citas_por_dia = int(request.POST.get('max_citas_por_dia', 50))
             clinica.activa = 'activa' in request.POST
+            clinica.zona_horaria = request.POST.get('zona_horaria') or clinica.zona_horaria
+            validar_zona_horaria(clinica.zona_horaria)
             
             # Actualizar administrador
             admin_id = request.POST.get('administrador')
@@ -149,8 +158,7 @@ def detalle_clinica(request, clinica_id):
     clinica = get_object_or_404(Clinica, id=clinica_id)
     
     # Verificar permisos
-    if not (request.user.is_staff or 
-            UsuarioClinica.objects.filter(usuario=request.user, clinica=clinica, activo=True).exists()):
+    if not (request.user.is_staff or clinica.id in request.clinic_roles):
         messages.error(request, 'No tiene permisos para ver esta clínica')
         return redirect('doctors:dashboard')
     
@@ -158,18 +166,18 @@ def detalle_clinica(request, clinica_id):
     doctores = Doctor.objects.filter(clinica=clinica, activo=True)
     pacientes = Patient.objects.filter(clinica=clinica)
     
-    hoy = timezone.now().date()
-    citas_hoy = Appointment.objects.filter(clinica=clinica, fecha__date=hoy)
+    hoy = hoy_local(clinica.id)
+    citas_hoy = Appointment.objects.filter(clinica=clinica, fecha_local=hoy)
     citas_mes = Appointment.objects.filter(
         clinica=clinica,
-        fecha__month=hoy.month,
-        fecha__year=hoy.year
+        fecha_local__range=rango_mes(hoy)
     )
     
     usuarios_clinica = UsuarioClinica.objects.filter(
         clinica=clinica, 
         activo=True
     ).select_related('usuario')
+    resumen = resumen_clinica(clinica)
     
     context = {
         'clinica': clinica,
@@ -179,16 +187,42 @@ def detalle_clinica(request, clinica_id):
         'citas_mes': citas_mes,
         'usuarios_clinica': usuarios_clinica,
         'estadisticas': {
-            'total_doctores': doctores.count(),
-            'total_pacientes': pacientes.count(),
-            'citas_hoy_count': citas_hoy.count(),
-            'citas_mes_count': citas_mes.count(),
-            'citas_completadas_mes': citas_mes.filter(estado='completada').count(),
+            'total_doctores': resumen['doctores'],
+            'total_pacientes': resumen['pacientes'],
+            'citas_hoy_count': resumen['citas_hoy'],
+            'citas_mes_count': resumen['citas_mes'],
+            'citas_completadas_mes': resumen['citas_completadas_mes'],
         }
     }
     
     return render(request, 'clinicas/detalle.html', context)
 
+@login_required
+def carga_trabajo_api(request, clinica_id):
+    """
+    Mapa de calor de carga de la clínica: doctores × días con citas, minutos
+    reservados y ocupación frente a la capacidad (ver clinicas/workload.py).
+    Parámetros: desde (YYYY-MM-DD, default hoy) y dias (default 30, máx. 90).
+    """
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+
+    clinica = get_object_or_404(Clinica, id=clinica_id)
+    if not (request.user.is_staff or clinica.id in request.clinic_roles or
+            (request.doctor is not None and request.doctor.clinica_id == clinica.id)):
+        return JsonResponse({'error': 'No tiene permisos para ver esta clínica'}, status=403)
+
+    try:
+        desde = request.GET.get('desde')
+        desde = datetime.strptime(desde, '%Y-%m-%d').date() if desde else hoy_local(clinica.id)
+        dias = int(request.GET.get('dias', 30))
+    except ValueError:
+        return JsonResponse({'error': 'Parámetros inválidos: desde=YYYY-MM-DD, dias=entero'}, status=400)
+    if not 1 <= dias <= MAX_DIAS:
+        return JsonResponse({'error': f'dias debe estar entre 1 y {MAX_DIAS}'}, status=400)
+
+    return JsonResponse(carga_clinica(clinica, desde, dias))
+
 @login_required
 @user_passes_test(es_admin_global)
 def usuarios_clinica(request, clinica_id):
@@ -308,7 +342,19 @@ def transferir_paciente(request):
                 paciente.save()
                 
                 # Actualizar citas históricas
-                Appointment.objects.filter(paciente=paciente).update(clinica=clinica_destino)
+                citas = Appointment.objects.filter(paciente=paciente)
+                campos_contador = ('doctor_id', 'paciente_id', 'fecha_local', 'estado')
+                anteriores = list(citas.select_for_update().values(*campos_contador))
+                citas.update(
+                    clinica=clinica_destino, actualizada_en=timezone.now(), version=F('version') + 1
+                )
+                recalcular_fechas_locales(citas)
+                # Con otra zona horaria las citas pueden cambiar de día local
+                actualizar_contadores(anteriores, citas.values(*campos_contador))
+                cache.invalidar(
+                    doctores={anterior['doctor_id'] for anterior in anteriores},
+                    clinicas=[clinica_origen.pk if clinica_origen else None, clinica_destino.pk],
+                )
                 
                 return JsonResponse({
                     'success': True,
@@ -344,23 +390,15 @@ def reportes_consolidados(request):
     estadisticas_consolidadas = []
     
     for clinica in clinicas:
-        hoy = timezone.now().date()
-        inicio_mes = hoy.replace(day=1)
+        resumen = resumen_clinica(clinica)
         
         stats = {
             'clinica': clinica,
-            'doctores_activos': Doctor.objects.filter(clinica=clinica, activo=True).count(),
-            'pacientes_total': Patient.objects.filter(clinica=clinica).count(),
-            'citas_hoy': Appointment.objects.filter(clinica=clinica, fecha__date=hoy).count(),
-            'citas_mes': Appointment.objects.filter(
-                clinica=clinica,
-                fecha__date__gte=inicio_mes
-            ).count(),
-            'citas_completadas_mes': Appointment.objects.filter(
-                clinica=clinica,
-                fecha__date__gte=inicio_mes,
-                estado='completada'
-            ).count(),
+            'doctores_activos': resumen['doctores'],
+            'pacientes_total': resumen['pacientes'],
+            'citas_hoy': resumen['citas_hoy'],
+            'citas_mes': resumen['citas_mes'],
+            'citas_completadas_mes': resumen['citas_completadas_mes'],
         }
         
         # Calcular porcentaje de éxito
@@ -0,0 +1,121 @@
+"""
+Mapa de carga de trabajo de una clínica: matriz doctores × días con las
+citas y los minutos reservados de cada doctor-día, comparados con su
+capacidad.
+
+Los conteos salen de una sola consulta agrupada sobre los contadores
+diarios (ContadorDiarioCitas), así que el coste no depende del número de
+citas sino de las celdas con actividad: cientos de doctores a 90 días son
+unas decenas de miles de filas como máximo.
+
+Capacidad de una celda en un día laboral de la clínica:
+- minutos: la jornada (horario_fin - horario_inicio);
+- citas: las que caben en la jornada con la duración de cita del doctor,
+  limitadas por Clinica.max_citas_por_dia.
+Los días no laborales tienen capacidad 0.
+"""
+from datetime import timedelta
+
+from django.db.models import Sum
+
+from appointments.availability import HorarioDoctor
+from appointments.conflicts import ESTADOS_INACTIVOS
+from appointments.models import ContadorDiarioCitas
+from core import cache
+from doctors.models import Doctor
+
+MAX_DIAS = 90
+
+# Umbrales de ocupación (porcentaje) para el nivel de cada celda
+NIVELES = (
+    (50, 'baja'),
+    (80, 'media'),
+    (100, 'alta'),
+)
+NIVEL_COMPLETA = 'completa'
+NIVEL_NO_LABORAL = 'no_laboral'
+
+
+def nivel(ocupacion, laboral=True):
+    if not laboral:
+        return NIVEL_NO_LABORAL
+    for limite, nombre in NIVELES:
+        if ocupacion < limite:
+            return nombre
+    return NIVEL_COMPLETA
+
+
+def calcular_carga(clinica, desde, dias):
+    """
+    Matriz de carga de `clinica` para [desde, desde + dias). Devuelve datos
+    planos: listas paralelas por doctor (filas) y por día (columnas).
+    """
+    fechas = [desde + timedelta(days=i) for i in range(dias)]
+    columna = {fecha: i for i, fecha in enumerate(fechas)}
+    doctores = list(
+        Doctor.objects.filter(clinica=clinica, activo=True)
+        .only('id', 'nombre', 'apellidos', 'duracion_cita_default', 'clinica_id')
+        .order_by('apellidos', 'nombre', 'id')
+    )
+    fila = {doctor.id: i for i, doctor in enumerate(doctores)}
+    for doctor in doctores:
+        # La duración de cita por defecto de la clínica sin volver a consultarla
+        doctor.clinica = clinica
+    horarios = [HorarioDoctor.para_doctor(doctor, clinica) for doctor in doctores]
+    # La jornada y los días laborables son los de la clínica, iguales para todos
+    jornada = horarios[0] if horarios else HorarioDoctor.para_doctor(Doctor(), clinica)
+    minutos_jornada = jornada.minutos_jornada
+    laborables = [jornada.es_laboral(fecha) for fecha in fechas]
+
+    citas = [[0] * dias for _ in doctores]
+    conteos = ContadorDiarioCitas.objects.filter(
+        doctor_id__in=list(fila), fecha__range=(fechas[0], fechas[-1]),
+    ).exclude(estado__in=ESTADOS_INACTIVOS).values('doctor_id', 'fecha').annotate(
+        citas=Sum('total')
+    ).order_by()
+    for conteo in conteos:
+        citas[fila[conteo['doctor_id']]][columna[conteo['fecha']]] = conteo['citas']
+
+    filas = []
+    for doctor, horario, citas_doctor in zip(doctores, horarios, citas):
+        duracion = horario.duracion
+        capacidad_citas = min(minutos_jornada // duracion if duracion else 0, clinica.max_citas_por_dia)
+        minutos = [n * duracion for n in citas_doctor]
+        ocupacion = [
+            _porcentaje(n, capacidad_citas, m, minutos_jornada) if laboral else (100 if n else 0)
+            for n, m, laboral in zip(citas_doctor, minutos, laborables)
+        ]
+        filas.append({
+            'id': doctor.id,
+            'nombre': f'{doctor.nombre} {doctor.apellidos}',
+            'duracion_cita': duracion,
+            'capacidad_citas': capacidad_citas,
+            'citas': citas_doctor,
+            'minutos': minutos,
+            'ocupacion': ocupacion,
+            'niveles': [nivel(o, laboral) for o, laboral in zip(ocupacion, laborables)],
+        })
+
+    return {
+        'clinica': clinica.id,
+        'dias': [fecha.isoformat() for fecha in fechas],
+        'laborables': laborables,
+        'minutos_jornada': minutos_jornada,
+        'max_citas_por_dia': clinica.max_citas_por_dia,
+        'doctores': filas,
+        'citas_por_dia': [sum(columna_citas) for columna_citas in zip(*citas)] if citas else [0] * dias,
+    }
+
+
+def _porcentaje(citas, capacidad_citas, minutos, capacidad_minutos):
+    """Ocupación de la celda: el recurso más ajustado (citas o minutos)"""
+    if not capacidad_citas or not capacidad_minutos:
+        return 100 if citas else 0
+    return round(max(citas / capacidad_citas, minutos / capacidad_minutos) * 100)
+
+
+def carga_clinica(clinica, desde, dias):
+    """calcular_carga cacheada por clínica; los cambios de citas y doctores la invalidan"""
+    return cache.obtener(
+        f'carga:{desde.isoformat()}:{dias}', lambda: calcular_carga(clinica, desde, dias), clinica=clinica.id,
+    )
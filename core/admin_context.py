@@ -1,10 +1,38 @@
 from django.contrib import admin
 from django.contrib.admin import AdminSite
+from django.core.cache import cache
+from core.admin_utils import UMBRAL_ESTIMADO, conteo_estimado
 from patients.models import Patient
 from doctors.models import Doctor
 from appointments.models import Appointment
 from clinicas.models import Clinica
 
+# Segundos que se reutilizan los totales del índice del admin
+TIMEOUT_INDICE = 300
+
+
+def _total(modelo):
+    """COUNT(*) o, en tablas grandes, la estimación de la base de datos"""
+    estimado = conteo_estimado(modelo)
+    if estimado is not None and estimado >= UMBRAL_ESTIMADO:
+        return estimado
+    return modelo.objects.count()
+
+
+def _calcular_estadisticas():
+    return {
+        'total_patients': _total(Patient),
+        'total_doctors': Doctor.objects.filter(activo=True).count(),
+        'total_appointments': _total(Appointment),
+        'total_clinics': Clinica.objects.count(),
+    }
+
+
+def estadisticas_indice():
+    """Totales del índice del admin, cacheados TIMEOUT_INDICE segundos"""
+    return cache.get_or_set('admin:estadisticas_indice', _calcular_estadisticas, TIMEOUT_INDICE)
+
+
 class MediCitasAdminSite(AdminSite):
     """
     Admin site personalizado para MediCitas Pro
@@ -19,14 +47,9 @@ class MediCitasAdminSite(AdminSite):
         """
         extra_context = extra_context or {}
         
-        # Obtener estadísticas
+        # Obtener estadísticas (cacheadas: no se recalculan en cada carga)
         try:
-            extra_context.update({
-                'total_patients': Patient.objects.count(),
-                'total_doctors': Doctor.objects.filter(activo=True).count(),
-                'total_appointments': Appointment.objects.count(),
-                'total_clinics': Clinica.objects.count(),
-            })
+            extra_context.update(estadisticas_indice())
         except Exception:
             # En caso de error con la base de datos
             extra_context.update({
@@ -0,0 +1,142 @@
+"""
+Utilidades para que los listados del admin no dependan del tamaño de las tablas.
+
+- contar(): conteos por fila como subconsulta escalar anotada en el
+  queryset del listado, en lugar de `obj.<relacion>_set.count()` por fila.
+- FiltroAutocompletar: filtro lateral por relación (doctor, paciente...) que
+  no carga todas las opciones; se eligen con el autocompletado del admin.
+- ConteoRapidoPaginator: el total de resultados se cachea unos segundos y,
+  en tablas grandes sin filtros, se estima con las estadísticas de la base
+  de datos en lugar de un COUNT(*) completo.
+- ListadoRapidoMixin: junta lo anterior para un ModelAdmin.
+"""
+import hashlib
+
+from django import forms
+from django.contrib import admin
+from django.contrib.admin.widgets import AutocompleteSelect
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Count, IntegerField, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils.functional import cached_property
+
+# Segundos que se reutiliza el total de resultados de un listado
+TIMEOUT_CONTEO = 60
+# A partir de este número estimado de filas se usa la estimación sin filtros
+UMBRAL_ESTIMADO = 100_000
+
+
+def contar(queryset, campo):
+    """
+    Subconsulta escalar con el número de filas de `queryset`, que debe
+    filtrar por `campo` con OuterRef. 0 si no hay filas.
+    """
+    conteo = queryset.order_by().values(campo).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(conteo, output_field=IntegerField()), Value(0))
+
+
+def conteo_estimado(modelo):
+    """
+    Filas estimadas de la tabla de `modelo` según las estadísticas de la base
+    de datos (None si el motor no las ofrece). En MySQL (InnoDB) puede
+    desviarse bastante del valor real.
+    """
+    conexion = connections[modelo.objects.db]
+    tabla = modelo._meta.db_table
+    with conexion.cursor() as cursor:
+        if conexion.vendor == 'mysql':
+            cursor.execute(
+                'SELECT TABLE_ROWS FROM information_schema.TABLES '
+                'WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s',
+                [tabla],
+            )
+        elif conexion.vendor == 'postgresql':
+            cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(%s)', [tabla])
+        else:
+            return None
+        fila = cursor.fetchone()
+    if not fila or fila[0] is None or fila[0] < 0:
+        return None
+    return int(fila[0])
+
+
+def conteo_cacheado(queryset, timeout=TIMEOUT_CONTEO):
+    """queryset.count() reutilizado durante `timeout` segundos para la misma consulta"""
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return 0
+    clave = 'conteo:' + hashlib.md5(f'{sql}|{params}'.encode()).hexdigest()
+    conteo = cache.get(clave)
+    if conteo is None:
+        conteo = queryset.count()
+        cache.set(clave, conteo, timeout)
+    return conteo
+
+
+class ConteoRapidoPaginator(Paginator):
+    """
+    Paginador del admin con total aproximado: estimado en tablas grandes sin
+    filtros, cacheado TIMEOUT_CONTEO segundos en el resto.
+    """
+
+    @cached_property
+    def count(self):
+        consulta = self.object_list.query
+        if not consulta.where and not consulta.distinct:
+            estimado = conteo_estimado(self.object_list.model)
+            if estimado is not None and estimado >= UMBRAL_ESTIMADO:
+                return estimado
+        return conteo_cacheado(self.object_list)
+
+
+class FiltroAutocompletar(admin.RelatedFieldListFilter):
+    """
+    Filtro por una relación con muchos registros: solo se consulta la opción
+    seleccionada y el resto se busca con el autocompletado del admin (el
+    admin del modelo relacionado necesita search_fields). Se usa como
+    `list_filter = (('doctor', FiltroAutocompletar), ...)` en un admin con
+    ListadoRapidoMixin.
+    """
+    template = 'admin/filtro_autocompletar.html'
+
+    def field_choices(self, field, request, model_admin):
+        if not self.lookup_val:
+            return []
+        modelo = field.remote_field.model
+        try:
+            return [(obj.pk, str(obj)) for obj in modelo._default_manager.filter(pk__in=self.lookup_val)]
+        except (ValueError, ValidationError):
+            return []
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        # Para el template: parámetros del listado sin este filtro y campo de origen del autocompletado
+        self.url_base = changelist.get_query_string(remove=[self.lookup_kwarg, self.lookup_kwarg_isnull, 'p'])
+        self.app_label = changelist.model._meta.app_label
+        self.model_name = changelist.model._meta.model_name
+        return super().choices(changelist)
+
+
+class ListadoRapidoMixin:
+    """ModelAdmin con ConteoRapidoPaginator, sin el segundo COUNT del total y con FiltroAutocompletar"""
+    paginator = ConteoRapidoPaginator
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        media = super().media
+        campos = [
+            filtro[0] for filtro in self.list_filter
+            if isinstance(filtro, (list, tuple)) and issubclass(filtro[1], FiltroAutocompletar)
+        ]
+        if campos:
+            campo = self.model._meta.get_field(campos[0])
+            media += AutocompleteSelect(campo, self.admin_site).media
+            media += forms.Media(js=['admin/js/filtro_autocompletar.js'])
+        return media
@@ -5,6 +5,17 @@ It exposes the ASGI callable as a module-level variable named ``application``.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
+
+El stream SSE de cambios de citas (/calendario/api/eventos/) solo funciona
+servido desde aquí, p. ej.:
+
+    uvicorn core.asgi:application --workers 1
+
+Con el pub/sub en memoria (settings.PUBSUB_BACKEND = 'memoria', el valor por
+defecto) los cambios hechos en un worker solo llegan a los clientes
+conectados a ese mismo worker, así que hay que usar un único worker. Con
+PUBSUB_BACKEND = 'redis' (core.pubsub.RedisBroker) los eventos se reparten
+entre todos los procesos y se pueden usar varios workers (WEB_CONCURRENCY).
 """
 
 import os
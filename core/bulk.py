@@ -0,0 +1,79 @@
+"""
+Utilidades comunes de los endpoints de carga masiva.
+
+El cuerpo es {"items": [...], "modo": "atomico" | "parcial"}:
+
+- atomico (por defecto): si algún elemento no es válido no se escribe nada.
+- parcial: se escriben los elementos válidos y se informa del resto.
+
+La respuesta incluye un resultado por elemento, en el mismo orden:
+{"indice", "ok", "id"?, "errores"?}. `ok` indica que el elemento se escribió.
+"""
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+MODO_ATOMICO = 'atomico'
+MODO_PARCIAL = 'parcial'
+MODOS_LOTE = (MODO_ATOMICO, MODO_PARCIAL)
+
+MAX_ITEMS_LOTE = 500
+
+
+def leer_lote(data):
+    """Valida la forma del cuerpo y devuelve (items, modo)"""
+    if not isinstance(data, dict):
+        raise ValidationError({'items': 'Se esperaba un objeto con la lista de items'})
+    items = data.get('items')
+    modo = data.get('modo') or MODO_ATOMICO
+    if not isinstance(items, list) or not items:
+        raise ValidationError({'items': 'Se requiere una lista de items no vacía'})
+    if len(items) > MAX_ITEMS_LOTE:
+        raise ValidationError({'items': f'Máximo {MAX_ITEMS_LOTE} items por lote'})
+    if modo not in MODOS_LOTE:
+        raise ValidationError({'modo': f'Modo inválido: use {" o ".join(MODOS_LOTE)}'})
+    return items, modo
+
+
+def resultados_vacios(items):
+    return [{'indice': indice, 'ok': False} for indice in range(len(items))]
+
+
+def agregar_error(resultado, campo, mensaje):
+    resultado.setdefault('errores', {}).setdefault(campo, []).append(mensaje)
+
+
+def errores_formulario(form):
+    return {campo: [str(error) for error in errores] for campo, errores in form.errors.items()}
+
+
+def escribir_lote(resultados, modo):
+    """¿Se escriben los elementos válidos? En modo atómico solo si no hay errores"""
+    hay_errores = any('errores' in resultado for resultado in resultados)
+    hay_validos = any('errores' not in resultado for resultado in resultados)
+    return hay_validos and (modo == MODO_PARCIAL or not hay_errores)
+
+
+def respuesta_lote(resultados, modo, status_ok=status.HTTP_200_OK):
+    """
+    status_ok si se escribieron todos, 207 si el modo parcial dejó elementos
+    sin escribir y 400 si no se escribió ninguno
+    """
+    aplicados = sum(1 for resultado in resultados if resultado['ok'])
+    if aplicados == len(resultados):
+        codigo = status_ok
+        mensaje = f'{aplicados} elementos procesados exitosamente'
+    elif aplicados:
+        codigo = status.HTTP_207_MULTI_STATUS
+        mensaje = f'{aplicados} de {len(resultados)} elementos procesados; revise los errores indicados'
+    else:
+        codigo = status.HTTP_400_BAD_REQUEST
+        mensaje = 'No se aplicó ningún cambio: corrija los errores indicados'
+    return Response({
+        'success': aplicados == len(resultados),
+        'modo': modo,
+        'mensaje': mensaje,
+        'aplicados': aplicados,
+        'fallidos': len(resultados) - aplicados,
+        'resultados': resultados,
+    }, status=codigo)
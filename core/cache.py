@@ -0,0 +1,139 @@
+"""
+Caché de los datos de dashboards (doctores y clínicas).
+
+Las claves incluyen la versión de cada ámbito del que dependen
+(`doctor:<id>`, `clinica:<id>`, `usuario:<id>`). Invalidar es incrementar esa versión: las
+entradas anteriores dejan de leerse y caducan solas, sin tener que conocer
+ni borrar cada clave. Las señales de Appointment, Patient, Doctor y Clinica
+llaman a invalidar(); las escrituras masivas (bulk_create, bulk_update,
+update) deben hacerlo explícitamente.
+
+Protección contra estampidas: cuando una entrada falta, solo el proceso
+que obtiene el candado (cache.add) la calcula; el resto espera un momento
+a que aparezca. Cuando una entrada está por caducar, un único proceso la
+recalcula mientras los demás siguen sirviendo el valor guardado.
+
+Versiones, entradas y candados viven en la caché de Django, así que solo
+se comparten entre procesos si su backend es compartido
+(settings.CACHE_BACKEND 'archivo', 'redis' o 'memcached'). Con 'locmem',
+el valor por defecto, cada proceso tiene los suyos: una invalidación solo
+afecta al proceso que la hace y el resto puede servir datos de hasta
+TIMEOUT segundos de antigüedad. Solo sirve con un único proceso.
+
+Los valores deben ser datos planos (dicts, listas, números, fechas), nunca
+querysets ni instancias de modelos.
+"""
+import random
+import time
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+
+# Segundos de vida de una entrada; se renueva antes de ese plazo
+TIMEOUT = 300
+# Fracción de TIMEOUT a partir de la que un proceso renueva la entrada
+RENOVAR_DESDE = 0.8
+# Tiempo máximo de cálculo antes de que otro proceso pueda tomar el candado
+CANDADO_SEGUNDOS = 30
+# Espera (segundos) de los procesos que no obtienen el candado ante una entrada ausente
+ESPERA_MAXIMA = 2.0
+ESPERA_PASO = 0.05
+
+
+def compartida():
+    """¿Ven todos los procesos las mismas entradas e invalidaciones?"""
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def _clave_version(ambito, ambito_id):
+    return f'version:{ambito}:{ambito_id}'
+
+
+def _versiones(ambitos):
+    """Versión actual de cada ámbito {nombre: id}; las que faltan se crean"""
+    claves = {_clave_version(ambito, ambito_id) for ambito, ambito_id in ambitos.items()}
+    versiones = cache.get_many(claves)
+    for clave in claves - versiones.keys():
+        # Valor inicial basado en el reloj: una versión desalojada de la caché
+        # no vuelve a un número ya usado por entradas antiguas
+        cache.add(clave, time.time_ns(), timeout=None)
+        versiones[clave] = cache.get(clave)
+    return ':'.join(f'{clave}={versiones[clave]}' for clave in sorted(claves))
+
+
+def version(**ambitos):
+    """
+    Versión conjunta de los ámbitos dados; cambia con cada invalidar() que
+    afecte a alguno. Sirve para validar copias guardadas fuera de la caché
+    (p. ej. en la sesión) y, como las entradas, solo es fiable entre procesos
+    si compartida().
+    """
+    return _versiones(ambitos)
+
+
+def _incrementar(claves):
+    for clave in claves:
+        try:
+            cache.incr(clave)
+        except ValueError:
+            cache.add(clave, time.time_ns(), timeout=None)
+
+
+def invalidar(doctores=(), clinicas=(), usuarios=()):
+    """
+    Invalida los datos cacheados de `doctores`, `clinicas` y `usuarios` (ids;
+    se ignoran los None). Dentro de una transacción se aplica de inmediato y otra vez al
+    confirmarla: lo que otro proceso cachee entretanto, con los datos de antes
+    del cambio, queda descartado.
+    """
+    claves = {_clave_version('doctor', doctor_id) for doctor_id in doctores if doctor_id is not None}
+    claves |= {_clave_version('clinica', clinica_id) for clinica_id in clinicas if clinica_id is not None}
+    claves |= {_clave_version('usuario', usuario_id) for usuario_id in usuarios if usuario_id is not None}
+    if not claves:
+        return
+    _incrementar(claves)
+    if transaction.get_connection().in_atomic_block:
+        transaction.on_commit(lambda: _incrementar(claves))
+
+
+def _guardar(clave, calcular, timeout):
+    valor = calcular()
+    renovar_en = time.time() + timeout * RENOVAR_DESDE * random.uniform(0.9, 1.0)
+    cache.set(clave, (valor, renovar_en), timeout)
+    return valor
+
+
+def obtener(nombre, calcular, timeout=TIMEOUT, **ambitos):
+    """
+    Valor cacheado de `nombre` para los ámbitos dados (p. ej.
+    doctor=3, clinica=1); si falta o está por caducar se obtiene con
+    `calcular()`.
+    """
+    clave = f'{nombre}|{_versiones(ambitos)}'
+    candado = f'candado|{clave}'
+
+    entrada = cache.get(clave)
+    if entrada is not None:
+        valor, renovar_en = entrada
+        if time.time() < renovar_en or not cache.add(candado, 1, CANDADO_SEGUNDOS):
+            return valor
+        try:
+            return _guardar(clave, calcular, timeout)
+        finally:
+            cache.delete(candado)
+
+    if cache.add(candado, 1, CANDADO_SEGUNDOS):
+        try:
+            return _guardar(clave, calcular, timeout)
+        finally:
+            cache.delete(candado)
+
+    # Otro proceso la está calculando: esperar su resultado
+    limite = time.monotonic() + ESPERA_MAXIMA
+    while time.monotonic() < limite:
+        time.sleep(ESPERA_PASO)
+        entrada = cache.get(clave)
+        if entrada is not None:
+            return entrada[0]
+    return calcular()
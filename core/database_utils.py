@@ -2,11 +2,43 @@
 Database utilities for MySQL stored procedures and advanced queries
 """
 from django.db import connection
+from django.db.models import BigIntegerField, Func
 from django.conf import settings
 import logging
 
 logger = logging.getLogger(__name__)
 
+
+class EpochSeconds(Func):
+    """
+    Segundos UNIX de una columna DateTime calculados en la base de datos.
+    Evita convertir miles de filas a datetime en Python cuando solo se
+    necesitan para cálculos vectorizados. Los DATETIME se guardan en UTC.
+    """
+    output_field = BigIntegerField()
+
+    def as_mysql(self, compiler, connection, **extra_context):
+        # TIMESTAMPDIFF no depende del time_zone de la sesión (a diferencia de UNIX_TIMESTAMP)
+        return self.as_sql(
+            compiler, connection,
+            template="TIMESTAMPDIFF(SECOND, '1970-01-01 00:00:00', %(expressions)s)",
+            **extra_context
+        )
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="CAST(strftime('%%%%s', %(expressions)s) AS INTEGER)",
+            **extra_context
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return self.as_sql(
+            compiler, connection,
+            template="EXTRACT(EPOCH FROM %(expressions)s)::bigint",
+            **extra_context
+        )
+
 class MySQLStoredProcedures:
     """
     Class to manage MySQL stored procedures for MediCitas Pro
@@ -60,7 +92,7 @@ class MySQLStoredProcedures:
             INNER JOIN patients_patient p ON a.paciente_id = p.id
             INNER JOIN doctors_doctor d ON a.doctor_id = d.id
             WHERE a.doctor_id = doctor_id
-                AND DATE(a.fecha) BETWEEN start_date AND end_date
+                AND a.fecha_local BETWEEN start_date AND end_date
                 AND (priority_filter IS NULL OR priority_filter = '' OR p.prioridad = priority_filter)
             ORDER BY a.fecha ASC;
         END;
@@ -79,9 +111,9 @@ class MySQLStoredProcedures:
             SELECT 
                 -- Basic counts
                 COUNT(DISTINCT a.id) as total_appointments,
-                COUNT(DISTINCT CASE WHEN DATE(a.fecha) = CURDATE() THEN a.id END) as today_appointments,
-                COUNT(DISTINCT CASE WHEN YEARWEEK(a.fecha) = YEARWEEK(CURDATE()) THEN a.id END) as week_appointments,
-                COUNT(DISTINCT CASE WHEN YEAR(a.fecha) = YEAR(CURDATE()) AND MONTH(a.fecha) = MONTH(CURDATE()) THEN a.id END) as month_appointments,
+                COUNT(DISTINCT CASE WHEN a.fecha_local = CURDATE() THEN a.id END) as today_appointments,
+                COUNT(DISTINCT CASE WHEN YEARWEEK(a.fecha_local) = YEARWEEK(CURDATE()) THEN a.id END) as week_appointments,
+                COUNT(DISTINCT CASE WHEN a.fecha_local BETWEEN LAST_DAY(CURDATE() - INTERVAL 1 MONTH) + INTERVAL 1 DAY AND LAST_DAY(CURDATE()) THEN a.id END) as month_appointments,
                 COUNT(DISTINCT p.id) as total_patients,
                 
                 -- Upcoming appointments
@@ -94,7 +126,7 @@ class MySQLStoredProcedures:
                 COUNT(DISTINCT CASE WHEN p.prioridad = 'B' THEN a.id END) as low_priority_appointments,
                 
                 -- Average appointments per day
-                ROUND(COUNT(DISTINCT a.id) / GREATEST(DATEDIFF(CURDATE(), MIN(DATE(a.fecha))), 1), 2) as avg_appointments_per_day
+                ROUND(COUNT(DISTINCT a.id) / GREATEST(DATEDIFF(CURDATE(), MIN(a.fecha_local)), 1), 2) as avg_appointments_per_day
                 
             FROM appointments_appointment a
             INNER JOIN patients_patient p ON a.paciente_id = p.id
@@ -167,12 +199,12 @@ class MySQLStoredProcedures:
                 COUNT(CASE WHEN p.prioridad = 'B' THEN 1 END) as low_priority_count,
                 
                 -- Percentages
-                ROUND((COUNT(a.id) * 100.0 / (SELECT COUNT(*) FROM appointments_appointment WHERE DATE(fecha) BETWEEN start_date AND end_date)), 2) as percentage_of_total,
+                ROUND((COUNT(a.id) * 100.0 / (SELECT COUNT(*) FROM appointments_appointment WHERE fecha_local BETWEEN start_date AND end_date)), 2) as percentage_of_total,
                 ROUND(AVG(TIMESTAMPDIFF(YEAR, p.fecha_nacimiento, CURDATE())), 1) as avg_patient_age
                 
             FROM doctors_doctor d
             LEFT JOIN appointments_appointment a ON d.id = a.doctor_id 
-                AND DATE(a.fecha) BETWEEN start_date AND end_date
+                AND a.fecha_local BETWEEN start_date AND end_date
             LEFT JOIN patients_patient p ON a.paciente_id = p.id
             GROUP BY d.id, d.nombre, d.apellidos, d.especialidad
             HAVING total_appointments > 0
@@ -223,10 +255,10 @@ class MySQLStoredProcedures:
             )
             AND (
                 search_term IS NULL OR search_term = '' OR
-                p.nombre LIKE CONCAT('%', search_term, '%') OR
-                p.apellidos LIKE CONCAT('%', search_term, '%') OR
-                p.dni LIKE CONCAT('%', search_term, '%') OR
-                p.informacion_contacto LIKE CONCAT('%', search_term, '%')
+                p.id IN (
+                    SELECT i.paciente_id FROM patients_indicebusquedapaciente i
+                    WHERE MATCH(i.nombre, i.contacto) AGAINST (search_term IN BOOLEAN MODE)
+                )
             )
             AND (priority_filter IS NULL OR priority_filter = '' OR p.prioridad = priority_filter)
             AND (age_min IS NULL OR TIMESTAMPDIFF(YEAR, p.fecha_nacimiento, CURDATE()) >= age_min)
@@ -276,6 +308,10 @@ class MySQLStoredProcedures:
     @staticmethod
     def call_filter_patients(doctor_id, search_term=None, priority_filter=None, age_min=None, age_max=None, limit_count=20, offset_count=0):
         """Call the FilterPatients stored procedure"""
+        from patients.search import consulta_booleana
+
+        # El procedimiento busca con el índice FULLTEXT de patients/search.py
+        search_term = consulta_booleana(search_term) if search_term else None
         with connection.cursor() as cursor:
             cursor.callproc('FilterPatients', [doctor_id, search_term, priority_filter, age_min, age_max, limit_count, offset_count])
             columns = [col[0] for col in cursor.description]
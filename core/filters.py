@@ -0,0 +1,77 @@
+"""
+Filtros por parámetros de consulta para las APIs REST.
+
+Cada ViewSet declara `{parametro: (lookup, conversor)}`; los parámetros
+presentes se convierten y se aplican como un único filter(). Un valor que no
+se puede convertir devuelve 400 en lugar de ignorarse en silencio.
+ListadoFiltradoMixin los aplica al listado junto con la paginación keyset.
+"""
+from datetime import datetime
+
+from rest_framework.exceptions import ValidationError
+
+from .pagination import KeysetPagination
+
+
+def entero(valor):
+    return int(valor)
+
+
+def texto(valor):
+    return valor.strip()
+
+
+def fecha(valor):
+    return datetime.strptime(valor, '%Y-%m-%d').date()
+
+
+def booleano(valor):
+    valor = valor.strip().lower()
+    if valor in ('1', 'true', 'si', 'sí'):
+        return True
+    if valor in ('0', 'false', 'no'):
+        return False
+    raise ValueError(valor)
+
+
+def opcion(opciones):
+    """Conversor que solo acepta las claves de un `choices` de modelo"""
+    claves = {clave for clave, _ in opciones}
+
+    def convertir(valor):
+        if valor not in claves:
+            raise ValueError(valor)
+        return valor
+    return convertir
+
+
+def filtrar_por_parametros(queryset, params, filtros):
+    condiciones = {}
+    errores = {}
+    for parametro, (lookup, conversor) in filtros.items():
+        valor = params.get(parametro)
+        if valor in (None, ''):
+            continue
+        try:
+            condiciones[lookup] = conversor(valor)
+        except (TypeError, ValueError):
+            errores[parametro] = 'Valor inválido'
+    if errores:
+        raise ValidationError(errores)
+    return queryset.filter(**condiciones) if condiciones else queryset
+
+
+class ListadoFiltradoMixin:
+    """
+    Listado de un ViewSet paginado por cursor (`keyset_ordering`, ver
+    core.pagination) y filtrado con `filtros`; el resto de acciones usan el
+    queryset sin filtrar.
+    """
+    pagination_class = KeysetPagination
+    filtros = {}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action == 'list':
+            queryset = filtrar_por_parametros(queryset, self.request.query_params, self.filtros)
+        return queryset
@@ -0,0 +1,126 @@
+"""
+Paginación keyset (por cursor) para las APIs REST.
+
+La página siguiente se pide con un cursor opaco que contiene los valores de
+ordenación de la última fila entregada; la consulta filtra con
+`(f1, f2, ...) > (v1, v2, ...)` y LIMIT, sin OFFSET. Con un índice sobre los
+campos de ordenación, cualquier página cuesta lo mismo que la primera.
+
+Los campos de ordenación no pueden ser nulos y el último debe ser único
+(normalmente `id`).
+"""
+import base64
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    page_size = 50
+    max_page_size = 200
+    ordering = ('-id',)
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Cursor inválido'
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'keyset_ordering', self.ordering))
+
+    def get_page_size(self, request):
+        try:
+            tamaño = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return min(max(tamaño, 1), self.max_page_size)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering_fields = self.get_ordering(view)
+        self.page_size_actual = self.get_page_size(request)
+        modelo = queryset.model
+
+        queryset = queryset.order_by(*self.ordering_fields)
+        posicion = self.decode_cursor(request, modelo)
+        if posicion is not None:
+            queryset = queryset.filter(self.filtro_posicion(posicion))
+
+        # Una fila extra indica si hay página siguiente
+        filas = list(queryset[:self.page_size_actual + 1])
+        self.has_next = len(filas) > self.page_size_actual
+        self.page = filas[:self.page_size_actual]
+        return self.page
+
+    def filtro_posicion(self, posicion):
+        """(f1, f2, ...) > (v1, v2, ...) respetando la dirección de cada campo"""
+        filtro = Q()
+        iguales = {}
+        for orden, valor in zip(self.ordering_fields, posicion):
+            campo = orden.lstrip('-')
+            operador = 'lt' if orden.startswith('-') else 'gt'
+            filtro |= Q(**iguales, **{f'{campo}__{operador}': valor})
+            iguales[campo] = valor
+        # Condición redundante sobre el primer campo: permite al motor empezar
+        # a leer el índice en la posición del cursor en vez de recorrerlo con el OR
+        primero = self.ordering_fields[0]
+        operador = 'lte' if primero.startswith('-') else 'gte'
+        return Q(**{f'{primero.lstrip("-")}__{operador}': posicion[0]}) & filtro
+
+    def valores_posicion(self, instancia):
+        # Filas de modelo o diccionarios de values()
+        if isinstance(instancia, dict):
+            return [instancia[orden.lstrip('-')] for orden in self.ordering_fields]
+        return [getattr(instancia, orden.lstrip('-')) for orden in self.ordering_fields]
+
+    def encode_cursor(self, instancia):
+        valores = [
+            valor.isoformat() if hasattr(valor, 'isoformat') else valor
+            for valor in self.valores_posicion(instancia)
+        ]
+        cursor = base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request, modelo):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            valores = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+            if not isinstance(valores, list) or len(valores) != len(self.ordering_fields):
+                raise ValueError
+            return [
+                modelo._meta.get_field(orden.lstrip('-')).to_python(valor)
+                for orden, valor in zip(self.ordering_fields, valores)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1])
+
+    def get_first_link(self):
+        return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('first', self.get_first_link()),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'first': {'type': 'string', 'format': 'uri'},
+                'results': schema,
+            },
+        }
@@ -0,0 +1,187 @@
+"""
+Pub/sub para los streams de eventos (SSE).
+
+Los publicadores son código síncrono en cualquier hilo (señales de modelos);
+cada mensaje se entrega en el bucle de eventos de cada suscriptor con
+call_soon_threadsafe. Cada suscripción tiene un buffer acotado: si un
+cliente lento lo llena se descartan los mensajes más antiguos y la
+suscripción queda marcada como desbordada para que el cliente se
+resincronice.
+
+Broker solo alcanza a los suscriptores del mismo proceso. Con varios
+procesos ASGI hay que usar RedisBroker (settings.PUBSUB_BACKEND = 'redis'):
+cada mensaje se publica en un canal de Redis y un hilo de cada proceso lo
+reparte entre sus suscripciones locales.
+"""
+import asyncio
+import itertools
+import json
+import threading
+import time
+from collections import deque
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+MAX_BUFFER_SUSCRIPCION = 100
+
+# Canal de Redis por el que pasan todos los mensajes de RedisBroker
+CANAL_REDIS = 'medicitas:eventos'
+# Espera antes de volver a conectar con Redis tras perder la conexión
+REINTENTO_REDIS_SEGUNDOS = 1
+
+
+class Suscripcion:
+    def __init__(self, canales, max_buffer, loop):
+        self.canales = frozenset(canales)
+        self.max_buffer = max_buffer
+        self.loop = loop
+        self.buffer = deque()
+        self.desbordada = False
+        self._aviso = asyncio.Event()
+
+    def _entregar(self, mensaje):
+        # Se ejecuta en el bucle de eventos del suscriptor
+        if len(self.buffer) >= self.max_buffer:
+            self.buffer.popleft()
+            self.desbordada = True
+        self.buffer.append(mensaje)
+        self._aviso.set()
+
+    async def esperar(self, timeout):
+        """Mensajes pendientes como [(secuencia, mensaje)]; [] si vence el timeout"""
+        if not self.buffer:
+            try:
+                await asyncio.wait_for(self._aviso.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        self._aviso.clear()
+        mensajes = list(self.buffer)
+        self.buffer.clear()
+        return mensajes
+
+
+class Broker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._canales = {}
+        self._secuencia = itertools.count(1)
+
+    def suscribir(self, canales, max_buffer=MAX_BUFFER_SUSCRIPCION):
+        """Debe llamarse desde el bucle de eventos que consumirá los mensajes"""
+        suscripcion = Suscripcion(canales, max_buffer, asyncio.get_running_loop())
+        with self._lock:
+            for canal in suscripcion.canales:
+                self._canales.setdefault(canal, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            for canal in suscripcion.canales:
+                suscripciones = self._canales.get(canal)
+                if suscripciones is None:
+                    continue
+                suscripciones.discard(suscripcion)
+                if not suscripciones:
+                    del self._canales[canal]
+
+    def total_suscripciones(self):
+        with self._lock:
+            return len(set().union(*self._canales.values()))
+
+    def publicar(self, canales, mensaje):
+        """
+        Entrega `mensaje` una sola vez a cada suscripción de alguno de los
+        `canales`. Devuelve el número de suscripciones alcanzadas.
+        """
+        return self._repartir(canales, mensaje)
+
+    def _repartir(self, canales, mensaje):
+        """Entrega a las suscripciones de este proceso"""
+        with self._lock:
+            destinatarios = set()
+            for canal in canales:
+                destinatarios.update(self._canales.get(canal, ()))
+            if not destinatarios:
+                return 0
+            item = (next(self._secuencia), mensaje)
+
+        cerradas = []
+        for suscripcion in destinatarios:
+            try:
+                suscripcion.loop.call_soon_threadsafe(suscripcion._entregar, item)
+            except RuntimeError:
+                # Bucle de eventos cerrado: el cliente ya no existe
+                cerradas.append(suscripcion)
+        for suscripcion in cerradas:
+            self.cancelar(suscripcion)
+        return len(destinatarios) - len(cerradas)
+
+    def _marcar_desbordadas(self):
+        """Todas las suscripciones deben resincronizarse (se perdieron mensajes)"""
+        with self._lock:
+            suscripciones = set().union(*self._canales.values())
+        for suscripcion in suscripciones:
+            try:
+                suscripcion.loop.call_soon_threadsafe(_desbordar, suscripcion)
+            except RuntimeError:
+                self.cancelar(suscripcion)
+
+
+def _desbordar(suscripcion):
+    suscripcion.desbordada = True
+    suscripcion._aviso.set()
+
+
+class RedisBroker(Broker):
+    """
+    Broker compartido entre procesos mediante Redis pub/sub (requiere el
+    paquete redis). Los mensajes deben ser serializables a JSON.
+    """
+
+    def __init__(self, url):
+        super().__init__()
+        import redis
+        self._redis = redis.Redis.from_url(url)
+        self._errores_redis = (redis.ConnectionError, redis.TimeoutError)
+        self._lock_oyente = threading.Lock()
+        self._oyente = None
+
+    def suscribir(self, canales, max_buffer=MAX_BUFFER_SUSCRIPCION):
+        self._escuchar()
+        return super().suscribir(canales, max_buffer)
+
+    def publicar(self, canales, mensaje):
+        """Publica en Redis; devuelve el número de procesos que lo reciben"""
+        datos = json.dumps({'canales': sorted(canales), 'mensaje': mensaje}, cls=DjangoJSONEncoder)
+        return self._redis.publish(CANAL_REDIS, datos)
+
+    def _escuchar(self):
+        """Arranca (una vez por proceso) el hilo que reparte los mensajes de Redis"""
+        with self._lock_oyente:
+            if self._oyente is None or not self._oyente.is_alive():
+                self._oyente = threading.Thread(target=self._bucle, name='pubsub-redis', daemon=True)
+                self._oyente.start()
+
+    def _bucle(self):
+        while True:
+            try:
+                pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CANAL_REDIS)
+                for item in pubsub.listen():
+                    datos = json.loads(item['data'])
+                    self._repartir(datos['canales'], datos['mensaje'])
+            except self._errores_redis:
+                # Los mensajes publicados mientras tanto se pierden: los clientes recargan
+                self._marcar_desbordadas()
+                time.sleep(REINTENTO_REDIS_SEGUNDOS)
+
+
+def crear_broker():
+    if settings.PUBSUB_BACKEND == 'redis':
+        return RedisBroker(settings.PUBSUB_REDIS_URL)
+    return Broker()
+
+
+# Instancia compartida por el proceso
+broker = crear_broker()
@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'clinicas.middleware.ContextoClinicaMiddleware',  # request.doctor, request.clinica, request.clinic_roles
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -75,6 +76,8 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'core.wsgi.application'
+# Necesario para el stream SSE de eventos de citas (ver core/asgi.py)
+ASGI_APPLICATION = 'core.asgi.application'
 
 
 # Database
@@ -155,3 +158,44 @@ SESSION_COOKIE_AGE = 1800  # 30 min
 
 # Si deseas que la sesión se borre al cerrar el navegador
 SESSION_EXPIRE_AT_BROWSER_CLOSE = True
+
+# Progreso del comando mantenimiento_citas (para reanudar tras una interrupción).
+# Estado de ejecución: fuera del repositorio (está en .gitignore) y configurable
+MANTENIMIENTO_CITAS_CHECKPOINT = BASE_DIR / '.mantenimiento_citas.json'
+
+# Pub/sub del stream de eventos de citas (ver core/pubsub.py). 'memoria' solo
+# reparte los eventos dentro de un proceso: con más de un worker ASGI usar
+# 'redis' (requiere el paquete redis) para que lleguen a todos los clientes.
+PUBSUB_BACKEND = 'memoria'
+PUBSUB_REDIS_URL = 'redis://127.0.0.1:6379/2'
+
+# Caché de los dashboards (ver core/cache.py). 'locmem' (por defecto, para
+# desarrollo) es privada de cada proceso: con varios workers las
+# invalidaciones no llegan a los demás, que sirven datos de hasta TIMEOUT
+# segundos de antigüedad. 'archivo' la comparten los workers de un mismo
+# servidor; con varios servidores usar 'redis' (requiere el paquete redis) o
+# 'memcached' (requiere pymemcache).
+CACHE_BACKEND = 'locmem'
+CACHES_DISPONIBLES = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'medicitas',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'archivo': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / '.cache',
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+    'redis': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://127.0.0.1:6379/1',
+    },
+    'memcached': {
+        'BACKEND': 'django.core.cache.backends.memcached.PyMemcacheCache',
+        'LOCATION': '127.0.0.1:11211',
+    },
+}
+CACHES = {
+    'default': {**CACHES_DISPONIBLES[CACHE_BACKEND], 'KEY_PREFIX': 'medicitas', 'TIMEOUT': 300},
+}
@@ -20,7 +20,7 @@ from django.contrib.auth import views as auth_views
 from django.contrib.auth.views import LogoutView  # Importa LogoutView
 from appointments.views import crear_cita
 
-from doctors.views import dashboard  # Importa LoginView
+from doctors.views import citas_prioridad_dashboard, dashboard  # Importa LoginView
 
 
 from core.views_analytics import analytics_dashboard, appointment_analytics_ajax, export_analytics_report
@@ -29,6 +29,7 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('', auth_views.LoginView.as_view(template_name='login.html'), name='login'),  # Pantalla principal
     path('doctors/dashboard/', dashboard, name='doctor_dashboard'),  # Ruta para el dashboard del doctor
+    path('doctors/dashboard/citas/', citas_prioridad_dashboard, name='doctor_dashboard_citas'),
     path('logout/', LogoutView.as_view(), name='logout'),  # Añadir la ruta de cierre de sesión
     
     # Appointments URLs
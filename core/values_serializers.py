@@ -0,0 +1,128 @@
+"""
+Listados de solo lectura basados en values().
+
+Para las acciones `list`, los ViewSets con ValuesListMixin leen las filas con
+`values()` y construyen los diccionarios directamente, sin instanciar modelos
+ni recorrer los campos del ModelSerializer. La salida por defecto es la misma
+que la del serializer con `fields='__all__'`.
+
+- `?fields=id,fecha,paciente`: solo esos campos.
+- `?expand=paciente,doctor`: sustituye el id de la relación por un objeto con
+  las columnas declaradas en `campos_expandibles`, leídas con JOIN en la
+  misma consulta.
+"""
+from django.db import models
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+
+def _fecha_hora(valor):
+    # Mismo formato que serializers.DateTimeField (ISO 8601 en la zona actual)
+    if valor is None:
+        return None
+    texto = timezone.localtime(valor).isoformat()
+    return texto[:-6] + 'Z' if texto.endswith('+00:00') else texto
+
+
+def _fecha(valor):
+    return valor.isoformat() if valor is not None else None
+
+
+def _conversor(campo):
+    # Se devuelven cadenas ya formateadas: el render JSON no tiene que
+    # pasar cada fecha por el encoder
+    if isinstance(campo, models.DateTimeField):
+        return _fecha_hora
+    if isinstance(campo, models.DateField):
+        return _fecha
+    return None
+
+
+def _lista_parametro(params, nombre):
+    valor = params.get(nombre)
+    if not valor:
+        return []
+    return [parte.strip() for parte in valor.split(',') if parte.strip()]
+
+
+class ValuesListMixin:
+    # {relación: (campos del modelo relacionado, ...)}
+    campos_expandibles = {}
+
+    def campos_lista(self):
+        """
+        {nombre: (lookup, conversor)} de los campos concretos del modelo, en el
+        orden de ModelSerializer: clave primaria, campos simples y relaciones
+        """
+        opts = self.get_queryset().model._meta
+        simples = [campo for campo in opts.concrete_fields if not campo.primary_key and not campo.is_relation]
+        relaciones = [campo for campo in opts.concrete_fields if campo.is_relation]
+        return {
+            campo.name: (campo.name, _conversor(campo))
+            for campo in [opts.pk] + simples + relaciones
+        }
+
+    def columnas_lista(self, params):
+        """Lista de (clave, lookup, conversor, anidados) según fields/expand"""
+        modelo = self.get_queryset().model
+        disponibles = self.campos_lista()
+
+        pedidos = _lista_parametro(params, 'fields') or list(disponibles)
+        expandir = _lista_parametro(params, 'expand')
+        desconocidos = [nombre for nombre in pedidos if nombre not in disponibles]
+        if desconocidos:
+            raise ValidationError({'fields': f'Campos desconocidos: {", ".join(desconocidos)}'})
+        no_expandibles = [nombre for nombre in expandir if nombre not in self.campos_expandibles]
+        if no_expandibles:
+            raise ValidationError({'expand': f'Relaciones no expandibles: {", ".join(no_expandibles)}'})
+
+        columnas = []
+        for nombre in pedidos + [nombre for nombre in expandir if nombre not in pedidos]:
+            lookup, conversor = disponibles[nombre]
+            anidados = None
+            if nombre in expandir:
+                relacionado = modelo._meta.get_field(nombre).related_model
+                anidados = [('id', lookup, None)] + [
+                    (campo, f'{nombre}__{campo}', _conversor(relacionado._meta.get_field(campo)))
+                    for campo in self.campos_expandibles[nombre]
+                ]
+            columnas.append((nombre, lookup, conversor, anidados))
+        return columnas
+
+    def list(self, request, *args, **kwargs):
+        columnas = self.columnas_lista(request.query_params)
+
+        lookups = set()
+        for _, lookup, _, anidados in columnas:
+            lookups.add(lookup)
+            if anidados:
+                lookups.update(lookup_anidado for _, lookup_anidado, _ in anidados)
+        # La paginación keyset necesita los campos de ordenación en cada fila
+        lookups.update(orden.lstrip('-') for orden in getattr(self, 'keyset_ordering', ()))
+
+        queryset = self.filter_queryset(self.get_queryset()).values(*lookups)
+        page = self.paginate_queryset(queryset)
+        filas = page if page is not None else queryset
+
+        data = [self.fila_lista(fila, columnas) for fila in filas]
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    @staticmethod
+    def fila_lista(fila, columnas):
+        resultado = {}
+        for clave, lookup, conversor, anidados in columnas:
+            if anidados is not None:
+                if fila[lookup] is None:
+                    resultado[clave] = None
+                    continue
+                resultado[clave] = {
+                    subclave: conversor_anidado(fila[sublookup]) if conversor_anidado else fila[sublookup]
+                    for subclave, sublookup, conversor_anidado in anidados
+                }
+                continue
+            valor = fila[lookup]
+            resultado[clave] = conversor(valor) if conversor else valor
+        return resultado
@@ -5,9 +5,10 @@ from django.http import JsonResponse
 from django.utils import timezone
 from datetime import datetime, timedelta, date
 from django.db.models import Count, Q, Avg
-from doctors.models import Doctor
 from patients.models import Patient
 from appointments.models import Appointment
+from appointments.counters import resumir_contadores
+from appointments.local_time import hoy_local
 # from core.database_utils import MySQLStoredProcedures  # Comentado temporalmente
 import json
 
@@ -15,9 +16,8 @@ import json
 @login_required
 def analytics_dashboard(request):
     """Dashboard principal de analytics y reportes"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -35,37 +35,29 @@ def analytics_dashboard(request):
         start_date = start_date_obj.strftime('%Y-%m-%d')
         end_date = end_date_obj.strftime('%Y-%m-%d')
     
-    # Usar consultas Django directamente (más confiable)
-    # Estadísticas básicas del doctor
-    total_appointments = Appointment.objects.filter(doctor=doctor).count()
-    today_appointments = Appointment.objects.filter(
-        doctor=doctor, 
-        fecha__date=timezone.now().date()
-    ).count()
-    
-    week_start = timezone.now().date() - timedelta(days=7)
-    month_start = timezone.now().date() - timedelta(days=30)
-    
-    week_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date__gte=week_start
-    ).count()
-    
-    month_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date__gte=month_start
-    ).count()
+    # Estadísticas básicas del doctor: una consulta sobre los contadores diarios
+    # y otra sobre las citas para lo que no se puede contar por día
+    today = hoy_local(doctor.clinica_id)
+    resumen = resumir_contadores(
+        doctor.id,
+        hoy=Q(fecha=today),
+        semana=Q(fecha__gte=today - timedelta(days=7)),
+        mes=Q(fecha__gte=today - timedelta(days=30)),
+    )
+    citas = Appointment.objects.filter(doctor=doctor).aggregate(
+        pacientes=Count('paciente_id', distinct=True),
+        proximas=Count('id', filter=Q(fecha__gt=timezone.now())),
+    )
     
     doctor_stats = {
-        'total_appointments': total_appointments,
-        'today_appointments': today_appointments,
-        'week_appointments': week_appointments,
-        'month_appointments': month_appointments,
-        'total_patients': Patient.objects.filter(appointment__doctor=doctor).distinct().count(),
-        'upcoming_appointments': Appointment.objects.filter(
-            doctor=doctor, 
-            fecha__gt=timezone.now()
-        ).count(),
+        'total_appointments': resumen['total'],
+        'today_appointments': resumen['hoy'],
+        'week_appointments': resumen['semana'],
+        'month_appointments': resumen['mes'],
+        'total_patients': citas['pacientes'],
+        'upcoming_appointments': citas['proximas'],
+        'urgent_appointments': resumen['prioridades'].get(Patient.PRIORITY_URGENT, 0),
+        'high_priority_appointments': resumen['prioridades'].get(Patient.PRIORITY_HIGH, 0),
     }
     
     # Estadísticas de pacientes
@@ -78,15 +70,15 @@ def analytics_dashboard(request):
     # Analytics de citas en el período
     appointment_analytics = Appointment.objects.filter(
         doctor=doctor,
-        fecha__date__range=[start_date_obj, end_date_obj]
-    ).values('fecha__date').annotate(
+        fecha_local__range=[start_date_obj, end_date_obj]
+    ).values('fecha_local').annotate(
         count=Count('id')
-    ).order_by('fecha__date')
+    ).order_by('fecha_local')
     
     # Citas filtradas
     filtered_appointments = Appointment.objects.filter(
         doctor=doctor,
-        fecha__date__range=[start_date_obj, end_date_obj]
+        fecha_local__range=[start_date_obj, end_date_obj]
     ).select_related('paciente').order_by('-fecha')[:20]
     
     # Preparar datos para gráficos
@@ -110,9 +102,8 @@ def analytics_dashboard(request):
 @login_required
 def appointment_analytics_ajax(request):
     """AJAX endpoint para analytics de citas"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         return JsonResponse({'error': 'Doctor no encontrado'}, status=404)
     
     start_date = request.GET.get('start_date')
@@ -149,9 +140,8 @@ def appointment_analytics_ajax(request):
 @login_required
 def export_analytics_report(request):
     """Exportar reporte de analytics en formato JSON/CSV"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         return JsonResponse({'error': 'Doctor no encontrado'}, status=404)
     
     start_date = request.GET.get('start_date')
@@ -183,7 +173,7 @@ def export_analytics_report(request):
         # Usar consultas Django básicas
         appointments = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__range=[start_date_obj, end_date_obj]
+            fecha_local__range=[start_date_obj, end_date_obj]
         )
         
         report_data.update({
@@ -215,7 +205,7 @@ def prepare_chart_data(doctor, start_date, end_date):
         # Usar consultas Django básicas (más confiable)
         appointments = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__range=[start_date, end_date]
+            fecha_local__range=[start_date, end_date]
         ).select_related('paciente')
         
         # Inicializar contadores
@@ -289,7 +279,7 @@ def get_appointments_by_day_chart(doctor, start_date, end_date):
     try:
         appointments = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__range=[start_date, end_date]
+            fecha_local__range=[start_date, end_date]
         )
         
         daily_counts = {}
@@ -321,7 +311,7 @@ def get_priority_distribution_chart(doctor, start_date, end_date):
     try:
         appointments = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__range=[start_date, end_date]
+            fecha_local__range=[start_date, end_date]
         ).select_related('paciente')
         
         priority_counts = {'Urgente': 0, 'Alta': 0, 'Media': 0, 'Baja': 0}
@@ -388,7 +378,7 @@ def get_appointments_by_hour_chart(doctor, start_date, end_date):
     try:
         appointments = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__range=[start_date, end_date]
+            fecha_local__range=[start_date, end_date]
         )
         
         hourly_counts = {i: 0 for i in range(8, 19)}  # 8 AM to 6 PM
@@ -1,7 +1,11 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
+from django.db.models import OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
 from django.utils.html import format_html
+from appointments.models import ContadorDiarioCitas
+from core.admin_utils import ListadoRapidoMixin
 from .models import Doctor
 
 class DoctorInline(admin.StackedInline):
@@ -36,6 +40,7 @@ class UserAdmin(BaseUserAdmin):
     list_display = ('get_user_info', 'get_doctor_info', 'get_status_badges', 'get_contact_info', 'last_login')
     list_filter = ('is_staff', 'is_superuser', 'is_active', 'doctor__especialidad', 'doctor__activo')
     search_fields = ('username', 'first_name', 'last_name', 'email', 'doctor__nombre', 'doctor__apellidos', 'doctor__especialidad')
+    list_select_related = ('doctor',)
     list_per_page = 25
     
     def get_user_info(self, obj):
@@ -110,11 +115,12 @@ admin.site.register(User, UserAdmin)
 
 # Admin independiente para Doctor
 @admin.register(Doctor)
-class DoctorAdmin(admin.ModelAdmin):
+class DoctorAdmin(ListadoRapidoMixin, admin.ModelAdmin):
     list_display = ('get_full_name', 'especialidad', 'get_status_badge', 'telefono', 'clinica', 'get_appointment_count')
     list_filter = ('especialidad', 'activo', 'clinica')
     search_fields = ('nombre', 'apellidos', 'especialidad', 'telefono', 'usuario__username')
     ordering = ('apellidos', 'nombre')
+    list_select_related = ('usuario', 'clinica')
     list_per_page = 25
     
     fieldsets = (
@@ -136,6 +142,13 @@ class DoctorAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        # Citas por doctor desde los contadores diarios: una subconsulta, no un COUNT por fila
+        citas = ContadorDiarioCitas.objects.filter(doctor=OuterRef('pk')).order_by().values('doctor')
+        return super().get_queryset(request).annotate(
+            num_citas=Coalesce(Subquery(citas.annotate(n=Sum('total')).values('n')), 0)
+        )
+    
     def get_full_name(self, obj):
         return format_html(
             '<strong>Dr(a). {}</strong><br><small style="color: #6c757d;">👤 {}</small>',
@@ -158,11 +171,12 @@ class DoctorAdmin(admin.ModelAdmin):
     get_status_badge.admin_order_field = 'activo'
     
     def get_appointment_count(self, obj):
-        count = obj.appointment_set.count()
+        count = obj.num_citas
         if count > 0:
             return format_html('<span style="color: #007bff; font-weight: bold;">📅 {}</span>', count)
         return format_html('<span style="color: #6c757d;">➖ 0</span>')
     get_appointment_count.short_description = '📊 Citas'
+    get_appointment_count.admin_order_field = 'num_citas'
 #     search_fields = ('nombre', 'apellidos', 'especialidad')
 #     ordering = ('apellidos', 'nombre')
 #     filter_horizontal = []
\ No newline at end of file
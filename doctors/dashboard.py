@@ -0,0 +1,100 @@
+"""
+Citas del dashboard del doctor agrupadas por prioridad del paciente.
+
+La primera página sale de una sola consulta con funciones de ventana: por
+cada prioridad, las primeras POR_GRUPO citas (ROW_NUMBER sobre fecha, id)
+y el total del grupo (COUNT sobre la misma partición). Las siguientes
+páginas de un grupo se piden con un cursor (fecha, id) y LIMIT, sin OFFSET.
+El tiempo de la página no depende de cuántas citas futuras tenga el doctor.
+"""
+import base64
+import json
+from datetime import datetime
+
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When, Window
+from django.db.models.functions import RowNumber
+
+from appointments.models import Appointment
+from patients.models import Patient
+
+# Citas por grupo en la carga inicial y en cada "Cargar más"
+POR_GRUPO = 10
+
+# Orden de los grupos: de mayor a menor prioridad
+ORDEN_PRIORIDADES = (
+    Patient.PRIORITY_URGENT,
+    Patient.PRIORITY_HIGH,
+    Patient.PRIORITY_MEDIUM,
+    Patient.PRIORITY_LOW,
+)
+NOMBRES_PRIORIDAD = dict(Patient.PRIORITY_CHOICES)
+
+
+class CursorInvalido(ValueError):
+    pass
+
+
+def codificar_cursor(cita):
+    valores = [cita.fecha.isoformat(), cita.id]
+    return base64.urlsafe_b64encode(json.dumps(valores).encode()).decode()
+
+
+def decodificar_cursor(cursor):
+    """(fecha, id) de la última cita entregada"""
+    try:
+        fecha, cita_id = json.loads(base64.urlsafe_b64decode(cursor.encode()).decode())
+        return datetime.fromisoformat(fecha), int(cita_id)
+    except Exception:
+        raise CursorInvalido('Cursor inválido')
+
+
+def _citas(doctor, desde):
+    return Appointment.objects.filter(doctor=doctor, fecha_local__gte=desde).select_related('paciente')
+
+
+def grupos_por_prioridad(doctor, desde, por_grupo=POR_GRUPO):
+    """
+    [{prioridad, nombre, citas, total, siguiente}] en orden de prioridad,
+    solo los grupos con citas. `siguiente` es el cursor de la página
+    siguiente del grupo (None si no hay más).
+    """
+    particion = F('paciente__prioridad')
+    rango = Case(
+        *[When(paciente__prioridad=codigo, then=Value(i)) for i, codigo in enumerate(ORDEN_PRIORIDADES)],
+        default=Value(len(ORDEN_PRIORIDADES)),
+        output_field=IntegerField(),
+    )
+    citas = _citas(doctor, desde).annotate(
+        posicion=Window(RowNumber(), partition_by=particion, order_by=[F('fecha').asc(), F('id').asc()]),
+        total_grupo=Window(Count('id'), partition_by=particion),
+        rango_prioridad=rango,
+    ).filter(posicion__lte=por_grupo).order_by('rango_prioridad', 'fecha', 'id')
+
+    grupos = {}
+    for cita in citas:
+        prioridad = cita.paciente.prioridad
+        grupo = grupos.setdefault(prioridad, {
+            'prioridad': prioridad,
+            'nombre': NOMBRES_PRIORIDAD.get(prioridad, prioridad),
+            'citas': [],
+            'total': cita.total_grupo,
+        })
+        grupo['citas'].append(cita)
+    for grupo in grupos.values():
+        grupo['siguiente'] = (
+            codificar_cursor(grupo['citas'][-1]) if grupo['total'] > len(grupo['citas']) else None
+        )
+    return list(grupos.values())
+
+
+def pagina_prioridad(doctor, desde, prioridad, cursor, por_grupo=POR_GRUPO):
+    """(citas, siguiente) del grupo `prioridad` a continuación de `cursor`"""
+    fecha, cita_id = decodificar_cursor(cursor)
+    citas = list(
+        _citas(doctor, desde).filter(paciente__prioridad=prioridad)
+        .filter(Q(fecha__gte=fecha) & (Q(fecha__gt=fecha) | Q(fecha=fecha, id__gt=cita_id)))
+        .order_by('fecha', 'id')[:por_grupo + 1]
+    )
+    # Una fila extra indica si hay página siguiente
+    siguiente = codificar_cursor(citas[por_grupo - 1]) if len(citas) > por_grupo else None
+    return citas[:por_grupo], siguiente
@@ -0,0 +1,132 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from datetime import datetime, timedelta
+import calendar
+import statistics
+import time
+
+from doctors.models import Doctor
+from patients.models import Patient
+from appointments.models import Appointment
+from appointments.local_time import asignar_fecha_local
+from appointments import views_calendario
+
+
+class Command(BaseCommand):
+    help = 'Mide tiempo, tamaño de respuesta y consultas del calendario mensual con un volumen dado de citas'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--citas',
+            type=int,
+            default=10000,
+            help='Citas sintéticas a generar en el mes (default: 10000)'
+        )
+        parser.add_argument(
+            '--mes',
+            type=int,
+            help='Mes a medir (default: mes siguiente al actual)'
+        )
+        parser.add_argument(
+            '--año',
+            type=int,
+            help='Año a medir (default: año del mes siguiente)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Repeticiones por medición (default: 5)'
+        )
+        parser.add_argument(
+            '--conservar',
+            action='store_true',
+            help='No revertir las citas generadas al terminar'
+        )
+
+    def handle(self, *args, **options):
+        doctor = Doctor.objects.filter(activo=True, clinica__isnull=False).select_related('usuario').first()
+        if doctor is None:
+            raise CommandError('Se necesita al menos un doctor activo asignado a una clínica')
+        pacientes = list(Patient.objects.values_list('id', flat=True)[:500])
+        if not pacientes:
+            raise CommandError('Se necesita al menos un paciente')
+
+        siguiente = (timezone.localdate().replace(day=1) + timedelta(days=32)).replace(day=1)
+        mes = options['mes'] or siguiente.month
+        año = options['año'] or siguiente.year
+
+        with transaction.atomic():
+            dias = self.dias_laborales(año, mes)
+            creadas = self.crear_citas(doctor, pacientes, dias, options['citas'])
+            self.stdout.write(self.style.SUCCESS(
+                f'Generadas {creadas} citas en {mes:02d}/{año} para la clínica {doctor.clinica}'
+            ))
+
+            self.medir(
+                'Calendario mensual',
+                views_calendario.vista_calendario,
+                doctor.usuario,
+                {'mes': mes, 'año': año},
+                options['repeticiones'],
+            )
+            self.medir(
+                'Detalle de un día (primera página)',
+                views_calendario.obtener_citas_dia,
+                doctor.usuario,
+                {'fecha': dias[len(dias) // 2].strftime('%Y-%m-%d')},
+                options['repeticiones'],
+            )
+
+            if not options['conservar']:
+                transaction.set_rollback(True)
+                self.stdout.write('Citas generadas revertidas')
+
+    def dias_laborales(self, año, mes):
+        return [
+            datetime(año, mes, dia)
+            for dia in range(1, calendar.monthrange(año, mes)[1] + 1)
+            if datetime(año, mes, dia).weekday() < 5
+        ]
+
+    def crear_citas(self, doctor, pacientes, dias, total):
+        """Reparte `total` citas entre los doctores de la clínica en horario laboral"""
+        doctores = list(Doctor.objects.filter(clinica=doctor.clinica, activo=True).values_list('id', flat=True))
+        huecos_por_dia = 20  # 08:00 - 18:00 cada 30 minutos
+        estados = [clave for clave, _ in Appointment.ESTADOS]
+
+        citas = []
+        for i in range(total):
+            dia = dias[i % len(dias)]
+            hueco = (i // len(dias)) % huecos_por_dia
+            citas.append(asignar_fecha_local(Appointment(
+                paciente_id=pacientes[i % len(pacientes)],
+                doctor_id=doctores[(i // (len(dias) * huecos_por_dia)) % len(doctores)],
+                clinica_id=doctor.clinica_id,
+                fecha=timezone.make_aware(dia + timedelta(hours=8, minutes=30 * hueco)),
+                motivo='Cita sintética de benchmark',
+                estado=estados[i % len(estados)],
+            )))
+        Appointment.objects.bulk_create(citas, batch_size=1000)
+        return len(citas)
+
+    def medir(self, nombre, vista, usuario, params, repeticiones):
+        factory = RequestFactory()
+        tiempos = []
+        for _ in range(repeticiones):
+            request = factory.get('/', params)
+            request.user = usuario
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                response = vista(request)
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+
+        self.stdout.write(f'\n{nombre}:')
+        self.stdout.write(f'  Estado HTTP:      {response.status_code}')
+        self.stdout.write(f'  Tiempo mediana:   {statistics.median(tiempos):.1f} ms')
+        self.stdout.write(f'  Tiempo mínimo:    {min(tiempos):.1f} ms')
+        self.stdout.write(f'  Tamaño respuesta: {len(response.content) / 1024:.1f} KB')
+        self.stdout.write(f'  Consultas SQL:    {len(consultas.captured_queries)}')
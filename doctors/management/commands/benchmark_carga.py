@@ -0,0 +1,100 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.http import JsonResponse
+from django.test.utils import CaptureQueriesContext
+from datetime import timedelta
+import random
+import statistics
+import time
+
+from doctors.models import Doctor
+from clinicas.models import Clinica
+from clinicas.workload import MAX_DIAS, calcular_carga
+from appointments.models import ContadorDiarioCitas
+
+
+class Command(BaseCommand):
+    help = (
+        'Mide el mapa de carga de una clínica (doctores × días) con doctores y '
+        'contadores diarios sintéticos que se revierten al terminar'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--doctores',
+            type=int,
+            default=300,
+            help='Doctores sintéticos en la clínica (default: 300)'
+        )
+        parser.add_argument(
+            '--dias',
+            type=int,
+            default=MAX_DIAS,
+            help=f'Horizonte en días (default: {MAX_DIAS})'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Repeticiones de la medición (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        clinica = Clinica.objects.first()
+        if clinica is None:
+            raise CommandError('Se necesita al menos una clínica')
+        dias = options['dias']
+        desde = clinica.fecha_creacion.date() + timedelta(days=365 * 60)
+
+        try:
+            with transaction.atomic():
+                self.generar(clinica, desde, options['doctores'], dias)
+                self.medir(clinica, desde, dias, options['repeticiones'])
+                raise _Revertir()
+        except _Revertir:
+            pass
+
+    def generar(self, clinica, desde, total, dias):
+        """Doctores en la clínica y contadores con 0-20 citas por doctor-día laborable"""
+        User.objects.bulk_create([User(username=f'benchmark_carga_{i}') for i in range(total)])
+        usuarios = User.objects.filter(username__startswith='benchmark_carga_').values_list('id', flat=True)
+        doctores = Doctor.objects.bulk_create([
+            Doctor(
+                usuario_id=usuario_id, nombre=f'Carga{i}', apellidos='Sintético',
+                especialidad='Medicina General', clinica=clinica,
+                duracion_cita_default=random.choice([15, 20, 30]),
+            )
+            for i, usuario_id in enumerate(usuarios)
+        ])
+        if doctores and doctores[0].pk is None:
+            # MySQL no devuelve los ids de un INSERT múltiple
+            doctores = list(Doctor.objects.filter(usuario__username__startswith='benchmark_carga_'))
+        contadores = [
+            ContadorDiarioCitas(
+                doctor_id=doctor.pk, fecha=desde + timedelta(days=d),
+                estado=random.choice(['programada', 'confirmada']), prioridad='B', total=random.randint(0, 20),
+            )
+            for doctor in doctores for d in range(dias) if (desde + timedelta(days=d)).isoweekday() <= 5
+        ]
+        ContadorDiarioCitas.objects.bulk_create(contadores, batch_size=2000)
+        self.stdout.write(f'{total} doctores, {len(contadores)} contadores sintéticos')
+
+    def medir(self, clinica, desde, dias, repeticiones):
+        tiempos = []
+        for _ in range(repeticiones):
+            with CaptureQueriesContext(connection) as consultas:
+                inicio = time.perf_counter()
+                datos = calcular_carga(clinica, desde, dias)
+                contenido = JsonResponse(datos).content
+                tiempos.append(time.perf_counter() - inicio)
+        filas = len(datos['doctores'])
+        self.stdout.write(self.style.MIGRATE_HEADING(f'Mapa de carga {filas} doctores × {dias} días'))
+        self.stdout.write(
+            f'  mediana {statistics.median(tiempos) * 1000:.1f} ms (cálculo + JSON), '
+            f'{len(consultas)} consultas, {len(contenido) / 1024:.0f} KB'
+        )
+
+
+class _Revertir(Exception):
+    """Fuerza el rollback de los datos sintéticos"""
@@ -0,0 +1,126 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
+from datetime import datetime, timedelta
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+import statistics
+import time
+
+from doctors.models import Doctor
+from patients.models import Patient
+from appointments.models import Appointment
+from appointments.local_time import asignar_fecha_local
+from appointments.serializers import AppointmentSerializaer
+from appointments.views import AppointmentsViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el ModelSerializer de citas con el listado basado en values() '
+        '(serialización + render JSON) para distintos volúmenes de filas'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--filas',
+            type=int,
+            nargs='+',
+            default=[10000, 100000],
+            help='Volúmenes a medir (default: 10000 100000)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=3,
+            help='Repeticiones por medición (default: 3)'
+        )
+
+    def handle(self, *args, **options):
+        doctor = Doctor.objects.filter(activo=True, clinica__isnull=False).first()
+        if doctor is None:
+            raise CommandError('Se necesita al menos un doctor activo asignado a una clínica')
+        pacientes = list(Patient.objects.values_list('id', flat=True)[:500])
+        if not pacientes:
+            raise CommandError('Se necesita al menos un paciente')
+
+        volumenes = sorted(options['filas'])
+        try:
+            with transaction.atomic():
+                self.generar_citas(doctor, pacientes, volumenes[-1])
+                for filas in volumenes:
+                    self.comparar(filas, options['repeticiones'])
+                raise _Revertir()
+        except _Revertir:
+            pass
+
+    def generar_citas(self, doctor, pacientes, total):
+        """Citas sintéticas a partir de 2090; se revierten al terminar"""
+        self.inicio = inicio = timezone.make_aware(datetime(2090, 1, 1, 8))
+        estados = [clave for clave, _ in Appointment.ESTADOS]
+        self.stdout.write(f'Generando {total} citas sintéticas...')
+        Appointment.objects.bulk_create([
+            asignar_fecha_local(Appointment(
+                paciente_id=pacientes[i % len(pacientes)],
+                doctor=doctor,
+                clinica_id=doctor.clinica_id,
+                fecha=inicio + timedelta(minutes=30 * i),
+                motivo='Cita sintética de benchmark',
+                estado=estados[i % len(estados)],
+            ))
+            for i in range(total)
+        ], batch_size=2000)
+
+    def comparar(self, filas, repeticiones):
+        queryset = Appointment.objects.filter(fecha__gte=self.inicio).order_by('fecha', 'id')[:filas]
+        renderer = JSONRenderer()
+
+        def model_serializer():
+            return renderer.render(AppointmentSerializaer(queryset, many=True).data)
+
+        vista = AppointmentsViewSet()
+        vista.action = 'list'
+        vista.request = Request(RequestFactory().get('/'))
+        vista.format_kwarg = None
+        columnas = vista.columnas_lista({})
+        lookups = {lookup for _, lookup, _, _ in columnas}
+
+        def values():
+            return renderer.render([vista.fila_lista(fila, columnas) for fila in queryset.values(*lookups)])
+
+        columnas_expand = vista.columnas_lista({'expand': 'paciente,doctor'})
+        lookups_expand = set()
+        for _, lookup, _, anidados in columnas_expand:
+            lookups_expand.add(lookup)
+            lookups_expand.update(sublookup for _, sublookup, _ in anidados or ())
+
+        def values_expand():
+            return renderer.render([
+                vista.fila_lista(fila, columnas_expand) for fila in queryset.values(*lookups_expand)
+            ])
+
+        if model_serializer() != values():
+            raise CommandError('La salida de values() no coincide con la del ModelSerializer')
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'\n{filas} filas'))
+        base = None
+        for nombre, funcion in (
+            ('ModelSerializer', model_serializer),
+            ('values()', values),
+            ('values() + expand=paciente,doctor', values_expand),
+        ):
+            tiempos = []
+            for _ in range(repeticiones):
+                inicio = time.perf_counter()
+                contenido = funcion()
+                tiempos.append(time.perf_counter() - inicio)
+            mediana = statistics.median(tiempos)
+            base = base or mediana
+            self.stdout.write(
+                f'  {nombre:<36} {mediana * 1000:9.1f} ms  {len(contenido) / 1024:9.0f} KB  x{base / mediana:.1f}'
+            )
+
+
+class _Revertir(Exception):
+    """Fuerza el rollback de los datos sintéticos"""
@@ -384,8 +384,8 @@ class Command(BaseCommand):
         # Appointment distribution
         if appointments_created > 0:
             today = timezone.now().date()
-            past_appointments = Appointment.objects.filter(fecha__date__lt=today).count()
-            future_appointments = Appointment.objects.filter(fecha__date__gte=today).count()
+            past_appointments = Appointment.objects.filter(fecha_local__lt=today).count()
+            future_appointments = Appointment.objects.filter(fecha_local__gte=today).count()
             
             self.stdout.write('\nDistribución temporal de citas:')
             self.stdout.write(f'  - Citas pasadas: {past_appointments}')
@@ -0,0 +1,90 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Count
+from datetime import datetime
+import statistics
+import time
+
+from doctors.models import Doctor
+from appointments.models import Appointment
+from appointments.local_time import hoy_local, rango_mes
+
+
+class Command(BaseCommand):
+    help = (
+        'Compara el plan de ejecución (EXPLAIN) y el tiempo de las consultas por día/mes '
+        'con funciones sobre `fecha` frente a los predicados de rango sobre `fecha_local`'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--doctor-id',
+            type=int,
+            help='Doctor a usar en las consultas (default: el primer doctor activo con clínica)'
+        )
+        parser.add_argument(
+            '--fecha',
+            help='Día de referencia YYYY-MM-DD (default: hoy en la zona de la clínica)'
+        )
+        parser.add_argument(
+            '--repeticiones',
+            type=int,
+            default=5,
+            help='Repeticiones por consulta para medir el tiempo (default: 5)'
+        )
+
+    def handle(self, *args, **options):
+        doctores = Doctor.objects.filter(activo=True, clinica__isnull=False)
+        if options['doctor_id']:
+            doctores = doctores.filter(id=options['doctor_id'])
+        doctor = doctores.first()
+        if doctor is None:
+            raise CommandError('Se necesita un doctor activo asignado a una clínica')
+
+        if options['fecha']:
+            try:
+                dia = datetime.strptime(options['fecha'], '%Y-%m-%d').date()
+            except ValueError:
+                raise CommandError('--fecha debe tener el formato YYYY-MM-DD')
+        else:
+            dia = hoy_local(doctor.clinica_id)
+        inicio_mes, fin_mes = rango_mes(dia)
+
+        citas = Appointment.objects.all()
+        comparaciones = [
+            (
+                'Citas del día de un doctor',
+                citas.filter(doctor=doctor, fecha__date=dia),
+                citas.filter(doctor=doctor, fecha_local=dia),
+            ),
+            (
+                'Citas del mes de una clínica',
+                citas.filter(clinica_id=doctor.clinica_id, fecha__year=dia.year, fecha__month=dia.month),
+                citas.filter(clinica_id=doctor.clinica_id, fecha_local__range=(inicio_mes, fin_mes)),
+            ),
+            (
+                'Conteo por día del mes (todas las clínicas)',
+                citas.filter(fecha__date__range=(inicio_mes, fin_mes)).values('fecha__date')
+                .annotate(total=Count('id')).order_by(),
+                citas.filter(fecha_local__range=(inicio_mes, fin_mes)).values('fecha_local')
+                .annotate(total=Count('id')).order_by(),
+            ),
+        ]
+
+        self.stdout.write(f'Motor: {connection.vendor} | doctor {doctor.id} | día {dia}')
+        for titulo, antes, despues in comparaciones:
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{titulo}'))
+            for etiqueta, queryset in (('antes (función sobre fecha)', antes), ('después (fecha_local)', despues)):
+                filas, segundos = self.medir(queryset, options['repeticiones'])
+                self.stdout.write(f'  {etiqueta}: {filas} filas, mediana {segundos * 1000:.2f} ms')
+                for linea in queryset.explain().splitlines():
+                    self.stdout.write(f'      {linea}')
+
+    def medir(self, queryset, repeticiones):
+        tiempos = []
+        filas = 0
+        for _ in range(max(repeticiones, 1)):
+            inicio = time.perf_counter()
+            filas = len(list(queryset.all()))
+            tiempos.append(time.perf_counter() - inicio)
+        return filas, statistics.median(tiempos)
@@ -0,0 +1,191 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.utils import timezone
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta
+import asyncio
+import json
+import statistics
+import time
+import tracemalloc
+
+from doctors.models import Doctor
+from patients.models import Patient
+from appointments.models import Appointment
+from core.pubsub import broker
+
+
+class Command(BaseCommand):
+    help = (
+        'Prueba de carga del stream SSE de citas: abre cientos de suscriptores '
+        'concurrentes contra core.asgi.application, los mantiene inactivos y mide '
+        'memoria, CPU en reposo y latencia de entrega de eventos'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--suscriptores',
+            type=int,
+            default=500,
+            help='Conexiones SSE concurrentes (default: 500)'
+        )
+        parser.add_argument(
+            '--reposo',
+            type=float,
+            default=5.0,
+            help='Segundos con todas las conexiones inactivas (default: 5)'
+        )
+        parser.add_argument(
+            '--eventos',
+            type=int,
+            default=10,
+            help='Citas a crear/reagendar/cancelar/eliminar durante la prueba (default: 10)'
+        )
+
+    def handle(self, *args, **options):
+        doctor = Doctor.objects.filter(activo=True, clinica__isnull=False, usuario__isnull=False).first()
+        if doctor is None:
+            raise CommandError('Se necesita un doctor activo con usuario y clínica')
+        paciente = Patient.objects.first()
+        if paciente is None:
+            raise CommandError('Se necesita al menos un paciente')
+
+        cliente = Client()
+        cliente.force_login(doctor.usuario)
+        self.cookie = f'sessionid={cliente.cookies["sessionid"].value}'
+        self.doctor = doctor
+        self.paciente = paciente
+
+        from core.asgi import application
+        asyncio.run(self.prueba(application, options))
+
+    async def prueba(self, application, options):
+        total = options['suscriptores']
+        conectados = asyncio.Semaphore(0)
+        desconectar = asyncio.Event()
+        recibidos = [dict() for _ in range(total)]
+
+        tracemalloc.start()
+        memoria_inicial = tracemalloc.get_traced_memory()[0]
+        inicio = time.perf_counter()
+        tareas = [
+            asyncio.create_task(self.suscriptor(application, recibidos[i], conectados, desconectar))
+            for i in range(total)
+        ]
+        for _ in range(total):
+            await asyncio.wait_for(conectados.acquire(), timeout=120)
+        segundos_conexion = time.perf_counter() - inicio
+        memoria = tracemalloc.get_traced_memory()[0] - memoria_inicial
+        tracemalloc.stop()
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{total} suscriptores SSE'))
+        self.stdout.write(f'  conexión de todos: {segundos_conexion:.2f} s')
+        self.stdout.write(f'  suscripciones activas en el broker: {broker.total_suscripciones()}')
+        self.stdout.write(f'  memoria Python por suscriptor: {memoria / total / 1024:.1f} KB')
+
+        cpu = time.process_time()
+        await asyncio.sleep(options['reposo'])
+        cpu = time.process_time() - cpu
+        self.stdout.write(
+            f'  CPU en reposo: {cpu * 1000:.1f} ms en {options["reposo"]:.0f} s '
+            f'({cpu / options["reposo"] * 100:.2f}%)'
+        )
+
+        # Cada cambio pasa por save()/delete() -> señales -> on_commit -> broker
+        publicados = await sync_to_async(self.generar_cambios)(options['eventos'])
+        await asyncio.sleep(1)
+
+        latencias = []
+        perdidos = 0
+        for tipo_id, instante in publicados:
+            for eventos in recibidos:
+                if tipo_id in eventos:
+                    latencias.append(eventos[tipo_id] - instante)
+                else:
+                    perdidos += 1
+        latencias.sort()
+        self.stdout.write(self.style.MIGRATE_HEADING(f'{len(publicados)} eventos x {total} suscriptores'))
+        self.stdout.write(f'  entregas: {len(latencias)} | perdidas: {perdidos}')
+        if latencias:
+            self.stdout.write(
+                f'  latencia publicación→recepción: mediana {statistics.median(latencias) * 1000:.1f} ms, '
+                f'p99 {latencias[int(len(latencias) * 0.99) - 1] * 1000:.1f} ms, '
+                f'máx {latencias[-1] * 1000:.1f} ms'
+            )
+
+        desconectar.set()
+        await asyncio.gather(*tareas, return_exceptions=True)
+        self.stdout.write(f'  suscripciones tras desconectar: {broker.total_suscripciones()}')
+
+    async def suscriptor(self, application, recibidos, conectados, desconectar):
+        """Cliente SSE mínimo hablando ASGI directamente con la aplicación"""
+        cuerpo_enviado = False
+
+        async def receive():
+            nonlocal cuerpo_enviado
+            if not cuerpo_enviado:
+                cuerpo_enviado = True
+                return {'type': 'http.request', 'body': b'', 'more_body': False}
+            await desconectar.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(mensaje):
+            if mensaje['type'] == 'http.response.start' and mensaje['status'] != 200:
+                raise CommandError(f'El stream respondió {mensaje["status"]}')
+            if mensaje['type'] != 'http.response.body':
+                return
+            for bloque in mensaje.get('body', b'').decode().split('\n\n'):
+                campos = dict(
+                    linea.split(': ', 1) for linea in bloque.splitlines() if ': ' in linea and not linea.startswith(':')
+                )
+                if campos.get('event') == 'conectado':
+                    conectados.release()
+                elif 'id' in campos:
+                    recibidos[(campos['event'], json.loads(campos['data'])['id'])] = time.perf_counter()
+
+        scope = {
+            'type': 'http',
+            'asgi': {'version': '3.0'},
+            'http_version': '1.1',
+            'method': 'GET',
+            'scheme': 'http',
+            'path': '/calendario/api/eventos/',
+            'raw_path': b'/calendario/api/eventos/',
+            'query_string': b'',
+            'root_path': '',
+            'headers': [(b'host', b'localhost'), (b'cookie', self.cookie.encode())],
+            'client': ('127.0.0.1', 0),
+            'server': ('localhost', 80),
+        }
+        await application(scope, receive, send)
+
+    def generar_cambios(self, total):
+        """Crea, reagenda, cancela y elimina citas sintéticas; devuelve [((tipo, id), instante)]"""
+        publicados = []
+        inicio = timezone.make_aware(datetime(2090, 1, 2, 9))
+        for i in range(total):
+            instante = time.perf_counter()
+            cita = Appointment.objects.create(
+                paciente=self.paciente,
+                doctor=self.doctor,
+                clinica_id=self.doctor.clinica_id,
+                fecha=inicio + timedelta(days=i),
+                motivo='Cita sintética de prueba de carga',
+            )
+            publicados.append((('creada', cita.id), instante))
+
+            instante = time.perf_counter()
+            cita.fecha += timedelta(hours=1)
+            cita.save()
+            publicados.append((('reagendada', cita.id), instante))
+
+            instante = time.perf_counter()
+            cita.estado = 'cancelada'
+            cita.save()
+            publicados.append((('cancelada', cita.id), instante))
+
+            instante = time.perf_counter()
+            cita_id = cita.id
+            cita.delete()
+            publicados.append((('eliminada', cita_id), instante))
+        return publicados
@@ -0,0 +1,206 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from datetime import datetime, timedelta
+import json
+import os
+import time
+
+from appointments.counters import actualizar_contadores
+from core import cache
+from appointments.models import Appointment, CitaEliminada, OcupacionHorario, SolicitudIdempotente
+from reportes.models import ReporteGenerado
+
+
+# Transiciones de estado: (nombre, estado origen, estado destino, horas de gracia tras la cita)
+TRANSICIONES = [
+    ('programadas_vencidas', 'programada', 'no_asistio', 2),
+    ('confirmadas_vencidas', 'confirmada', 'completada', 2),
+    ('en_curso_vencidas', 'en_curso', 'completada', 12),
+]
+
+# Purgas: (nombre, modelo, campo de fecha, días de retención)
+PURGAS = [
+    ('reportes_antiguos', ReporteGenerado, 'fecha_generacion', 30),
+    ('citas_eliminadas_antiguas', CitaEliminada, 'eliminada_en', 180),
+    ('horarios_ocupados_pasados', OcupacionHorario, 'inicio', 1),
+    ('claves_idempotencia_vencidas', SolicitudIdempotente, 'creada_en', 2),
+]
+
+CHECKPOINT_DEFAULT = settings.MANTENIMIENTO_CITAS_CHECKPOINT
+
+
+class Command(BaseCommand):
+    help = (
+        'Mantenimiento del ciclo de vida de las citas por lotes (equivalente portable '
+        'de sp_mantenimiento_diario). Reanuda desde el último checkpoint si existe.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--lote',
+            type=int,
+            default=1000,
+            help='Filas por lote; cada lote es una transacción independiente (default: 1000)'
+        )
+        parser.add_argument(
+            '--pausa',
+            type=float,
+            default=0,
+            help='Segundos de espera entre lotes para reducir la carga (default: 0)'
+        )
+        parser.add_argument(
+            '--reglas',
+            nargs='+',
+            choices=[t[0] for t in TRANSICIONES] + [p[0] for p in PURGAS],
+            help='Ejecutar solo estas reglas (default: todas)'
+        )
+        parser.add_argument(
+            '--checkpoint',
+            default=str(CHECKPOINT_DEFAULT),
+            help='Archivo donde se guarda el progreso para reanudar (default: settings.MANTENIMIENTO_CITAS_CHECKPOINT)'
+        )
+        parser.add_argument(
+            '--reiniciar',
+            action='store_true',
+            help='Ignorar el checkpoint existente y empezar desde cero'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Solo contar las filas afectadas, sin modificar nada'
+        )
+
+    def handle(self, *args, **options):
+        lote = options['lote']
+        if not 1 <= lote <= 10000:
+            raise CommandError('--lote debe estar entre 1 y 10000')
+        self.pausa = options['pausa']
+        self.ruta_checkpoint = options['checkpoint']
+        reglas = options['reglas']
+
+        if options['dry_run']:
+            self.contar(timezone.now(), reglas)
+            return
+
+        self.checkpoint = None if options['reiniciar'] else self.leer_checkpoint()
+        if self.checkpoint:
+            self.stdout.write(self.style.WARNING(
+                f"Reanudando mantenimiento iniciado el {self.checkpoint['corte']}"
+            ))
+        else:
+            # El corte se fija al inicio para que una ejecución reanudada use los mismos límites
+            self.checkpoint = {'corte': timezone.now().isoformat(), 'reglas': {}}
+            self.guardar_checkpoint()
+        corte = datetime.fromisoformat(self.checkpoint['corte'])
+
+        inicio_total = time.perf_counter()
+        for nombre, origen, destino, horas in TRANSICIONES:
+            if reglas and nombre not in reglas:
+                continue
+            queryset = Appointment.objects.filter(estado=origen, fecha__lt=corte - timedelta(hours=horas))
+            self.procesar(nombre, queryset, lote, lambda qs, destino=destino: self.transicion(qs, destino))
+
+        for nombre, modelo, campo, dias in PURGAS:
+            if reglas and nombre not in reglas:
+                continue
+            queryset = modelo.objects.filter(**{f'{campo}__lt': corte - timedelta(days=dias)})
+            self.procesar(nombre, queryset, lote, lambda qs: qs.delete()[0])
+
+        self.borrar_checkpoint()
+        self.stdout.write(self.style.SUCCESS(
+            f'Mantenimiento completado en {time.perf_counter() - inicio_total:.1f}s'
+        ))
+
+    def procesar(self, nombre, queryset, lote, aplicar):
+        """
+        Recorre `queryset` por id (paginación keyset) aplicando `aplicar` a cada
+        lote dentro de su propia transacción. El predicado original se vuelve a
+        evaluar al escribir, así que las filas modificadas entretanto se omiten.
+        """
+        estado = self.checkpoint['reglas'].setdefault(nombre, {'ultimo_id': 0, 'filas': 0, 'completa': False})
+        if estado['completa']:
+            self.stdout.write(f'{nombre}: ya completada ({estado["filas"]} filas)')
+            return
+
+        self.stdout.write(f'{nombre}: procesando desde id > {estado["ultimo_id"]}...')
+        inicio = time.perf_counter()
+        filas_sesion = 0
+        lotes = 0
+        while True:
+            ids = list(
+                queryset.filter(id__gt=estado['ultimo_id']).order_by('id').values_list('id', flat=True)[:lote]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                afectadas = aplicar(queryset.filter(id__in=ids))
+
+            estado['ultimo_id'] = ids[-1]
+            estado['filas'] += afectadas
+            filas_sesion += afectadas
+            lotes += 1
+            self.guardar_checkpoint()
+
+            if lotes % 10 == 0:
+                self.reportar(nombre, filas_sesion, inicio, en_progreso=True)
+            if self.pausa:
+                time.sleep(self.pausa)
+
+        estado['completa'] = True
+        self.guardar_checkpoint()
+        self.reportar(nombre, filas_sesion, inicio)
+
+    def transicion(self, queryset, destino):
+        """Cambia el estado del lote y mueve sus citas entre los contadores diarios"""
+        anteriores = list(queryset.select_for_update().values(
+            'doctor_id', 'clinica_id', 'paciente_id', 'fecha_local', 'estado'
+        ))
+        afectadas = queryset.update(estado=destino, actualizada_en=timezone.now(), version=F('version') + 1)
+        actualizar_contadores(anteriores, [dict(anterior, estado=destino) for anterior in anteriores])
+        cache.invalidar(
+            doctores={anterior['doctor_id'] for anterior in anteriores},
+            clinicas={anterior['clinica_id'] for anterior in anteriores},
+        )
+        return afectadas
+
+    def reportar(self, nombre, filas, inicio, en_progreso=False):
+        segundos = time.perf_counter() - inicio
+        ritmo = filas / segundos if segundos > 0 else 0
+        mensaje = f'  {nombre}: {filas} filas en {segundos:.1f}s ({ritmo:.0f} filas/s)'
+        self.stdout.write(mensaje if en_progreso else self.style.SUCCESS(mensaje))
+
+    def contar(self, corte, reglas):
+        for nombre, origen, destino, horas in TRANSICIONES:
+            if not reglas or nombre in reglas:
+                total = Appointment.objects.filter(estado=origen, fecha__lt=corte - timedelta(hours=horas)).count()
+                self.stdout.write(f'{nombre}: {total} citas pasarían de {origen} a {destino}')
+        for nombre, modelo, campo, dias in PURGAS:
+            if not reglas or nombre in reglas:
+                total = modelo.objects.filter(**{f'{campo}__lt': corte - timedelta(days=dias)}).count()
+                self.stdout.write(f'{nombre}: {total} filas se eliminarían')
+
+    def leer_checkpoint(self):
+        try:
+            with open(self.ruta_checkpoint, encoding='utf-8') as archivo:
+                return json.load(archivo)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            raise CommandError(f'Checkpoint ilegible ({e}); use --reiniciar')
+
+    def guardar_checkpoint(self):
+        # Escritura atómica: un corte a mitad de escritura no deja el checkpoint corrupto
+        temporal = f'{self.ruta_checkpoint}.tmp'
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(self.checkpoint, archivo)
+        os.replace(temporal, self.ruta_checkpoint)
+
+    def borrar_checkpoint(self):
+        try:
+            os.remove(self.ruta_checkpoint)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+import time
+
+from appointments.counters import reconstruir_contadores
+from appointments.models import Appointment, ContadorDiarioCitas
+
+
+class Command(BaseCommand):
+    help = (
+        'Recalcula los contadores diarios de citas (ContadorDiarioCitas) a partir de '
+        'las citas. Útil tras cargas o correcciones hechas fuera de la aplicación.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--doctor-id',
+            type=int,
+            action='append',
+            help='Limitar a estos doctores (se puede repetir; default: todos)'
+        )
+        parser.add_argument(
+            '--verificar',
+            action='store_true',
+            help='Solo comparar los contadores con las citas, sin modificar nada'
+        )
+
+    def handle(self, *args, **options):
+        doctor_ids = options['doctor_id']
+        if options['verificar']:
+            self.verificar(doctor_ids)
+            return
+
+        inicio = time.perf_counter()
+        filas = reconstruir_contadores(doctor_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'{filas} contadores recalculados en {time.perf_counter() - inicio:.1f}s'
+        ))
+
+    def verificar(self, doctor_ids):
+        citas = Appointment.objects.all()
+        contadores = ContadorDiarioCitas.objects.exclude(total=0)
+        if doctor_ids:
+            citas = citas.filter(doctor_id__in=doctor_ids)
+            contadores = contadores.filter(doctor_id__in=doctor_ids)
+
+        esperados = {
+            (fila['doctor_id'], fila['fecha_local'], fila['estado'], fila['paciente__prioridad']): fila['total']
+            for fila in citas.values('doctor_id', 'fecha_local', 'estado', 'paciente__prioridad').annotate(
+                total=Count('id')
+            ).order_by()
+        }
+        guardados = {
+            (doctor_id, fecha, estado, prioridad): total
+            for doctor_id, fecha, estado, prioridad, total in contadores.values_list(
+                'doctor_id', 'fecha', 'estado', 'prioridad', 'total'
+            )
+        }
+        diferencias = sorted(
+            (clave, guardados.get(clave, 0), esperados.get(clave, 0))
+            for clave in esperados.keys() | guardados.keys()
+            if guardados.get(clave, 0) != esperados.get(clave, 0)
+        )
+        for (doctor_id, fecha, estado, prioridad), guardado, esperado in diferencias[:20]:
+            self.stdout.write(
+                f'  doctor {doctor_id} {fecha} {estado}/{prioridad}: contador {guardado}, citas {esperado}'
+            )
+        if diferencias:
+            self.stdout.write(self.style.WARNING(
+                f'{len(diferencias)} contadores no coinciden; ejecute el comando sin --verificar'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS(f'{len(guardados)} contadores coinciden con las citas'))
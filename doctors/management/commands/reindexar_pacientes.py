@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+import time
+
+from patients.models import Patient
+from patients.search import indexar
+
+LOTE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        'Reconstruye el índice de búsqueda por texto de los pacientes '
+        '(IndiceBusquedaPaciente). Útil tras cargas hechas fuera de la aplicación.'
+    )
+
+    def handle(self, *args, **options):
+        inicio = time.perf_counter()
+        campos = ('id', 'nombre', 'apellidos', 'dni', 'informacion_contacto')
+        total = 0
+        with transaction.atomic():
+            ultimo = 0
+            while True:
+                pacientes = list(Patient.objects.only(*campos).filter(id__gt=ultimo).order_by('id')[:LOTE])
+                if not pacientes:
+                    break
+                indexar(pacientes)
+                total += len(pacientes)
+                ultimo = pacientes[-1].id
+        self.stdout.write(self.style.SUCCESS(
+            f'{total} pacientes indexados en {time.perf_counter() - inicio:.1f}s'
+        ))
@@ -0,0 +1,29 @@
+"""
+Señales de la app de doctores
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from core import cache
+
+from .models import Doctor
+
+
+@receiver(pre_save, sender=Doctor)
+def recordar_clinica_doctor(sender, instance, **kwargs):
+    instance._clinica_anterior = None
+    if instance.pk:
+        instance._clinica_anterior = Doctor.objects.filter(pk=instance.pk).values_list(
+            'clinica_id', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Doctor)
+@receiver(post_delete, sender=Doctor)
+def invalidar_cache_doctor(sender, instance, **kwargs):
+    """Dashboards del doctor y de sus clínicas (actual y anterior) y su contexto de clínica"""
+    cache.invalidar(
+        doctores=[instance.pk],
+        clinicas={instance.clinica_id, getattr(instance, '_clinica_anterior', None)},
+        usuarios=[instance.usuario_id],
+    )
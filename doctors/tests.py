@@ -1,3 +1,155 @@
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Q
 from django.test import TestCase
+from django.utils import timezone
+
+from appointments.counters import resumir_contadores
+from appointments.models import Appointment
+from clinicas.models import Clinica
+from patients.models import Patient
+
+from .dashboard import codificar_cursor, grupos_por_prioridad, pagina_prioridad
+from .models import Doctor
+from .utils import cache_doctor_data
+
+
+class ListadosAdminTests(TestCase):
+    """Los listados del admin hacen las mismas consultas con 2 filas que con 10"""
+
+    def setUp(self):
+        self.clinica = Clinica.objects.create(
+            nombre='Central', codigo='ADM', direccion='Calle 1', telefono='1', email='c@example.com',
+        )
+        self.paciente = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='ADM-1')
+        self.client.force_login(User.objects.create_superuser('admin_listados', password='x'))
+
+    def _crear_doctores(self, desde, hasta):
+        for i in range(desde, hasta):
+            doctor = Doctor.objects.create(
+                usuario=User.objects.create_user(f'doctor_admin_{i}', password='x'),
+                nombre=f'Doc{i}', apellidos='Admin', especialidad='Medicina General', clinica=self.clinica,
+            )
+            Appointment.objects.create(
+                paciente=self.paciente, doctor=doctor, motivo='Control del listado',
+                fecha=(timezone.now() + timedelta(days=7)).replace(hour=10, minute=0, second=0, microsecond=0),
+            )
+
+    def _assert_consultas_constantes(self, url, consultas):
+        self._crear_doctores(0, 2)
+        cache.clear()
+        with self.assertNumQueries(consultas):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self._crear_doctores(2, 10)
+        cache.clear()
+        with self.assertNumQueries(consultas):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_listado_doctores(self):
+        # sesión, usuario, filtros de clínica y especialidad,
+        # COUNT y página (usuario y clínica en el JOIN, citas anotadas desde los contadores diarios)
+        self._assert_consultas_constantes('/admin/doctors/doctor/', 6)
+
+    def test_listado_usuarios(self):
+        # sesión, usuario, COUNT, página (doctor en el JOIN)
+        # y los filtros por especialidad y activo
+        self._assert_consultas_constantes('/admin/auth/user/', 6)
+
+
+class EstadisticasDoctorTests(TestCase):
+    """Estadísticas del dashboard servidas desde los contadores diarios"""
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(
+            usuario=User.objects.create_user('doctor_estadisticas', password='x'),
+            nombre='Ana', apellidos='Pérez', especialidad='Medicina General', duracion_cita_default=30,
+        )
+        urgente = Patient.objects.create(nombre='Eva', apellidos='Ruiz', dni='EST-1', prioridad=Patient.PRIORITY_URGENT)
+        normal = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='EST-2')
+        manana = (timezone.now() + timedelta(days=1)).replace(hour=10, minute=0, second=0, microsecond=0)
+        for horas, paciente in enumerate([urgente, urgente, normal]):
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, fecha=manana + timedelta(hours=horas),
+                motivo='Control de estadísticas',
+            )
+        self.manana = manana
+
+    def test_conteos(self):
+        stats = cache_doctor_data(self.doctor)
+        self.assertEqual(stats['total_appointments'], 3)
+        self.assertEqual(stats['today_appointments'], 0)
+        self.assertEqual(stats['week_appointments'], 3)
+        self.assertEqual(stats['total_patients'], 2)
+        self.assertEqual(stats['priority_breakdown'], {Patient.PRIORITY_URGENT: 2, Patient.PRIORITY_LOW: 1})
+        self.assertEqual([cita['fecha'] for cita in stats['upcoming_appointments']][0], self.manana)
+
+    def test_contadores_siguen_las_cancelaciones(self):
+        cita = Appointment.objects.filter(doctor=self.doctor).first()
+        cita.estado = 'cancelada'
+        cita.save()
+        resumen = resumir_contadores(self.doctor.id, canceladas=Q(estado='cancelada'))
+        self.assertEqual((resumen['total'], resumen['canceladas']), (3, 1))
+
+    def test_numero_de_consultas(self):
+        # Contadores y pacientes distintos, próximas citas y pacientes recientes
+        with self.assertNumQueries(3):
+            cache_doctor_data(self.doctor)
+
+
+class DashboardPrioridadesTests(TestCase):
+    """Dashboard agrupado por prioridad con "Cargar más" por cursor"""
+
+    def setUp(self):
+        self.doctor = Doctor.objects.create(
+            usuario=User.objects.create_user('doctor_dashboard', password='x'),
+            nombre='Ana', apellidos='Pérez', especialidad='Medicina General',
+        )
+        urgente = Patient.objects.create(
+            nombre='Eva', apellidos='Ruiz', dni='DSH-1', prioridad=Patient.PRIORITY_URGENT,
+        )
+        baja = Patient.objects.create(nombre='Luis', apellidos='Gómez', dni='DSH-2')
+        inicio = (timezone.now() + timedelta(days=7)).replace(hour=9, minute=0, second=0, microsecond=0)
+        self.urgentes = [
+            Appointment.objects.create(
+                paciente=urgente, doctor=self.doctor, fecha=inicio + timedelta(minutes=30 * n), motivo='Control',
+            )
+            for n in range(5)
+        ]
+        Appointment.objects.create(
+            paciente=baja, doctor=self.doctor, fecha=inicio - timedelta(hours=1), motivo='Control',
+        )
+        self.desde = timezone.now().date()
+
+    def test_primera_pagina_por_prioridad(self):
+        with self.assertNumQueries(1):
+            grupos = grupos_por_prioridad(self.doctor, self.desde, por_grupo=2)
+        self.assertEqual([(g['prioridad'], g['total'], len(g['citas'])) for g in grupos], [
+            (Patient.PRIORITY_URGENT, 5, 2), (Patient.PRIORITY_LOW, 1, 1),
+        ])
+        self.assertEqual([cita.id for cita in grupos[0]['citas']], [cita.id for cita in self.urgentes[:2]])
+        self.assertIsNotNone(grupos[0]['siguiente'])
+        self.assertIsNone(grupos[1]['siguiente'])
+
+    def test_cargar_mas_hasta_el_final(self):
+        cursor = grupos_por_prioridad(self.doctor, self.desde, por_grupo=2)[0]['siguiente']
+        vistas = []
+        while cursor:
+            citas, cursor = pagina_prioridad(self.doctor, self.desde, Patient.PRIORITY_URGENT, cursor, por_grupo=2)
+            vistas += [cita.id for cita in citas]
+        self.assertEqual(vistas, [cita.id for cita in self.urgentes[2:]])
 
-# Create your tests here.
+    def test_endpoint_cargar_mas(self):
+        self.client.force_login(self.doctor.usuario)
+        cursor = grupos_por_prioridad(self.doctor, self.desde)[0]['citas'][0]
+        respuesta = self.client.get('/doctors/dashboard/citas/', {
+            'prioridad': Patient.PRIORITY_URGENT, 'cursor': codificar_cursor(cursor),
+        }).json()
+        self.assertIsNone(respuesta['siguiente'])
+        for cita in self.urgentes[1:]:
+            self.assertIn(f'#citaModal{cita.id}"', respuesta['html'])
+        self.assertNotIn(f'#citaModal{self.urgentes[0].id}"', respuesta['html'])
+        malo = self.client.get('/doctors/dashboard/citas/', {'prioridad': Patient.PRIORITY_URGENT, 'cursor': 'x'})
+        self.assertEqual(malo.status_code, 400)
+        self.assertEqual(self.client.get('/doctors/dashboard/citas/', {'prioridad': 'Z'}).status_code, 400)
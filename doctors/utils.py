@@ -5,35 +5,37 @@ from django.db.models import Count, Q, Avg
 from django.utils import timezone
 from datetime import timedelta, datetime
 from appointments.models import Appointment
+from appointments.availability import slots_disponibles
+from appointments.conflicts import conflict_index, get_duracion_cita
+from appointments.counters import resumir_contadores
+from appointments.local_time import hoy_local, rango_mes, zona_clinica
+from appointments.reports import generar_reporte
+from core import cache
 from patients.models import Patient
 
 
 def get_doctor_statistics(doctor):
     """
-    Get comprehensive statistics for a doctor
-    """
-    today = timezone.now().date()
+    Get comprehensive statistics for a doctor: one query for the counts and
+    distinct patients, plus one each for the upcoming appointments and the
+    recent patients (lazy querysets)
+    """
+    today = hoy_local(doctor.clinica_id)
+    # Conteos por ventana, por prioridad y pacientes distintos: una sola consulta sobre los contadores diarios
+    resumen = resumir_contadores(
+        doctor.id,
+        hoy=Q(fecha=today),
+        semana=Q(fecha__gte=today, fecha__lt=today + timedelta(days=7)),
+        mes=Q(fecha__range=rango_mes(today)),
+    )
     
     stats = {
-        'total_appointments': Appointment.objects.filter(doctor=doctor).count(),
-        'today_appointments': Appointment.objects.filter(
-            doctor=doctor, 
-            fecha__date=today
-        ).count(),
-        'week_appointments': Appointment.objects.filter(
-            doctor=doctor,
-            fecha__date__gte=today,
-            fecha__date__lt=today + timedelta(days=7)
-        ).count(),
-        'month_appointments': Appointment.objects.filter(
-            doctor=doctor,
-            fecha__date__gte=today.replace(day=1),
-            fecha__date__lt=(today.replace(day=1) + timedelta(days=32)).replace(day=1)
-        ).count(),
-        'total_patients': Patient.objects.filter(
-            appointment__doctor=doctor
-        ).distinct().count(),
-        'priority_breakdown': get_priority_breakdown(doctor),
+        'total_appointments': resumen['total'],
+        'today_appointments': resumen['hoy'],
+        'week_appointments': resumen['semana'],
+        'month_appointments': resumen['mes'],
+        'total_patients': resumen['pacientes'],
+        'priority_breakdown': resumen['prioridades'],
         'upcoming_appointments': get_upcoming_appointments(doctor, limit=5),
         'recent_patients': get_recent_patients(doctor, limit=5)
     }
@@ -45,13 +47,7 @@ def get_priority_breakdown(doctor):
     """
     Get breakdown of appointments by patient priority
     """
-    priorities = Patient.objects.filter(
-        appointment__doctor=doctor
-    ).values('prioridad').annotate(
-        count=Count('appointment')
-    ).order_by('-count')
-    
-    return {priority['prioridad']: priority['count'] for priority in priorities}
+    return resumir_contadores(doctor.id)['prioridades']
 
 
 def get_upcoming_appointments(doctor, limit=10):
@@ -90,28 +86,25 @@ def optimize_appointments_query(doctor, start_date=None, end_date=None):
     return queryset.select_related('paciente', 'doctor').order_by('fecha')
 
 
-def get_appointment_conflicts(doctor, fecha_inicio, fecha_fin):
+def get_appointment_conflicts(doctor, fecha, duracion=None, exclude_id=None):
     """
-    Check for appointment conflicts in a given time range
+    Check for appointments overlapping [fecha, fecha + duracion).
+    Returns a list of (id, start, end) tuples; each call runs one query
+    (see appointments.conflicts.ConflictIndex).
     """
-    return Appointment.objects.filter(
-        doctor=doctor,
-        fecha__range=[fecha_inicio, fecha_fin]
-    ).exists()
+    return conflict_index.conflictos(doctor, fecha, duracion, exclude_id)
 
 
 def format_appointment_duration(appointment):
     """
     Calculate and format appointment duration
     """
-    # Assuming appointments are 30 minutes by default
-    # You can modify this based on your appointment model
-    duration = timedelta(minutes=30)
-    end_time = appointment.fecha + duration
+    duration_minutes = get_duracion_cita(appointment.doctor)
+    end_time = appointment.fecha + timedelta(minutes=duration_minutes)
     return {
         'start': appointment.fecha,
         'end': end_time,
-        'duration_minutes': 30
+        'duration_minutes': duration_minutes
     }
 
 
@@ -119,142 +112,89 @@ def get_doctor_workload(doctor, date_range_days=7):
     """
     Calculate doctor's workload for the next N days
     """
-    today = timezone.now().date()
+    today = hoy_local(doctor.clinica_id)
     end_date = today + timedelta(days=date_range_days)
     
     appointments = Appointment.objects.filter(
         doctor=doctor,
-        fecha__date__gte=today,
-        fecha__date__lte=end_date
-    ).values('fecha__date').annotate(
+        fecha_local__gte=today,
+        fecha_local__lte=end_date
+    ).values('fecha_local').annotate(
         daily_count=Count('id')
-    ).order_by('fecha__date')
+    ).order_by('fecha_local')
     
     workload = {}
     for appointment in appointments:
-        date_str = appointment['fecha__date'].strftime('%Y-%m-%d')
+        date_str = appointment['fecha_local'].strftime('%Y-%m-%d')
         workload[date_str] = appointment['daily_count']
     
     return workload
 
 
-def suggest_optimal_appointment_time(doctor, preferred_date):
-    """
-    Suggest optimal appointment times based on doctor's schedule
-    """
-    existing_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date=preferred_date
-    ).values_list('fecha__time', flat=True)
-    
-    # Define working hours (9 AM to 5 PM)
-    working_hours = []
-    for hour in range(9, 17):
-        for minute in [0, 30]:  # 30-minute slots
-            time_slot = datetime.strptime(f"{hour:02d}:{minute:02d}", "%H:%M").time()
-            if time_slot not in existing_appointments:
-                working_hours.append(time_slot)
-    
-    return working_hours[:5]  # Return first 5 available slots
-
-
 def generate_appointment_report(doctor, start_date, end_date):
     """
-    Generate a comprehensive appointment report for a doctor
+    Generate a comprehensive appointment report for a doctor in a single
+    pass over the appointments (see appointments/reports.py)
     """
-    appointments = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date__gte=start_date,
-        fecha__date__lte=end_date
-    ).select_related('paciente')
-    
-    report = {
-        'period': f"{start_date} to {end_date}",
-        'total_appointments': appointments.count(),
-        'appointments_by_day': {},
-        'appointments_by_priority': {},
-        'most_common_reasons': [],
-        'patient_demographics': {}
-    }
-    
-    # Group by day
-    for appointment in appointments:
-        day = appointment.fecha.date()
-        if day not in report['appointments_by_day']:
-            report['appointments_by_day'][day] = 0
-        report['appointments_by_day'][day] += 1
-    
-    # Group by priority
-    for appointment in appointments:
-        priority = appointment.paciente.get_prioridad_display()
-        if priority not in report['appointments_by_priority']:
-            report['appointments_by_priority'][priority] = 0
-        report['appointments_by_priority'][priority] += 1
-    
-    return report
+    return generar_reporte(Appointment.objects.filter(doctor=doctor), start_date, end_date)
 
 
 def cache_doctor_data(doctor):
     """
-    Cache frequently accessed doctor data for performance optimization
+    Doctor dashboard statistics as plain data (no querysets), ready to be cached
     """
-    from django.core.cache import cache
-    
-    cache_key = f"doctor_stats_{doctor.id}"
     stats = get_doctor_statistics(doctor)
-    
-    # Cache for 1 hour
-    cache.set(cache_key, stats, 3600)
+    stats['upcoming_appointments'] = [
+        {
+            'id': cita.id,
+            'fecha': cita.fecha,
+            'estado': cita.estado,
+            'motivo': cita.motivo,
+            'paciente_id': cita.paciente_id,
+            'paciente': f'{cita.paciente.nombre} {cita.paciente.apellidos}',
+            'prioridad': cita.paciente.prioridad,
+        }
+        for cita in stats['upcoming_appointments']
+    ]
+    stats['recent_patients'] = list(stats['recent_patients'].values('id', 'nombre', 'apellidos', 'prioridad'))
     return stats
 
 
 def get_cached_doctor_data(doctor):
     """
-    Retrieve cached doctor data or generate if not available
+    Retrieve cached doctor data or generate if not available. Appointment and
+    patient changes invalidate it through the doctor/clinic version keys.
     """
-    from django.core.cache import cache
-    
-    cache_key = f"doctor_stats_{doctor.id}"
-    stats = cache.get(cache_key)
-    
-    if stats is None:
-        stats = cache_doctor_data(doctor)
-    
-    return stats
+    # El día forma parte de la clave: las métricas de "hoy" cambian a medianoche
+    return cache.obtener(
+        f'doctor_stats:{hoy_local(doctor.clinica_id).isoformat()}',
+        lambda: cache_doctor_data(doctor),
+        doctor=doctor.id,
+        clinica=doctor.clinica_id,
+    )
 
 
-def get_appointment_conflicts(doctor, start_time, end_time):
+def suggest_appointment_times_range(doctor, start_date, end_date, limit=5):
     """
-    Check for appointment conflicts in a given time range
+    Suggest available appointment times for every day in [start_date, end_date]
+    using the bitmap availability engine (one query for the whole range)
     """
-    return Appointment.objects.filter(
-        doctor=doctor,
-        fecha__range=[start_time, end_time]
-    )
+    slots = slots_disponibles(doctor, start_date, end_date)
+    zona = zona_clinica(doctor.clinica_id)
+    suggestions = {}
+    for day, day_slots in slots.items():
+        suggestions[day] = []
+        for slot in day_slots[:limit]:
+            local_slot = slot.astimezone(zona)
+            suggestions[day].append({
+                'time': local_slot,
+                'display': local_slot.strftime('%H:%M')
+            })
+    return suggestions
 
 
-def suggest_optimal_appointment_time(doctor, date):
+def suggest_optimal_appointment_time(doctor, date, limit=5):
     """
     Suggest optimal appointment times for a given date
     """
-    # Business hours: 8 AM to 6 PM
-    business_start = 8
-    business_end = 18
-    
-    # Get existing appointments for the date
-    existing_appointments = Appointment.objects.filter(
-        doctor=doctor,
-        fecha__date=date
-    ).values_list('fecha__hour', flat=True)
-    
-    suggestions = []
-    for hour in range(business_start, business_end):
-        if hour not in existing_appointments:
-            # Create datetime for suggestion
-            suggested_time = timezone.datetime.combine(date, timezone.datetime.min.time().replace(hour=hour))
-            suggestions.append({
-                'time': suggested_time,
-                'display': f"{hour:02d}:00"
-            })
-    
-    return suggestions[:5]  # Return first 5 suggestions
+    return suggest_appointment_times_range(doctor, date, date, limit)[date]
@@ -4,76 +4,44 @@ from django.utils import timezone # Para obtener la fecha actual con zona horari
 from datetime import timedelta, date
 from django.db.models import Count, Q
 from django.contrib import messages
+from django.http import JsonResponse
+from django.template.loader import render_to_string
 from appointments.models import Appointment
 from patients.models import Patient
 from .models import Doctor # Asegúrate que este es el modelo correcto para Doctor
 from rest_framework import viewsets
+from core.filters import ListadoFiltradoMixin, booleano, entero, texto
+from core.values_serializers import ValuesListMixin
+from .dashboard import NOMBRES_PRIORIDAD, ORDEN_PRIORIDADES, CursorInvalido, grupos_por_prioridad, pagina_prioridad
 from .serializers import DoctorsSerializaer
-from .utils import get_doctor_statistics, optimize_appointments_query
+from .utils import get_cached_doctor_data
 
 @login_required
 def dashboard(request):
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         # Redirige a una página donde el usuario pueda crear un perfil de doctor
         # o a una página de error genérica. 'doctor_dashboard' podría ser un bucle
         # si el perfil aún no existe.
         return redirect('crear_perfil_doctor') # O alguna otra ruta apropiada
 
     today = timezone.now().date()
-    start_date_filter = today  # Por defecto, desde hoy
-    filter_description = "Citas de hoy en adelante"
+    start_date_filter, filter_description = _inicio_dashboard(request, today)
 
-    # Comprobar si se solicita el rango extendido (incluyendo el mes anterior)
-    if request.GET.get('rango') == 'mes_anterior':
-        # Calcular el primer día del mes actual
-        first_day_current_month = today.replace(day=1)
-        # Restar un día para obtener el último día del mes anterior
-        last_day_previous_month = first_day_current_month - timedelta(days=1)
-        # Obtener el primer día del mes anterior
-        start_date_filter = last_day_previous_month.replace(day=1)
-        filter_description = f"Citas desde el {start_date_filter.strftime('%d/%m/%Y')} en adelante"
+    # Primera página de cada prioridad y su total, en una sola consulta
+    grupos_citas = grupos_por_prioridad(doctor, start_date_filter)
 
-    # Filtrar citas usando función optimizada
-    citas_query = optimize_appointments_query(
-        doctor=doctor,
-        start_date=start_date_filter
-    )
-
-    # Diccionario para agrupar citas por prioridad del paciente
-    # Es buena idea predefinir las prioridades para que siempre aparezcan en el template
-    citas_por_prioridad = {
-        'Urgente': [],
-        'Alta': [],
-        'Media': [],
-        'Baja': [],
-        # Podrías añadir una categoría para prioridades no definidas o por si get_prioridad_display() devuelve algo inesperado
-        # 'Otra': []
-    }
-
-    for cita in citas_query:
-        prioridad = cita.paciente.get_prioridad_display()
-        if prioridad in citas_por_prioridad:
-            citas_por_prioridad[prioridad].append(cita)
-        else:
-            # Si la prioridad no está en las claves predefinidas, la añadimos dinámicamente
-            # o la agrupamos en una categoría 'Otra' si prefieres
-            citas_por_prioridad.setdefault(prioridad, []).append(cita)
-            # O si quieres agrupar en 'Otra':
-            # citas_por_prioridad.setdefault('Otra', []).append(cita)
-
-
-    # Obtener estadísticas optimizadas usando función de utilidad
-    doctor_stats = get_doctor_statistics(doctor)
+    # Estadísticas del dashboard desde la caché (se invalidan al cambiar citas o pacientes)
+    doctor_stats = get_cached_doctor_data(doctor)
     
     context = {
-        'citas_por_prioridad': citas_por_prioridad,
+        'grupos_citas': grupos_citas,
         'user_type': 'doctor',
         'current_filter_description': filter_description,
         'is_showing_previous_month': request.GET.get('rango') == 'mes_anterior',
+        'rango': request.GET.get('rango', ''),
         'today_date_for_template': today , # Útil para el template si necesitas comparar fechas
-        'hay_citas': citas_query.exists(), # ¡IMPORTANTE PARA EL TEMPLATE!
+        'hay_citas': bool(grupos_citas), # ¡IMPORTANTE PARA EL TEMPLATE!
         # Estadísticas optimizadas para el dashboard
         'total_citas': doctor_stats['total_appointments'],
         'citas_hoy': doctor_stats['today_appointments'],
@@ -86,6 +54,63 @@ def dashboard(request):
 
     return render(request, 'dashboard.html', context)
 
-class DoctorsViewSet(viewsets.ModelViewSet):
-    queryset = Doctor.objects.all().order_by('-id') # Define el conjunto de datos base
-    serializer_class = DoctorsSerializaer
\ No newline at end of file
+
+def _inicio_dashboard(request, today):
+    """Fecha inicial de las citas del dashboard y su descripción según ?rango="""
+    # Comprobar si se solicita el rango extendido (incluyendo el mes anterior)
+    if request.GET.get('rango') == 'mes_anterior':
+        # Calcular el primer día del mes actual
+        first_day_current_month = today.replace(day=1)
+        # Restar un día para obtener el último día del mes anterior
+        last_day_previous_month = first_day_current_month - timedelta(days=1)
+        # Obtener el primer día del mes anterior
+        start_date_filter = last_day_previous_month.replace(day=1)
+        return start_date_filter, f"Citas desde el {start_date_filter.strftime('%d/%m/%Y')} en adelante"
+    return today, "Citas de hoy en adelante"
+
+
+@login_required
+def citas_prioridad_dashboard(request):
+    """Siguiente página ("Cargar más") de un grupo de prioridad del dashboard"""
+    if request.method != 'GET':
+        return JsonResponse({'error': 'Método no permitido'}, status=405)
+    doctor = request.doctor
+    if doctor is None:
+        return JsonResponse({'error': 'Perfil de doctor no encontrado'}, status=404)
+
+    prioridad = request.GET.get('prioridad')
+    if prioridad not in ORDEN_PRIORIDADES:
+        return JsonResponse({'error': 'Prioridad inválida'}, status=400)
+
+    today = timezone.now().date()
+    start_date_filter, _ = _inicio_dashboard(request, today)
+    try:
+        citas, siguiente = pagina_prioridad(doctor, start_date_filter, prioridad, request.GET.get('cursor', ''))
+    except CursorInvalido as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    contexto = {'prioridad': NOMBRES_PRIORIDAD[prioridad], 'today_date_for_template': today}
+    return JsonResponse({
+        'html': ''.join(
+            render_to_string('components/cita_dashboard.html', {**contexto, 'cita': cita}, request=request)
+            for cita in citas
+        ),
+        'modales': ''.join(
+            render_to_string('components/cita_dashboard_modal.html', {**contexto, 'cita': cita}, request=request)
+            for cita in citas
+        ),
+        'siguiente': siguiente,
+    })
+
+class DoctorsViewSet(ListadoFiltradoMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Doctor.objects.all() # Define el conjunto de datos base
+    serializer_class = DoctorsSerializaer
+    keyset_ordering = ('-id',)
+    filtros = {
+        'clinica': ('clinica_id', entero),
+        'especialidad': ('especialidad', texto),
+        'activo': ('activo', booleano),
+    }
+    campos_expandibles = {
+        'clinica': ('nombre', 'codigo'),
+    }
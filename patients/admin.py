@@ -1,13 +1,17 @@
 from django.contrib import admin
+from django.db.models import OuterRef
 from django.utils.html import format_html
+from appointments.models import Appointment
+from core.admin_utils import ListadoRapidoMixin, contar
 from .models import Patient
 
 @admin.register(Patient)
-class PatientAdmin(admin.ModelAdmin):
+class PatientAdmin(ListadoRapidoMixin, admin.ModelAdmin):
     list_display = ('get_full_name', 'dni', 'get_age', 'get_priority_badge', 'clinica', 'get_appointment_count')
     list_filter = ('prioridad', 'clinica', 'fecha_nacimiento')
     search_fields = ('dni', 'apellidos', 'nombre', 'informacion_contacto')
     ordering = ('apellidos', 'nombre')
+    list_select_related = ('clinica',)
     list_per_page = 25
     
     fieldsets = (
@@ -30,6 +34,11 @@ class PatientAdmin(admin.ModelAdmin):
         }),
     )
     
+    def get_queryset(self, request):
+        return super().get_queryset(request).annotate(
+            num_citas=contar(Appointment.objects.filter(paciente=OuterRef('pk')), 'paciente')
+        )
+    
     def get_full_name(self, obj):
         return f"{obj.apellidos}, {obj.nombre}"
     get_full_name.short_description = '👤 Paciente'
@@ -70,8 +79,9 @@ class PatientAdmin(admin.ModelAdmin):
     get_priority_badge.admin_order_field = 'prioridad'
     
     def get_appointment_count(self, obj):
-        count = obj.appointment_set.count()
+        count = obj.num_citas
         if count > 0:
             return format_html('<span style="color: #007bff; font-weight: bold;">📅 {}</span>', count)
         return format_html('<span style="color: #6c757d;">➖ 0</span>')
-    get_appointment_count.short_description = '📊 Citas'
\ No newline at end of file
+    get_appointment_count.short_description = '📊 Citas'
+    get_appointment_count.admin_order_field = 'num_citas'
\ No newline at end of file
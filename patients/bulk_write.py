@@ -0,0 +1,190 @@
+"""
+Altas y modificaciones masivas de pacientes (lotes de derivaciones).
+
+Cada elemento se valida con las reglas de PatientForm (PatientLoteForm, sin
+consultas por fila) y la unicidad del DNI de todo el lote se comprueba con
+una sola consulta, además de los duplicados dentro del propio lote. Las
+filas se escriben con bulk_create / bulk_update y el índice de búsqueda se
+actualiza con una sola consulta por lote (patients/search.py).
+"""
+from django.db import IntegrityError, transaction
+
+from appointments.counters import mover_prioridad
+from appointments.models import Appointment
+from core import cache
+from core.bulk import agregar_error, errores_formulario, escribir_lote, resultados_vacios
+from doctors.models import Doctor
+
+from .forms import PatientLoteForm
+from .models import Patient
+from .search import CAMPOS_INDEXADOS, indexar
+
+CAMPOS_MODIFICABLES = (
+    'nombre', 'apellidos', 'dni', 'fecha_nacimiento', 'prioridad',
+    'historial_medico_basico', 'informacion_contacto',
+)
+
+MENSAJE_CONCURRENTE = 'Otro proceso registró uno de los DNI del lote; reintente la operación'
+
+
+def _formularios(items, resultados, parcial=False):
+    """Aplica PatientLoteForm a cada elemento; devuelve [(resultado, datos limpios)]"""
+    validos = []
+    for resultado, item in zip(resultados, items):
+        if not isinstance(item, dict):
+            agregar_error(resultado, '__all__', 'Se esperaba un objeto')
+            continue
+        form = PatientLoteForm(item, parcial=parcial)
+        if not form.is_valid():
+            resultado['errores'] = errores_formulario(form)
+            continue
+        validos.append((resultado, form.cleaned_data))
+    return validos
+
+
+def _comprobar_dnis(validos):
+    """
+    Un DNI no puede pertenecer a otro paciente ni repetirse en el lote.
+    `validos` es [(resultado, datos, paciente_id | None)].
+    """
+    dnis = {datos['dni'] for _, datos, _ in validos if datos.get('dni')}
+    propietarios = dict(Patient.objects.filter(dni__in=dnis).values_list('dni', 'id'))
+    vistos = set()
+    for resultado, datos, paciente_id in validos:
+        dni = datos.get('dni')
+        if not dni:
+            continue
+        if dni in vistos:
+            agregar_error(resultado, 'dni', f'El DNI {dni} aparece más de una vez en el lote')
+        elif propietarios.get(dni, paciente_id) != paciente_id:
+            agregar_error(resultado, 'dni', f'Ya existe un paciente con el DNI {dni}.')
+        vistos.add(dni)
+
+
+def crear_pacientes_lote(items, usuario, modo):
+    """
+    Crea los pacientes de `items`. Si el usuario es un doctor, los pacientes
+    quedan asignados a su clínica.
+    """
+    resultados = resultados_vacios(items)
+    validos = _formularios(items, resultados)
+    doctor_usuario = Doctor.objects.filter(usuario=usuario).first()
+
+    _comprobar_dnis([(resultado, datos, None) for resultado, datos in validos])
+    if not escribir_lote(resultados, modo):
+        return resultados
+
+    nuevos = [
+        (resultado, Patient(
+            clinica_id=doctor_usuario.clinica_id if doctor_usuario else None,
+            **{campo: datos[campo] for campo in CAMPOS_MODIFICABLES if campo in datos}
+        ))
+        for resultado, datos in validos if 'errores' not in resultado
+    ]
+    try:
+        with transaction.atomic():
+            pacientes = Patient.objects.bulk_create([paciente for _, paciente in nuevos])
+            if pacientes and pacientes[0].pk is None:
+                # MySQL no devuelve los ids de un INSERT múltiple: el DNI es único
+                ids = dict(Patient.objects.filter(
+                    dni__in=[paciente.dni for paciente in pacientes]
+                ).values_list('dni', 'id'))
+                for paciente in pacientes:
+                    paciente.pk = ids.get(paciente.dni)
+            indexar(pacientes)
+    except IntegrityError:
+        for resultado, _ in nuevos:
+            agregar_error(resultado, 'dni', MENSAJE_CONCURRENTE)
+        return resultados
+
+    for resultado, paciente in nuevos:
+        resultado.update({'ok': True, 'id': paciente.pk})
+    cache.invalidar(clinicas={paciente.clinica_id for paciente in pacientes})
+    return resultados
+
+
+def actualizar_pacientes_lote(items, usuario, modo):
+    """
+    Modifica los pacientes de `items` ({"id", campo?...}). Un doctor solo puede
+    modificar pacientes con los que tiene citas, como en la edición web.
+    """
+    resultados = resultados_vacios(items)
+    ids_lote = set()
+    for resultado, item in zip(resultados, items):
+        try:
+            paciente_id = int(item['id'])
+        except (KeyError, TypeError, ValueError):
+            agregar_error(resultado, 'id', 'Se requiere el id del paciente')
+            continue
+        if paciente_id in ids_lote:
+            agregar_error(resultado, 'id', 'El paciente aparece más de una vez en el lote')
+            continue
+        ids_lote.add(paciente_id)
+        resultado['id'] = paciente_id
+        if not any(campo in item for campo in CAMPOS_MODIFICABLES):
+            agregar_error(resultado, '__all__', f'Sin cambios: campos modificables {", ".join(CAMPOS_MODIFICABLES)}')
+
+    validos = _formularios(
+        [item for resultado, item in zip(resultados, items) if 'errores' not in resultado],
+        [resultado for resultado in resultados if 'errores' not in resultado],
+        parcial=True,
+    )
+    doctor_usuario = Doctor.objects.filter(usuario=usuario).first()
+
+    try:
+        with transaction.atomic():
+            pacientes = Patient.objects.select_for_update().in_bulk(
+                [resultado['id'] for resultado, _ in validos]
+            )
+            permitidos = None
+            if not usuario.is_staff:
+                permitidos = set(Appointment.objects.filter(
+                    doctor=doctor_usuario, paciente_id__in=list(pacientes)
+                ).values_list('paciente_id', flat=True).distinct()) if doctor_usuario else set()
+
+            for resultado, _ in validos:
+                if resultado['id'] not in pacientes:
+                    agregar_error(resultado, 'id', 'Paciente no encontrado')
+                elif permitidos is not None and resultado['id'] not in permitidos:
+                    agregar_error(resultado, 'id', 'Sin permisos para modificar este paciente')
+            _comprobar_dnis([
+                (resultado, datos, resultado['id']) for resultado, datos in validos
+                if 'errores' not in resultado
+            ])
+
+            if not escribir_lote(resultados, modo):
+                return resultados
+
+            campos = set()
+            modificados = []
+            prioridades = {}
+            for resultado, datos in validos:
+                if 'errores' in resultado:
+                    continue
+                paciente = pacientes[resultado['id']]
+                if 'prioridad' in datos:
+                    prioridades[paciente.pk] = (paciente.prioridad, datos['prioridad'])
+                for campo in CAMPOS_MODIFICABLES:
+                    if campo in datos:
+                        setattr(paciente, campo, datos[campo])
+                        campos.add(campo)
+                modificados.append((resultado, paciente))
+            Patient.objects.bulk_update([paciente for _, paciente in modificados], sorted(campos))
+            mover_prioridad(prioridades)
+            if campos & set(CAMPOS_INDEXADOS):
+                indexar([paciente for _, paciente in modificados])
+            cache.invalidar(
+                doctores=Appointment.objects.filter(
+                    paciente_id__in=[paciente.pk for _, paciente in modificados]
+                ).values_list('doctor_id', flat=True).distinct(),
+                clinicas={paciente.clinica_id for _, paciente in modificados},
+            )
+    except IntegrityError:
+        for resultado, _ in validos:
+            if 'errores' not in resultado:
+                agregar_error(resultado, 'dni', MENSAJE_CONCURRENTE)
+        return resultados
+
+    for resultado, _ in modificados:
+        resultado['ok'] = True
+    return resultados
@@ -4,6 +4,26 @@ from datetime import datetime, timedelta
 from .models import Patient
 
 
+def normalizar_dni(dni):
+    """Quita espacios, pasa a mayúsculas y valida la longitud del DNI"""
+    if dni:
+        # Remove spaces and convert to uppercase
+        dni = dni.replace(' ', '').upper()
+        
+        # Basic length validation
+        if len(dni) < 5:
+            raise forms.ValidationError(
+                "El DNI debe tener al menos 5 caracteres."
+            )
+        
+        if len(dni) > 20:
+            raise forms.ValidationError(
+                "El DNI no puede exceder los 20 caracteres."
+            )
+    
+    return dni
+
+
 class PatientForm(forms.ModelForm):
     class Meta:
         model = Patient
@@ -79,23 +99,9 @@ class PatientForm(forms.ModelForm):
         self.fields['fecha_nacimiento'].widget.attrs['min'] = min_date.strftime('%Y-%m-%d')
 
     def clean_dni(self):
-        dni = self.cleaned_data.get('dni')
+        dni = normalizar_dni(self.cleaned_data.get('dni'))
         
         if dni:
-            # Remove spaces and convert to uppercase
-            dni = dni.replace(' ', '').upper()
-            
-            # Basic length validation
-            if len(dni) < 5:
-                raise forms.ValidationError(
-                    "El DNI debe tener al menos 5 caracteres."
-                )
-            
-            if len(dni) > 20:
-                raise forms.ValidationError(
-                    "El DNI no puede exceder los 20 caracteres."
-                )
-            
             # Check for uniqueness (excluding current instance if editing)
             existing_patient = Patient.objects.filter(dni=dni)
             if self.instance and self.instance.pk:
@@ -209,3 +215,25 @@ class PatientForm(forms.ModelForm):
             return info_contacto.strip()
         
         return info_contacto
+
+
+class PatientLoteForm(PatientForm):
+    """
+    Mismas reglas que PatientForm para un paciente de una carga masiva; la
+    unicidad del DNI se comprueba con una consulta para todo el lote (ver
+    patients.bulk_write).
+    """
+
+    def __init__(self, *args, parcial=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        if parcial:
+            # Modificación: solo se validan los campos enviados
+            for nombre in [nombre for nombre in self.fields if nombre not in self.data]:
+                del self.fields[nombre]
+
+    def clean_dni(self):
+        return normalizar_dni(self.cleaned_data.get('dni'))
+
+    def _post_clean(self):
+        # Sin construir la instancia ni validar unicidad contra la base de datos
+        pass
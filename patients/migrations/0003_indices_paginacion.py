@@ -0,0 +1,18 @@
+# Generated by Django 5.2.1 on 2026-10-18 00:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clinicas', '0002_clinica_zona_horaria'),
+        ('patients', '0002_patient_clinica'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['prioridad', 'id'], name='paciente_prioridad_id_idx'),
+        ),
+    ]
@@ -0,0 +1,118 @@
+# Generated by Django 5.2.1 on 2026-10-18 01:26
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLA = 'patients_indicebusquedapaciente'
+TABLA_FTS = 'patients_busqueda_fts'
+
+# SQLite: tabla FTS5 de contenido externo (TABLA), sincronizada con triggers
+FTS5 = [
+    f"""CREATE VIRTUAL TABLE {TABLA_FTS} USING fts5(
+        nombre, contacto, content='{TABLA}', content_rowid='paciente_id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER {TABLA_FTS}_ai AFTER INSERT ON {TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}(rowid, nombre, contacto) VALUES (new.paciente_id, new.nombre, new.contacto);
+    END""",
+    f"""CREATE TRIGGER {TABLA_FTS}_ad AFTER DELETE ON {TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, contacto)
+        VALUES ('delete', old.paciente_id, old.nombre, old.contacto);
+    END""",
+    f"""CREATE TRIGGER {TABLA_FTS}_au AFTER UPDATE ON {TABLA} BEGIN
+        INSERT INTO {TABLA_FTS}({TABLA_FTS}, rowid, nombre, contacto)
+        VALUES ('delete', old.paciente_id, old.nombre, old.contacto);
+        INSERT INTO {TABLA_FTS}(rowid, nombre, contacto) VALUES (new.paciente_id, new.nombre, new.contacto);
+    END""",
+]
+SIN_FTS5 = [
+    f'DROP TRIGGER IF EXISTS {TABLA_FTS}_au',
+    f'DROP TRIGGER IF EXISTS {TABLA_FTS}_ad',
+    f'DROP TRIGGER IF EXISTS {TABLA_FTS}_ai',
+    f'DROP TABLE IF EXISTS {TABLA_FTS}',
+]
+
+# MySQL: índices FULLTEXT para la relevancia total y la del nombre
+FULLTEXT = [
+    f'CREATE FULLTEXT INDEX paciente_busqueda_ft ON {TABLA} (nombre, contacto)',
+    f'CREATE FULLTEXT INDEX paciente_busqueda_nombre_ft ON {TABLA} (nombre)',
+]
+SIN_FULLTEXT = [
+    f'DROP INDEX paciente_busqueda_nombre_ft ON {TABLA}',
+    f'DROP INDEX paciente_busqueda_ft ON {TABLA}',
+]
+
+
+def _ejecutar(schema_editor, sentencias):
+    for sql in sentencias:
+        schema_editor.execute(sql)
+
+
+def _fts5_disponible(schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT sqlite_compileoption_used('ENABLE_FTS5')")
+        if cursor.fetchone()[0]:
+            return True
+        try:
+            cursor.execute('CREATE VIRTUAL TABLE temp.prueba_fts5 USING fts5(x)')
+        except Exception:
+            return False
+        cursor.execute('DROP TABLE temp.prueba_fts5')
+        return True
+
+
+def crear_indice_texto(apps, schema_editor):
+    """FTS5 en SQLite (si está compilado); en MySQL los FULLTEXT se crean tras poblar"""
+    if schema_editor.connection.vendor == 'sqlite' and _fts5_disponible(schema_editor):
+        _ejecutar(schema_editor, FTS5)
+
+
+def borrar_indice_texto(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        _ejecutar(schema_editor, SIN_FTS5)
+    elif vendor == 'mysql':
+        _ejecutar(schema_editor, SIN_FULLTEXT)
+
+
+def poblar_indice(apps, schema_editor):
+    """Entradas del índice de los pacientes existentes"""
+    from patients.search import documento
+
+    Patient = apps.get_model('patients', 'Patient')
+    IndiceBusquedaPaciente = apps.get_model('patients', 'IndiceBusquedaPaciente')
+    campos = ('id', 'nombre', 'apellidos', 'dni', 'informacion_contacto')
+    pendientes = []
+    for paciente in Patient.objects.only(*campos).iterator(chunk_size=2000):
+        pendientes.append(IndiceBusquedaPaciente(paciente_id=paciente.pk, **documento(paciente)))
+        if len(pendientes) >= 2000:
+            IndiceBusquedaPaciente.objects.bulk_create(pendientes)
+            pendientes = []
+    if pendientes:
+        IndiceBusquedaPaciente.objects.bulk_create(pendientes)
+    if schema_editor.connection.vendor == 'mysql':
+        _ejecutar(schema_editor, FULLTEXT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('patients', '0003_indices_paginacion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBusquedaPaciente',
+            fields=[
+                ('paciente', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='indice_busqueda', serialize=False, to='patients.patient')),
+                ('nombre', models.TextField()),
+                ('contacto', models.TextField(blank=True)),
+            ],
+            options={
+                'verbose_name': 'Índice de Búsqueda de Paciente',
+                'verbose_name_plural': 'Índice de Búsqueda de Pacientes',
+            },
+        ),
+        migrations.RunPython(crear_indice_texto, borrar_indice_texto),
+        migrations.RunPython(poblar_indice, migrations.RunPython.noop),
+    ]
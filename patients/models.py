@@ -80,6 +80,9 @@ class Patient(models.Model):
         verbose_name = "Paciente"
         verbose_name_plural = "Pacientes"
         ordering = ['apellidos', 'nombre'] # Ordenar por defecto por apellidos, luego nombre
+        indexes = [
+            models.Index(fields=['prioridad', 'id'], name='paciente_prioridad_id_idx'),
+        ]
 
     def __str__(self):
         """
@@ -98,4 +101,24 @@ class Patient(models.Model):
             return None # No se puede calcular si no hay fecha de nacimiento
         hoy = timezone.now().date()
         edad = hoy.year - self.fecha_nacimiento.year - ((hoy.month, hoy.day) < (self.fecha_nacimiento.month, self.fecha_nacimiento.day))
-        return edad
\ No newline at end of file
+        return edad
+
+class IndiceBusquedaPaciente(models.Model):
+    """
+    Texto normalizado de cada paciente para la búsqueda por texto
+    (patients/search.py). Lo mantienen la señal post_save de Patient y las
+    escrituras masivas; no se edita directamente.
+    """
+    paciente = models.OneToOneField(
+        Patient,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='indice_busqueda'
+    )
+    # Nombre, apellidos y DNI sin separadores
+    nombre = models.TextField()
+    contacto = models.TextField(blank=True)
+
+    class Meta:
+        verbose_name = "Índice de Búsqueda de Paciente"
+        verbose_name_plural = "Índice de Búsqueda de Pacientes"
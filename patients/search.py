@@ -0,0 +1,304 @@
+"""
+Búsqueda de pacientes por texto con índice.
+
+IndiceBusquedaPaciente guarda, por paciente, su texto ya normalizado
+(minúsculas, sin tildes ni signos: "José Muñoz-Peña" -> "jose munoz pena"):
+- nombre: nombre, apellidos y DNI sin separadores ("12.345.678-K" -> "12345678k");
+- contacto: informacion_contacto.
+Cada palabra de la consulta debe aparecer como prefijo de alguna palabra
+del paciente, así que "mu pe" encuentra a "Muñoz Peña" y "12345" su DNI.
+
+El índice de texto completo depende del motor (BACKENDS):
+- MySQL: índices FULLTEXT sobre la tabla del índice (búsqueda booleana);
+- SQLite: tabla virtual FTS5 sincronizada con triggers;
+- otros: LIKE por prefijo de palabra sobre el texto normalizado (sin índice).
+La relevancia pondera más las coincidencias en el nombre que en el contacto.
+
+Patient.save() mantiene el índice (patients/signals.py); las escrituras
+masivas deben llamar a indexar(). `python manage.py reindexar_pacientes`
+lo reconstruye.
+"""
+import re
+import unicodedata
+from datetime import date
+
+from django.db import connection
+from django.db.models import Count, Exists, OuterRef, Q
+from django.db.models.expressions import RawSQL
+
+from appointments.models import Appointment
+from appointments.reports import FRANJAS_EDAD, SIN_EDAD
+
+from .models import IndiceBusquedaPaciente, Patient
+
+# Campos de Patient que forman parte del índice
+CAMPOS_INDEXADOS = ('nombre', 'apellidos', 'dni', 'informacion_contacto')
+
+TABLA_FTS = 'patients_busqueda_fts'
+# Peso del nombre frente al contacto en la relevancia
+PESO_NOMBRE = 10.0
+# Palabras por consulta (el resto se ignora)
+MAX_TERMINOS = 8
+
+# Partículas de los apellidos españoles: no filtran si hay otras palabras
+PARTICULAS = frozenset(('de', 'del', 'la', 'las', 'los', 'y', 'e', 'san', 'santa'))
+
+_PALABRA = re.compile(r'[a-z0-9]+')
+_PARECE_DNI = re.compile(r'[\d.\-\s]*\d[\d.\-\s]*[a-zA-Z]?')
+
+
+def normalizar(texto):
+    """Minúsculas, sin tildes ni diacríticos (ñ -> n) y sin apóstrofos (O'Brien -> obrien)"""
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c)).replace("'", '').replace('’', '')
+
+
+def palabras(texto):
+    return _PALABRA.findall(normalizar(texto))
+
+
+def normalizar_dni(dni):
+    return ''.join(palabras(dni))
+
+
+def documento(paciente):
+    """Campos del índice de `paciente`"""
+    nombre = palabras(f'{paciente.nombre} {paciente.apellidos}')
+    dni = normalizar_dni(paciente.dni)
+    return {
+        'nombre': ' '.join(nombre + [dni] if dni else nombre),
+        'contacto': ' '.join(palabras(paciente.informacion_contacto)),
+    }
+
+
+def indexar(pacientes):
+    """Crea o actualiza las entradas del índice de `pacientes` (con pk) en una consulta"""
+    entradas = [
+        IndiceBusquedaPaciente(paciente_id=paciente.pk, **documento(paciente))
+        for paciente in pacientes if paciente.pk is not None
+    ]
+    if entradas:
+        IndiceBusquedaPaciente.objects.bulk_create(
+            entradas, update_conflicts=True, unique_fields=['paciente'], update_fields=['nombre', 'contacto'],
+        )
+
+
+def terminos_consulta(texto):
+    """Palabras de la consulta; un DNI con puntos o guion es una sola palabra"""
+    if _PARECE_DNI.fullmatch((texto or '').strip()):
+        dni = normalizar_dni(texto)
+        return [dni] if dni else []
+    terminos = list(dict.fromkeys(palabras(texto)))
+    significativos = [termino for termino in terminos if termino not in PARTICULAS]
+    return (significativos or terminos)[:MAX_TERMINOS]
+
+
+class BusquedaLike:
+    """Sin índice de texto completo: LIKE por prefijo de palabra sobre el texto normalizado"""
+
+    def _coincide(self, columna, termino):
+        return f'({columna} LIKE %s OR {columna} LIKE %s)', [f'{termino}%', f'% {termino}%']
+
+    def _todas(self, terminos):
+        condiciones, params = [], []
+        for termino in terminos:
+            en_nombre, p_nombre = self._coincide('nombre', termino)
+            en_contacto, p_contacto = self._coincide('contacto', termino)
+            condiciones.append(f'({en_nombre} OR {en_contacto})')
+            params += p_nombre + p_contacto
+        return ' AND '.join(condiciones), params
+
+    def subconsulta(self, terminos):
+        """(sql, params) con los ids de los pacientes que coinciden"""
+        condicion, params = self._todas(terminos)
+        return f'SELECT paciente_id FROM {IndiceBusquedaPaciente._meta.db_table} WHERE {condicion}', params
+
+    def ranking(self, terminos, alcance, limite):
+        """(sql, params) con los ids de `alcance` que coinciden, por relevancia"""
+        condicion, params = self._todas(terminos)
+        alcance_sql, alcance_params = alcance
+        params += alcance_params
+        en_nombre = []
+        for termino in terminos:
+            sql, p = self._coincide('nombre', termino)
+            en_nombre.append(f'CASE WHEN {sql} THEN 1 ELSE 0 END')
+            params += p
+        return (
+            f'SELECT paciente_id FROM {IndiceBusquedaPaciente._meta.db_table} '
+            f'WHERE {condicion} AND paciente_id IN ({alcance_sql}) '
+            f'ORDER BY {" + ".join(en_nombre)} DESC, nombre LIMIT %s',
+            params + [limite],
+        )
+
+
+class BusquedaFTS5(BusquedaLike):
+    """SQLite: tabla virtual FTS5 (TABLA_FTS) con consultas por prefijo y bm25"""
+
+    def _consulta(self, terminos):
+        return ' AND '.join(f'"{termino}"*' for termino in terminos)
+
+    def subconsulta(self, terminos):
+        return f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s', [self._consulta(terminos)]
+
+    def ranking(self, terminos, alcance, limite):
+        alcance_sql, alcance_params = alcance
+        return (
+            f'SELECT rowid FROM {TABLA_FTS} WHERE {TABLA_FTS} MATCH %s AND rowid IN ({alcance_sql}) '
+            f'ORDER BY bm25({TABLA_FTS}, {PESO_NOMBRE}, 1.0) LIMIT %s',
+            [self._consulta(terminos), *alcance_params, limite],
+        )
+
+
+class BusquedaMySQL(BusquedaLike):
+    """
+    MySQL: MATCH ... AGAINST en modo booleano sobre los índices FULLTEXT
+    (nombre, contacto) y (nombre). InnoDB no indexa palabras de menos de
+    innodb_ft_min_token_size (3) caracteres: esas consultas usan LIKE.
+    """
+    LONGITUD_MINIMA = 3
+
+    def _consulta(self, terminos):
+        return ' '.join(f'+{termino}*' for termino in terminos)
+
+    @classmethod
+    def _indexables(cls, terminos):
+        return all(len(termino) >= cls.LONGITUD_MINIMA for termino in terminos)
+
+    def subconsulta(self, terminos):
+        if not self._indexables(terminos):
+            return super().subconsulta(terminos)
+        return (
+            f'SELECT paciente_id FROM {IndiceBusquedaPaciente._meta.db_table} '
+            f'WHERE MATCH(nombre, contacto) AGAINST (%s IN BOOLEAN MODE)',
+            [self._consulta(terminos)],
+        )
+
+    def ranking(self, terminos, alcance, limite):
+        if not self._indexables(terminos):
+            return super().ranking(terminos, alcance, limite)
+        consulta = self._consulta(terminos)
+        alcance_sql, alcance_params = alcance
+        return (
+            f'SELECT paciente_id FROM {IndiceBusquedaPaciente._meta.db_table} '
+            f'WHERE MATCH(nombre, contacto) AGAINST (%s IN BOOLEAN MODE) AND paciente_id IN ({alcance_sql}) '
+            f'ORDER BY MATCH(nombre) AGAINST (%s IN BOOLEAN MODE) * {PESO_NOMBRE} '
+            f'+ MATCH(nombre, contacto) AGAINST (%s IN BOOLEAN MODE) DESC LIMIT %s',
+            [consulta, *alcance_params, consulta, consulta, limite],
+        )
+
+
+# connection.vendor -> backend; los motores sin entrada usan BusquedaLike
+BACKENDS = {
+    'mysql': BusquedaMySQL,
+    'sqlite': BusquedaFTS5,
+}
+_backends = {}
+
+
+def backend():
+    clase = BACKENDS.get(connection.vendor, BusquedaLike)
+    if clase is BusquedaFTS5 and TABLA_FTS not in _tablas():
+        # SQLite compilado sin FTS5: la migración no creó la tabla virtual
+        clase = BusquedaLike
+    if clase not in _backends:
+        _backends[clase] = clase()
+    return _backends[clase]
+
+
+_tablas_existentes = None
+
+
+def _tablas():
+    global _tablas_existentes
+    if _tablas_existentes is None:
+        with connection.cursor() as cursor:
+            _tablas_existentes = set(connection.introspection.table_names(cursor))
+    return _tablas_existentes
+
+
+def filtro_busqueda(texto):
+    """Q que filtra un queryset de Patient por `texto` (sin orden por relevancia)"""
+    terminos = terminos_consulta(texto)
+    if not terminos:
+        return Q()
+    sql, params = backend().subconsulta(terminos)
+    return Q(pk__in=RawSQL(sql, params))
+
+
+def consulta_booleana(texto):
+    """
+    `texto` como consulta MATCH ... AGAINST en modo booleano para el índice
+    FULLTEXT de MySQL (procedimiento FilterPatients). ValueError si tiene
+    palabras más cortas de las que indexa InnoDB.
+    """
+    terminos = terminos_consulta(texto)
+    if not terminos or not BusquedaMySQL._indexables(terminos):
+        raise ValueError(f'Búsqueda sin palabras de {BusquedaMySQL.LONGITUD_MINIMA} o más caracteres')
+    return BusquedaMySQL()._consulta(terminos)
+
+
+def pacientes_de(doctor):
+    """Pacientes con citas con `doctor`, sin JOIN ni DISTINCT (alcance de las búsquedas)"""
+    return Patient.objects.filter(Exists(Appointment.objects.filter(paciente=OuterRef('pk'), doctor=doctor)))
+
+
+def hace_años(hoy, años):
+    try:
+        return hoy.replace(year=hoy.year - años)
+    except ValueError:
+        # 29 de febrero en un año no bisiesto
+        return hoy.replace(year=hoy.year - años, day=28)
+
+
+def _facetas(pacientes, hoy):
+    """Conteos por prioridad y por franja de edad, con el total, en una sola agregación"""
+    conteos = {'total': Count('pk')}
+    for codigo, _ in Patient.PRIORITY_CHOICES:
+        conteos[f'prioridad_{codigo}'] = Count('pk', filter=Q(prioridad=codigo))
+    limites = [minima for minima, _ in FRANJAS_EDAD[1:]] + [None]
+    for i, ((minima, _), siguiente) in enumerate(zip(FRANJAS_EDAD, limites)):
+        # edad >= minima  <=>  nacido como muy tarde hace `minima` años
+        rango = Q(fecha_nacimiento__lte=hace_años(hoy, minima))
+        if siguiente is not None:
+            rango &= Q(fecha_nacimiento__gt=hace_años(hoy, siguiente))
+        conteos[f'edad_{i}'] = Count('pk', filter=rango)
+    conteos['edad_desconocida'] = Count('pk', filter=Q(fecha_nacimiento__isnull=True))
+
+    valores = pacientes.order_by().aggregate(**conteos)
+    edades = {nombre: valores[f'edad_{i}'] for i, (_, nombre) in enumerate(FRANJAS_EDAD)}
+    edades[SIN_EDAD] = valores['edad_desconocida']
+    return valores['total'], {
+        'prioridad': {codigo: valores[f'prioridad_{codigo}'] for codigo, _ in Patient.PRIORITY_CHOICES},
+        'edad': edades,
+    }
+
+
+def buscar_pacientes(texto, alcance=None, limite=10, hoy=None):
+    """
+    Pacientes de `alcance` (queryset de Patient, todos por defecto) que
+    coinciden con `texto`, los `limite` más relevantes primero, con el total
+    de coincidencias y sus facetas por prioridad y franja de edad:
+    {'pacientes': [...], 'total': n, 'facetas': {'prioridad': {...}, 'edad': {...}}}
+    Tres consultas: facetas, ranking y datos de los pacientes.
+    """
+    alcance = Patient.objects.all() if alcance is None else alcance
+    terminos = terminos_consulta(texto)
+    if not terminos:
+        return {'pacientes': [], 'total': 0, 'facetas': {'prioridad': {}, 'edad': {}}}
+
+    busqueda = backend()
+    sql, params = busqueda.subconsulta(terminos)
+    total, facetas = _facetas(alcance.filter(pk__in=RawSQL(sql, params)), hoy or date.today())
+    if not total:
+        return {'pacientes': [], 'total': 0, 'facetas': facetas}
+
+    sql, params = busqueda.ranking(terminos, alcance.order_by().values('pk').query.sql_with_params(), limite)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [fila[0] for fila in cursor.fetchall()]
+    pacientes = Patient.objects.in_bulk(ids)
+    return {
+        'pacientes': [pacientes[paciente_id] for paciente_id in ids if paciente_id in pacientes],
+        'total': total,
+        'facetas': facetas,
+    }
@@ -0,0 +1,46 @@
+"""
+Señales de la app de pacientes
+"""
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from appointments.counters import mover_prioridad
+from appointments.models import Appointment
+from core import cache
+
+from .models import Patient
+from .search import CAMPOS_INDEXADOS, indexar
+
+
+@receiver(pre_save, sender=Patient)
+def recordar_prioridad(sender, instance, **kwargs):
+    instance._prioridad_anterior = None
+    if instance.pk:
+        instance._prioridad_anterior = Patient.objects.filter(pk=instance.pk).values_list(
+            'prioridad', flat=True
+        ).first()
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidar_cache_paciente(sender, instance, **kwargs):
+    """Los dashboards muestran prioridad y nombre de los pacientes de cada doctor"""
+    cache.invalidar(
+        doctores=Appointment.objects.filter(paciente_id=instance.pk).values_list('doctor_id', flat=True).distinct(),
+        clinicas=[instance.clinica_id],
+    )
+
+
+@receiver(post_save, sender=Patient)
+def indexar_paciente(sender, instance, update_fields=None, **kwargs):
+    """Índice de búsqueda por texto (search.py); el borrado va en cascada"""
+    if update_fields is None or set(update_fields) & set(CAMPOS_INDEXADOS):
+        indexar([instance])
+
+
+@receiver(post_save, sender=Patient)
+def mover_contadores_prioridad(sender, instance, created, **kwargs):
+    """Las citas del paciente pasan a contarse con su nueva prioridad"""
+    anterior = getattr(instance, '_prioridad_anterior', None)
+    if not created and anterior and anterior != instance.prioridad:
+        mover_prioridad({instance.pk: (anterior, instance.prioridad)})
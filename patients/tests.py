@@ -1,3 +1,133 @@
+import json
+from datetime import timedelta
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from appointments.models import Appointment
+from clinicas.models import Clinica
+from doctors.models import Doctor
+
+from .models import Patient
+
+
+class ListadoPacientesAdminTests(TestCase):
+    """El listado de pacientes hace las mismas consultas con 2 filas que con 10"""
+
+    def setUp(self):
+        self.clinica = Clinica.objects.create(
+            nombre='Central', codigo='ADM', direccion='Calle 1', telefono='1', email='c@example.com',
+        )
+        self.doctor = Doctor.objects.create(
+            usuario=User.objects.create_user('doctor_admin', password='x'),
+            nombre='Ana', apellidos='Pérez', especialidad='Medicina General', clinica=self.clinica,
+        )
+        self.client.force_login(User.objects.create_superuser('admin_listados', password='x'))
+
+    def _crear_pacientes(self, desde, hasta):
+        inicio = (timezone.now() + timedelta(days=7)).replace(hour=8, minute=0, second=0, microsecond=0)
+        for i in range(desde, hasta):
+            paciente = Patient.objects.create(
+                nombre=f'Paciente{i}', apellidos='Admin', dni=f'ADM-{i}', clinica=self.clinica,
+            )
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, motivo='Control del listado',
+                fecha=inicio + timedelta(minutes=30 * i),
+            )
+
+    def test_listado_pacientes(self):
+        # sesión, usuario, filtro de clínicas, COUNT y página
+        # (clínica en el JOIN, citas anotadas)
+        for desde, hasta in ((0, 2), (2, 10)):
+            self._crear_pacientes(desde, hasta)
+            cache.clear()
+            with self.assertNumQueries(5):
+                self.assertEqual(self.client.get('/admin/patients/patient/').status_code, 200)
+
+
+class BusquedaPacientesTests(TestCase):
+    """Búsqueda por texto con el índice: tildes, prefijos, DNI, relevancia y facetas"""
+
+    def setUp(self):
+        usuario = User.objects.create_user('doctor_busqueda', password='x')
+        self.doctor = Doctor.objects.create(
+            usuario=usuario, nombre='Ana', apellidos='Pérez', especialidad='Medicina General',
+        )
+        fecha = timezone.now() + timedelta(days=7)
+        self.jose = Patient.objects.create(
+            nombre='José María', apellidos='Muñoz-Peña', dni='12.345.678-K',
+            fecha_nacimiento=timezone.now().date() - timedelta(days=365 * 40), prioridad='U',
+        )
+        self.vecina = Patient.objects.create(
+            nombre='Lucía', apellidos='Sanz', dni='87654321', informacion_contacto='Vecina de José Muñoz',
+        )
+        # Sin citas con el doctor: fuera del alcance de sus búsquedas
+        Patient.objects.create(nombre='José', apellidos='Muñoz', dni='55555555')
+        for i, paciente in enumerate((self.jose, self.vecina)):
+            Appointment.objects.create(
+                paciente=paciente, doctor=self.doctor, motivo='Control', fecha=fecha + timedelta(hours=i),
+            )
+        self.client.force_login(usuario)
+
+    def test_busqueda_ajax(self):
+        respuesta = self.client.get('/patients/search-ajax/', {'q': 'jose MUNOZ'}).json()
+        # El nombre pesa más que el contacto
+        self.assertEqual([p['id'] for p in respuesta['patients']], [self.jose.pk, self.vecina.pk])
+        self.assertEqual(respuesta['total'], 2)
+        self.assertEqual(respuesta['facets']['prioridad'], {'B': 1, 'M': 0, 'A': 0, 'U': 1})
+        self.assertEqual(respuesta['facets']['edad']['30-44'], 1)
+        self.assertEqual(respuesta['facets']['edad']['Desconocida'], 1)
+
+    def test_prefijos_y_dni(self):
+        for consulta in ('mu pe', 'Peña', '12345', '12.345.678'):
+            respuesta = self.client.get('/patients/search-ajax/', {'q': consulta}).json()
+            self.assertEqual([p['id'] for p in respuesta['patients']], [self.jose.pk], consulta)
+
+    def test_indice_sincronizado(self):
+        self.jose.apellidos = 'Ruiz'
+        self.jose.save()
+        respuesta = self.client.get('/patients/search-ajax/', {'q': 'ruiz'}).json()
+        self.assertEqual([p['id'] for p in respuesta['patients']], [self.jose.pk])
+        respuesta = self.client.get('/patients/search-ajax/', {'q': 'pena'}).json()
+        self.assertEqual(respuesta['patients'], [])
+
+
+class CargaMasivaPacientesTests(TestCase):
+    """Altas de pacientes en lote con una sola comprobación de DNI"""
+
+    URL = '/api/v1/patients/paciente/bulk/'
+
+    def setUp(self):
+        Patient.objects.create(nombre='Eva', apellidos='Ruiz', dni='11111111')
+        self.client.force_login(User.objects.create_user('staff_lote', password='x', is_staff=True))
+
+    def _enviar(self, items, modo=None):
+        cuerpo = {'items': items}
+        if modo:
+            cuerpo['modo'] = modo
+        return self.client.post(self.URL, json.dumps(cuerpo), content_type='application/json')
+
+    def test_dni_existente_y_repetido_en_el_lote(self):
+        respuesta = self._enviar([
+            {'nombre': 'luis', 'apellidos': 'gómez', 'dni': '11111111', 'prioridad': 'M'},
+            {'nombre': 'Ana', 'apellidos': 'Sanz', 'dni': '22222222', 'prioridad': 'M'},
+            {'nombre': 'Rosa', 'apellidos': 'Gil', 'dni': '22222222', 'prioridad': 'M'},
+        ])
+        self.assertEqual(respuesta.status_code, 400)
+        resultados = respuesta.json()['resultados']
+        self.assertEqual(['dni' in resultado.get('errores', {}) for resultado in resultados], [True, False, True])
+        self.assertEqual(Patient.objects.count(), 1)
 
-# Create your tests here.
+    def test_parcial_con_las_reglas_del_formulario(self):
+        respuesta = self._enviar([
+            {'nombre': 'luis  maría', 'apellidos': 'gómez', 'dni': '33333333', 'prioridad': 'A'},
+            {'nombre': 'X', 'apellidos': 'Gil', 'dni': '44444444', 'prioridad': 'M'},
+        ], modo='parcial')
+        self.assertEqual(respuesta.status_code, 207)
+        self.assertIn('nombre', respuesta.json()['resultados'][1]['errores'])
+        paciente = Patient.objects.get(dni='33333333')
+        self.assertEqual((paciente.nombre, paciente.apellidos), ('Luis María', 'Gómez'))
+        # bulk_create no emite post_save: el índice de búsqueda se actualiza con el lote
+        self.assertEqual(paciente.indice_busqueda.nombre, 'luis maria gomez 33333333')
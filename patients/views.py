@@ -1,11 +1,36 @@
 from django.shortcuts import render
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from core.bulk import leer_lote, respuesta_lote
+from core.filters import ListadoFiltradoMixin, entero, opcion
+from core.values_serializers import ValuesListMixin
 from .models import Patient
 from .serializers import PatientsSerializer
+from .bulk_write import actualizar_pacientes_lote, crear_pacientes_lote
 
 # Create your views here.
 
 
-class PatientsViewSet(viewsets.ModelViewSet):
-    queryset = Patient.objects.all().order_by('-id') # Define el conjunto de datos base
-    serializer_class = PatientsSerializer
\ No newline at end of file
+class PatientsViewSet(ListadoFiltradoMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Patient.objects.all() # Define el conjunto de datos base
+    serializer_class = PatientsSerializer
+    keyset_ordering = ('-id',)
+    filtros = {
+        'clinica': ('clinica_id', entero),
+        'prioridad': ('prioridad', opcion(Patient.PRIORITY_CHOICES)),
+    }
+    campos_expandibles = {
+        'clinica': ('nombre', 'codigo'),
+    }
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk', permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """
+        Alta (POST) o modificación (PATCH) de varios pacientes en una petición:
+        {"items": [...], "modo": "atomico" | "parcial"}
+        """
+        items, modo = leer_lote(request.data)
+        if request.method == 'POST':
+            return respuesta_lote(crear_pacientes_lote(items, request.user, modo), modo, status.HTTP_201_CREATED)
+        return respuesta_lote(actualizar_pacientes_lote(items, request.user, modo), modo)
@@ -1,24 +1,64 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Max
+from django.db.models import Q, Count, Max, OuterRef
 from django.core.paginator import Paginator
 from django.http import JsonResponse
 from django.utils import timezone
 from datetime import datetime, timedelta
 from .models import Patient
-from doctors.models import Doctor
+from .search import hace_años, buscar_pacientes, filtro_busqueda, pacientes_de
 from appointments.models import Appointment
+from core.admin_utils import contar
 from core.database_utils import MySQLStoredProcedures
 from .forms import PatientForm
 
 
+def _pacientes_orm(doctor, search_query, priority_filter, age_min, age_max, page, per_page):
+    """Página de pacientes del doctor con consultas Django (búsqueda por texto con el índice)"""
+    patients = pacientes_de(doctor)
+    
+    if search_query:
+        patients = patients.filter(filtro_busqueda(search_query))
+    
+    if priority_filter:
+        patients = patients.filter(prioridad=priority_filter)
+    
+    today = timezone.now().date()
+    if age_min is not None:
+        patients = patients.filter(fecha_nacimiento__lte=hace_años(today, age_min))
+    if age_max is not None:
+        patients = patients.filter(fecha_nacimiento__gt=hace_años(today, age_max + 1))
+    
+    patients = patients.annotate(
+        total_appointments=contar(Appointment.objects.filter(paciente=OuterRef('pk'), doctor=doctor), 'paciente')
+    ).order_by('apellidos', 'nombre')
+    
+    # Paginación manual
+    paginator = Paginator(patients, per_page)
+    page_obj = paginator.get_page(page)
+    
+    patients_data = []
+    for patient in page_obj:
+        patients_data.append({
+            'id': patient.id,
+            'nombre': patient.nombre,
+            'apellidos': patient.apellidos,
+            'dni': patient.dni,
+            'prioridad': patient.prioridad,
+            'priority_display': patient.get_prioridad_display(),
+            'age': patient.calcular_edad(),
+            'total_appointments': patient.total_appointments,
+            'last_appointment': None,  # Requeriría consulta adicional
+        })
+    return patients_data
+
+
 @login_required
 def patient_dashboard(request):
     """Dashboard principal de gestión de pacientes"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -37,67 +77,30 @@ def patient_dashboard(request):
     per_page = 12
     offset = (int(page) - 1) * per_page
     
-    try:
-        # Usar stored procedure para filtrar pacientes
-        patients_data = MySQLStoredProcedures.call_filter_patients(
-            doctor_id=doctor.id,
-            search_term=search_query if search_query else None,
-            priority_filter=priority_filter if priority_filter else None,
-            age_min=age_min_int,
-            age_max=age_max_int,
-            limit_count=per_page,
-            offset_count=offset
-        )
-        
-        # Obtener estadísticas de pacientes
-        patient_stats = MySQLStoredProcedures.call_patient_statistics(doctor.id)
-        
-    except Exception as e:
-        # Fallback a consultas Django si los SP no están disponibles
-        messages.warning(request, 'Usando consultas básicas. Ejecute: python manage.py create_stored_procedures')
-        
-        patients = Patient.objects.filter(
-            appointment__doctor=doctor
-        ).distinct()
-        
-        if search_query:
-            patients = patients.filter(
-                Q(nombre__icontains=search_query) |
-                Q(apellidos__icontains=search_query) |
-                Q(dni__icontains=search_query) |
-                Q(informacion_contacto__icontains=search_query)
-            )
-        
-        if priority_filter:
-            patients = patients.filter(prioridad=priority_filter)
-        
-        patients = patients.annotate(
-            total_appointments=Count('appointment', filter=Q(appointment__doctor=doctor))
-        ).order_by('apellidos', 'nombre')
-        
-        # Paginación manual
-        paginator = Paginator(patients, per_page)
-        page_obj = paginator.get_page(page)
-        
-        patients_data = []
-        for patient in page_obj:
-            age = None
-            if patient.fecha_nacimiento:
-                age = timezone.now().date().year - patient.fecha_nacimiento.year
-            
-            patients_data.append({
-                'id': patient.id,
-                'nombre': patient.nombre,
-                'apellidos': patient.apellidos,
-                'dni': patient.dni,
-                'prioridad': patient.prioridad,
-                'priority_display': patient.get_prioridad_display(),
-                'age': age,
-                'total_appointments': patient.total_appointments,
-                'last_appointment': None,  # Requeriría consulta adicional
-            })
-        
+    if search_query:
+        # La búsqueda por texto usa el índice de patients/search.py
+        patients_data = _pacientes_orm(doctor, search_query, priority_filter, age_min_int, age_max_int, page, per_page)
         patient_stats = []
+    else:
+        try:
+            # Usar stored procedure para filtrar pacientes
+            patients_data = MySQLStoredProcedures.call_filter_patients(
+                doctor_id=doctor.id,
+                priority_filter=priority_filter if priority_filter else None,
+                age_min=age_min_int,
+                age_max=age_max_int,
+                limit_count=per_page,
+                offset_count=offset
+            )
+
+            # Obtener estadísticas de pacientes
+            patient_stats = MySQLStoredProcedures.call_patient_statistics(doctor.id)
+
+        except Exception as e:
+            # Fallback a consultas Django si los SP no están disponibles
+            messages.warning(request, 'Usando consultas básicas. Ejecute: python manage.py create_stored_procedures')
+            patients_data = _pacientes_orm(doctor, '', priority_filter, age_min_int, age_max_int, page, per_page)
+            patient_stats = []
     
     # Choices para filtros
     priority_choices = Patient.PRIORITY_CHOICES
@@ -127,9 +130,8 @@ def patient_dashboard(request):
 @login_required
 def create_patient(request):
     """Crear nuevo paciente"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -162,9 +164,8 @@ def create_patient(request):
 @login_required
 def edit_patient(request, patient_id):
     """Editar paciente existente"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -206,9 +207,8 @@ def edit_patient(request, patient_id):
 @login_required
 def patient_detail(request, patient_id):
     """Vista detallada del paciente con historial completo"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -262,9 +262,8 @@ def patient_detail(request, patient_id):
 def patient_search_ajax(request):
     """Búsqueda AJAX de pacientes para autocompletado"""
     if request.method == 'GET':
-        try:
-            doctor = Doctor.objects.get(usuario=request.user)
-        except Doctor.DoesNotExist:
+        doctor = request.doctor
+        if doctor is None:
             return JsonResponse({'error': 'Doctor no encontrado'}, status=404)
         
         query = request.GET.get('q', '')
@@ -272,49 +271,25 @@ def patient_search_ajax(request):
         if len(query) < 2:
             return JsonResponse({'patients': []})
         
-        try:
-            # Usar stored procedure si está disponible
-            patients_data = MySQLStoredProcedures.call_filter_patients(
-                doctor_id=doctor.id,
-                search_term=query,
-                limit_count=10,
-                offset_count=0
-            )
-            
-            results = []
-            for patient in patients_data:
-                results.append({
-                    'id': patient['id'],
-                    'name': f"{patient['nombre']} {patient['apellidos']}",
-                    'dni': patient['dni'],
-                    'priority': patient['priority_display'],
-                    'age': patient['age'],
-                    'total_appointments': patient['total_appointments']
-                })
-            
-            return JsonResponse({'patients': results})
-            
-        except Exception:
-            # Fallback a consulta Django
-            patients = Patient.objects.filter(
-                appointment__doctor=doctor
-            ).filter(
-                Q(nombre__icontains=query) |
-                Q(apellidos__icontains=query) |
-                Q(dni__icontains=query)
-            ).distinct()[:10]
-            
-            results = []
-            for patient in patients:
-                results.append({
-                    'id': patient.id,
-                    'name': f"{patient.nombre} {patient.apellidos}",
-                    'dni': patient.dni,
-                    'priority': patient.get_prioridad_display(),
-                    'age': None,
-                    'total_appointments': 0
-                })
-            
-            return JsonResponse({'patients': results})
+        # Índice de búsqueda: relevancia, total y facetas en la misma llamada
+        busqueda = buscar_pacientes(query, pacientes_de(doctor), limite=10)
+        ids = [patient.id for patient in busqueda['pacientes']]
+        citas = dict(
+            Appointment.objects.filter(doctor=doctor, paciente_id__in=ids)
+            .values('paciente_id').annotate(n=Count('id')).order_by().values_list('paciente_id', 'n')
+        )
+        
+        results = []
+        for patient in busqueda['pacientes']:
+            results.append({
+                'id': patient.id,
+                'name': f"{patient.nombre} {patient.apellidos}",
+                'dni': patient.dni,
+                'priority': patient.get_prioridad_display(),
+                'age': patient.calcular_edad(),
+                'total_appointments': citas.get(patient.id, 0)
+            })
+        
+        return JsonResponse({'patients': results, 'total': busqueda['total'], 'facets': busqueda['facetas']})
     
     return JsonResponse({'error': 'Método no permitido'}, status=405)
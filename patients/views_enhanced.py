@@ -1,22 +1,28 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Count, Max
+from django.db.models import Q, Count, Max, OuterRef
 from django.core.paginator import Paginator
 from django.http import JsonResponse
 from django.utils import timezone
 from .models import Patient
-from doctors.models import Doctor
+from .search import buscar_pacientes, filtro_busqueda, pacientes_de
 from appointments.models import Appointment
-from rest_framework import viewsets
+from rest_framework import status, viewsets
+from rest_framework.decorators import action
+from rest_framework.permissions import IsAuthenticated
+from core.admin_utils import contar
+from core.bulk import leer_lote, respuesta_lote
+from core.filters import ListadoFiltradoMixin, entero, opcion
+from core.values_serializers import ValuesListMixin
 from .serializers import PatientSerializaer
+from .bulk_write import actualizar_pacientes_lote, crear_pacientes_lote
 
 @login_required
 def lista_pacientes(request):
     """List all patients with search and filtering"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -25,18 +31,11 @@ def lista_pacientes(request):
     priority_filter = request.GET.get('priority', '')
     
     # Base queryset - patients that have appointments with this doctor
-    patients = Patient.objects.filter(
-        appointment__doctor=doctor
-    ).distinct()
+    patients = pacientes_de(doctor)
     
-    # Apply search filter
+    # Apply search filter (text index, see patients/search.py)
     if search_query:
-        patients = patients.filter(
-            Q(nombre__icontains=search_query) |
-            Q(apellidos__icontains=search_query) |
-            Q(dni__icontains=search_query) |
-            Q(informacion_contacto__icontains=search_query)
-        )
+        patients = patients.filter(filtro_busqueda(search_query))
     
     # Apply priority filter
     if priority_filter:
@@ -44,7 +43,7 @@ def lista_pacientes(request):
     
     # Annotate with appointment count
     patients = patients.annotate(
-        total_appointments=Count('appointment', filter=Q(appointment__doctor=doctor))
+        total_appointments=contar(Appointment.objects.filter(paciente=OuterRef('pk'), doctor=doctor), 'paciente')
     ).order_by('nombre', 'apellidos')
     
     # Pagination
@@ -69,9 +68,8 @@ def lista_pacientes(request):
 @login_required
 def detalle_paciente(request, paciente_id):
     """Patient detail view with appointment history"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -114,9 +112,8 @@ def detalle_paciente(request, paciente_id):
 def buscar_pacientes_ajax(request):
     """AJAX endpoint for patient search"""
     if request.method == 'GET':
-        try:
-            doctor = Doctor.objects.get(usuario=request.user)
-        except Doctor.DoesNotExist:
+        doctor = request.doctor
+        if doctor is None:
             return JsonResponse({'error': 'Doctor no encontrado'}, status=404)
         
         query = request.GET.get('q', '')
@@ -124,16 +121,11 @@ def buscar_pacientes_ajax(request):
         if len(query) < 2:
             return JsonResponse({'patients': []})
         
-        patients = Patient.objects.filter(
-            appointment__doctor=doctor
-        ).filter(
-            Q(nombre__icontains=query) |
-            Q(apellidos__icontains=query) |
-            Q(dni__icontains=query)
-        ).distinct()[:10]  # Limit to 10 results
+        # Ranked by relevance, with totals and facets from the same search
+        busqueda = buscar_pacientes(query, pacientes_de(doctor), limite=10)
         
         patient_data = []
-        for patient in patients:
+        for patient in busqueda['pacientes']:
             patient_data.append({
                 'id': patient.id,
                 'name': f"{patient.nombre} {patient.apellidos}",
@@ -142,7 +134,7 @@ def buscar_pacientes_ajax(request):
                 'priority_class': get_priority_class(patient.prioridad)
             })
         
-        return JsonResponse({'patients': patient_data})
+        return JsonResponse({'patients': patient_data, 'total': busqueda['total'], 'facets': busqueda['facetas']})
     
     return JsonResponse({'error': 'Método no permitido'}, status=405)
 
@@ -159,9 +151,8 @@ def get_priority_class(priority):
 @login_required
 def estadisticas_pacientes(request):
     """Patient statistics dashboard"""
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-    except Doctor.DoesNotExist:
+    doctor = request.doctor
+    if doctor is None:
         messages.error(request, 'No se encontró el perfil de doctor asociado a su usuario.')
         return redirect('doctor_dashboard')
     
@@ -201,6 +192,25 @@ def estadisticas_pacientes(request):
     return render(request, 'patients/estadisticas_pacientes.html', context)
 
 # Keep the existing ViewSet for API
-class PatientsViewSet(viewsets.ModelViewSet):
-    queryset = Patient.objects.all().order_by('-id')
+class PatientsViewSet(ListadoFiltradoMixin, ValuesListMixin, viewsets.ModelViewSet):
+    queryset = Patient.objects.all()
     serializer_class = PatientSerializaer
+    keyset_ordering = ('-id',)
+    filtros = {
+        'clinica': ('clinica_id', entero),
+        'prioridad': ('prioridad', opcion(Patient.PRIORITY_CHOICES)),
+    }
+    campos_expandibles = {
+        'clinica': ('nombre', 'codigo'),
+    }
+
+    @action(detail=False, methods=['post', 'patch'], url_path='bulk', permission_classes=[IsAuthenticated])
+    def bulk(self, request):
+        """
+        Alta (POST) o modificación (PATCH) de varios pacientes en una petición:
+        {"items": [...], "modo": "atomico" | "parcial"}
+        """
+        items, modo = leer_lote(request.data)
+        if request.method == 'POST':
+            return respuesta_lote(crear_pacientes_lote(items, request.user, modo), modo, status.HTTP_201_CREATED)
+        return respuesta_lote(actualizar_pacientes_lote(items, request.user, modo), modo)
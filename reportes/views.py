@@ -44,6 +44,7 @@ from io import BytesIO
 import base64
 
 from appointments.models import Appointment
+from appointments.local_time import hoy_local
 from doctors.models import Doctor
 from patients.models import Patient
 from clinicas.models import Clinica
@@ -55,15 +56,11 @@ def dashboard_reportes(request):
     Dashboard principal de reportes
     """
     # Obtener doctor y clínica del usuario
-    try:
-        doctor = Doctor.objects.get(usuario=request.user)
-        clinica = doctor.clinica
-    except Doctor.DoesNotExist:
-        doctor = None
-        clinica = None
+    doctor = request.doctor
+    clinica = doctor.clinica if doctor else None
     
     # Estadísticas rápidas
-    hoy = timezone.now().date()
+    hoy = hoy_local(clinica.id if clinica else None)
     inicio_mes = hoy.replace(day=1)
     
     # Filtrar por clínica si existe
@@ -72,8 +69,8 @@ def dashboard_reportes(request):
         citas_query = citas_query.filter(clinica=clinica)
     
     estadisticas = {
-        'citas_hoy': citas_query.filter(fecha__date=hoy).count(),
-        'citas_mes': citas_query.filter(fecha__date__gte=inicio_mes).count(),
+        'citas_hoy': citas_query.filter(fecha_local=hoy).count(),
+        'citas_mes': citas_query.filter(fecha_local__gte=inicio_mes).count(),
         'pacientes_activos': Patient.objects.filter(clinica=clinica).count() if clinica else Patient.objects.count(),
         'doctores_activos': Doctor.objects.filter(clinica=clinica, activo=True).count() if clinica else Doctor.objects.filter(activo=True).count(),
     }
@@ -121,11 +118,8 @@ def generar_reporte_pdf(request):
         fecha_fin = fecha_inicio
     
     # Obtener clínica del usuario
-    try:
-        doctor_usuario = Doctor.objects.get(usuario=request.user)
-        clinica = doctor_usuario.clinica
-    except Doctor.DoesNotExist:
-        clinica = None
+    doctor_usuario = request.doctor
+    clinica = doctor_usuario.clinica if doctor_usuario else None
     
     # Crear respuesta HTTP para PDF
     response = HttpResponse(content_type='application/pdf')
@@ -230,11 +224,8 @@ def generar_reporte_excel(request):
         fecha_fin = fecha_inicio
     
     # Obtener clínica del usuario
-    try:
-        doctor_usuario = Doctor.objects.get(usuario=request.user)
-        clinica = doctor_usuario.clinica
-    except Doctor.DoesNotExist:
-        clinica = None
+    doctor_usuario = request.doctor
+    clinica = doctor_usuario.clinica if doctor_usuario else None
     
     # Crear libro de Excel
     wb = openpyxl.Workbook()
@@ -332,11 +323,8 @@ def generar_grafico_estadisticas(request):
     tipo_grafico = request.GET.get('tipo', 'citas_por_mes')
     
     # Obtener clínica del usuario
-    try:
-        doctor_usuario = Doctor.objects.get(usuario=request.user)
-        clinica = doctor_usuario.clinica
-    except Doctor.DoesNotExist:
-        clinica = None
+    doctor_usuario = request.doctor
+    clinica = doctor_usuario.clinica if doctor_usuario else None
     
     # Crear gráfico según el tipo
     plt.figure(figsize=(12, 8))
@@ -377,8 +365,8 @@ def generar_grafico_estadisticas(request):
 def obtener_datos_citas_diarias(fecha_inicio, fecha_fin, doctor_id, clinica):
     """Obtener datos de citas diarias para PDF"""
     citas_query = Appointment.objects.filter(
-        fecha__date__gte=fecha_inicio,
-        fecha__date__lte=fecha_fin
+        fecha_local__gte=fecha_inicio,
+        fecha_local__lte=fecha_fin
     )
     
     if clinica:
@@ -421,8 +409,8 @@ def obtener_estadisticas_doctor(fecha_inicio, fecha_fin, doctor_id, clinica):
     for doctor in doctores_query:
         citas_doctor = Appointment.objects.filter(
             doctor=doctor,
-            fecha__date__gte=fecha_inicio,
-            fecha__date__lte=fecha_fin
+            fecha_local__gte=fecha_inicio,
+            fecha_local__lte=fecha_fin
         )
         
         total = citas_doctor.count()
@@ -450,7 +438,7 @@ def obtener_ocupacion_clinica(fecha_inicio, fecha_fin, clinica):
     
     fecha_actual = fecha_inicio
     while fecha_actual <= fecha_fin:
-        citas_query = Appointment.objects.filter(fecha__date=fecha_actual)
+        citas_query = Appointment.objects.filter(fecha_local=fecha_actual)
         
         if clinica:
             citas_query = citas_query.filter(clinica=clinica)
@@ -476,7 +464,7 @@ def obtener_citas_por_mes(clinica):
     hoy = timezone.now().date()
     hace_12_meses = hoy - timedelta(days=365)
     
-    citas_query = Appointment.objects.filter(fecha__date__gte=hace_12_meses)
+    citas_query = Appointment.objects.filter(fecha_local__gte=hace_12_meses)
     
     if clinica:
         citas_query = citas_query.filter(clinica=clinica)
@@ -494,8 +482,8 @@ def obtener_citas_por_mes(clinica):
                      else mes_inicio.replace(year=mes_inicio.year+1, month=1)) - timedelta(days=1)
         
         cantidad = citas_query.filter(
-            fecha__date__gte=mes_inicio,
-            fecha__date__lte=mes_fin
+            fecha_local__gte=mes_inicio,
+            fecha_local__lte=mes_fin
         ).count()
         
         meses.insert(0, mes_inicio.strftime('%b %Y'))
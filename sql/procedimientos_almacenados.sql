@@ -16,9 +16,26 @@ DROP PROCEDURE IF EXISTS sp_transferir_paciente_clinica;
 DROP PROCEDURE IF EXISTS sp_obtener_horarios_disponibles;
 DROP PROCEDURE IF EXISTS sp_estadisticas_dashboard;
 DROP PROCEDURE IF EXISTS sp_validar_conflicto_citas;
+DROP FUNCTION IF EXISTS fn_hora_local;
 
 DELIMITER //
 
+-- =====================================================
+-- FUNCIÓN: Hora local de una cita en la zona de su clínica
+-- =====================================================
+-- appointments_appointment.fecha está en UTC; fecha_local y hora_local se
+-- derivan con esta función cuando un procedimiento modifica fecha o clínica.
+-- Requiere las tablas de zonas horarias de MySQL (mysql_tzinfo_to_sql); si
+-- no están cargadas, CONVERT_TZ devuelve NULL y se usa la hora UTC.
+CREATE FUNCTION fn_hora_local(p_fecha DATETIME, p_clinica_id INT)
+RETURNS DATETIME
+READS SQL DATA
+BEGIN
+    DECLARE v_zona VARCHAR(64);
+    SELECT zona_horaria INTO v_zona FROM clinicas_clinica WHERE id = p_clinica_id;
+    RETURN COALESCE(CONVERT_TZ(p_fecha, '+00:00', v_zona), p_fecha);
+END //
+
 -- =====================================================
 -- 1. PROCEDIMIENTO: Obtener estadísticas de clínica
 -- =====================================================
@@ -48,7 +65,7 @@ BEGIN
         ) AS porcentaje_exito
     FROM clinicas_clinica c
     LEFT JOIN appointments_appointment a ON c.id = a.clinica_id 
-        AND DATE(a.fecha) BETWEEN p_fecha_inicio AND p_fecha_fin
+        AND a.fecha_local BETWEEN p_fecha_inicio AND p_fecha_fin
     WHERE c.id = p_clinica_id AND c.activa = 1
     GROUP BY c.id, c.nombre;
 END //
@@ -81,7 +98,7 @@ BEGIN
     INNER JOIN patients_patient p ON a.paciente_id = p.id
     INNER JOIN doctors_doctor d ON a.doctor_id = d.id
     INNER JOIN clinicas_clinica c ON a.clinica_id = c.id
-    WHERE DATE(a.fecha) BETWEEN ? AND ?';
+    WHERE a.fecha_local BETWEEN ? AND ?';
     
     IF p_clinica_id IS NOT NULL THEN
         SET sql_query = CONCAT(sql_query, ' AND a.clinica_id = ', p_clinica_id);
@@ -155,7 +172,10 @@ BEGIN
             -- Actualizar la cita
             UPDATE appointments_appointment 
             SET fecha = p_nueva_fecha,
-                estado = 'programada'
+                fecha_local = DATE(fn_hora_local(p_nueva_fecha, v_clinica_id)),
+                hora_local = HOUR(fn_hora_local(p_nueva_fecha, v_clinica_id)),
+                estado = 'programada',
+                actualizada_en = UTC_TIMESTAMP()
             WHERE id = p_cita_id;
             
             -- Registrar el cambio en log (si existe tabla de auditoría)
@@ -187,7 +207,7 @@ BEGIN
     FROM appointments_appointment a
     INNER JOIN patients_patient p ON a.paciente_id = p.id
     WHERE a.doctor_id = p_doctor_id
-    AND DATE(a.fecha) = p_fecha
+    AND a.fecha_local = p_fecha
     AND TIME(a.fecha) BETWEEN p_hora_inicio AND p_hora_fin
     AND a.estado NOT IN ('cancelada')
     ORDER BY a.fecha;
@@ -203,7 +223,7 @@ CREATE PROCEDURE sp_obtener_ocupacion_mensual(
 )
 BEGIN
     SELECT 
-        DAY(a.fecha) AS dia,
+        DAY(a.fecha_local) AS dia,
         COUNT(a.id) AS total_citas,
         COUNT(CASE WHEN a.estado = 'completada' THEN 1 END) AS completadas,
         COUNT(CASE WHEN a.estado = 'cancelada' THEN 1 END) AS canceladas,
@@ -214,10 +234,10 @@ BEGIN
         ) AS porcentaje_ocupacion
     FROM appointments_appointment a
     WHERE a.clinica_id = p_clinica_id
-    AND YEAR(a.fecha) = p_año
-    AND MONTH(a.fecha) = p_mes
-    GROUP BY DAY(a.fecha)
-    ORDER BY DAY(a.fecha);
+    AND a.fecha_local BETWEEN MAKEDATE(p_año, 1) + INTERVAL (p_mes - 1) MONTH
+        AND LAST_DAY(MAKEDATE(p_año, 1) + INTERVAL (p_mes - 1) MONTH)
+    GROUP BY DAY(a.fecha_local)
+    ORDER BY DAY(a.fecha_local);
 END //
 
 -- =====================================================
@@ -252,14 +272,14 @@ BEGIN
         ) AS porcentaje_exito
     FROM doctors_doctor d
     LEFT JOIN appointments_appointment a ON d.id = a.doctor_id 
-        AND DATE(a.fecha) BETWEEN p_fecha_inicio AND p_fecha_fin
+        AND a.fecha_local BETWEEN p_fecha_inicio AND p_fecha_fin
     LEFT JOIN clinicas_clinica c ON d.clinica_id = c.id
     WHERE d.id = p_doctor_id
     GROUP BY d.id;
     
     -- Detalle de citas por día
     SELECT 
-        DATE(a.fecha) AS fecha,
+        a.fecha_local AS fecha,
         COUNT(a.id) AS citas_dia,
         COUNT(CASE WHEN a.estado = 'completada' THEN 1 END) AS completadas_dia,
         GROUP_CONCAT(
@@ -271,9 +291,9 @@ BEGIN
     FROM appointments_appointment a
     INNER JOIN patients_patient p ON a.paciente_id = p.id
     WHERE a.doctor_id = p_doctor_id
-    AND DATE(a.fecha) BETWEEN p_fecha_inicio AND p_fecha_fin
-    GROUP BY DATE(a.fecha)
-    ORDER BY DATE(a.fecha);
+    AND a.fecha_local BETWEEN p_fecha_inicio AND p_fecha_fin
+    GROUP BY a.fecha_local
+    ORDER BY a.fecha_local;
 END //
 
 -- =====================================================
@@ -325,7 +345,10 @@ BEGIN
             
             -- Actualizar citas históricas
             UPDATE appointments_appointment 
-            SET clinica_id = p_clinica_destino_id
+            SET clinica_id = p_clinica_destino_id,
+                fecha_local = DATE(fn_hora_local(fecha, p_clinica_destino_id)),
+                hora_local = HOUR(fn_hora_local(fecha, p_clinica_destino_id)),
+                actualizada_en = UTC_TIMESTAMP()
             WHERE paciente_id = p_paciente_id;
             
             SET p_codigo_error = 0;
@@ -377,9 +400,9 @@ BEGIN
             ELSE NULL
         END AS paciente_nombre
     FROM horarios h
-    LEFT JOIN appointments_appointment a ON DATE(a.fecha) = p_fecha 
-        AND TIME(a.fecha) = h.hora 
-        AND a.doctor_id = p_doctor_id
+    LEFT JOIN appointments_appointment a ON a.doctor_id = p_doctor_id
+        AND a.fecha_local = p_fecha
+        AND TIME(a.fecha) = h.hora
         AND a.estado NOT IN ('cancelada')
     LEFT JOIN patients_patient p ON a.paciente_id = p.id
     ORDER BY h.hora;
@@ -408,7 +431,7 @@ BEGIN
         COUNT(CASE WHEN a.estado = 'programada' THEN 1 END) AS programadas,
         COUNT(CASE WHEN a.estado = 'cancelada' THEN 1 END) AS canceladas
     FROM appointments_appointment a
-    WHERE DATE(a.fecha) = CURDATE()
+    WHERE a.fecha_local = CURDATE()
     AND (p_clinica_id IS NULL OR a.clinica_id = p_clinica_id)
     
     UNION ALL
@@ -421,13 +444,12 @@ BEGIN
         COUNT(CASE WHEN a.estado = 'programada' THEN 1 END) AS programadas,
         COUNT(CASE WHEN a.estado = 'cancelada' THEN 1 END) AS canceladas
     FROM appointments_appointment a
-    WHERE YEAR(a.fecha) = YEAR(CURDATE()) 
-    AND MONTH(a.fecha) = MONTH(CURDATE())
+    WHERE a.fecha_local BETWEEN LAST_DAY(CURDATE() - INTERVAL 1 MONTH) + INTERVAL 1 DAY AND LAST_DAY(CURDATE())
     AND (p_clinica_id IS NULL OR a.clinica_id = p_clinica_id);
     
     -- Próximas citas (siguientes 7 días)
     SELECT 
-        DATE(a.fecha) AS fecha,
+        a.fecha_local AS fecha,
         COUNT(a.id) AS citas_programadas,
         GROUP_CONCAT(
             CONCAT(TIME(a.fecha), ' - ', d.nombre, ' ', d.apellidos)
@@ -435,11 +457,11 @@ BEGIN
         ) AS detalle
     FROM appointments_appointment a
     INNER JOIN doctors_doctor d ON a.doctor_id = d.id
-    WHERE DATE(a.fecha) BETWEEN CURDATE() AND DATE_ADD(CURDATE(), INTERVAL 7 DAY)
+    WHERE a.fecha_local BETWEEN CURDATE() AND DATE_ADD(CURDATE(), INTERVAL 7 DAY)
     AND a.estado = 'programada'
     AND (p_clinica_id IS NULL OR a.clinica_id = p_clinica_id)
-    GROUP BY DATE(a.fecha)
-    ORDER BY DATE(a.fecha)
+    GROUP BY a.fecha_local
+    ORDER BY a.fecha_local
     LIMIT 7;
 END //
 
@@ -493,9 +515,9 @@ DELIMITER ;
 -- =====================================================
 
 -- Índices para appointments_appointment
-CREATE INDEX IF NOT EXISTS idx_appointment_fecha ON appointments_appointment(fecha);
-CREATE INDEX IF NOT EXISTS idx_appointment_doctor_fecha ON appointments_appointment(doctor_id, fecha);
-CREATE INDEX IF NOT EXISTS idx_appointment_clinica_fecha ON appointments_appointment(clinica_id, fecha);
+-- Los índices compuestos sobre fecha y fecha_local ((fecha, id), (doctor_id, fecha),
+-- (clinica_id, fecha), (estado, fecha), (doctor_id, fecha_local), ...) los
+-- crean las migraciones de appointments
 CREATE INDEX IF NOT EXISTS idx_appointment_estado ON appointments_appointment(estado);
 CREATE INDEX IF NOT EXISTS idx_appointment_paciente ON appointments_appointment(paciente_id);
 
@@ -527,8 +549,8 @@ SELECT
     COUNT(DISTINCT p.id) AS total_pacientes,
     COUNT(a.id) AS total_citas,
     COUNT(CASE WHEN a.estado = 'completada' THEN 1 END) AS citas_completadas,
-    COUNT(CASE WHEN DATE(a.fecha) = CURDATE() THEN 1 END) AS citas_hoy,
-    COUNT(CASE WHEN YEAR(a.fecha) = YEAR(CURDATE()) AND MONTH(a.fecha) = MONTH(CURDATE()) THEN 1 END) AS citas_mes_actual
+    COUNT(CASE WHEN a.fecha_local = CURDATE() THEN 1 END) AS citas_hoy,
+    COUNT(CASE WHEN a.fecha_local BETWEEN LAST_DAY(CURDATE() - INTERVAL 1 MONTH) + INTERVAL 1 DAY AND LAST_DAY(CURDATE()) THEN 1 END) AS citas_mes_actual
 FROM clinicas_clinica c
 LEFT JOIN doctors_doctor d ON c.id = d.clinica_id AND d.activo = 1
 LEFT JOIN patients_patient p ON c.id = p.clinica_id
@@ -550,13 +572,15 @@ SELECT
     ) AS detalle_citas
 FROM doctors_doctor d
 INNER JOIN clinicas_clinica c ON d.clinica_id = c.id
-LEFT JOIN appointments_appointment a ON d.id = a.doctor_id AND DATE(a.fecha) = CURDATE()
+LEFT JOIN appointments_appointment a ON d.id = a.doctor_id AND a.fecha_local = CURDATE()
 LEFT JOIN patients_patient p ON a.paciente_id = p.id
 WHERE d.activo = 1
 GROUP BY d.id, d.nombre, d.apellidos, d.especialidad, c.nombre;
 
 -- =====================================================
 -- PROCEDIMIENTO DE MANTENIMIENTO
+-- Alternativa portable y por lotes (sin bloqueos largos, reanudable):
+--   python manage.py mantenimiento_citas
 -- =====================================================
 
 DELIMITER //
@@ -573,7 +597,8 @@ BEGIN
     
     -- Actualizar citas vencidas a "no_asistio" si no se marcaron como completadas
     UPDATE appointments_appointment 
-    SET estado = 'no_asistio'
+    SET estado = 'no_asistio',
+        actualizada_en = UTC_TIMESTAMP()
     WHERE fecha < DATE_SUB(NOW(), INTERVAL 2 HOUR)
     AND estado = 'programada';
     
@@ -0,0 +1,16 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Filtros FiltroAutocompletar: al elegir una opción se recarga el listado filtrado
+    $(function() {
+        $('.filtro-autocompletar').on('change', function() {
+            if (!this.value) {
+                return;
+            }
+            const params = new URLSearchParams(this.dataset.urlBase);
+            params.set(this.dataset.parametro, this.value);
+            window.location.search = params.toString();
+        });
+    });
+}